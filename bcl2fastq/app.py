@@ -14,9 +14,17 @@ def routes(**kwargs):
     return [
         url(r"/api/1.0/versions", VersionsHandler, name="versions", kwargs=kwargs),
         url(r"/api/1.0/start/([\w_-]+)", StartHandler, name="start", kwargs=kwargs),
+        url(r"/api/1.0/start_batch", BatchStartHandler, name="start_batch", kwargs=kwargs),
+        url(r"/api/1.0/plan/([\w_-]+)", PlanHandler, name="plan", kwargs=kwargs),
         url(r"/api/1.0/status/(\d*)", StatusHandler, name="status", kwargs=kwargs),
+        url(r"/api/1.0/resources/(\d+)", ResourcesHandler, name="resources", kwargs=kwargs),
         url(r"/api/1.0/stop/([\d|all]*)", StopHandler, name="stop", kwargs=kwargs),
-        url(r"/api/1.0/logs/([\w_-]+)", Bcl2FastqLogHandler, name="logs", kwargs=kwargs)
+        url(r"/api/1.0/logs/([\w_-]+)", Bcl2FastqLogHandler, name="logs", kwargs=kwargs),
+        url(r"/api/1.0/log_search/([\w_-]*)", LogSearchHandler, name="log_search", kwargs=kwargs),
+        url(r"/api/1.0/reaper", OutputReaperStatusHandler, name="reaper", kwargs=kwargs),
+        url(r"/api/1.0/autotune/([\w_-]*)", AutotuneHandler, name="autotune", kwargs=kwargs),
+        url(r"/api/1.0/metrics", MetricsHandler, name="metrics", kwargs=kwargs),
+        url(r"/api/1.0/stats/([\w_-]+)", StatsHandler, name="stats", kwargs=kwargs)
     ]
 
 def start():
@@ -25,4 +33,25 @@ def start():
     """
 
     app_svc = AppService.create(__package__)
+
+    # Probe the bcl2fastq binaries in the background, so that the versions are
+    # known before the first run is started.
+    cmd_generation_service = Bcl2FastqServiceMixin.bcl2fastq_cmd_generation_service(app_svc.config_svc)
+    Bcl2FastqServiceMixin.executor(app_svc.config_svc).submit(cmd_generation_service.warm_version_cache)
+
+    # Start deleting any old output left in the trash since the service last ran.
+    Bcl2FastqServiceMixin.output_reaper(app_svc.config_svc)
+
+    # Load the jobs recorded by earlier runs of the service.
+    Bcl2FastqServiceMixin.runner_service(app_svc.config_svc)
+
+    # Archive the logs of jobs as they finish, and any logs left unarchived since the service last ran.
+    Bcl2FastqServiceMixin.log_archiver(app_svc.config_svc)
+
+    # Sample the resources used by the jobs as they run.
+    Bcl2FastqServiceMixin.resource_monitor(app_svc.config_svc)
+
+    # Fit the models predicting the runtime of jobs on the jobs which have already finished.
+    Bcl2FastqServiceMixin.runtime_predictor(app_svc.config_svc)
+
     app_svc.start(routes(config=app_svc.config_svc))
@@ -1,12 +1,34 @@
 
+import codecs
+import errno
 import json
 import logging
+import multiprocessing
 import os
+import re
+import shutil
+import time
 
-from bcl2fastq.lib.jobrunner import LocalQAdapter
-from bcl2fastq.lib.bcl2fastq_utils import BCL2FastqRunnerFactory, Bcl2FastqConfig
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.ioloop import PeriodicCallback
+
+from bcl2fastq.lib.jobrunner import LocalQAdapter, SubprocessAdapter, BatchSchedulerAdapter, JobStoreAdapter
+from bcl2fastq.lib.jobstore import JobStore
+from bcl2fastq.lib.bcl2fastq_utils import BCL2FastqRunnerFactory, Bcl2FastqConfig, get_config_value
 from bcl2fastq import __version__ as version
-from bcl2fastq.lib.bcl2fastq_logs import Bcl2FastqLogFileProvider
+from bcl2fastq.lib.bcl2fastq_logs import Bcl2FastqLogFileProvider, LogArchiver
+from bcl2fastq.lib.illumina import RunfolderMetadata, Samplesheet
+from bcl2fastq.lib.output_reaper import OutputReaper
+from bcl2fastq.lib.metrics import ServiceMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from bcl2fastq.lib.demux_stats import StatsSummaryCache, filter_summary
+from bcl2fastq.lib.log_index import LogSearcher, SEVERITIES
+from bcl2fastq.lib.fingerprint import FingerprintRecorder, input_fingerprint, output_matches
+from bcl2fastq.lib.plans import PlanCache, plan_key
+from bcl2fastq.lib.progress import ProgressTracker, expected_tiles, merge_progress
+from bcl2fastq.lib.resources import ResourceMonitor, summarize_resources
+from bcl2fastq.lib.runtime_model import RuntimePredictor, job_estimate, run_features
+from bcl2fastq.lib.scheduling import DEFAULT_AGING_INTERVAL, FIFO, SCHEDULING_POLICIES, estimated_run_size
 from arteria.exceptions import ArteriaUsageException
 from arteria.web.state import State
 from arteria.web.handlers import BaseRestHandler
@@ -25,17 +47,43 @@ class Bcl2FastqServiceMixin:
     _runner_service = None
 
     @staticmethod
-    def runner_service():
+    def runner_service(config):
         """
-        Create an adaptor to the runner service unless one already exists
+        Create an adaptor to the runner service unless one already exists. All jobs
+        are recorded in a job store, which is persisted if `job_store_path` has been
+        configured. Jobs are run as subprocesses of the service by default, by localq
+        if `job_runner: {type: localq}` has been configured, or are submitted to a
+        batch scheduler if `job_runner: {type: batch_scheduler}` has been configured.
+        Jobs run as subprocesses are scheduled by the policy in `job_runner: {scheduling: ...}`
+        (see `queue_order`).
         """
         if Bcl2FastqServiceMixin._runner_service:
             return Bcl2FastqServiceMixin._runner_service
         else:
             import multiprocessing
             nbr_of_cores = multiprocessing.cpu_count()
-            # TODO Make configurable
-            Bcl2FastqServiceMixin._runner_service = LocalQAdapter(nbr_of_cores=nbr_of_cores, interval=2)
+            runner_config = get_config_value(config, "job_runner", {})
+            runner_type = runner_config.get("type", "subprocess")
+            if runner_type == "localq":
+                job_runner = LocalQAdapter(nbr_of_cores=nbr_of_cores, interval=2,
+                                           priority_method=runner_config.get("priority_method", "fifo"))
+            elif runner_type == "subprocess":
+                scheduling = runner_config.get("scheduling", FIFO)
+                if scheduling not in SCHEDULING_POLICIES:
+                    raise ArteriaUsageException("Unknown scheduling policy: {}".format(scheduling))
+                job_runner = SubprocessAdapter(nbr_of_cores=nbr_of_cores,
+                                               scheduling=scheduling,
+                                               aging_interval=runner_config.get("aging_interval",
+                                                                                DEFAULT_AGING_INTERVAL))
+            elif runner_type == "batch_scheduler":
+                job_runner = BatchSchedulerAdapter(**config["job_runner"]["batch_scheduler"])
+            else:
+                raise ArteriaUsageException("Unknown job runner type: {}".format(runner_type))
+            job_store = JobStore(get_config_value(config, "job_store_path", ":memory:"))
+            runner_service = JobStoreAdapter(job_runner, job_store)
+            sync_interval = get_config_value(config, "job_store_sync_interval", 2)
+            PeriodicCallback(runner_service.sync, sync_interval * 1000).start()
+            Bcl2FastqServiceMixin._runner_service = runner_service
             return Bcl2FastqServiceMixin._runner_service
 
     _bcl2fastq_cmd_generation_service = None
@@ -51,6 +99,213 @@ class Bcl2FastqServiceMixin:
             Bcl2FastqServiceMixin._bcl2fastq_cmd_generation_service = BCL2FastqRunnerFactory(config)
             return Bcl2FastqServiceMixin._bcl2fastq_cmd_generation_service
 
+    _executor = None
+
+    @staticmethod
+    def executor(config):
+        """
+        Create a bounded thread pool for blocking work (e.g. subprocesses and file
+        system operations) unless one already exists, so that such work can be
+        kept off the IOLoop.
+        """
+        if Bcl2FastqServiceMixin._executor:
+            return Bcl2FastqServiceMixin._executor
+        else:
+            max_workers = get_config_value(config, "blocking_worker_threads", 4)
+            Bcl2FastqServiceMixin._executor = ThreadPoolExecutor(max_workers=max_workers)
+            return Bcl2FastqServiceMixin._executor
+
+    _staging_executor = None
+
+    @staticmethod
+    def staging_executor(config):
+        """
+        Create a thread pool for finishing the output of jobs (which includes copying staged
+        output from scratch, and can take hours) unless one already exists. It is kept apart
+        from `executor`, so that requests are not held up by output being copied.
+        """
+        if Bcl2FastqServiceMixin._staging_executor:
+            return Bcl2FastqServiceMixin._staging_executor
+        else:
+            max_workers = get_config_value(config, "staging_copy_threads", 4)
+            Bcl2FastqServiceMixin._staging_executor = ThreadPoolExecutor(max_workers=max_workers)
+            return Bcl2FastqServiceMixin._staging_executor
+
+    _output_reaper = None
+
+    @staticmethod
+    def output_reaper(config):
+        """
+        Create an output reaper, which deletes old output in the background, unless one
+        already exists. When it is created it will pick up anything left in the trash
+        from before the service was (re)started.
+        """
+        if Bcl2FastqServiceMixin._output_reaper:
+            return Bcl2FastqServiceMixin._output_reaper
+        else:
+            reaper_config = get_config_value(config, "output_reaper", {})
+            output_reaper = OutputReaper(
+                nbr_of_threads=reaper_config.get("nbr_of_threads", 4),
+                max_deletions_per_second=reaper_config.get("max_deletions_per_second"))
+            scratch_path = get_config_value(config, "scratch_path")
+            output_reaper.resume(config["allowed_output_folders"] + ([scratch_path] if scratch_path else []))
+            Bcl2FastqServiceMixin._output_reaper = output_reaper
+            return Bcl2FastqServiceMixin._output_reaper
+
+    _progress_tracker = None
+
+    @staticmethod
+    def progress_tracker(config):
+        """
+        Create a progress tracker, which follows the logs of running jobs, unless one
+        already exists. The progress of a job (and of the jobs which are part of it) is
+        forgotten once it has finished.
+        """
+        if Bcl2FastqServiceMixin._progress_tracker:
+            return Bcl2FastqServiceMixin._progress_tracker
+        else:
+            progress_tracker = ProgressTracker()
+            runner_service = Bcl2FastqServiceMixin.runner_service(config)
+
+            def forget_finished(job, old_state, new_state):
+                if new_state in JobStore.FINISHED_STATES and not job["parent_job_id"]:
+                    progress_tracker.forget(job["job_id"])
+                    for child_job in runner_service.job_store.child_jobs(job["job_id"]):
+                        progress_tracker.forget(child_job["job_id"])
+
+            runner_service.add_listener(forget_finished)
+            Bcl2FastqServiceMixin._progress_tracker = progress_tracker
+            return Bcl2FastqServiceMixin._progress_tracker
+
+    _metrics = None
+
+    @staticmethod
+    def metrics(config):
+        """
+        Create the metrics of the service, which follow the jobs of the runner service,
+        unless they already exist.
+        """
+        if Bcl2FastqServiceMixin._metrics:
+            return Bcl2FastqServiceMixin._metrics
+        else:
+            Bcl2FastqServiceMixin._metrics = ServiceMetrics(Bcl2FastqServiceMixin.runner_service(config))
+            return Bcl2FastqServiceMixin._metrics
+
+    _stats_summary_cache = None
+
+    @staticmethod
+    def stats_summary_cache(config):
+        """
+        Create a cache of the summaries of Stats.json files unless one already exists.
+        """
+        if Bcl2FastqServiceMixin._stats_summary_cache:
+            return Bcl2FastqServiceMixin._stats_summary_cache
+        else:
+            Bcl2FastqServiceMixin._stats_summary_cache = StatsSummaryCache()
+            return Bcl2FastqServiceMixin._stats_summary_cache
+
+    _plan_cache = None
+
+    @staticmethod
+    def plan_cache(config):
+        """
+        Create a cache of the plans made for runfolders unless one already exists.
+        """
+        if Bcl2FastqServiceMixin._plan_cache:
+            return Bcl2FastqServiceMixin._plan_cache
+        else:
+            Bcl2FastqServiceMixin._plan_cache = PlanCache()
+            return Bcl2FastqServiceMixin._plan_cache
+
+    _log_archiver = None
+
+    @staticmethod
+    def log_archiver(config):
+        """
+        Create a log archiver, which compresses the logs of finished jobs of the runner
+        service, unless one already exists. When it is created it will compress any logs
+        left uncompressed since the service last ran.
+        """
+        if Bcl2FastqServiceMixin._log_archiver:
+            return Bcl2FastqServiceMixin._log_archiver
+        else:
+            archive_config = get_config_value(config, "log_archive", {})
+            max_total_size_mb = archive_config.get("max_total_size_mb")
+            log_archiver = LogArchiver(config["bcl2fastq_logs_path"],
+                                       Bcl2FastqServiceMixin.executor(config),
+                                       max_age_days=archive_config.get("max_age_days"),
+                                       max_total_bytes=max_total_size_mb * 1024 * 1024 if max_total_size_mb else None)
+            Bcl2FastqServiceMixin.runner_service(config).add_listener(log_archiver.on_job_state_change)
+            log_archiver.resume()
+            Bcl2FastqServiceMixin._log_archiver = log_archiver
+            return Bcl2FastqServiceMixin._log_archiver
+
+    _log_searcher = None
+
+    @staticmethod
+    def log_searcher(config):
+        """
+        Create a searcher of the logs, which keeps an index of each log next to it, unless
+        one already exists.
+        """
+        if Bcl2FastqServiceMixin._log_searcher:
+            return Bcl2FastqServiceMixin._log_searcher
+        else:
+            Bcl2FastqServiceMixin._log_searcher = LogSearcher()
+            return Bcl2FastqServiceMixin._log_searcher
+
+    _fingerprint_recorder = None
+
+    @staticmethod
+    def fingerprint_recorder(config):
+        """
+        Create a recorder of the fingerprints of the inputs of successful jobs, which follows
+        the jobs of the runner service, unless one already exists.
+        """
+        if Bcl2FastqServiceMixin._fingerprint_recorder:
+            return Bcl2FastqServiceMixin._fingerprint_recorder
+        else:
+            Bcl2FastqServiceMixin._fingerprint_recorder = FingerprintRecorder(
+                Bcl2FastqServiceMixin.runner_service(config),
+                Bcl2FastqServiceMixin.executor(config))
+            return Bcl2FastqServiceMixin._fingerprint_recorder
+
+    _resource_monitor = None
+
+    @staticmethod
+    def resource_monitor(config):
+        """
+        Create a monitor of the resources used by running jobs unless one already exists.
+        The jobs are sampled every `resource_sampling_interval` seconds (30 by default,
+        0 to not sample them at all).
+        """
+        if Bcl2FastqServiceMixin._resource_monitor:
+            return Bcl2FastqServiceMixin._resource_monitor
+        else:
+            resource_monitor = ResourceMonitor(Bcl2FastqServiceMixin.runner_service(config),
+                                               Bcl2FastqServiceMixin.executor(config))
+            sampling_interval = get_config_value(config, "resource_sampling_interval", 30)
+            if sampling_interval:
+                PeriodicCallback(resource_monitor.sample, sampling_interval * 1000).start()
+            Bcl2FastqServiceMixin._resource_monitor = resource_monitor
+            return Bcl2FastqServiceMixin._resource_monitor
+
+    _runtime_predictor = None
+
+    @staticmethod
+    def runtime_predictor(config):
+        """
+        Create a predictor of the runtime of jobs, fitted on the jobs of the runner service
+        which have finished successfully, unless one already exists.
+        """
+        if Bcl2FastqServiceMixin._runtime_predictor:
+            return Bcl2FastqServiceMixin._runtime_predictor
+        else:
+            Bcl2FastqServiceMixin._runtime_predictor = RuntimePredictor(
+                Bcl2FastqServiceMixin.runner_service(config),
+                Bcl2FastqServiceMixin.executor(config))
+            return Bcl2FastqServiceMixin._runtime_predictor
+
 class BaseBcl2FastqHandler(BaseRestHandler):
     """
     Base handler for bcl2fastq.
@@ -63,9 +318,32 @@ class BaseBcl2FastqHandler(BaseRestHandler):
         """
         self.config = config
         self.bcl2fastq_log_file_provider = Bcl2FastqLogFileProvider(self.config)
+        self.usage_error_recorded = False
 
+    def route_name(self):
+        """
+        :return: the name of the route (as given in `app.routes`) this handler serves
+        """
+        for name, url_spec in self.application.named_handlers.items():
+            if url_spec.handler_class is type(self):
+                return name
+        return type(self).__name__
+
+    def record_usage_error(self):
+        """
+        Count a request which failed because of an `ArteriaUsageException`.
+        """
+        self.usage_error_recorded = True
+        Bcl2FastqServiceMixin.metrics(self.config).usage_errors.inc(route=self.route_name())
 
-class VersionsHandler(BaseBcl2FastqHandler):
+    def on_finish(self):
+        Bcl2FastqServiceMixin.metrics(self.config).handler_latency.observe(self.request.request_time(),
+                                                                         route=self.route_name(),
+                                                                         method=self.request.method,
+                                                                         code=self.get_status())
+
+
+class VersionsHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
     """
     Get the available bcl2fastq versions that the
     service knows about.
@@ -73,9 +351,14 @@ class VersionsHandler(BaseBcl2FastqHandler):
 
     def get(self):
         """
-        Returns all available bcl2fastq versions (as defined by config).
+        Returns all available bcl2fastq versions (as defined by config). For each
+        version the `detected_version` is the version reported by the binary itself,
+        or null if it has not been detected yet.
         """
-        available_versions = self.config["bcl2fastq"]["versions"]
+        detected_versions = self.bcl2fastq_cmd_generation_service(self.config).detected_versions()
+        available_versions = {}
+        for version, version_config in self.config["bcl2fastq"]["versions"].items():
+            available_versions[version] = dict(version_config, detected_version=detected_versions.get(version))
         self.write_object(available_versions)
 
 class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
@@ -83,7 +366,7 @@ class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
     Start bcl2fastq
     """
 
-    def create_config_from_request(self, runfolder, request_body):
+    def create_config_from_request(self, runfolder, request_body, dry_run=False):
         """
         For the specified runfolder, will look it up from the place setup in the
         configuration, and then parse additional data from the request_data object.
@@ -91,6 +374,7 @@ class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
         instance.
         :param runfolder: name of the runfolder we want to create a config for
         :param request_body: the body of the request. Can be empty, in which case if will not be loaded.
+        :param dry_run: do not write a provided samplesheet to the runfolder yet (see `Bcl2FastqConfig`)
         :return: an instances of Bcl2FastqConfig
         """
 
@@ -109,6 +393,8 @@ class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
         use_base_mask = ""
         create_indexes = False
         additional_args = ""
+        split_by_lane = False
+        lanes = None
 
         runfolder_base_path = self.config["runfolder_path"]
         runfolder_input = "{0}/{1}".format(runfolder_base_path, runfolder)
@@ -141,6 +427,18 @@ class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
         if "additional_args" in request_data:
             additional_args = request_data["additional_args"]
 
+        if "split_by_lane" in request_data:
+            split_by_lane = request_data["split_by_lane"] in (True, "True")
+
+        if "lanes" in request_data:
+            lanes = request_data["lanes"]
+            if isinstance(lanes, basestring):
+                lanes = lanes.split(",")
+            try:
+                lanes = [int(lane) for lane in lanes]
+            except (TypeError, ValueError):
+                raise ArteriaUsageException("Invalid lanes: {}".format(request_data["lanes"]))
+
         config = Bcl2FastqConfig(
             self.config,
             bcl2fastq_version,
@@ -151,10 +449,335 @@ class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
             tiles,
             use_base_mask,
             create_indexes,
-            additional_args)
+            additional_args,
+            split_by_lane=split_by_lane,
+            lanes=lanes,
+            dry_run=dry_run)
 
         return config
 
+    def build_job(self, runfolder, request_body, dry_run=False):
+        """
+        Does the (potentially slow) work needed to know what to run for a runfolder:
+        reading the runfolder meta data and samplesheet, probing the bcl2fastq version
+        and generating the command. This leaves any old output alone. It blocks, so it
+        should not be run on the IOLoop.
+        :param runfolder: name of the runfolder we want to start bcl2fastq for
+        :param request_body: the body of the request
+        :param dry_run: do not write anything (i.e. a provided samplesheet, and the samplesheets of
+                        the lanes), which then has to be done with `write_job_files` before the job
+                        is started
+        :return: a tuple of the Bcl2FastqConfig, the bcl2fastq runner, the bcl2fastq version,
+                 the machine type (None if not known) and the command to run (or when splitting
+                 by lane, a list of (lane, command, number of cores) tuples)
+        """
+        runfolder_config = self.create_config_from_request(runfolder, request_body, dry_run=dry_run)
+
+        job_runner = self.bcl2fastq_cmd_generation_service(self.config). \
+            create_bcl2fastq_runner(runfolder_config)
+        bcl2fastq_version = job_runner.version()
+        if runfolder_config.split_by_lane:
+            cmd = job_runner.construct_lane_commands(write_samplesheets=not dry_run)
+        else:
+            cmd = job_runner.construct_command()
+
+        try:
+            machine_type = RunfolderMetadata.for_runfolder(runfolder_config.runfolder_input).machine_type
+        except (IOError, OSError):
+            machine_type = None
+
+        return runfolder_config, job_runner, bcl2fastq_version, machine_type, cmd
+
+    def clear_output(self, job_runner):
+        """
+        If the output directory exists, we always want to clear it. It is moved out
+        of the way here, and then deleted in the background. The output is then linked
+        to from the runfolder. This blocks, so it should not be run on the IOLoop.
+        :param job_runner: the bcl2fastq runner to clear the output of
+        """
+        job_runner.delete_output(self.output_reaper(self.config))
+        job_runner.symlink_output_to_unaligned()
+
+    @staticmethod
+    def write_job_files(prepared_job):
+        """
+        Write the files a job built as a dry run needs, i.e. a provided samplesheet and the
+        samplesheets of the lanes.
+        :param prepared_job: as returned by `build_job`
+        """
+        runfolder_config, job_runner, _, _, cmd = prepared_job
+        runfolder_config.write_pending_samplesheet()
+        if runfolder_config.split_by_lane:
+            job_runner.write_lane_samplesheets([lane for lane, _, _ in cmd])
+
+    @staticmethod
+    def fingerprint(prepared_job):
+        """
+        :param prepared_job: as returned by `build_job`
+        :return: the fingerprint of the inputs of the job, see `input_fingerprint`
+        """
+        runfolder_config, _, bcl2fastq_version, _, cmd = prepared_job
+        return input_fingerprint(runfolder_config.samplesheet_file,
+                                 os.path.join(runfolder_config.runfolder_input, "RunInfo.xml"),
+                                 cmd,
+                                 bcl2fastq_version)
+
+    def prepare_output(self, prepared_job, request_body):
+        """
+        Clear the output of a job, unless it is the intact output of an earlier successful
+        run with the same fingerprint and `force` has not been requested. This blocks, so it
+        should not be run on the IOLoop.
+        :param prepared_job: as returned by `build_job`
+        :param request_body: the body of the request
+        :return: a tuple of the fingerprint of the job, and True if the output was kept since
+                 it is up to date (otherwise False)
+        """
+        request_data = json.loads(request_body) if request_body else {}
+        force = request_data.get("force") in (True, "True", "true")
+        fingerprint = self.fingerprint(prepared_job)
+        output = prepared_job[0].output
+        if not force and output_matches(output, fingerprint):
+            log.info("The output in {} is up to date, so it will not be made again".format(output))
+            return fingerprint, True
+
+        self.clear_output(prepared_job[1])
+        return fingerprint, False
+
+    def plan_key(self, runfolder, request_body):
+        """
+        :return: the key of the plan for a runfolder and request (see `plan_key`), which also changes
+                 when a configured bcl2fastq binary is replaced or a thread profile is stored by
+                 autotuning, since the command of the plan is made from them
+        """
+        request_data = json.loads(request_body) if request_body else {}
+        cmd_generation_service = self.bcl2fastq_cmd_generation_service(self.config)
+        environment = {"binaries": cmd_generation_service.binary_stats(),
+                       "thread_profiles": cmd_generation_service.thread_profiles.store.version}
+        return plan_key("{0}/{1}".format(self.config["runfolder_path"], runfolder), request_data, environment)
+
+    def prepare_job(self, runfolder, request_body):
+        """
+        Does all the (potentially slow) work needed before bcl2fastq can be
+        started for a runfolder, i.e. `build_job` followed by `prepare_output`.
+        If a plan has been made for the runfolder with the same samplesheet, run
+        meta data and parameters, the job of the plan is used instead of building
+        it again. This blocks, so it should not be run on the IOLoop.
+        :return: a tuple of the job (see `build_job`), its fingerprint, if its output
+                 is already up to date (see `prepare_output`), and its estimates (see
+                 `run_estimates`)
+        """
+        plan = None
+        if not (request_body and json.loads(request_body).get("samplesheet")):
+            plan = self.plan_cache(self.config).get(self.plan_key(runfolder, request_body))
+
+        if plan:
+            log.info("Using the plan made for {}".format(runfolder))
+            prepared_job = plan["prepared_job"]
+            estimates = plan["estimates"]
+            self.write_job_files(prepared_job)
+        else:
+            prepared_job = self.build_job(runfolder, request_body)
+            estimates = self.run_estimates(prepared_job[0], prepared_job[4])
+        fingerprint, output_is_current = self.prepare_output(prepared_job, request_body)
+        return prepared_job, fingerprint, output_is_current, estimates
+
+    @staticmethod
+    def priority(request_body):
+        """
+        :param request_body: the body of the request
+        :return: the priority requested for the job (0 if none was requested)
+        :raises: ArteriaUsageException if the priority is not an integer
+        """
+        request_data = json.loads(request_body) if request_body else {}
+        priority = request_data.get("priority", 0)
+        if isinstance(priority, (int, long)) and not isinstance(priority, bool):
+            return priority
+        if isinstance(priority, basestring) and re.match(r"^-?\d+$", priority.strip()):
+            return int(priority)
+        raise ArteriaUsageException("Invalid priority: {}".format(priority))
+
+    @staticmethod
+    def run_estimates(runfolder_config, cmd):
+        """
+        Describe the work of a job, or when splitting by lane, of the job of each lane. This reads
+        RunInfo.xml and the samplesheet, so it should not be run on the IOLoop.
+        :param cmd: the command of a job, as returned by `build_job`
+        :return: a list with a tuple of the estimated size (see `estimated_run_size`, None if not
+                 known) and the features (see `run_features`) of each job
+        """
+        try:
+            runfolder_metadata = RunfolderMetadata.for_runfolder(runfolder_config.runfolder_input)
+        except (IOError, OSError):
+            runfolder_metadata = None
+        try:
+            samplesheet = Samplesheet(runfolder_config.samplesheet_source)
+        except (IOError, OSError):
+            samplesheet = None
+
+        if runfolder_config.split_by_lane:
+            jobs = cmd
+        else:
+            jobs = [(None, cmd, runfolder_config.nbr_of_cores)]
+        return [(estimated_run_size(runfolder_metadata, job_cmd),
+                 run_features(runfolder_metadata, samplesheet, expected_tiles(runfolder_metadata, job_cmd), lane,
+                              nbr_of_cores))
+                for lane, job_cmd, nbr_of_cores in jobs]
+
+    def start_job(self, runfolder, runfolder_config, job_runner, bcl2fastq_version, machine_type, cmd,
+                  fingerprint=None, priority=0, estimates=None):
+        """
+        Start a job from what `prepare_job` returned. This does not block.
+        :param fingerprint: of the inputs of the job, written to its output if it is successful
+        :param priority: of the job, jobs of higher priority are run first
+        :param estimates: of the job, see `run_estimates` (None if not known)
+        :return: the response data describing the started job
+        """
+        if estimates is None:
+            estimates = [(None, None)] * (len(cmd) if runfolder_config.split_by_lane else 1)
+        sizes = [size for size, _ in estimates]
+        features = [job_features for _, job_features in estimates]
+        runtime_predictor = self.runtime_predictor(self.config)
+        runtimes = [runtime_predictor.predict(job_features) if job_features else None for job_features in features]
+        if runfolder_config.split_by_lane:
+            job_id = self.start_lane_jobs(runfolder, runfolder_config, job_runner, cmd, priority=priority,
+                                          sizes=sizes, runtimes=runtimes, features=features)
+        elif runfolder_config.scratch:
+            # The job is started as a group of one, so that it is only done once its output is in place.
+            log_file = self.bcl2fastq_log_file_provider.log_file_path(runfolder)
+            job_id = self.runner_service(self.config).start_group(
+                [(cmd, runfolder_config.nbr_of_cores, log_file, log_file)],
+                run_dir=runfolder_config.runfolder_input,
+                finalizer=self.output_finalizer(job_runner),
+                priority=priority,
+                sizes=sizes,
+                runtimes=runtimes,
+                features=features)
+
+            log.info("Cmd: {} started in {} with {} cores, staging the output in {}. Writing logs to: {}".format(
+                cmd, runfolder_config.runfolder_input, runfolder_config.nbr_of_cores, runfolder_config.scratch,
+                log_file))
+        else:
+            log_file = self.bcl2fastq_log_file_provider.log_file_path(runfolder)
+
+            job_id = self.runner_service(self.config).start(
+                cmd,
+                nbr_of_cores=runfolder_config.nbr_of_cores,
+                run_dir=runfolder_config.runfolder_input,
+                stdout=log_file,
+                stderr=log_file,
+                priority=priority,
+                size=sizes[0],
+                runtime=runtimes[0],
+                features=features[0])
+
+            log.info(
+                "Cmd: {} started in {} with {} cores. Writing logs to: {}".format(cmd,
+                                                                                  runfolder_config.runfolder_input,
+                                                                                  runfolder_config.nbr_of_cores,
+                                                                                  log_file))
+
+        if job_id is not None:
+            self.metrics(self.config).label_job(job_id, bcl2fastq_version, machine_type)
+            self.resource_monitor(self.config).watch(job_id, runfolder_config.work_output)
+        if job_id is not None and fingerprint:
+            self.fingerprint_recorder(self.config).expect(job_id, runfolder_config.output, fingerprint)
+
+        return self._response_data(job_id, runfolder_config, bcl2fastq_version, cmd, State.STARTED)
+
+    def skip_job(self, runfolder, runfolder_config, job_runner, bcl2fastq_version, machine_type, cmd):
+        """
+        Record a job whose output is already up to date as done, without running it.
+        :return: the response data describing the job
+        """
+        if runfolder_config.split_by_lane:
+            job_cmd = "\n".join(lane_cmd for _, lane_cmd, _ in cmd)
+            nbr_of_cores = sum(nbr_of_cores for _, _, nbr_of_cores in cmd)
+        else:
+            job_cmd = cmd
+            nbr_of_cores = runfolder_config.nbr_of_cores
+
+        job_id = self.runner_service(self.config).add_done_job(job_cmd,
+                                                               nbr_of_cores=nbr_of_cores,
+                                                               run_dir=runfolder_config.runfolder_input)
+        log.info("Cmd: {} was not run, since the output in {} is up to date".format(job_cmd,
+                                                                                  runfolder_config.output))
+
+        response_data = self._response_data(job_id, runfolder_config, bcl2fastq_version, cmd, State.DONE)
+        response_data["output_reused"] = True
+        return response_data
+
+    def _response_data(self, job_id, runfolder_config, bcl2fastq_version, cmd, state):
+        status_end_point = "{0}://{1}{2}".format(
+            self.request.protocol,
+            self.request.host,
+            self.reverse_url("status", job_id))
+
+        response_data = {
+            "job_id": job_id,
+            "bcl2fastq_version": bcl2fastq_version,
+            "service_version": version,
+            "link": status_end_point,
+            "state": state}
+
+        if runfolder_config.split_by_lane:
+            response_data["lanes"] = [lane for lane, _, _ in cmd]
+
+        return response_data
+
+    @staticmethod
+    def finish_output(job_runner, output_reaper=None):
+        """
+        Finish the output of a job once bcl2fastq is done, by merging the statistics and reports
+        of the lanes when splitting by lane, and then moving the output from scratch when it is
+        staged there (see `BCL2FastqRunner.move_staged_output`). This blocks, so it should not
+        be run on the IOLoop.
+        :param job_runner: the bcl2fastq runner of the job
+        :param output_reaper: to delete any output replaced by the staged output
+        """
+        if job_runner.config.split_by_lane:
+            job_runner.merge_lane_outputs()
+        if job_runner.config.scratch:
+            job_runner.move_staged_output(output_reaper)
+
+    def output_finalizer(self, job_runner):
+        """
+        :return: a finalizer for the group of jobs of a bcl2fastq run (see `JobStoreAdapter.start_group`),
+                 which finishes its output in the background, so that the group is only done once that
+                 has succeeded
+        """
+        def finalizer(group_job_id):
+            return self.staging_executor(self.config).submit(self.finish_output, job_runner,
+                                                             self.output_reaper(self.config))
+        return finalizer
+
+    def start_lane_jobs(self, runfolder, runfolder_config, job_runner, lane_commands, priority=0, sizes=None,
+                        runtimes=None, features=None):
+        """
+        Start one job per lane, as a group which is done once all lanes are done and their
+        statistics and reports have been merged (and the output moved from scratch, if staged).
+        The log of each lane is written to the log of `<runfolder>_L<lane>`, e.g. `<runfolder>_L001`.
+        :param priority: of the jobs
+        :param sizes: the estimated size of the job of each lane (see `run_estimates`)
+        :param runtimes: the predicted runtime of the job of each lane (see `RuntimePredictor`)
+        :param features: of the job of each lane, recorded to predict the runtime of later jobs from
+        :return: the job id of the group
+        """
+        jobs = []
+        for lane, cmd, nbr_of_cores in lane_commands:
+            log_file = self.bcl2fastq_log_file_provider.log_file_path("{}_L{:03d}".format(runfolder, lane))
+            jobs.append((cmd, nbr_of_cores, log_file, log_file))
+            log.info("Cmd: {} for lane {} started in {} with {} cores. Writing logs to: {}".format(
+                cmd, lane, runfolder_config.runfolder_input, nbr_of_cores, log_file))
+
+        return self.runner_service(self.config).start_group(jobs,
+                                                            run_dir=runfolder_config.runfolder_input,
+                                                            finalizer=self.output_finalizer(job_runner),
+                                                            priority=priority,
+                                                            sizes=sizes,
+                                                            runtimes=runtimes,
+                                                            features=features)
+
+    @gen.coroutine
     def post(self, runfolder):
         """
         Starts a bcl2fastq for a runfolder. The input data can contain extra
@@ -167,63 +790,395 @@ class StartHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
          - tiles
          - use_base_mask
          - additional_args
+         - split_by_lane (run one job per lane, and merge the statistics at the end)
+         - lanes (only run these lanes, when splitting by lane)
+         - force (run bcl2fastq even if the output is already up to date)
+         - priority (an integer, jobs of higher priority are run first, 0 by default)
         If these are not set defaults setup in Bcl2FastqConfig will be
         used (and those should be good enough for most cases).
 
+        When a job is successful, a fingerprint of the samplesheet, RunInfo.xml, the command
+        and the bcl2fastq version is written to its output. If the output is intact and has
+        the same fingerprint when bcl2fastq is started again, nothing is run and the job is
+        returned as done, unless `force` is true.
+
+        If `scratch_path` is configured, bcl2fastq writes its output to local scratch, and
+        `Unaligned` points there while it runs. The output is then moved to the output directory,
+        with each file copy verified, and `Unaligned` is re-pointed at it, before the job is done.
+
         :param runfolder: name of the runfolder we want to start bcl2fastq for
         """
 
         try:
-            runfolder_config = self.create_config_from_request(runfolder, self.request.body)
+            priority = self.priority(self.request.body)
+            prepared_job, fingerprint, output_is_current, estimates = yield self.executor(self.config).submit(
+                self.prepare_job, runfolder, self.request.body)
+            if output_is_current:
+                response_data = self.skip_job(runfolder, *prepared_job)
+            else:
+                response_data = self.start_job(runfolder, *prepared_job, fingerprint=fingerprint, priority=priority,
+                                               estimates=estimates)
 
-            job_runner = self.bcl2fastq_cmd_generation_service(self.config). \
-                create_bcl2fastq_runner(runfolder_config)
-            bcl2fastq_version = job_runner.version()
-            cmd = job_runner.construct_command()
-            # If the output directory exists, we always want to clear it.
-            job_runner.delete_output()
-            job_runner.symlink_output_to_unaligned()
+            self.set_status(202, reason="started processing")
+            self.write_json(response_data)
+        except ArteriaUsageException as e:
+            log.warning("Failed starting {0}. Message: {1}".format(runfolder, e.message))
+            self.record_usage_error()
+            self.send_error(status_code=500, reason=e.message)
 
-            log_file = self.bcl2fastq_log_file_provider.log_file_path(runfolder)
+    def on_finish(self):
+        super(StartHandler, self).on_finish()
+        if self.get_status() >= 400:
+            reason = "usage_error" if self.usage_error_recorded else "error"
+            self.metrics(self.config).start_failures.inc(reason=reason)
 
-            job_id = self.runner_service().start(
-                cmd,
-                nbr_of_cores=runfolder_config.nbr_of_cores,
-                run_dir=runfolder_config.runfolder_input,
-                stdout=log_file,
-                stderr=log_file)
 
-            log.info(
-                "Cmd: {} started in {} with {} cores. Writing logs to: {}".format(cmd,
-                                                                                  runfolder_config.runfolder_input,
-                                                                                  runfolder_config.nbr_of_cores,
-                                                                                  log_file))
 
-            status_end_point = "{0}://{1}{2}".format(
-                self.request.protocol,
-                self.request.host,
-                self.reverse_url("status", job_id))
+class PlanHandler(StartHandler):
+    """
+    Show what would be run for a runfolder, without starting anything
+    """
+
+    @staticmethod
+    def describe_plan(runfolder, key, prepared_job):
+        """
+        Describe a job built as a dry run.
+        :return: the description as a dict
+        """
+        runfolder_config, job_runner, bcl2fastq_version, machine_type, cmd = prepared_job
+        if runfolder_config.split_by_lane:
+            commands = [{"lane": lane, "cmd": lane_cmd, "nbr_of_cores": nbr_of_cores}
+                        for lane, lane_cmd, nbr_of_cores in cmd]
+        else:
+            commands = [{"lane": None, "cmd": cmd, "nbr_of_cores": runfolder_config.nbr_of_cores}]
+
+        try:
+            runfolder_metadata = RunfolderMetadata.for_runfolder(runfolder_config.runfolder_input)
+        except (IOError, OSError):
+            runfolder_metadata = None
+
+        samplesheet = Samplesheet(runfolder_config.samplesheet_source)
+        if runfolder_config.use_base_mask:
+            bases_masks = {"all": runfolder_config.use_base_mask}
+        elif runfolder_metadata:
+            bases_masks = Bcl2FastqConfig.get_bases_mask_per_lane_from_samplesheet(
+                samplesheet, runfolder_metadata.index_lengths, runfolder_metadata.is_single_read)
+        else:
+            bases_masks = {}
 
-            response_data = {
-                "job_id": job_id,
+        tiles = [expected_tiles(runfolder_metadata, command["cmd"]) for command in commands]
+        return {"plan_id": key,
+                "runfolder": runfolder,
                 "bcl2fastq_version": bcl2fastq_version,
-                "service_version": version,
-                "link": status_end_point,
-                "state": State.STARTED}
+                "requested_bcl2fastq_version": runfolder_config.bcl2fastq_version,
+                "machine_type": machine_type,
+                "output": runfolder_config.output,
+                "scratch": runfolder_config.scratch,
+                "split_by_lane": runfolder_config.split_by_lane,
+                "commands": commands,
+                "bases_masks": {str(lane): bases_mask for lane, bases_mask in bases_masks.items()},
+                "resources": {"nbr_of_jobs": len(commands),
+                              "nbr_of_cores": sum(command["nbr_of_cores"] for command in commands),
+                              "nbr_of_samples": len(samplesheet.columns.lane),
+                              "nbr_of_tiles": sum(tiles) if None not in tiles else None}}
 
-            self.set_status(202, reason="started processing")
-            self.write_json(response_data)
+    def make_plan(self, runfolder, request_body):
+        """
+        Make the plan for a runfolder, or get it from the cache if it has already been made
+        with the same samplesheet, run meta data and parameters. This blocks, so it should
+        not be run on the IOLoop.
+        :return: a tuple of the plan, and whether it was found in the cache
+        """
+        key = self.plan_key(runfolder, request_body)
+        plan_cache = self.plan_cache(self.config)
+        plan = plan_cache.get(key)
+        if plan:
+            return plan, True
+
+        if request_body and json.loads(request_body).get("samplesheet"):
+            raise ArteriaUsageException("Plans can only be made using the samplesheet in the runfolder")
+        prepared_job = self.build_job(runfolder, request_body, dry_run=True)
+        runfolder_config, _, _, _, cmd = prepared_job
+        plan = {"prepared_job": prepared_job,
+                "description": self.describe_plan(runfolder, key, prepared_job),
+                "estimates": self.run_estimates(runfolder_config, cmd)}
+        plan_cache.put(key, plan)
+        return plan, False
+
+    def with_predicted_runtimes(self, description, features):
+        """
+        Add the runtime predicted for each command of a plan, and for all of them, which is that of
+        the longest command since the jobs of the lanes are run side by side. The runtimes are
+        predicted when the plan is shown, so that they follow the jobs which have finished since
+        it was made.
+        :param description: of the plan, see `describe_plan`
+        :param features: of the job of each command (see `run_features`)
+        :return: a copy of the description with the predicted runtimes (None if not known), in seconds
+        """
+        runtime_predictor = self.runtime_predictor(self.config)
+        runtimes = [runtime_predictor.predict(job_features) for job_features in features]
+        commands = [dict(command, predicted_runtime_seconds=runtime)
+                    for command, runtime in zip(description["commands"], runtimes)]
+        resources = dict(description["resources"],
+                         predicted_runtime_seconds=max(runtimes) if runtimes and None not in runtimes else None)
+        return dict(description, commands=commands, resources=resources)
+
+    @gen.coroutine
+    def _respond_with_plan(self, runfolder, request_body):
+        try:
+            plan, cached = yield self.executor(self.config).submit(self.make_plan, runfolder, request_body)
+            description = self.with_predicted_runtimes(plan["description"],
+                                                       [features for _, features in plan["estimates"]])
+            self.write_json(dict(description, cached=cached))
         except ArteriaUsageException as e:
-            log.warning("Failed starting {0}. Message: {1}".format(runfolder, e.message))
+            log.warning("Failed making a plan for {0}. Message: {1}".format(runfolder, e.message))
+            self.record_usage_error()
             self.send_error(status_code=500, reason=e.message)
 
+    @gen.coroutine
+    def get(self, runfolder):
+        """
+        Get the plan for running bcl2fastq on a runfolder with the default parameters. See `post`.
+        :param runfolder: name of the runfolder to make a plan for
+        """
+        yield self._respond_with_plan(runfolder, "")
+
+    @gen.coroutine
+    def post(self, runfolder):
+        """
+        Get the plan for running bcl2fastq on a runfolder, without starting anything or changing
+        any existing output. The input data can contain the same parameters as when starting
+        bcl2fastq (except for `samplesheet`). The plan contains the commands that would be run,
+        the bases mask of each lane, the bcl2fastq version, and the resources needed. Plans are
+        cached by the content of the samplesheet, RunInfo.xml and RunParameters.xml and the
+        parameters, and a start with the same parameters will use the cached plan. The runtime of
+        each command is predicted from the history of finished jobs, once there is enough of it.
+        :param runfolder: name of the runfolder to make a plan for
+        """
+        yield self._respond_with_plan(runfolder, self.request.body)
+
+    def on_finish(self):
+        # Plans are not starts, so failures are not counted as failed starts.
+        BaseBcl2FastqHandler.on_finish(self)
+
+
+class BatchStartHandler(StartHandler):
+    """
+    Start bcl2fastq for many runfolders at once
+    """
+
+    @staticmethod
+    def parse_batch(request_body):
+        """
+        Parse the body of a batch start request.
+        :return: a list of (runfolder, request body) tuples, where the request body is what
+                 would have been posted to start the runfolder on its own
+        :raises: ArteriaUsageException if the request is not valid
+        """
+        try:
+            request_data = json.loads(request_body) if request_body else {}
+        except ValueError:
+            raise ArteriaUsageException("The request body is not valid json")
+
+        runfolders = request_data.get("runfolders")
+        defaults = request_data.get("defaults") or {}
+        if not runfolders or not isinstance(runfolders, list):
+            raise ArteriaUsageException("No runfolders to start")
+
+        batch = []
+        for entry in runfolders:
+            if isinstance(entry, basestring):
+                runfolder, overrides = entry, {}
+            elif isinstance(entry, dict) and entry.get("runfolder"):
+                overrides = dict(entry)
+                runfolder = overrides.pop("runfolder")
+            else:
+                raise ArteriaUsageException("Invalid runfolder entry: {}".format(entry))
+            batch.append((runfolder, json.dumps(dict(defaults, **overrides))))
+
+        names = [runfolder for runfolder, _ in batch]
+        duplicates = sorted(set(runfolder for runfolder in names if names.count(runfolder) > 1))
+        if duplicates:
+            raise ArteriaUsageException("Runfolders given more than once: {}".format(", ".join(duplicates)))
+        return batch
+
+    @gen.coroutine
+    def _wait_for_all(self, futures):
+        """
+        Wait for all futures, also when some of them fail.
+        :return: a list of (result, exception) tuples, in the order of the futures
+        """
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(((yield future), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        raise gen.Return(outcomes)
+
+    def build_job_with_estimates(self, runfolder, request_body):
+        """
+        Build the job of a runfolder as a dry run (see `build_job`), and its estimates (see
+        `run_estimates`). This blocks, so it should not be run on the IOLoop.
+        :return: a tuple of the job and its estimates
+        """
+        prepared_job = self.build_job(runfolder, request_body, dry_run=True)
+        return prepared_job, self.run_estimates(prepared_job[0], prepared_job[4])
+
+    def _report_errors(self, runfolders, outcomes):
+        errors = {}
+        for runfolder, (_, exception) in zip(runfolders, outcomes):
+            if exception is not None:
+                log.warning("Failed preparing {0} for a batch start. Message: {1}".format(runfolder, exception))
+                if isinstance(exception, ArteriaUsageException):
+                    self.record_usage_error()
+                errors[runfolder] = str(exception)
+        self.set_status(500, reason="failed preparing runfolders")
+        self.write_json({"errors": errors, "state": State.ERROR})
+
+    @gen.coroutine
+    def post(self):
+        """
+        Starts bcl2fastq for several runfolders. The input data should be a json encoded object
+        with a list of `runfolders`, each either the name of a runfolder, or an object with the
+        name as `runfolder` and any of the parameters accepted when starting a single runfolder,
+        e.g.:
+
+            {"runfolders": ["runfolder_1", {"runfolder": "runfolder_2", "tiles": "s_1"}],
+             "defaults": {"barcode_mismatches": "0"}}
+
+        Parameters in `defaults` apply to all runfolders (unless overridden). All runfolders are
+        validated and their commands built concurrently, and only if that succeeds for all of
+        them are their samplesheets written, their old output cleared, and are they all started.
+        Otherwise nothing is started and the errors are returned per runfolder. Runfolders whose output is already up to date
+        are not run again, unless `force` is true (see `StartHandler.post`).
+        """
+        try:
+            batch = self.parse_batch(self.request.body)
+            priorities = [self.priority(request_body) for _, request_body in batch]
+        except ArteriaUsageException as e:
+            log.warning("Failed starting batch. Message: {0}".format(e.message))
+            self.record_usage_error()
+            self.send_error(status_code=400, reason=e.message)
+            return
+
+        runfolders = [runfolder for runfolder, _ in batch]
+        executor = self.executor(self.config)
+
+        outcomes = yield self._wait_for_all([executor.submit(self.build_job_with_estimates, runfolder, request_body)
+                                             for runfolder, request_body in batch])
+        if any(exception is not None for _, exception in outcomes):
+            for result, exception in outcomes:
+                if exception is None:
+                    result[0][0].discard_pending_samplesheet()
+            self._report_errors(runfolders, outcomes)
+            return
+        prepared_jobs = [prepared_job for (prepared_job, _), _ in outcomes]
+        estimates = [job_estimates for (_, job_estimates), _ in outcomes]
+
+        # The jobs were built as dry runs, so that no runfolder is changed unless all of them are valid.
+        write_outcomes = yield self._wait_for_all([executor.submit(self.write_job_files, prepared_job)
+                                                   for prepared_job in prepared_jobs])
+        if any(exception is not None for _, exception in write_outcomes):
+            self._report_errors(runfolders, write_outcomes)
+            return
+
+        output_outcomes = yield self._wait_for_all([executor.submit(self.prepare_output, prepared_job, request_body)
+                                                    for prepared_job, (_, request_body) in zip(prepared_jobs, batch)])
+        if any(exception is not None for _, exception in output_outcomes):
+            self._report_errors(runfolders, output_outcomes)
+            return
+
+        # All jobs are started without yielding to the IOLoop, so that none of them are
+        # dispatched before all of them have been queued.
+        jobs = []
+        for runfolder, prepared_job, output_outcome, priority, job_estimates in zip(
+                runfolders, prepared_jobs, output_outcomes, priorities, estimates):
+            (fingerprint, output_is_current), _ = output_outcome
+            if output_is_current:
+                response_data = self.skip_job(runfolder, *prepared_job)
+            else:
+                response_data = self.start_job(runfolder, *prepared_job, fingerprint=fingerprint, priority=priority,
+                                               estimates=job_estimates)
+            response_data["runfolder"] = runfolder
+            jobs.append(response_data)
+
+        self.set_status(202, reason="started processing")
+        self.write_json({"jobs": jobs, "state": State.STARTED})
 
 
 class StatusHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
     """
-    Get the status of one or all jobs.
+    Get the status of one or all jobs. For running jobs the progress, as followed in
+    the bcl2fastq log, is included as well, and so are the resources used by the jobs
+    (see `ResourcesHandler`). For jobs waiting to run, their position in the queue and
+    when they are expected to start are included, if the job runner can tell. For jobs
+    waiting or running, the runtime predicted for them and when they are expected to end
+    are included, once there is enough history to predict it.
     """
 
+    @staticmethod
+    def _format_time(timestamp):
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) if timestamp is not None else None
+
+    @staticmethod
+    def _queue_status(status):
+        return {"queue_position": status["queue_position"],
+                "expected_start": StatusHandler._format_time(status["expected_start"])}
+
+    def _log_progress(self, job):
+        if not job["stdout"]:
+            return None
+        try:
+            runfolder_metadata = RunfolderMetadata.for_runfolder(job["run_dir"])
+        except (IOError, OSError):
+            runfolder_metadata = None
+        return self.progress_tracker(self.config).progress(job["job_id"], job["stdout"],
+                                                           expected_tiles(runfolder_metadata, job["cmd"]))
+
+    def job_progress(self, job_id):
+        """
+        Get the progress of a job. The progress of a job which is split into several jobs
+        (e.g. by lane) is the combined progress of those.
+        :param job_id: of the job
+        :return: a dict describing the progress, or None if it can not be followed
+        """
+        job_store = self.runner_service(self.config).job_store
+        job = job_store.get_job(job_id)
+        if not job:
+            return None
+        child_jobs = job_store.child_jobs(job["job_id"])
+        if not child_jobs:
+            return self._log_progress(job)
+        child_progresses = [progress for progress in map(self._log_progress, child_jobs) if progress]
+        return merge_progress(child_progresses) if child_progresses else None
+
+    def _progress_of_started_jobs(self, states):
+        return {job_id: self.job_progress(job_id)
+                for job_id, state in states.iteritems() if state == State.STARTED}
+
+    def _resources_of_jobs(self, states, include_finished):
+        job_store = self.runner_service(self.config).job_store
+        resources = {}
+        for job_id, state in states.iteritems():
+            if state == State.STARTED or include_finished:
+                summary = summarize_resources(job_store.resource_samples(job_id))
+                if summary:
+                    resources[job_id] = summary
+        return resources
+
+    def _estimates_of_jobs(self, states, queue_status):
+        job_store = self.runner_service(self.config).job_store
+        estimates = {}
+        for job_id, state in states.iteritems():
+            if state in (State.PENDING, State.STARTED):
+                estimate = job_estimate(job_store, int(job_id), queue_status)
+                if estimate:
+                    estimates[job_id] = {"predicted_runtime": estimate["predicted_runtime"],
+                                         "expected_end": self._format_time(estimate["expected_end"])}
+        return estimates
+
+    @gen.coroutine
     def get(self, job_id):
         """
         Get the status of the specified job_id, or if now id is given, the
@@ -232,22 +1187,74 @@ class StatusHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
         """
 
         if job_id:
-            status = {"state": self.runner_service().status(job_id)}
+            states = {job_id: self.runner_service(self.config).status(job_id)}
+        else:
+            states = self.runner_service(self.config).status_all()
+        # The queue is followed on the IOLoop, so it is read here.
+        queue_status = self.runner_service(self.config).queue_status()
+
+        # Reading the logs and the job store is blocking, so it is done off the IOLoop. The resources
+        # of finished jobs are only included when asking for a single job, to keep the response small.
+        executor = self.executor(self.config)
+        progresses, resources, estimates = yield [executor.submit(self._progress_of_started_jobs, states),
+                                                  executor.submit(self._resources_of_jobs, states, bool(job_id)),
+                                                  executor.submit(self._estimates_of_jobs, states, queue_status)]
+
+        status_dict = {}
+        for k, v in states.iteritems():
+            status_dict[k] = {"state": v}
+            if k in progresses:
+                status_dict[k]["progress"] = progresses[k]
+            if k in resources:
+                status_dict[k]["resources"] = resources[k]
+            if k in estimates:
+                status_dict[k].update(estimates[k])
+            if v == State.PENDING and int(k) in queue_status:
+                status_dict[k].update(self._queue_status(queue_status[int(k)]))
+
+        if job_id:
+            status = status_dict[job_id]
         else:
-            all_status = self.runner_service().status_all()
-            status_dict = {}
-            for k,v in all_status.iteritems():
-                status_dict[k] = {"state": v}
             status = status_dict
 
         self.write_json(status)
 
 
+class ResourcesHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
+    """
+    Get the history of the resources used by a job, as sampled while it was running.
+    """
+
+    def resources(self, job_id):
+        job_store = self.runner_service(self.config).job_store
+        if job_store.get_job(job_id) is None:
+            return None
+        samples = job_store.resource_samples(job_id)
+        return {"job_id": int(job_id), "summary": summarize_resources(samples), "samples": samples}
+
+    @gen.coroutine
+    def get(self, job_id):
+        """
+        Get the resource samples of a job, the oldest first, and a summary of them. Each sample
+        holds the CPU time used (in seconds), the resident memory and the number of processes of
+        the job at the time, the bytes read and written by the job so far, and the size of its
+        output. The CPU time, memory and I/O can only be sampled for jobs run as subprocesses of
+        the service.
+        :param job_id: of the job
+        """
+        resources = yield self.executor(self.config).submit(self.resources, job_id)
+        if resources is None:
+            self.send_error(404, reason="Found no job with id {}".format(job_id))
+            return
+        self.write_json(resources)
+
+
 class StopHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
     """
     Stop one or all jobs.
     """
 
+    @gen.coroutine
     def post(self, job_id):
         """
         Stops the job with the specified id.
@@ -256,36 +1263,468 @@ class StopHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
         try:
             if job_id == "all":
                 log.info("Attempting to stop all jobs.")
-                self.runner_service().stop_all()
+                yield self.runner_service(self.config).stop_all()
                 log.info("Stopped all jobs!")
                 self.set_status(200)
             elif job_id:
                 log.info("Attempting to stop job: {}".format(job_id))
-                self.runner_service().stop(job_id)
+                yield self.runner_service(self.config).stop(job_id)
                 self.set_status(200)
             else:
                 ArteriaUsageException("Unknown job to stop")
         except ArteriaUsageException as e:
             log.warning("Failed stopping job: {}. Message: ".format(job_id, e.message))
+            self.record_usage_error()
             self.send_error(500, reason=e.message)
 
 
-class Bcl2FastqLogHandler(BaseBcl2FastqHandler):
+class Bcl2FastqLogHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
     """
-    Gets the content of the log for a particular runfolder
+    Gets the content of the log for a particular runfolder. The log is read on the executor,
+    since reading an archived log means decompressing it (up to where reading starts).
     """
 
+    # How often (in seconds) to check if the log has grown when following it.
+    FOLLOW_POLL_INTERVAL = 0.25
+    DEFAULT_FOLLOW_TIMEOUT = 30
+    MAX_FOLLOW_TIMEOUT = 300
+
+    def initialize(self, config):
+        BaseBcl2FastqHandler.initialize(self, config)
+        self.connection_closed = False
+
+    def on_connection_close(self):
+        self.connection_closed = True
+
+    def _non_negative_int_argument(self, name, default=None):
+        value = self.get_argument(name, default=None)
+        if value is None:
+            return default
+        value = int(value)
+        if value < 0:
+            raise ValueError("{} must not be negative".format(name))
+        return value
+
+    @gen.coroutine
+    def _wait_for_log_to_grow(self, runfolder, offset, timeout, job_id=None):
+        """
+        Wait until the log is larger than `offset` bytes, or `timeout` seconds have passed.
+        A log which does not exist yet (e.g. because the job is still pending) is treated
+        as being empty.
+        :return: the size of the log when waiting finished
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                size = yield self.executor(self.config).submit(self.bcl2fastq_log_file_provider.log_size,
+                                                               runfolder, job_id)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                size = 0
+            if size > offset or time.time() >= deadline or self.connection_closed:
+                raise gen.Return(size)
+            yield gen.sleep(self.FOLLOW_POLL_INTERVAL)
+
+    @gen.coroutine
     def get(self, runfolder):
         """
-        Get the content of the log for a particular runfolder
+        Get the content of the log for a particular runfolder. The logs of finished jobs
+        are archived (compressed) per job, and the log of the latest job is returned unless
+        `job_id` is given. The log is streamed back in chunks (archived logs are decompressed
+        as they are streamed), and the following (optional) query parameters can be used to
+        only fetch a part of it:
+         - job_id: get the archived log of this job
+         - offset: byte offset to start reading from (default: 0)
+         - limit: maximum number of bytes to return (default: until the end of the log)
+         - tail: only return the last N lines of the log (overrides offset)
+         - follow: if "true" and there is no data after offset, wait for data to be
+                   appended to the log before returning
+         - timeout: maximum number of seconds to wait when following (default: 30)
+        The response includes `next_offset`, which should be passed as `offset` to
+        get the next part of the log.
         :param runfolder:
         :return:
         """
         try:
-            log_content = self.bcl2fastq_log_file_provider.get_log_for_runfolder(runfolder)
-            response_data = {"runfolder": runfolder, "log": log_content}
-            self.set_status(200)
-            self.write_json(response_data)
+            offset = self._non_negative_int_argument("offset", 0)
+            limit = self._non_negative_int_argument("limit")
+            tail = self._non_negative_int_argument("tail")
+            timeout = min(self._non_negative_int_argument("timeout", self.DEFAULT_FOLLOW_TIMEOUT),
+                          self.MAX_FOLLOW_TIMEOUT)
+            follow = self.get_argument("follow", "false").lower() in ("true", "1")
+            job_id = self._non_negative_int_argument("job_id")
+        except ValueError as e:
+            self.send_error(400, reason=str(e))
+            return
+
+        executor = self.executor(self.config)
+        log_file_provider = self.bcl2fastq_log_file_provider
+        try:
+            if follow:
+                size = yield self._wait_for_log_to_grow(runfolder, offset, timeout, job_id)
+            else:
+                size = yield executor.submit(log_file_provider.log_size, runfolder, job_id)
+            if tail is not None:
+                offset = yield executor.submit(log_file_provider.offset_for_tail, runfolder, tail, job_id)
+            offset = min(offset, size)
+        except (IOError, OSError) as e:
+            log.warning("Problem with accessing {}, message: {}".format(runfolder, e))
+            self.send_error(500, reason=str(e))
+            return
+
+        # The log can be rotated or archived after its size was read, in which case
+        # it is no longer there to be read.
+        try:
+            chunks = yield executor.submit(log_file_provider.iter_log_chunks, runfolder, offset, limit,
+                                           end=size, job_id=job_id)
         except IOError as e:
-            log.warning("Problem with accessing {}, message: {}".format(runfolder, e.message))
-            self.send_error(500, reason=e.message)
+            log.warning("Could not open the log of {}, message: {}".format(runfolder, e))
+            self.send_error(404, reason=str(e))
+            return
+
+        # The log is written as a json object, one chunk at the time, so that the
+        # entire log never has to be kept in memory.
+        self.set_status(200)
+        self.set_header("Content-Type", "application/json")
+        self.write('{{"runfolder": {}, "offset": {}, "log": "'.format(json.dumps(runfolder), offset))
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        bytes_read = 0
+        while True:
+            chunk = yield executor.submit(next, chunks, None)
+            if chunk is None:
+                break
+            bytes_read += len(chunk)
+            self.write(json.dumps(decoder.decode(chunk))[1:-1])
+            yield self.flush()
+            if self.connection_closed:
+                return
+
+        # Don't split a multi-byte character between two responses, instead leave
+        # it for the next request.
+        incomplete_bytes = len(decoder.getstate()[0])
+        next_offset = offset + bytes_read - incomplete_bytes
+        self.write('", "next_offset": {}, "size": {}}}'.format(next_offset, size))
+
+
+class LogSearchHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
+    """
+    Search the logs for errors, warnings, phases of the runs and regular expressions
+    """
+
+    MAX_LIMIT = 10000
+
+    @gen.coroutine
+    def get(self, runfolder):
+        """
+        Search the log of a runfolder, or if no runfolder is given, all logs (live and archived).
+        At least one of the following query parameters must be given:
+         - severity: "error" for errors, or "warning" for warnings and errors
+         - phases: if "true", include the first line of each phase of the run (e.g. demultiplexing)
+         - pattern: a regular expression the lines must match
+        Errors, warnings and phases are found using an index kept next to each log, which is
+        updated with what has been written since the last search, so only the matching lines
+        are read from the logs. A pattern without a severity or phases is matched against all
+        lines of the logs. The following (optional) query parameters can also be given:
+         - job_id: search the archived log of this job (only when searching one runfolder)
+         - limit: maximum number of lines to return (default: 1000)
+        Each line found is returned with the log it is in, its line number and byte offset (which
+        can be passed as `offset` to get the log around it), and its kind (error, warning or phase).
+        :param runfolder: to search the log of (empty to search all logs)
+        """
+        try:
+            pattern = self.get_argument("pattern", default=None)
+            regex = re.compile(pattern) if pattern else None
+            severity = self.get_argument("severity", default=None)
+            if severity is not None and severity not in SEVERITIES:
+                raise ValueError("severity must be one of {}".format(", ".join(sorted(SEVERITIES))))
+            phases = self.get_argument("phases", "false").lower() in ("true", "1")
+            limit = int(self.get_argument("limit", LogSearcher.DEFAULT_LIMIT))
+            if not 0 < limit <= self.MAX_LIMIT:
+                raise ValueError("limit must be between 1 and {}".format(self.MAX_LIMIT))
+            job_id = self.get_argument("job_id", default=None)
+            job_id = int(job_id) if job_id is not None else None
+            if job_id is not None and not runfolder:
+                raise ValueError("job_id can only be given when searching the log of a runfolder")
+            if not (regex or severity or phases):
+                raise ValueError("Give a severity, phases or a pattern to search for")
+        except (ValueError, re.error) as e:
+            self.send_error(400, reason=str(e))
+            return
+
+        def search():
+            if runfolder:
+                log_files = [self.bcl2fastq_log_file_provider.resolve_log_path(runfolder, job_id)]
+            else:
+                log_files = self.bcl2fastq_log_file_provider.all_log_files()
+            return self.log_searcher(self.config).search(log_files, regex, severity, phases, limit)
+
+        try:
+            result = yield self.executor(self.config).submit(search)
+        except (IOError, OSError) as e:
+            log.warning("Problem with searching the logs of {}, message: {}".format(runfolder or "all runfolders", e))
+            self.send_error(500, reason=str(e))
+            return
+
+        self.write_json(result)
+
+
+class OutputReaperStatusHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
+    """
+    Get the status of the deletion of old output directories.
+    """
+
+    def get(self):
+        """
+        Get what the output reaper is currently deleting, what is waiting to be
+        deleted, how many bytes are left to reclaim in the directory currently being
+        deleted and how much has been reclaimed since the service started.
+        """
+        self.write_json(self.output_reaper(self.config).status())
+
+
+class AutotuneHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
+    """
+    Find the fastest thread profile for bcl2fastq by running it on a few tiles of a runfolder
+    with different numbers of loading and writing threads.
+    """
+
+    # Directory in the default output path where the output of the autotuning runs is placed.
+    AUTOTUNE_DIR_NAME = ".bcl2fastq_autotune"
+
+    DEFAULT_TILES = "s_1_1101"
+
+    def get(self, runfolder):
+        """
+        Get all thread profiles found by autotuning, keyed by `<machine type>/<number of cores>`,
+        together with the time each of the tried profiles took.
+        """
+        self.write_json(self.bcl2fastq_cmd_generation_service(self.config).thread_profiles.store.all())
+
+    def prepare_autotune(self, runfolder, request_body):
+        """
+        Does the (blocking) work needed before autotuning can be started for a runfolder.
+        :return: a tuple of the machine type, the number of cores, the output directory and a
+                 list of (thread profile, output directory, command) tuples, one for each candidate.
+        """
+        request_data = json.loads(request_body) if request_body else {}
+        autotune_config = get_config_value(self.config, "autotune", {})
+
+        # Only a local runner can be made to run the candidates one at the time on the same machine,
+        # a batch scheduler would run them at the same time on different nodes.
+        runner_type = get_config_value(self.config, "job_runner", {}).get("type", "subprocess")
+        if runner_type == "batch_scheduler":
+            raise ArteriaUsageException("Autotuning is only supported with a local job runner, "
+                                        "not with {}".format(runner_type))
+
+        runfolder_input = "{0}/{1}".format(self.config["runfolder_path"], runfolder)
+        if not os.path.isdir(runfolder_input):
+            raise ArteriaUsageException("No such file: {0}".format(runfolder_input))
+
+        try:
+            runfolder_metadata = RunfolderMetadata.for_runfolder(runfolder_input)
+        except (IOError, OSError) as e:
+            raise ArteriaUsageException("Could not read the run meta data of {0}: {1}".format(runfolder_input, e))
+        if not runfolder_metadata.nbr_of_tiles:
+            raise ArteriaUsageException("The tiles of {0} are not known, so it can not be used for "
+                                        "autotuning".format(runfolder_input))
+        machine_type = runfolder_metadata.machine_type
+        if machine_type is None:
+            raise ArteriaUsageException("The machine type of {0} is not known, so no thread profile can be "
+                                        "stored for it".format(runfolder_input))
+
+        try:
+            nbr_of_cores = int(request_data.get("nbr_of_cores") or multiprocessing.cpu_count())
+        except ValueError:
+            raise ArteriaUsageException("Invalid nbr_of_cores: {}".format(request_data["nbr_of_cores"]))
+
+        output_base = os.path.join(self.config["default_output_path"],
+                                   AutotuneHandler.AUTOTUNE_DIR_NAME,
+                                   "{}.{}".format(runfolder, time.strftime("%Y%m%d-%H%M%S")))
+        runfolder_config = Bcl2FastqConfig(
+            self.config,
+            request_data.get("bcl2fastq_version"),
+            runfolder_input,
+            output_base,
+            tiles=request_data.get("tiles", autotune_config.get("tiles", AutotuneHandler.DEFAULT_TILES)),
+            additional_args=request_data.get("additional_args"),
+            nbr_of_cores=nbr_of_cores)
+
+        cmd_generation_service = self.bcl2fastq_cmd_generation_service(self.config)
+        job_runner = cmd_generation_service.create_bcl2fastq_runner(runfolder_config)
+        candidates = cmd_generation_service.thread_profiles.autotune_candidates(
+            machine_type,
+            nbr_of_cores,
+            loading_threads=autotune_config.get("loading_threads", (2, 4, 8)),
+            writing_threads=autotune_config.get("writing_threads", (2, 4, 8)))
+        commands = job_runner.construct_autotune_commands(candidates, output_base)
+        return machine_type, nbr_of_cores, output_base, commands
+
+    @staticmethod
+    def record_fastest_profile(job_store, thread_profiles, machine_type, nbr_of_cores, output_base, candidates,
+                               group_job_id):
+        """
+        Store the fastest of the candidates, based on how long the job of each candidate was
+        running. The output of the autotuning runs is removed by `remove_output`.
+        """
+        if machine_type is None:
+            raise ArteriaUsageException("No thread profile can be stored for an unknown machine type")
+        # A job can finish before it has been seen running (e.g. with a polling runner). How long
+        # it was running is not known then, as the time since it was created includes waiting for
+        # the candidates before it, so such candidates are left out.
+        timings = []
+        for candidate, job in zip(candidates, job_store.child_jobs(group_job_id)):
+            if job["started"] and job["finished"]:
+                timings.append((candidate, job["finished"] - job["started"]))
+            else:
+                log.warning("The autotuning run of {} was not seen running, so it is left out.".format(candidate))
+        if not timings:
+            raise ArteriaUsageException("None of the autotuning runs was seen running, so no thread profile "
+                                        "can be stored")
+        fastest = thread_profiles.fastest(timings)
+        log.info("Fastest thread profile for {} with {} cores: {}".format(machine_type, nbr_of_cores, fastest))
+        thread_profiles.store.put(machine_type, nbr_of_cores, fastest, timings)
+
+    @staticmethod
+    def remove_output(output_base):
+        """
+        Remove the output of the autotuning runs, whether they were successful or not.
+        """
+        shutil.rmtree(output_base, ignore_errors=True)
+
+    @gen.coroutine
+    def post(self, runfolder):
+        """
+        Start autotuning using a runfolder. The fastest thread profile is stored for the machine
+        type of the runfolder and the number of cores, and is then used for all runs of bcl2fastq
+        for that machine type with that number of cores. The candidates are run one at the time,
+        and no other jobs are run at the same time, so autotuning is only supported with a local
+        job runner (not with `batch_scheduler`). The input data can be a json encoded object
+        with any of the following parameters:
+         - tiles (the tiles to run on, defaults to the `tiles` set in the `autotune` config)
+         - nbr_of_cores (defaults to the number of cores of the machine)
+         - bcl2fastq_version
+         - additional_args
+
+        :param runfolder: name of the runfolder to autotune with
+        """
+        try:
+            machine_type, nbr_of_cores, output_base, commands = yield self.executor(self.config).submit(
+                self.prepare_autotune, runfolder, self.request.body)
+
+            # The jobs claim all cores of the machine, so that they are run one at the time.
+            job_cores = max(nbr_of_cores, multiprocessing.cpu_count())
+            jobs = []
+            for i, (candidate, output, cmd) in enumerate(commands):
+                log_file = self.bcl2fastq_log_file_provider.log_file_path("{}_autotune_{}".format(runfolder, i))
+                jobs.append((cmd, job_cores, log_file, log_file))
+
+            runner_service = self.runner_service(self.config)
+            thread_profiles = self.bcl2fastq_cmd_generation_service(self.config).thread_profiles
+            executor = self.executor(self.config)
+            candidates = [candidate for candidate, _, _ in commands]
+
+            def record_fastest_profile(group_job_id):
+                return executor.submit(AutotuneHandler.record_fastest_profile, runner_service.job_store,
+                                       thread_profiles, machine_type, nbr_of_cores, output_base, candidates,
+                                       group_job_id)
+
+            def remove_output(group_job_id):
+                executor.submit(AutotuneHandler.remove_output, output_base)
+
+            # The output is removed once the group has finished, also if any of the runs failed.
+            job_id = runner_service.start_group(jobs,
+                                                run_dir="{0}/{1}".format(self.config["runfolder_path"], runfolder),
+                                                finalizer=record_fastest_profile,
+                                                cleanup=remove_output)
+
+            status_end_point = "{0}://{1}{2}".format(
+                self.request.protocol,
+                self.request.host,
+                self.reverse_url("status", job_id))
+
+            self.set_status(202, reason="started autotuning")
+            self.write_json({"job_id": job_id,
+                             "machine_type": machine_type,
+                             "nbr_of_cores": nbr_of_cores,
+                             "candidates": [candidate.as_dict() for candidate in candidates],
+                             "link": status_end_point,
+                             "state": State.STARTED})
+        except ArteriaUsageException as e:
+            log.warning("Failed to start autotuning with {0}. Message: {1}".format(runfolder, e.message))
+            self.record_usage_error()
+            self.send_error(status_code=500, reason=e.message)
+
+
+class MetricsHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
+    """
+    Get the metrics of the service in the Prometheus text format.
+    """
+
+    def get(self):
+        """
+        Returns the metrics of the service in the Prometheus text format: the latency of
+        the handlers per route, the depth of the job queue and the cores in use, the time
+        jobs wait and run per bcl2fastq version and machine type, and counters of failures.
+        """
+        self.set_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.write(self.metrics(self.config).render())
+
+
+class StatsHandler(BaseBcl2FastqHandler, Bcl2FastqServiceMixin):
+    """
+    Get a summary of the demultiplexing statistics of a runfolder.
+    """
+
+    def stats_files(self, runfolder):
+        """
+        Find the Stats.json and samplesheet of the last run of bcl2fastq on a runfolder. The
+        output is found through the `Unaligned` link in the runfolder, or in the default output
+        path if there is no such link.
+        :return: a tuple of the paths to Stats.json and to the samplesheet
+        """
+        runfolder_input = os.path.join(self.config["runfolder_path"], runfolder)
+        unaligned = os.path.join(runfolder_input, "Unaligned")
+        if os.path.exists(unaligned):
+            output = os.path.realpath(unaligned)
+        else:
+            output = os.path.join(self.config["default_output_path"], runfolder)
+        return os.path.join(output, "Stats", "Stats.json"), os.path.join(runfolder_input, "SampleSheet.csv")
+
+    def filtered_summary(self, runfolder, lane, project, sample):
+        stats_file, samplesheet_file = self.stats_files(runfolder)
+        summary = self.stats_summary_cache(self.config).summary(stats_file, samplesheet_file)
+        return filter_summary(summary, lane=lane, project=project, sample=sample)
+
+    @gen.coroutine
+    def get(self, runfolder):
+        """
+        Get a summary of Stats.json for a runfolder: the clusters, yield and undetermined reads
+        of each lane, the reads, yield and quality of each sample, and the most common unknown
+        barcodes of each lane. The summary is made once, and is then kept next to Stats.json until
+        Stats.json changes. The summary can be filtered with the following arguments:
+         - lane: only include this lane
+         - project: only include the samples of this project
+         - sample: only include this sample (by id or name)
+        :param runfolder: to get the statistics of
+        """
+        try:
+            lane = self.get_argument("lane", None)
+            lane = int(lane) if lane is not None else None
+        except ValueError:
+            self.send_error(400, reason="Invalid lane: {}".format(self.get_argument("lane")))
+            return
+
+        try:
+            summary = yield self.executor(self.config).submit(self.filtered_summary,
+                                                              runfolder,
+                                                              lane,
+                                                              self.get_argument("project", None),
+                                                              self.get_argument("sample", None))
+        except (IOError, OSError) as e:
+            log.warning("Found no statistics for {}, message: {}".format(runfolder, e))
+            self.send_error(404, reason="Found no statistics for {}".format(runfolder))
+            return
+
+        self.write_json(summary)
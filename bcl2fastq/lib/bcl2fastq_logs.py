@@ -1,7 +1,53 @@
+import errno
+import gzip
+import logging
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+
+from arteria.web.state import State as arteria_state
+
+log = logging.getLogger(__name__)
+
+# Archived logs are named `<log name>.<job id>.log.gz`, where the log name is e.g. the runfolder,
+# or `<runfolder>_L001` for a lane. Logs which are waiting to be compressed lack the `.gz`.
+ARCHIVED_LOG_PATTERN = re.compile(r"^(?P<name>[\w-]+)\.(?P<job_id>\d+)\.log(?P<compressed>\.gz)?$")
+
+# Live logs are named `<log name>.log`.
+LIVE_LOG_PATTERN = re.compile(r"^(?P<name>[\w-]+)\.log$")
+
+# Suffix of the index of a log, kept next to it (see `log_index.LogIndex`).
+INDEX_SUFFIX = ".idx"
+
+
+def open_log_file(path):
+    """
+    :return: a file object to read the log with, which decompresses archived logs
+    """
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def log_file_size(path):
+    """
+    :return: the (uncompressed) size of a log. The size of a compressed log is read from the
+             end of the gzip file, so it is only correct for logs smaller than 4 GB.
+    """
+    if not path.endswith(".gz"):
+        return os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", f.read(4))[0]
 
 
 class Bcl2FastqLogFileProvider:
 
+    # Number of bytes read from the log at the time.
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, config):
         self.config = config
 
@@ -10,9 +56,287 @@ class Bcl2FastqLogFileProvider:
         log_file = "{0}/{1}.log".format(log_base_path, runfolder)
         return log_file
 
-    def get_log_for_runfolder(self, runfolder):
-        log_path = self.log_file_path(runfolder)
-        with open(log_path) as f:
-            file_content = f.read()
-        return file_content
+    def archived_logs(self, runfolder):
+        """
+        Find the archived logs of a runfolder, see `LogArchiver`.
+        :return: a list of (job id, path) tuples, the latest job first
+        """
+        logs = {}
+        for file_name in os.listdir(self.config["bcl2fastq_logs_path"]):
+            match = ARCHIVED_LOG_PATTERN.match(file_name)
+            if not match or match.group("name") != runfolder:
+                continue
+            job_id = int(match.group("job_id"))
+            # A log which is being compressed is there both compressed and not, until it is done.
+            if job_id not in logs or match.group("compressed"):
+                logs[job_id] = os.path.join(self.config["bcl2fastq_logs_path"], file_name)
+        return sorted(logs.items(), reverse=True)
+
+    def all_log_files(self):
+        """
+        :return: the paths of all live and archived logs, sorted by name
+        """
+        log_base_path = self.config["bcl2fastq_logs_path"]
+        file_names = set(os.listdir(log_base_path))
+        log_files = []
+        for file_name in sorted(file_names):
+            if LIVE_LOG_PATTERN.match(file_name):
+                log_files.append(os.path.join(log_base_path, file_name))
+                continue
+            match = ARCHIVED_LOG_PATTERN.match(file_name)
+            # A log which is being compressed is only included once.
+            if match and (match.group("compressed") or file_name + ".gz" not in file_names):
+                log_files.append(os.path.join(log_base_path, file_name))
+        return log_files
+
+    def resolve_log_path(self, runfolder, job_id=None):
+        """
+        Find the log to read for a runfolder.
+        :param runfolder: to find the log for
+        :param job_id: of the job to find the archived log of (None for the live log, or if there
+                       is no live log, the archived log of the latest job)
+        :return: the path to the log
+        :raises: IOError if there is no archived log for the job
+        """
+        if job_id is None:
+            live_log = self.log_file_path(runfolder)
+            if os.path.exists(live_log):
+                return live_log
+            archived_logs = self.archived_logs(runfolder)
+            return archived_logs[0][1] if archived_logs else live_log
+
+        for archived_job_id, path in self.archived_logs(runfolder):
+            if archived_job_id == job_id:
+                return path
+        raise IOError(errno.ENOENT, "No archived log of job {} for {}".format(job_id, runfolder))
+
+    def log_size(self, runfolder, job_id=None):
+        """
+        Get the current size of the log for a runfolder
+        :param runfolder: to get the log size for
+        :param job_id: see `resolve_log_path`
+        :return: the (uncompressed) size of the log in bytes
+        :raises: OSError if the log does not exist
+        """
+        return log_file_size(self.resolve_log_path(runfolder, job_id))
+
+    def _offset_for_tail_compressed(self, path, nbr_of_lines):
+        # A compressed log can not be read backwards, so it is read from the start, keeping
+        # the offsets of the starts of the last lines.
+        line_starts = deque([0], maxlen=nbr_of_lines + 1)
+        position = 0
+        with open_log_file(path) as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                newline_index = chunk.find(b"\n")
+                while newline_index != -1:
+                    line_starts.append(position + newline_index + 1)
+                    newline_index = chunk.find(b"\n", newline_index + 1)
+                position += len(chunk)
+
+        # A newline terminating the last line does not start a new line.
+        if line_starts[-1] == position and position > 0:
+            line_starts.pop()
+        if nbr_of_lines <= 0:
+            return position
+        return line_starts[-nbr_of_lines] if len(line_starts) >= nbr_of_lines else 0
+
+    def offset_for_tail(self, runfolder, nbr_of_lines, job_id=None):
+        """
+        Find the byte offset where the last `nbr_of_lines` lines of the log start. The log
+        is read backwards from the end, one chunk at the time, so only the tail of the
+        file is ever read (except for archived logs, which are compressed and have to be
+        read from the start).
+        :param runfolder: to find the offset in the log for
+        :param nbr_of_lines: number of lines at the end of the log to include
+        :param job_id: see `resolve_log_path`
+        :return: the byte offset of the first of the last `nbr_of_lines` lines
+        """
+        path = self.resolve_log_path(runfolder, job_id)
+        if path.endswith(".gz"):
+            return self._offset_for_tail_compressed(path, nbr_of_lines)
+
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+
+            if nbr_of_lines <= 0:
+                return position
+
+            newlines_to_find = nbr_of_lines
+            first_chunk = True
+            while position > 0:
+                read_size = min(self.CHUNK_SIZE, position)
+                position -= read_size
+                f.seek(position)
+                chunk = f.read(read_size)
+
+                # A newline terminating the last line does not start a new line.
+                if first_chunk and chunk.endswith(b"\n"):
+                    newlines_to_find += 1
+                first_chunk = False
+
+                end = len(chunk)
+                while True:
+                    newline_index = chunk.rfind(b"\n", 0, end)
+                    if newline_index == -1:
+                        break
+                    newlines_to_find -= 1
+                    if newlines_to_find == 0:
+                        return position + newline_index + 1
+                    end = newline_index
+            return 0
+
+    def iter_log_chunks(self, runfolder, offset=0, limit=None, end=None, job_id=None):
+        """
+        Iterate over the log in chunks, without reading the entire log into memory. Archived
+        logs are decompressed as they are read.
+        :param runfolder: to read the log for
+        :param offset: byte offset to start reading from
+        :param limit: maximum number of bytes to read (None means read until `end`)
+        :param end: byte offset to stop reading at (None means the size of the log when
+                    reading starts, so that a growing log will not be followed forever)
+        :param job_id: see `resolve_log_path`
+        :return: a generator of chunks (byte strings) of the log
+        :raises: IOError if the log cannot be opened. The log is opened before this returns,
+                 so that a log which is rotated or archived in the meantime is not only noticed
+                 once the chunks are read.
+        """
+        path = self.resolve_log_path(runfolder, job_id)
+        if end is None:
+            end = log_file_size(path)
+        if limit is not None:
+            end = min(end, offset + limit)
+        return self._read_chunks(open_log_file(path), offset, end)
+
+    def _read_chunks(self, f, offset, end):
+        with f:
+            f.seek(offset)
+            position = offset
+            while position < end:
+                chunk = f.read(min(self.CHUNK_SIZE, end - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+
+
+class LogArchiver:
+    """
+    Keeps the logs of all attempts to run a job. When a job has finished, its log is moved
+    to `<log name>.<job id>.log` in the log directory, so that it is not overwritten by the
+    next run, and then compressed to `<log name>.<job id>.log.gz` in the background. Archived
+    logs older than `max_age_days` are removed, as are the oldest archived logs once they
+    take up more than `max_total_bytes` together.
+    """
+
+    def __init__(self, logs_path, executor, max_age_days=None, max_total_bytes=None):
+        """
+        Instantiate a LogArchiver
+        :param logs_path: the directory the logs are written to
+        :param executor: to compress the logs with
+        :param max_age_days: how long to keep archived logs (None to keep them regardless of age)
+        :param max_total_bytes: how much space archived logs may take (None for no limit)
+        """
+        self.logs_path = logs_path
+        self.executor = executor
+        self.max_age_days = max_age_days
+        self.max_total_bytes = max_total_bytes
+        self._retention_lock = threading.Lock()
+
+    def on_job_state_change(self, job, old_state, new_state):
+        """
+        Archive the log of a job once it has finished. Only logs in the log directory
+        are archived.
+        """
+        if new_state not in (arteria_state.DONE, arteria_state.ERROR, arteria_state.CANCELLED):
+            return
+        log_file = job["stdout"]
+        if not log_file or not log_file.endswith(".log") or \
+                os.path.dirname(os.path.abspath(log_file)) != os.path.abspath(self.logs_path):
+            return
+
+        log_name = os.path.basename(log_file)[:-len(".log")]
+        archived_log = os.path.join(self.logs_path, "{}.{}.log".format(log_name, job["job_id"]))
+        try:
+            os.rename(log_file, archived_log)
+        except OSError as e:
+            # Jobs which never started have no log.
+            if e.errno != errno.ENOENT:
+                log.warning("Could not archive the log of job {} ({}): {}".format(job["job_id"], log_file, e))
+            return
+        LogArchiver._remove_index(log_file)
+        self.executor.submit(self.compress, archived_log)
+
+    @staticmethod
+    def _remove_index(log_file):
+        try:
+            os.remove(log_file + INDEX_SUFFIX)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                log.warning("Could not remove the index of {}: {}".format(log_file, e))
+
+    def compress(self, log_file):
+        """
+        Compress an archived log, and then remove archived logs according to the retention policy.
+        """
+        compressed_log = log_file + ".gz"
+        try:
+            # Write to a temporary file first, so that a half written log is never seen.
+            with open(log_file, "rb") as source, gzip.open(compressed_log + ".tmp", "wb") as destination:
+                shutil.copyfileobj(source, destination, Bcl2FastqLogFileProvider.CHUNK_SIZE)
+            os.rename(compressed_log + ".tmp", compressed_log)
+            os.remove(log_file)
+            LogArchiver._remove_index(log_file)
+        except (IOError, OSError) as e:
+            log.warning("Could not compress {}: {}".format(log_file, e))
+            return
+        self.enforce_retention()
+
+    def enforce_retention(self):
+        """
+        Remove the archived logs which are too old, and then the oldest archived logs until
+        the rest fit in `max_total_bytes`.
+        :return: the paths of the removed logs
+        """
+        with self._retention_lock:
+            archived_logs = []
+            for file_name in os.listdir(self.logs_path):
+                match = ARCHIVED_LOG_PATTERN.match(file_name)
+                if match and match.group("compressed"):
+                    path = os.path.join(self.logs_path, file_name)
+                    stat = os.stat(path)
+                    archived_logs.append((stat.st_mtime, stat.st_size, path))
+
+            to_remove = []
+            oldest_allowed = time.time() - self.max_age_days * 24 * 3600 if self.max_age_days is not None else None
+            total_bytes = 0
+            for mtime, size, path in sorted(archived_logs, reverse=True):
+                total_bytes += size
+                if (oldest_allowed is not None and mtime < oldest_allowed) or \
+                        (self.max_total_bytes is not None and total_bytes > self.max_total_bytes):
+                    to_remove.append(path)
+
+            for path in to_remove:
+                try:
+                    os.remove(path)
+                    LogArchiver._remove_index(path)
+                    log.info("Removed archived log {}".format(path))
+                except OSError as e:
+                    log.warning("Could not remove archived log {}: {}".format(path, e))
+            return to_remove
 
+    def resume(self):
+        """
+        Compress any logs left uncompressed when the service was stopped, and remove archived
+        logs according to the retention policy.
+        """
+        if not os.path.isdir(self.logs_path):
+            return
+        for file_name in os.listdir(self.logs_path):
+            path = os.path.join(self.logs_path, file_name)
+            match = ARCHIVED_LOG_PATTERN.match(file_name)
+            if file_name.endswith(".log.gz.tmp"):
+                os.remove(path)
+            elif match and not match.group("compressed"):
+                self.executor.submit(self.compress, path)
+        self.executor.submit(self.enforce_retention)
@@ -1,21 +1,38 @@
 import subprocess
 import os
 import errno
-from itertools import groupby
+import hashlib
 import logging
 import shutil
+import tempfile
+import threading
 import time
-
-
-import xmltodict
-
+from distutils.spawn import find_executable
 
 from arteria.exceptions import ArteriaUsageException
-from bcl2fastq.lib.illumina import Samplesheet
+from bcl2fastq.lib.illumina import Samplesheet, RunfolderMetadata
+from bcl2fastq.lib.lane_outputs import LANES_DIR_NAME, merge_lane_outputs
+from bcl2fastq.lib.output_reaper import OutputReaper
+from bcl2fastq.lib.staging import move_output, replace_symlink
+from bcl2fastq.lib.thread_profiles import ThreadProfile, ThreadProfiles, ThreadProfileStore
 
 log = logging.getLogger(__name__)
 
 
+def get_config_value(config, key, default=None):
+    """
+    Get an optional value from the configuration
+    :param config: the configuration to look the key up in
+    :param key: to look up
+    :param default: value to return if the key has not been configured
+    :return: the configured value, or the default
+    """
+    try:
+        return config[key]
+    except KeyError:
+        return default
+
+
 class Bcl2FastqConfig:
     """
     Container for configurations for bcl2fastq.
@@ -33,7 +50,10 @@ class Bcl2FastqConfig:
                  use_base_mask=None,
                  create_indexes=False,
                  additional_args=None,
-                 nbr_of_cores=None):
+                 nbr_of_cores=None,
+                 split_by_lane=False,
+                 lanes=None,
+                 dry_run=False):
         """
         Instantiate Bcl2FastqConfig
         :param general_config: a dict containing general configuration.
@@ -50,6 +70,17 @@ class Bcl2FastqConfig:
         :param create_indexes: Create fastq files for indexes
         :param additional_args: this can be used to pass any other arguments to bcl2fastq
         :param nbr_of_cores: number of cores to run bcl2fastq with
+        :param split_by_lane: run bcl2fastq as one job per lane, each with its own output directory,
+                              and merge the results once all lanes are done.
+        :param lanes: only run these lanes (requires `split_by_lane`), e.g. to rerun a single lane.
+        :param dry_run: do not write a provided samplesheet to the runfolder, but keep it in a temporary
+                        file until `write_pending_samplesheet` is called (or `discard_pending_samplesheet`)
+
+        If `scratch_path` is set in the general config, bcl2fastq writes its output to a directory
+        in it (`scratch`, see `scratch_dir_name`), from where it is moved to `output` once bcl2fastq
+        is done. This is not
+        done when rerunning some of the lanes, since those are merged with the output of the
+        other lanes, which is already in place.
         """
 
         self.general_config = general_config
@@ -57,8 +88,15 @@ class Bcl2FastqConfig:
         self.runfolder_input = runfolder_input
         self.base_calls_input = runfolder_input + "/Data/Intensities/BaseCalls"
 
+        # A provided samplesheet which has not been written to the runfolder yet (see `dry_run`).
+        self.pending_samplesheet_file = None
         if not samplesheet:
             self.samplesheet_file = runfolder_input + "/SampleSheet.csv"
+        elif dry_run:
+            self.samplesheet_file = runfolder_input + "/SampleSheet.csv"
+            fd, self.pending_samplesheet_file = tempfile.mkstemp(prefix="SampleSheet.", suffix=".csv")
+            os.close(fd)
+            Bcl2FastqConfig.write_samplesheet(samplesheet, self.pending_samplesheet_file)
         else:
             log.debug("Got a new samplesheet. Will use that instead of the one found in the runfolder.")
             new_samplesheet_file = runfolder_input + "/SampleSheet.csv"
@@ -82,6 +120,12 @@ class Bcl2FastqConfig:
             runfolder_base_name = os.path.basename(runfolder_input)
             self.output = "{0}/{1}".format(output_base, runfolder_base_name)
 
+        scratch_path = get_config_value(general_config, "scratch_path")
+        if scratch_path and not lanes:
+            self.scratch = os.path.join(scratch_path, Bcl2FastqConfig.scratch_dir_name(self.output))
+        else:
+            self.scratch = None
+
         self.barcode_mismatches = barcode_mismatches
         self.tiles = tiles
         # TODO Ensure that this is included in any user facing documentation.
@@ -91,6 +135,13 @@ class Bcl2FastqConfig:
         self.additional_args = additional_args
         self.create_indexes = create_indexes
 
+        if lanes and not split_by_lane:
+            raise ArteriaUsageException("Selecting lanes to run is only supported when splitting by lane.")
+        if split_by_lane and tiles:
+            raise ArteriaUsageException("Tiles can not be specified when splitting by lane.")
+        self.split_by_lane = split_by_lane
+        self.lanes = sorted(set(int(lane) for lane in lanes)) if lanes else None
+
         # Nbr of cores to use will default to the number of cpus on the system.
         if nbr_of_cores:
             self.nbr_of_cores = nbr_of_cores
@@ -98,6 +149,56 @@ class Bcl2FastqConfig:
             import multiprocessing
             self.nbr_of_cores = multiprocessing.cpu_count()
 
+    @staticmethod
+    def scratch_dir_name(output):
+        """
+        :return: the name of the directory in scratch the output is staged in, made from the
+                 name of the output directory and a hash of its full path, so that outputs with
+                 the same name in different output folders do not share a scratch directory
+        """
+        output = os.path.abspath(output)
+        return "{}.{}".format(os.path.basename(output), hashlib.md5(output.encode("utf-8")).hexdigest()[:12])
+
+    @property
+    def work_output(self):
+        """
+        The directory bcl2fastq writes its output to, i.e. `scratch` when staging the output
+        there, and otherwise `output`.
+        """
+        return self.scratch or self.output
+
+    @property
+    def samplesheet_source(self):
+        """
+        The file to read the samplesheet from, i.e. `samplesheet_file` unless a provided samplesheet
+        has not been written to the runfolder yet.
+        """
+        return self.pending_samplesheet_file or self.samplesheet_file
+
+    def write_pending_samplesheet(self):
+        """
+        Write a provided samplesheet which was kept aside in a dry run to the runfolder, after
+        making a copy of the samplesheet already there. This does nothing if there is none.
+        """
+        if not self.pending_samplesheet_file:
+            return
+        if os.path.exists(self.samplesheet_file):
+            Bcl2FastqConfig.copy_old_samplesheet(self.samplesheet_file)
+        shutil.copyfile(self.pending_samplesheet_file, self.samplesheet_file)
+        self.discard_pending_samplesheet()
+
+    def discard_pending_samplesheet(self):
+        """
+        Remove a provided samplesheet which was kept aside in a dry run, without writing it to the runfolder.
+        """
+        if not self.pending_samplesheet_file:
+            return
+        try:
+            os.remove(self.pending_samplesheet_file)
+        except OSError as e:
+            log.warning("Could not remove {}: {}".format(self.pending_samplesheet_file, e))
+        self.pending_samplesheet_file = None
+
     @staticmethod
     def copy_old_samplesheet(new_samplesheet_file):
         new_path_for_old_samplesheet = new_samplesheet_file + time.strftime("%Y%m%d-%H%M%S")
@@ -110,12 +211,6 @@ class Bcl2FastqConfig:
         with open(new_samplesheet_file, "w") as f:
             f.write(samplesheet_string)
 
-    @staticmethod
-    def runinfo_as_dict(runfolder):
-        runinfo_path = os.path.join(runfolder, "RunInfo.xml")
-        with open(runinfo_path) as f:
-            return xmltodict.parse(f.read())
-
     @staticmethod
     def get_bcl2fastq_version_from_run_parameters(runfolder, config):
         """
@@ -127,22 +222,9 @@ class Bcl2FastqConfig:
         :return the version of bcl2fastq to use.
         """
 
-        run_info = Bcl2FastqConfig.runinfo_as_dict(runfolder)
-        instrument_name = run_info["RunInfo"]["Run"]["Instrument"]
-
-        machine_type_mappings = {"M": "MiSeq",
-                                 "D": "HiSeq 2500",
-                                 "SN": "HiSeq 2000",
-                                 "ST": "HiSeq X",
-                                 "A": "NovaSeq",
-                                 "NS": "NextSeq 500",
-                                 "K": "HiSeq 4000",
-                                 "FS": "ISeq 100",
-                                 "LH": "NovaSeq X Plus"}
-
-        for key, value in machine_type_mappings.items():
-            if instrument_name.startswith(key):
-                return config["machine_type"][value]["bcl2fastq_version"]
+        machine_type = RunfolderMetadata.for_runfolder(runfolder).machine_type
+        if machine_type:
+            return config["machine_type"][machine_type]["bcl2fastq_version"]
 
     @staticmethod
     def get_length_of_indexes(runfolder):
@@ -153,22 +235,11 @@ class Bcl2FastqConfig:
                  {2: 7, 3: 8}
         """
 
-        run_info = Bcl2FastqConfig.runinfo_as_dict(runfolder)
-        reads = run_info["RunInfo"]["Run"]["Reads"]["Read"]
-
-        index_lengths = {}
-        for read in reads:
-            if read['@IsIndexedRead'] == 'Y':
-                index_lengths[int(read['@Number'])] = int(read['@NumCycles'])
-        return index_lengths
+        return RunfolderMetadata.for_runfolder(runfolder).index_lengths
 
     @staticmethod
     def is_single_read(runfolder):
-        run_info = Bcl2FastqConfig.runinfo_as_dict(runfolder)
-        reads = run_info["RunInfo"]["Run"]["Reads"]["Read"]
-
-        nbr_of_reads = len(list(filter(lambda x: not x["@IsIndexedRead"] == 'Y', reads)))
-        return nbr_of_reads < 2
+        return RunfolderMetadata.for_runfolder(runfolder).is_single_read
 
     @staticmethod
     def get_bases_mask_per_lane_from_samplesheet(samplesheet, index_lengths, is_single_read):
@@ -230,15 +301,9 @@ class Bcl2FastqConfig:
             else:
                 return ",".join(["y*"] + idx_masks + ["y*"])
 
-        def by_lane(x):
-            return x.lane
-        sample_rows_sorted_by_lane = sorted(samplesheet.samples, key=by_lane)
-        lanes_and_indexes = groupby(sample_rows_sorted_by_lane, by_lane)
-
-        first_sample_in_each_lane = {k: next(v) for k, v in lanes_and_indexes}
-
         base_masks = {}
-        for lane, sample_row in first_sample_in_each_lane.iteritems():
+        for lane in samplesheet.columns.lanes():
+            sample_row = samplesheet.columns.first_row(lane)
             if sample_row.index2:
                 base_masks[lane] = construct_base_mask([sample_row.index1.strip(), sample_row.index2.strip()])
             else:
@@ -247,6 +312,76 @@ class Bcl2FastqConfig:
         return base_masks
 
 
+class BinaryVersionCache:
+    """
+    Caches the versions reported by bcl2fastq binaries, so that a binary only has to be
+    probed again once it has changed. Entries are keyed on the resolved path of the
+    binary, and are only valid as long as the mtime and inode of the binary are unchanged.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_binary(binary):
+        """
+        Resolve the binary (looking it up on the PATH if needed) and stat it.
+        :param binary: path or name of the binary
+        :return: a tuple of the resolved path, mtime and inode of the binary, or
+                 None if it could not be found.
+        """
+        path = binary if os.path.dirname(binary) else find_executable(binary)
+        if not path:
+            return None
+        resolved_path = os.path.realpath(path)
+        try:
+            stat = os.stat(resolved_path)
+        except OSError:
+            return None
+        return resolved_path, stat.st_mtime, stat.st_ino
+
+    def get(self, binary):
+        """
+        Get the cached version of a binary. This never probes the binary.
+        :param binary: path or name of the binary
+        :return: the cached version, or None if there is no valid cache entry for it
+        """
+        binary_stat = BinaryVersionCache._stat_binary(binary)
+        if not binary_stat:
+            return None
+        resolved_path, mtime, inode = binary_stat
+        with self._lock:
+            cached = self._versions.get(resolved_path)
+        if cached and cached[0] == mtime and cached[1] == inode:
+            return cached[2]
+        return None
+
+    def get_or_probe(self, binary, probe):
+        """
+        Get the version of a binary, probing it only if there is no valid cache entry for it.
+        :param binary: path or name of the binary
+        :param probe: function taking the binary and returning its version (or None on failure)
+        :return: the version of the binary
+        """
+        binary_stat = BinaryVersionCache._stat_binary(binary)
+        if not binary_stat:
+            return probe(binary)
+
+        resolved_path, mtime, inode = binary_stat
+        with self._lock:
+            cached = self._versions.get(resolved_path)
+        if cached and cached[0] == mtime and cached[1] == inode:
+            return cached[2]
+
+        version = probe(binary)
+        if version is not None:
+            log.debug("Caching version {} for binary: {}".format(version, resolved_path))
+            with self._lock:
+                self._versions[resolved_path] = (mtime, inode, version)
+        return version
+
+
 class BCL2FastqRunnerFactory:
     """
     Generates new bcl2fastq runners according to the config passed.
@@ -261,6 +396,9 @@ class BCL2FastqRunnerFactory:
         """
         self.config = config
         self.bcl2fastq_mappings = config["bcl2fastq"]["versions"]
+        self.version_cache = BinaryVersionCache()
+        profile_store_path = get_config_value(config, "autotune", {}).get("profile_store_path")
+        self.thread_profiles = ThreadProfiles(config, ThreadProfileStore(profile_store_path))
 
     def _get_class_creator(self, version):
         """
@@ -272,10 +410,10 @@ class BCL2FastqRunnerFactory:
         """
 
         def _get_bcl2fastq2x_runner(self, config, binary):
-            return BCL2Fastq2xRunner(config, binary)
+            return BCL2Fastq2xRunner(config, binary, self.version_cache, self.thread_profiles)
 
         def _get_bcl2fastq1x_runner(self, config, binary):
-            return BCL2Fastq1xRunner(config, binary)
+            return BCL2Fastq1xRunner(config, binary, self.version_cache)
 
         function_name = self.bcl2fastq_mappings[version]["class_creation_function"]
         function = locals()[function_name]
@@ -287,6 +425,49 @@ class BCL2FastqRunnerFactory:
         """
         return self.bcl2fastq_mappings[version]["binary"]
 
+    def _is_probeable(self, version):
+        """
+        Only bcl2fastq 2.x binaries can report their own version.
+        """
+        return self.bcl2fastq_mappings[version]["class_creation_function"] == "_get_bcl2fastq2x_runner"
+
+    def warm_version_cache(self):
+        """
+        Probe the versions of all configured bcl2fastq binaries, so that this does
+        not have to be done when a run is started.
+        """
+        for version in self.bcl2fastq_mappings:
+            if self._is_probeable(version):
+                binary = self._get_binary(version)
+                detected_version = self.version_cache.get_or_probe(binary, BCL2Fastq2xRunner.probe_version)
+                log.info("Configured bcl2fastq version {} ({}) reports version: {}".format(version,
+                                                                                       binary,
+                                                                                       detected_version))
+
+    def detected_versions(self):
+        """
+        Get the versions reported by the configured binaries, as far as they are known
+        by the version cache. This will not probe any binaries.
+        :return: a dict of configured version as key, and detected version (or None if it
+                 is not known) as value.
+        """
+        detected = {}
+        for version in self.bcl2fastq_mappings:
+            if self._is_probeable(version):
+                detected[version] = self.version_cache.get(self._get_binary(version))
+            else:
+                detected[version] = version
+        return detected
+
+    def binary_stats(self):
+        """
+        Stat the configured binaries, so that it can be told when any of them has changed.
+        :return: a dict of configured version as key, and the resolved path, mtime and inode
+                 of its binary (or None if it could not be found) as value
+        """
+        return dict((version, BinaryVersionCache._stat_binary(self._get_binary(version)))
+                    for version in self.bcl2fastq_mappings)
+
     def create_bcl2fastq_runner(self, config):
         """
         Uses higher order functions to create a correct runner based
@@ -305,9 +486,11 @@ class BCL2FastqRunner(object):
     """
     Base class for bcl2fastq runners. Provides common functionality for running commands, etc.
     """
-    def __init__(self, config, binary):
+    def __init__(self, config, binary, version_cache=None, thread_profiles=None):
         self.config = config
         self.binary = binary
+        self.version_cache = version_cache
+        self.thread_profiles = thread_profiles
         self.command = None
 
     def version(self):
@@ -326,6 +509,53 @@ class BCL2FastqRunner(object):
         """
         raise NotImplementedError("Subclasses should implement this!")
 
+    def construct_lane_commands(self, write_samplesheets=True):
+        """
+        Implement this in subclasses which support splitting by lane
+        :return: a list of (lane, command, number of cores) tuples, one for each lane to run.
+        """
+        raise ArteriaUsageException("Splitting by lane is not supported for bcl2fastq {}".format(
+            self.config.bcl2fastq_version))
+
+    def construct_autotune_commands(self, candidates, output_base):
+        """
+        Implement this in subclasses which support autotuning
+        :return: a list of (thread profile, output directory, command) tuples, one for each candidate.
+        """
+        raise ArteriaUsageException("Autotuning is not supported for bcl2fastq {}".format(
+            self.config.bcl2fastq_version))
+
+    def lane_output(self, lane):
+        """
+        :param lane: to get the output directory for
+        :return: the output directory of a lane, when splitting by lane
+        """
+        return os.path.join(self.config.work_output, LANES_DIR_NAME, "L{:03d}".format(lane))
+
+    def merge_lane_outputs(self):
+        """
+        Merge the statistics and reports of all lanes in the output directory.
+        """
+        lanes_dir = os.path.join(self.config.work_output, LANES_DIR_NAME)
+        lane_outputs = [os.path.join(lanes_dir, name) for name in sorted(os.listdir(lanes_dir))]
+        merge_lane_outputs(lane_outputs, self.config.work_output)
+
+    def move_staged_output(self, output_reaper=None):
+        """
+        Move the output from scratch to the output directory, with `staging_copy_threads`
+        (4 by default) files copied at a time and each copy verified, and then atomically
+        re-point `runfolder/Unaligned` at the output directory. This blocks, so it should
+        not be run on the IOLoop.
+        :param output_reaper: to delete the output which is replaced with (see `move_output`)
+        :raises: IOError or OSError if the output could not be moved, in which case it is
+                 kept in scratch
+        """
+        nbr_of_threads = get_config_value(self.config.general_config, "staging_copy_threads", 4)
+        move_output(self.config.scratch, self.config.output, nbr_of_threads, output_reaper)
+        link_path = self.config.runfolder_input + "/Unaligned"
+        log.debug("Re-point symlink {} to {}.".format(link_path, self.config.output))
+        replace_symlink(self.config.output, link_path)
+
     def validate_output(self):
 
         def _parent_dir(d):
@@ -341,33 +571,69 @@ class BCL2FastqRunner(object):
             log.error(error_string)
             raise ArteriaUsageException(error_string)
 
-    def delete_output(self):
+        if OutputReaper.is_in_trash(self.config.output):
+            error_string = "Invalid output directory {} was specified." \
+                           " It is reserved for removed output.".format(self.config.output)
+            log.error(error_string)
+            raise ArteriaUsageException(error_string)
+
+    def delete_output(self, output_reaper=None):
         """
-        Delete the output directory if it exists and  the output path is valid
+        Delete the output directory (and any output left in scratch) if it exists and  the output
+        path is valid
+        :param output_reaper: if given, the output directory is moved to the trash and
+                              deleted in the background by this `OutputReaper`, instead
+                              of being deleted before returning.
         :return: None
         """
         self.validate_output()
-        log.info("Found a directory at output path {}, will remove it.".format(self.config.output))
+
+        # Output is trashed into the allowed output folder (or the scratch path), which is where
+        # the output reaper looks for trash left when the service is restarted.
+        output_folder = os.path.dirname(os.path.abspath(self.config.output))
+        # When rerunning some of the lanes, only their output is removed.
+        if self.config.split_by_lane and self.config.lanes:
+            outputs = [(self.lane_output(lane), output_folder) for lane in self.config.lanes]
+        else:
+            outputs = [(self.config.output, output_folder)]
+        if self.config.scratch:
+            outputs.append((self.config.scratch, os.path.dirname(os.path.abspath(self.config.scratch))))
+
+        for output, trash_root in outputs:
+            BCL2FastqRunner._delete_directory(output, output_reaper, trash_root)
+
+    @staticmethod
+    def _delete_directory(output, output_reaper=None, trash_root=None):
+        if output_reaper:
+            trash_path = OutputReaper.move_to_trash(output, trash_root)
+            if trash_path:
+                output_reaper.schedule(trash_path)
+            else:
+                log.debug("No such output directory, with path: {} will not remove it.".format(output))
+            return
+
+        log.info("Found a directory at output path {}, will remove it.".format(output))
         try:
-            shutil.rmtree(self.config.output)
+            shutil.rmtree(output)
         except OSError as e:
             # Ignore if the error is of type "No such file or directory"
             if e.errno == errno.ENOENT:
-                log.debug("No such output directory, with path: {} will not remove it.".format(self.config.output))
+                log.debug("No such output directory, with path: {} will not remove it.".format(output))
                 pass
             else:
                 log.error("Got error with error number {} when trying to remove dir: {}".format(e.errno,
-                                                                                                self.config.output))
+                                                                                                output))
                 raise e
 
     def symlink_output_to_unaligned(self):
         """
-        Create a symlink from `runfolder/Unaligned` to what has been defined as the output directory.
+        Create a symlink from `runfolder/Unaligned` to what has been defined as the output directory,
+        or to the directory in scratch the output is written to, when it is staged there.
         :raises: OSError if there was any problem creating the symlink, except for that it was already
                          there, in which case, do nothing.
         """
         link_path = self.config.runfolder_input + "/Unaligned"
-        link_target_path = self.config.output
+        link_target_path = self.config.work_output
 
         try:
             log.debug("Create symlink from {} to {}.".
@@ -392,13 +658,19 @@ class BCL2Fastq2xRunner(BCL2FastqRunner):
     Runs bcl2fastq with versions 2.x
     """
 
-    def __init__(self, config, binary):
-        BCL2FastqRunner.__init__(self, config, binary)
+    def __init__(self, config, binary, version_cache=None, thread_profiles=None):
+        BCL2FastqRunner.__init__(self, config, binary, version_cache, thread_profiles)
 
-    def version(self):
+    @staticmethod
+    def probe_version(binary):
+        """
+        Ask the binary which version it is by running it.
+        :param binary: the bcl2fastq binary to probe
+        :return: the version reported by the binary, or None if it could not be run.
+        """
         from subprocess import CalledProcessError
         try:
-            cmd = " ".join([self.binary,
+            cmd = " ".join([binary,
                             "--version",
                             "--min-log-level=NONE"])
             log.debug("Command generated was: {}".format(cmd))
@@ -410,23 +682,88 @@ class BCL2Fastq2xRunner(BCL2FastqRunner):
             log.error("Failed to get version: {0}".format(e.message))
             log.error("The command was: {0}".format(e.cmd))
 
+    def version(self):
+        if self.version_cache:
+            return self.version_cache.get_or_probe(self.binary, BCL2Fastq2xRunner.probe_version)
+        else:
+            return BCL2Fastq2xRunner.probe_version(self.binary)
+
     def construct_command(self):
+        return self._construct_command(self.config.work_output,
+                                       self.config.samplesheet_file,
+                                       self.config.tiles,
+                                       thread_profile=self.thread_profile(self.config.nbr_of_cores),
+                                       bases_mask_samplesheet_file=self.config.samplesheet_source)
+
+    def construct_autotune_commands(self, candidates, output_base):
+        """
+        Construct one command for each of the candidate thread profiles, each only processing the
+        tiles set in the config, and writing to a directory of its own in `output_base`.
+        :param candidates: the ThreadProfiles to construct commands for
+        :param output_base: the directory to place the output directories in
+        :return: a list of (thread profile, output directory, command) tuples, one for each candidate.
+        """
+        if not self.config.tiles:
+            raise ArteriaUsageException("Tiles must be specified when autotuning.")
+        commands = []
+        for i, candidate in enumerate(candidates):
+            output = os.path.join(output_base, "candidate_{}".format(i))
+            commands.append((candidate,
+                             output,
+                             self._construct_command(output,
+                                                     self.config.samplesheet_file,
+                                                     self.config.tiles,
+                                                     thread_profile=candidate)))
+        return commands
+
+    def thread_profile(self, nbr_of_cores):
+        """
+        :param nbr_of_cores: the number of cores bcl2fastq will be run with
+        :return: the ThreadProfile to run bcl2fastq with, or None if the runner has no thread profiles
+        """
+        if not self.thread_profiles:
+            return None
+        try:
+            machine_type = RunfolderMetadata.for_runfolder(self.config.runfolder_input).machine_type
+        except (IOError, OSError) as e:
+            log.warning("Could not find the machine type of {}, will use the default thread profile: {}".format(
+                self.config.runfolder_input, e))
+            machine_type = None
+        return self.thread_profiles.profile_for(machine_type, nbr_of_cores)
+
+    def _construct_command(self, output, samplesheet_file, tiles, lane=None, thread_profile=None,
+                           bases_mask_samplesheet_file=None):
+        """
+        Construct a bcl2fastq command
+        :param output: directory to write the output to
+        :param samplesheet_file: the samplesheet to use
+        :param tiles: tiles to include (None to include all)
+        :param lane: if given, the command is for this lane only
+        :param thread_profile: the ThreadProfile to run with (None to let bcl2fastq decide)
+        :param bases_mask_samplesheet_file: the samplesheet to find the bases masks from, if it is not
+                                            `samplesheet_file` (e.g. since that has not been written yet)
+        :return: the command
+        """
 
         commandline_collection = [
             self.binary,
             "--input-dir", self.config.base_calls_input,
-            "--output-dir", self.config.output,
-            "--sample-sheet", self.config.samplesheet_file]
+            "--output-dir", output,
+            "--sample-sheet", samplesheet_file]
 
         if self.config.barcode_mismatches:
             commandline_collection.append("--barcode-mismatches " + self.config.barcode_mismatches)
 
-        if self.config.tiles:
-            commandline_collection.append("--tiles " + self.config.tiles)
+        if tiles:
+            commandline_collection.append("--tiles " + tiles)
 
         if self.config.create_indexes:
             commandline_collection.append("--create-fastq-for-index-reads")
 
+        if thread_profile:
+            # Threads given in the additional arguments take precedence over the profile.
+            commandline_collection.extend(thread_profile.as_arguments(self._additional_arg_names()))
+
         if self.config.use_base_mask:
             # Note that for the base mask the "--use-bases-mask" must be included in the
             # commandline passed.
@@ -434,11 +771,16 @@ class BCL2Fastq2xRunner(BCL2FastqRunner):
         else:
             length_of_indexes = Bcl2FastqConfig.get_length_of_indexes(self.config.runfolder_input)
             is_single_read_run = Bcl2FastqConfig.is_single_read(self.config.runfolder_input)
-            samplesheet = Samplesheet(self.config.samplesheet_file)
+            samplesheet = Samplesheet(bases_mask_samplesheet_file or samplesheet_file)
             lanes_and_base_mask = Bcl2FastqConfig. \
                 get_bases_mask_per_lane_from_samplesheet(samplesheet, length_of_indexes, is_single_read_run)
-            for lane, base_mask in lanes_and_base_mask.iteritems():
-                commandline_collection.append("--use-bases-mask {0}:{1}".format(lane, base_mask))
+            if lane is not None:
+                # Samplesheets without lanes are read as if all samples were in lane 1, and
+                # then apply to all lanes.
+                base_mask = lanes_and_base_mask.get(lane, lanes_and_base_mask.get(1))
+                lanes_and_base_mask = {lane: base_mask}
+            for base_mask_lane, base_mask in lanes_and_base_mask.iteritems():
+                commandline_collection.append("--use-bases-mask {0}:{1}".format(base_mask_lane, base_mask))
 
         if self.config.additional_args:
             commandline_collection.append(self.config.additional_args)
@@ -447,11 +789,88 @@ class BCL2Fastq2xRunner(BCL2FastqRunner):
         log.debug("Generated command: " + command)
         return command
 
+    def _additional_arg_names(self):
+        if not self.config.additional_args:
+            return []
+        return [arg.split("=")[0] for arg in self.config.additional_args.split() if arg.startswith("-")]
+
+    def lanes_to_run(self):
+        """
+        :return: the lanes to run when splitting by lane; all lanes in the samplesheet (or on the
+                 flowcell, if the samplesheet has no lanes) unless specific lanes have been requested.
+        """
+        if Samplesheet.has_lane_column(self.config.samplesheet_source):
+            available_lanes = Samplesheet(self.config.samplesheet_source).columns.lanes()
+        else:
+            flowcell_layout = RunfolderMetadata.for_runfolder(self.config.runfolder_input).flowcell_layout
+            if not flowcell_layout:
+                raise ArteriaUsageException("Could not find the number of lanes for {}".format(
+                    self.config.runfolder_input))
+            available_lanes = range(1, flowcell_layout.lane_count + 1)
+
+        if not self.config.lanes:
+            return list(available_lanes)
+
+        missing_lanes = [lane for lane in self.config.lanes if lane not in available_lanes]
+        if missing_lanes:
+            raise ArteriaUsageException("Lanes {} are not in the samplesheet of {}".format(
+                ", ".join(map(str, missing_lanes)), self.config.runfolder_input))
+        return self.config.lanes
+
+    def lane_samplesheet_file(self, lane):
+        """
+        :param lane: to get the samplesheet for
+        :return: the path of the samplesheet containing only the samples of a lane
+        """
+        samplesheet_base, extension = os.path.splitext(self.config.samplesheet_file)
+        return "{}_L{:03d}{}".format(samplesheet_base, lane, extension)
+
+    def write_lane_samplesheets(self, lanes):
+        """
+        Write the samplesheets containing only the samples of each lane.
+        :param lanes: to write samplesheets for
+        """
+        for lane in lanes:
+            Samplesheet.write_for_lane(self.config.samplesheet_source, lane, self.lane_samplesheet_file(lane))
+
+    def construct_lane_commands(self, write_samplesheets=True):
+        """
+        Construct one command per lane, each only processing the tiles of its lane (using
+        `--tiles s_<lane>`), with a samplesheet containing only the samples of the lane and an
+        output directory of its own. The cores are divided evenly between the lanes, so that
+        the lanes can be run side by side.
+        :param write_samplesheets: write the samplesheets of the lanes; if False, nothing is written and
+                                   the samplesheets must be written with `write_lane_samplesheets`
+                                   before the commands are run.
+        :return: a list of (lane, command, number of cores) tuples, one for each lane to run.
+        """
+        lanes = self.lanes_to_run()
+        nbr_of_cores = max(1, self.config.nbr_of_cores // len(lanes))
+        # Each lane must at least be kept to its share of the cores.
+        thread_profile = self.thread_profile(nbr_of_cores) or \
+            ThreadProfile(loading_threads=None, processing_threads=nbr_of_cores, writing_threads=None,
+                          compression_level=None)
+
+        if write_samplesheets:
+            self.write_lane_samplesheets(lanes)
+
+        lane_commands = []
+        for lane in lanes:
+            command = self._construct_command(self.lane_output(lane),
+                                              self.lane_samplesheet_file(lane),
+                                              "s_{}".format(lane),
+                                              lane=lane,
+                                              thread_profile=thread_profile,
+                                              bases_mask_samplesheet_file=None if write_samplesheets else
+                                              self.config.samplesheet_source)
+            lane_commands.append((lane, command, nbr_of_cores))
+        return lane_commands
+
 class BCL2Fastq1xRunner(BCL2FastqRunner):
     """Runs bcl2fastq with versions 1.x"""
 
-    def __init__(self, config, binary):
-        BCL2FastqRunner.__init__(self, config, binary)
+    def __init__(self, config, binary, version_cache=None):
+        BCL2FastqRunner.__init__(self, config, binary, version_cache)
 
     def version(self):
         """
@@ -472,7 +891,7 @@ class BCL2Fastq1xRunner(BCL2FastqRunner):
             "configureBclToFastq.pl",
             "--input-dir", self.config.base_calls_input,
             "--sample-sheet", self.config.samplesheet_file,
-            "--output-dir", self.config.output,
+            "--output-dir", self.config.work_output,
             "--fastq-cluster-count 0", # No upper-limit on number of clusters per output file.
             "--force" # overwrite output if it exists.
         ]
@@ -487,7 +906,7 @@ class BCL2Fastq1xRunner(BCL2FastqRunner):
             commandline_collection.append("--use_bases_mask " + self.config.use_base_mask)
         else:
             length_of_indexes = Bcl2FastqConfig.get_length_of_indexes(self.config.runfolder_input)
-            samplesheet = Samplesheet(self.config.samplesheet_file)
+            samplesheet = Samplesheet(self.config.samplesheet_source)
             is_single_read_run = Bcl2FastqConfig.is_single_read(self.config.runfolder_input)
             lanes_and_base_mask = \
                 Bcl2FastqConfig.get_bases_mask_per_lane_from_samplesheet(
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import threading
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+from bcl2fastq.lib.illumina import Samplesheet
+
+log = logging.getLogger(__name__)
+
+# Name of the file, next to Stats.json, in which the summary of Stats.json is cached.
+SUMMARY_FILE_NAME = "Stats.summary.json"
+
+# The number of unknown barcodes to keep for each lane.
+TOP_UNKNOWN_BARCODES = 10
+
+# Top level values of Stats.json kept in the summary.
+_RUN_KEYS = ("Flowcell", "RunNumber", "RunId")
+
+# The lists of Stats.json which have one entry per lane.
+_LANE_LISTS = ("ConversionResults", "UnknownBarcodes")
+
+
+def _iter_stats_streaming(stats_file):
+    """
+    Go through Stats.json with a streaming parser, so that only one lane at the time is
+    held in memory.
+    :return: a generator of (key, value) tuples, for the top level values in `_RUN_KEYS` and
+             for each item of the lists in `_LANE_LISTS`
+    """
+    item_prefixes = {"{}.item".format(key): key for key in _LANE_LISTS}
+    builder = None
+    with open(stats_file, "rb") as f:
+        for prefix, event, value in ijson.parse(f):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix in item_prefixes and event == "end_map":
+                    yield item_prefixes[prefix], builder.value
+                    builder = None
+            elif prefix in item_prefixes and event == "start_map":
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            elif prefix in _RUN_KEYS:
+                yield prefix, value
+
+
+def _iter_stats_in_memory(stats_file):
+    """
+    Same as `_iter_stats_streaming`, for when no streaming parser is available.
+    """
+    with open(stats_file) as f:
+        stats = json.load(f)
+    for key in _RUN_KEYS:
+        if key in stats:
+            yield key, stats[key]
+    for key in _LANE_LISTS:
+        for item in stats.get(key, []):
+            yield key, item
+
+
+def _iter_stats(stats_file):
+    if ijson:
+        return _iter_stats_streaming(stats_file)
+    return _iter_stats_in_memory(stats_file)
+
+
+def _number(value):
+    # ijson gives decimals for non integer numbers, which json can not serialize.
+    return value if isinstance(value, (int, long)) else float(value)
+
+
+def _read_metrics(demux_result):
+    yield_total = sum(_number(read.get("Yield", 0)) for read in demux_result.get("ReadMetrics", []))
+    yield_q30 = sum(_number(read.get("YieldQ30", 0)) for read in demux_result.get("ReadMetrics", []))
+    quality_score_sum = sum(_number(read.get("QualityScoreSum", 0)) for read in demux_result.get("ReadMetrics", []))
+    return {"number_reads": _number(demux_result.get("NumberReads", 0)),
+            "yield": _number(demux_result.get("Yield", yield_total)),
+            "percent_q30": round(100.0 * yield_q30 / yield_total, 2) if yield_total else None,
+            "mean_quality_score": round(float(quality_score_sum) / yield_total, 2) if yield_total else None}
+
+
+def _sample_summary(demux_result, projects):
+    summary = {"sample_id": demux_result.get("SampleId"),
+               "sample_name": demux_result.get("SampleName"),
+               "project": projects.get(demux_result.get("SampleId"))}
+    summary.update(_read_metrics(demux_result))
+    index_metrics = demux_result.get("IndexMetrics", [])
+    summary["perfect_index_reads"] = sum(_number(index.get("MismatchCounts", {}).get("0", 0))
+                                         for index in index_metrics)
+    summary["one_mismatch_index_reads"] = sum(_number(index.get("MismatchCounts", {}).get("1", 0))
+                                              for index in index_metrics)
+    return summary
+
+
+def _projects_by_sample(samplesheet_file):
+    if not samplesheet_file or not os.path.exists(samplesheet_file):
+        return {}
+    try:
+        return {sample.sample_id: sample.sample_project for sample in Samplesheet(samplesheet_file).samples}
+    except (IOError, AssertionError) as e:
+        log.warning("Could not read the projects from {}: {}".format(samplesheet_file, e))
+        return {}
+
+
+def summarize_stats(stats_file, samplesheet_file=None):
+    """
+    Summarize a Stats.json written by bcl2fastq (2.x) per lane and sample, with the most
+    common unknown barcodes of each lane. Stats.json is parsed with a streaming parser if
+    ijson is installed.
+    :param stats_file: path to Stats.json
+    :param samplesheet_file: the samplesheet used, to find the project of each sample (optional)
+    :return: the summary as a dict
+    """
+    projects = _projects_by_sample(samplesheet_file)
+    summary = {"flowcell": None, "run_number": None, "run_id": None}
+    lanes = {}
+
+    def lane_summary(lane_number):
+        return lanes.setdefault(lane_number, {"lane": lane_number, "samples": [], "top_unknown_barcodes": []})
+
+    for key, value in _iter_stats(stats_file):
+        if key == "Flowcell":
+            summary["flowcell"] = value
+        elif key == "RunNumber":
+            summary["run_number"] = _number(value)
+        elif key == "RunId":
+            summary["run_id"] = value
+        elif key == "ConversionResults":
+            lane = lane_summary(value.get("LaneNumber"))
+            lane["total_clusters_raw"] = _number(value.get("TotalClustersRaw", 0))
+            lane["total_clusters_pf"] = _number(value.get("TotalClustersPF", 0))
+            lane["yield"] = _number(value.get("Yield", 0))
+            lane["samples"] = [_sample_summary(demux_result, projects)
+                               for demux_result in value.get("DemuxResults", [])]
+            lane["undetermined"] = _read_metrics(value.get("Undetermined", {}))
+        elif key == "UnknownBarcodes":
+            barcodes = sorted(value.get("Barcodes", {}).items(), key=lambda barcode: (-barcode[1], barcode[0]))
+            lane_summary(value.get("Lane"))["top_unknown_barcodes"] = [
+                {"barcode": barcode, "count": _number(count)} for barcode, count in barcodes[:TOP_UNKNOWN_BARCODES]]
+
+    summary["lanes"] = [lanes[lane_number] for lane_number in sorted(lanes)]
+    return summary
+
+
+def filter_summary(summary, lane=None, project=None, sample=None):
+    """
+    Only keep the parts of a summary matching the filters. Lanes without any matching
+    samples are left out when filtering on project or sample.
+    :param lane: the lane number to keep
+    :param project: the project to keep the samples of
+    :param sample: the sample (id or name) to keep
+    :return: the filtered summary
+    """
+    def sample_matches(sample_summary):
+        return ((project is None or sample_summary["project"] == project) and
+                (sample is None or sample in (sample_summary["sample_id"], sample_summary["sample_name"])))
+
+    filtered = dict(summary)
+    filtered["lanes"] = []
+    for lane_summary in summary["lanes"]:
+        if lane is not None and lane_summary["lane"] != lane:
+            continue
+        samples = [sample_summary for sample_summary in lane_summary["samples"] if sample_matches(sample_summary)]
+        if (project is not None or sample is not None) and not samples:
+            continue
+        filtered["lanes"].append(dict(lane_summary, samples=samples))
+    return filtered
+
+
+class StatsSummaryCache:
+    """
+    Keeps the summaries of Stats.json files on disk, in `Stats.summary.json` next to each
+    Stats.json, so that a Stats.json is only parsed once. A summary is made again if the
+    Stats.json (or the samplesheet) has changed since it was made.
+    """
+
+    def __init__(self):
+        # Summaries being made, so that the same Stats.json is not parsed by several threads at once.
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def _source_version(stats_file, samplesheet_file):
+        versions = []
+        for path in [stats_file, samplesheet_file]:
+            if path and os.path.exists(path):
+                stat = os.stat(path)
+                versions.append([stat.st_mtime, stat.st_size])
+            else:
+                versions.append(None)
+        return versions
+
+    def _lock_for(self, stats_file):
+        with self._locks_lock:
+            return self._locks.setdefault(stats_file, threading.Lock())
+
+    def summary(self, stats_file, samplesheet_file=None):
+        """
+        Get the summary of a Stats.json, from the cache if it is up to date.
+        :param stats_file: path to Stats.json
+        :param samplesheet_file: the samplesheet used, to find the project of each sample (optional)
+        :return: the summary as a dict, see `summarize_stats`
+        :raises: IOError/OSError if there is no Stats.json
+        """
+        summary_file = os.path.join(os.path.dirname(stats_file), SUMMARY_FILE_NAME)
+        with self._lock_for(stats_file):
+            source_version = StatsSummaryCache._source_version(stats_file, samplesheet_file)
+            if source_version[0] is None:
+                raise IOError("No such file: {}".format(stats_file))
+
+            try:
+                with open(summary_file) as f:
+                    cached = json.load(f)
+                if cached.get("source_version") == source_version:
+                    return cached["summary"]
+            except (IOError, OSError, ValueError):
+                pass
+
+            summary = summarize_stats(stats_file, samplesheet_file)
+            try:
+                # Write to a temporary file first, so that a half written summary is never seen.
+                with open(summary_file + ".tmp", "w") as f:
+                    json.dump({"source_version": source_version, "summary": summary}, f)
+                os.rename(summary_file + ".tmp", summary_file)
+            except (IOError, OSError) as e:
+                log.warning("Could not cache the summary of {}: {}".format(stats_file, e))
+            return summary
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from arteria.web.state import State
+
+log = logging.getLogger(__name__)
+
+# Name of the file, in the output directory, which the fingerprint of a successful run is written to.
+FINGERPRINT_FILE_NAME = ".bcl2fastq_fingerprint.json"
+
+
+def _hash_file(content_hash, path):
+    if not path or not os.path.exists(path):
+        content_hash.update(b"\0")
+        return
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            content_hash.update(chunk)
+
+
+def input_fingerprint(samplesheet_file, run_info_file, cmd, bcl2fastq_version):
+    """
+    Make a fingerprint of what decides the output of bcl2fastq: the samplesheet, RunInfo.xml,
+    the command run and the bcl2fastq version.
+    :param samplesheet_file: path to the samplesheet used
+    :param run_info_file: path to RunInfo.xml of the runfolder
+    :param cmd: the command run, or when splitting by lane, a list of (lane, command, number of
+                cores) tuples
+    :param bcl2fastq_version: the version of bcl2fastq run
+    :return: the fingerprint, as a hex string
+    """
+    content_hash = hashlib.sha1()
+    for path in [samplesheet_file, run_info_file]:
+        _hash_file(content_hash, path)
+    content_hash.update(json.dumps(cmd).encode("utf-8"))
+    content_hash.update(str(bcl2fastq_version).encode("utf-8"))
+    return content_hash.hexdigest()
+
+
+def output_manifest(output_dir):
+    """
+    :return: all files in the output directory (except for the fingerprint), as a sorted list
+             of [path relative to the output directory, size] lists
+    """
+    manifest = []
+    for root, _, files in os.walk(output_dir):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(path, output_dir)
+            if relative_path == FINGERPRINT_FILE_NAME:
+                continue
+            manifest.append([relative_path, os.path.getsize(path)])
+    return sorted(manifest)
+
+
+def write_fingerprint(output_dir, fingerprint):
+    """
+    Write the fingerprint of the inputs of a successful run to its output directory, with
+    the files of the output, so that it can later be told if the output is still intact.
+    """
+    fingerprint_file = os.path.join(output_dir, FINGERPRINT_FILE_NAME)
+    content = {"fingerprint": fingerprint,
+               "created": time.time(),
+               "files": output_manifest(output_dir)}
+    # Write to a temporary file first, so that a half written fingerprint is never seen.
+    with open(fingerprint_file + ".tmp", "w") as f:
+        json.dump(content, f)
+    os.rename(fingerprint_file + ".tmp", fingerprint_file)
+
+
+def output_matches(output_dir, fingerprint):
+    """
+    Check if the output directory holds the intact output of a successful run with the
+    same fingerprint, i.e. that all files it had are still there, with the same sizes.
+    :return: True if it does, otherwise False
+    """
+    try:
+        with open(os.path.join(output_dir, FINGERPRINT_FILE_NAME)) as f:
+            recorded = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False
+
+    if recorded.get("fingerprint") != fingerprint or not recorded.get("files"):
+        return False
+    for relative_path, size in recorded["files"]:
+        path = os.path.join(output_dir, relative_path)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            log.info("The output in {} has changed since it was made ({})".format(output_dir, relative_path))
+            return False
+    return True
+
+
+class FingerprintRecorder:
+    """
+    Writes the fingerprints of jobs to their output directories once they have finished
+    successfully. Only jobs which are not part of another job are followed.
+    """
+
+    def __init__(self, runner_service, executor=None):
+        """
+        Instantiate a FingerprintRecorder
+        :param runner_service: the `JobStoreAdapter` to follow the jobs of
+        :param executor: to write the fingerprints with, so that the output is not walked on
+                         the IOLoop (None to write them directly)
+        """
+        self.executor = executor
+        self._expected = {}
+        self._lock = threading.Lock()
+        runner_service.add_listener(self.on_job_state_change)
+
+    def expect(self, job_id, output_dir, fingerprint):
+        """
+        Write the fingerprint to the output directory if the job finishes successfully.
+        """
+        with self._lock:
+            self._expected[job_id] = (output_dir, fingerprint)
+
+    def _write(self, job_id, output_dir, fingerprint):
+        try:
+            write_fingerprint(output_dir, fingerprint)
+        except (IOError, OSError) as e:
+            log.warning("Could not write the fingerprint of job {} to {}: {}".format(job_id, output_dir, e))
+
+    def on_job_state_change(self, job, old_state, new_state):
+        if job["parent_job_id"] is not None or new_state not in (State.DONE, State.ERROR, State.CANCELLED):
+            return
+        with self._lock:
+            expected = self._expected.pop(job["job_id"], None)
+        if expected is None or new_state != State.DONE:
+            return
+        if self.executor:
+            self.executor.submit(self._write, job["job_id"], *expected)
+        else:
+            self._write(job["job_id"], *expected)
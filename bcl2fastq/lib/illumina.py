@@ -1,7 +1,13 @@
 
-from pandas import read_csv
+import csv
+import os
+import threading
+from array import array
+from collections import namedtuple, OrderedDict
 
-class SampleRow:
+import xmltodict
+
+class SampleRow(object):
     """
     Provides a representation of the information presented in a Illumina Samplesheet.
     Different samplesheet types (e.g. HiSeq, MiSeq, etc) will provide slightly different
@@ -15,6 +21,9 @@ class SampleRow:
     supported.
     """
 
+    __slots__ = ("lane", "sample_id", "sample_name", "sample_plate", "sample_well",
+                 "index1", "index2", "sample_project", "description")
+
     def __init__(self, sample_id, sample_name, index1, sample_project, lane=None, sample_plate=None,
                  sample_well=None, index2=None, description=None):
         """
@@ -43,18 +52,168 @@ class SampleRow:
         self.sample_project = str(sample_project)
         self.description = description
 
+    def _as_dict(self):
+        return {field: getattr(self, field) for field in SampleRow.__slots__}
+
     def __str__(self):
-        return str(self.__dict__)
+        return str(self._as_dict())
 
     def __eq__(self, other):
         if type(other) == type(self):
-            return self.__dict__ == other.__dict__
+            return all(getattr(self, field) == getattr(other, field) for field in SampleRow.__slots__)
         else:
-            False
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Rows are mutable and compared by value, so they should not be hashable.
+    __hash__ = None
+
+
+class SamplesheetColumns(object):
+    """
+    A columnar representation of the `[Data]` section of a samplesheet. Each field of
+    `SampleRow` is kept as one sequence, with the rows ordered by lane (and by their order
+    in the samplesheet within a lane). The range of rows for each lane is precomputed,
+    so that questions about a lane do not require looking at the rows of other lanes.
+
+    Values which are repeated between rows (e.g. projects) are only stored once.
+    """
+
+    COLUMNS = ("sample_id", "sample_name", "sample_plate", "sample_well",
+               "index1", "index2", "sample_project", "description")
+
+    def __init__(self):
+        """
+        Create an empty SamplesheetColumns instance. Add rows using `append` and
+        call `freeze` once all rows have been added.
+        """
+        self.lane = array("H")
+        self.columns = {column: [] for column in SamplesheetColumns.COLUMNS}
+        self._unique_values = {}
+        # Position of each row in the samplesheet, needed since rows are reordered by lane.
+        self._samplesheet_order = None
+        self._lane_ranges = None
+
+    def append(self, sample_id, sample_name, index1, sample_project, lane=None, sample_plate=None,
+               sample_well=None, index2=None, description=None):
+        """
+        Add a row. The parameters, and the normalization of them, are the same as for `SampleRow`.
+        """
+        self.lane.append(int(lane) if lane else 1)
+        values = {"sample_id": str(sample_id),
+                  "sample_name": str(sample_name),
+                  "sample_plate": sample_plate,
+                  "sample_well": sample_well,
+                  "index1": index1,
+                  "index2": index2,
+                  "sample_project": str(sample_project),
+                  "description": description}
+        unique_values = self._unique_values
+        for column, value in values.items():
+            self.columns[column].append(unique_values.setdefault(value, value))
+
+    def freeze(self):
+        """
+        Order the rows by lane, and build the index of which rows belong to each lane.
+        :return: self
+        """
+        self._unique_values = None
+        nbr_of_rows = len(self.lane)
+        lane_order = sorted(range(nbr_of_rows), key=self.lane.__getitem__)
+
+        if lane_order != list(range(nbr_of_rows)):
+            self.lane = array("H", (self.lane[i] for i in lane_order))
+            for column in SamplesheetColumns.COLUMNS:
+                values = self.columns[column]
+                self.columns[column] = [values[i] for i in lane_order]
+            samplesheet_order = array("L", [0] * nbr_of_rows)
+            for position, row in enumerate(lane_order):
+                samplesheet_order[row] = position
+            self._samplesheet_order = samplesheet_order
+
+        self._lane_ranges = OrderedDict()
+        for position, lane in enumerate(self.lane):
+            if lane in self._lane_ranges:
+                self._lane_ranges[lane][1] = position + 1
+            else:
+                self._lane_ranges[lane] = [position, position + 1]
+        return self
+
+    def __len__(self):
+        return len(self.lane)
+
+    def lanes(self):
+        """
+        :return: the lanes in the samplesheet, in ascending order
+        """
+        return list(self._lane_ranges.keys())
+
+    def lane_range(self, lane):
+        """
+        :param lane: to get the range of rows for
+        :return: a tuple of the first and one past the last row of the lane (in lane order)
+        """
+        start, end = self._lane_ranges[lane]
+        return start, end
+
+    def row(self, position):
+        """
+        Get a single row as a SampleRow.
+        :param position: of the row, in lane order
+        :return: a SampleRow instance
+        """
+        columns = self.columns
+        return SampleRow(lane=self.lane[position],
+                         sample_id=columns["sample_id"][position],
+                         sample_name=columns["sample_name"][position],
+                         sample_plate=columns["sample_plate"][position],
+                         sample_well=columns["sample_well"][position],
+                         index1=columns["index1"][position],
+                         index2=columns["index2"][position],
+                         sample_project=columns["sample_project"][position],
+                         description=columns["description"][position])
+
+    def first_row(self, lane):
+        return self.row(self._lane_ranges[lane][0])
+
+    def nbr_of_samples(self, lane):
+        start, end = self._lane_ranges[lane]
+        return end - start
+
+    def projects(self, lane):
+        """
+        :return: the projects with samples in the lane, in the order they first appear in the lane.
+        """
+        start, end = self._lane_ranges[lane]
+        return list(OrderedDict.fromkeys(self.columns["sample_project"][start:end]))
+
+    def index_lengths(self, lane):
+        """
+        The length of the indexes in a lane, based on the first row of the lane (the indexes of
+        all samples in a lane are assumed to have the same length).
+        :return: a tuple of the length of the first and the second index
+        """
+        position = self._lane_ranges[lane][0]
+        index1 = self.columns["index1"][position] or ""
+        index2 = self.columns["index2"][position] or ""
+        return len(index1.strip()), len(index2.strip())
+
+    def to_sample_rows(self):
+        """
+        :return: all rows as `SampleRow` instances, in the order they appear in the samplesheet
+        """
+        if self._samplesheet_order is None:
+            return [self.row(position) for position in range(len(self))]
+        else:
+            return [self.row(position) for position in self._samplesheet_order]
+
 
 class Samplesheet:
     """
-    Represent information contanied in a Illumina samplesheet
+    Represent information contanied in a Illumina samplesheet. The `[Data]` section is kept
+    in columnar form in `columns`, and `samples` is only built on demand.
     """
 
     def __init__(self, samplesheet_file):
@@ -64,7 +223,121 @@ class Samplesheet:
         """
         self.samplesheet_file = samplesheet_file
         with open(samplesheet_file, mode="r") as s:
-            self.samples = self._read_samples(s)
+            self.header, self.reads, self.settings, self.columns = self._parse(s)
+        self._samples = None
+
+    @property
+    def samples(self):
+        """
+        The sequencing units in the samplesheet as a list of `SampleRow` instances.
+        """
+        if self._samples is None:
+            self._samples = self.columns.to_sample_rows()
+        return self._samples
+
+    @staticmethod
+    def _parse(samplesheet_file_handle):
+        """
+        Parse the samplesheet in a single pass over the file.
+        :param samplesheet_file_handle: file handle for the corresponding samplesheet
+        :return: a tuple of the `[Header]` section (as an ordered dict), the `[Reads]` section (as a
+                 list of read lengths), the `[Settings]` section (as an ordered dict) and the sequencing
+                 units in the `[Data]` section (as `SamplesheetColumns`).
+        """
+
+        def value_of(row):
+            return row[1].strip() if len(row) > 1 else ""
+
+        header = OrderedDict()
+        reads = []
+        settings = OrderedDict()
+        columns = SamplesheetColumns()
+
+        section = None
+        data_columns = None
+        nbr_of_data_sections = 0
+
+        for row in csv.reader(samplesheet_file_handle):
+            # Skip empty lines, as well as lines only containing separators.
+            if not any(field.strip() for field in row):
+                continue
+
+            key = row[0].strip()
+            if key.startswith("[") and "]" in key:
+                section = key[1:key.index("]")]
+                if section == "Data":
+                    nbr_of_data_sections += 1
+                continue
+
+            if section == "Header":
+                header[key] = value_of(row)
+            elif section == "Reads":
+                reads.append(int(key) if key.isdigit() else key)
+            elif section == "Settings":
+                settings[key] = value_of(row)
+            elif section == "Data":
+                if data_columns is None:
+                    data_columns = [column.strip() for column in row]
+                    continue
+                # Columns missing at the end of a row are treated as empty.
+                row_by_column = {column: row[i] if i < len(row) else ""
+                                 for i, column in enumerate(data_columns)}
+                columns.append(lane=row_by_column.get("Lane"), sample_id=row_by_column.get("Sample_ID"),
+                               sample_name=row_by_column.get("Sample_Name"),
+                               sample_plate=row_by_column.get("Sample_Plate"),
+                               sample_well=row_by_column.get("Sample_Well"),
+                               index1=row_by_column.get("index"), index2=row_by_column.get("index2"),
+                               sample_project=row_by_column.get("Sample_Project"),
+                               description=row_by_column.get("Description"))
+
+        assert nbr_of_data_sections == 1, "There wasn't strictly one line in samplesheet with line '[Data]'"
+        return header, reads, settings, columns.freeze()
+
+    @staticmethod
+    def has_lane_column(samplesheet_file):
+        """
+        :param samplesheet_file: path to the samplesheet
+        :return: True if the `[Data]` section of the samplesheet has a `Lane` column
+        """
+        with open(samplesheet_file, mode="r") as f:
+            in_data_section = False
+            for row in csv.reader(f):
+                if not any(field.strip() for field in row):
+                    continue
+                if in_data_section:
+                    return "Lane" in [column.strip() for column in row]
+                in_data_section = row[0].strip().startswith("[Data]")
+        return False
+
+    @staticmethod
+    def write_for_lane(samplesheet_file, lane, destination):
+        """
+        Write a copy of a samplesheet with only the rows of the `[Data]` section which belong
+        to one lane. All other sections, and the columns of the data rows, are kept as they are.
+        If the samplesheet has no `Lane` column all rows are kept, since they then apply to all lanes.
+        :param samplesheet_file: path to the samplesheet to copy
+        :param lane: to keep the rows for
+        :param destination: path to write the new samplesheet to
+        """
+        with open(samplesheet_file, mode="r") as source, open(destination, mode="w") as target:
+            writer = csv.writer(target, lineterminator="\n")
+            section = None
+            lane_column = None
+            data_columns = None
+            for row in csv.reader(source):
+                key = row[0].strip() if row else ""
+                if key.startswith("[") and "]" in key:
+                    section = key[1:key.index("]")]
+                elif section == "Data" and any(field.strip() for field in row):
+                    if data_columns is None:
+                        data_columns = [column.strip() for column in row]
+                        if "Lane" in data_columns:
+                            lane_column = data_columns.index("Lane")
+                    elif lane_column is not None:
+                        row_lane = row[lane_column].strip() if lane_column < len(row) else ""
+                        if int(row_lane or 1) != int(lane):
+                            continue
+                writer.writerow(row)
 
     @staticmethod
     def _read_samples(samplesheet_file_handle):
@@ -73,24 +346,193 @@ class Samplesheet:
         :param samplesheet_file_handle: file handle for the corresponding samplesheet
         :return: a list of the sequencing units in the samplesheet in the form of `SampleRow` instances.
         """
+        return Samplesheet._parse(samplesheet_file_handle)[3].to_sample_rows()
+
+
+# Prefixes of instrument names, and the type of machine they correspond to.
+machine_type_mappings = {"M": "MiSeq",
+                         "D": "HiSeq 2500",
+                         "SN": "HiSeq 2000",
+                         "ST": "HiSeq X",
+                         "A": "NovaSeq",
+                         "NS": "NextSeq 500",
+                         "K": "HiSeq 4000",
+                         "FS": "ISeq 100",
+                         "LH": "NovaSeq X Plus"}
+
+Read = namedtuple("Read", ["number", "num_cycles", "is_index"])
+
+FlowcellLayout = namedtuple("FlowcellLayout", ["lane_count", "surface_count", "swath_count", "tile_count"])
+
+
+class RunfolderMetadata(object):
+    """
+    The parts of the meta data of a runfolder (i.e. RunInfo.xml and RunParameters.xml) that
+    are needed to run bcl2fastq. Use `RunfolderMetadata.for_runfolder` to get the meta data
+    for a runfolder, since that will only parse the xml files again once they have changed.
+    """
+
+    # Maximum number of runfolders to keep the meta data for.
+    CACHE_SIZE = 128
+
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, run_id, flowcell, instrument, reads, flowcell_layout=None,
+                 application_name=None, application_version=None, rta_version=None):
+        """
+        Create a RunfolderMetadata instance
+        :param run_id: id of the run
+        :param flowcell: id of the flowcell
+        :param instrument: name of the instrument, e.g. "D00251"
+        :param reads: list of `Read` instances, in the order they were sequenced
+        :param flowcell_layout: a `FlowcellLayout` (None if not specified for the run)
+        :param application_name: name of the control software (None if unknown)
+        :param application_version: version of the control software (None if unknown)
+        :param rta_version: version of RTA (None if unknown)
+        """
+        self.run_id = run_id
+        self.flowcell = flowcell
+        self.instrument = instrument
+        self.reads = reads
+        self.flowcell_layout = flowcell_layout
+        self.application_name = application_name
+        self.application_version = application_version
+        self.rta_version = rta_version
+
+    @property
+    def machine_type(self):
+        """
+        The type of machine the run was sequenced on, e.g. "HiSeq 2500", or None if unknown.
+        """
+        # Match the longest prefixes first, so that prefixes can not shadow each other.
+        for prefix in sorted(machine_type_mappings, key=len, reverse=True):
+            if self.instrument.startswith(prefix):
+                return machine_type_mappings[prefix]
+        return None
+
+    @property
+    def index_lengths(self):
+        """
+        The length of the index reads, as a dict with the read number as key, e.g. {2: 7, 3: 8}
+        """
+        return {read.number: read.num_cycles for read in self.reads if read.is_index}
+
+    @property
+    def is_single_read(self):
+        return len([read for read in self.reads if not read.is_index]) < 2
+
+    @property
+    def nbr_of_tiles(self):
+        """
+        The total number of tiles on the flowcell, or None if the flowcell layout is unknown.
+        """
+        if not self.flowcell_layout:
+            return None
+        layout = self.flowcell_layout
+        return layout.lane_count * layout.surface_count * layout.swath_count * layout.tile_count
+
+    @staticmethod
+    def _as_list(element):
+        if element is None:
+            return []
+        elif isinstance(element, list):
+            return element
+        else:
+            return [element]
+
+    @staticmethod
+    def _run_parameters_path(runfolder):
+        for file_name in ["RunParameters.xml", "runParameters.xml"]:
+            path = os.path.join(runfolder, file_name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _parse_run_parameters(run_parameters_path):
+        """
+        Parse the fields of interest from RunParameters.xml. Depending on the instrument
+        these can be found either at the top level or in the `Setup` section.
+        :return: a tuple of application name, application version and rta version
+        """
+        with open(run_parameters_path) as f:
+            run_parameters = xmltodict.parse(f.read()).get("RunParameters") or {}
+
+        def find(key):
+            if key in run_parameters:
+                return run_parameters[key]
+            return (run_parameters.get("Setup") or {}).get(key)
+
+        return find("ApplicationName"), find("ApplicationVersion"), find("RTAVersion")
+
+    @staticmethod
+    def parse(runfolder, run_parameters_path=None):
+        """
+        Parse the meta data of a runfolder. Prefer `for_runfolder`, which caches the result.
+        :param runfolder: path to the runfolder
+        :param run_parameters_path: path to RunParameters.xml (None if the runfolder has none)
+        :return: a RunfolderMetadata instance
+        """
+        with open(os.path.join(runfolder, "RunInfo.xml")) as f:
+            run = xmltodict.parse(f.read())["RunInfo"]["Run"]
+
+        reads = [Read(number=int(read["@Number"]),
+                      num_cycles=int(read["@NumCycles"]),
+                      is_index=read["@IsIndexedRead"] == "Y")
+                 for read in RunfolderMetadata._as_list(run["Reads"]["Read"])]
+        reads.sort(key=lambda read: read.number)
+
+        layout = run.get("FlowcellLayout")
+        if layout:
+            flowcell_layout = FlowcellLayout(lane_count=int(layout["@LaneCount"]),
+                                             surface_count=int(layout["@SurfaceCount"]),
+                                             swath_count=int(layout["@SwathCount"]),
+                                             tile_count=int(layout["@TileCount"]))
+        else:
+            flowcell_layout = None
+
+        if run_parameters_path:
+            application_name, application_version, rta_version = \
+                RunfolderMetadata._parse_run_parameters(run_parameters_path)
+        else:
+            application_name, application_version, rta_version = None, None, None
+
+        return RunfolderMetadata(run_id=run["@Id"],
+                                 flowcell=run["Flowcell"],
+                                 instrument=run["Instrument"],
+                                 reads=reads,
+                                 flowcell_layout=flowcell_layout,
+                                 application_name=application_name,
+                                 application_version=application_version,
+                                 rta_version=rta_version)
+
+    @staticmethod
+    def for_runfolder(runfolder):
+        """
+        Get the meta data for a runfolder. The meta data is kept in a least recently used
+        cache, and will only be parsed again if RunInfo.xml or RunParameters.xml has changed
+        (i.e. got a new mtime) since it was last parsed.
+        :param runfolder: path to the runfolder
+        :return: a RunfolderMetadata instance
+        :raises: IOError/OSError if there is no RunInfo.xml in the runfolder
+        """
+        runfolder = os.path.abspath(runfolder)
+        run_parameters_path = RunfolderMetadata._run_parameters_path(runfolder)
+        mtimes = (os.path.getmtime(os.path.join(runfolder, "RunInfo.xml")),
+                  os.path.getmtime(run_parameters_path) if run_parameters_path else None)
+
+        cache = RunfolderMetadata._cache
+        with RunfolderMetadata._cache_lock:
+            cached = cache.pop(runfolder, None)
+            if cached and cached[0] == mtimes:
+                cache[runfolder] = cached
+                return cached[1]
+
+        metadata = RunfolderMetadata.parse(runfolder, run_parameters_path)
 
-        def find_data_line():
-            enumurated_lines = enumerate(samplesheet_file_handle)
-            lines_with_data = filter(lambda x: "[Data]" in x[1], enumurated_lines)
-            assert len(lines_with_data) == 1, "There wasn't strictly one line in samplesheet with line '[Data]'"
-            return lines_with_data[0][0]
-
-        def row_to_sample_row(index_and_row):
-            row = index_and_row[1]
-            return SampleRow(lane=row.get("Lane"), sample_id=row.get("Sample_ID"), sample_name=row.get("Sample_Name"),
-                             sample_plate=row.get("Sample_Plate"), sample_well=row.get("Sample_Well"),
-                             index1=row.get("index"), index2=row.get("index2"),
-                             sample_project=row.get("Sample_Project"), description=row.get("Description"))
-
-        lines_to_skip = find_data_line() + 1
-        # Ensure that pointer is at beginning of file again.
-        samplesheet_file_handle.seek(0)
-        samplesheet_df = read_csv(samplesheet_file_handle, skiprows=lines_to_skip)
-        samplesheet_df = samplesheet_df.fillna("")
-        samples = map(row_to_sample_row, samplesheet_df.iterrows())
-        return list(samples)
+        with RunfolderMetadata._cache_lock:
+            cache[runfolder] = (mtimes, metadata)
+            while len(cache) > RunfolderMetadata.CACHE_SIZE:
+                cache.popitem(last=False)
+        return metadata
@@ -1,12 +1,36 @@
+import itertools
+import logging
+import os
+import pipes
+import re
+import signal
+import stat
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from localq import LocalQServer, Status
 from arteria.web.state import State as arteria_state
+from tornado import gen
+from tornado.concurrent import is_future
+from tornado.ioloop import IOLoop
+from tornado.process import Subprocess
+
+from bcl2fastq.lib.jobstore import JobStore
+from bcl2fastq.lib.scheduling import DEFAULT_AGING_INTERVAL, FIFO, SCHEDULING_POLICIES, expected_starts, queue_order
+
+log = logging.getLogger(__name__)
 
 class JobRunnerAdapter:
     """
     Specifies interface that should be used by jobrunners.
     """
 
-    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None):
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
         """
         Start a job corresponding to cmd
         :param cmd: to run
@@ -14,7 +38,13 @@ class JobRunnerAdapter:
         :param run_dir: where to run the job
         :param stdout: Reroute stdout to here
         :param stderr: Reroute stderr to here
-        :return: the jobid associated with it (None on failure).
+        :param priority: of the job, jobs of higher priority are run first (if supported by the jobrunner)
+        :param size: the estimated size of the job (see `estimated_run_size`), or None if not known.
+                     This may be used by the jobrunner to schedule the job.
+        :param runtime: the predicted runtime of the job in seconds (see `RuntimePredictor`), or None
+                        if not known. This may be used by the jobrunner to tell when jobs will start.
+        :return: the jobid associated with it (None on failure), or a future of it if starting the
+                 job would block (e.g. when submitting it to a batch scheduler).
         """
         raise NotImplementedError("Subclasses should implement this!")
 
@@ -22,14 +52,14 @@ class JobRunnerAdapter:
         """
         Stop job with job_id
         :param job_id: of job to stop
-        :return: the job_id of the stopped job, or None if not found.
+        :return: the job_id of the stopped job, or None if not found (or a future of it, see `start`).
         """
         raise NotImplementedError("Subclasses should implement this!")
 
     def stop_all(self):
         """
         Stop all jobs
-        :return: Nothing
+        :return: Nothing (or a future which is resolved once all jobs are stopped, see `start`)
         """
         raise NotImplementedError("Subclasses should implement this!")
 
@@ -79,13 +109,20 @@ class LocalQAdapter(JobRunnerAdapter):
         else:
             return arteria_state.NONE
 
-    # TODO Make configurable
     def __init__(self, nbr_of_cores, interval = 30, priority_method = "fifo"):
+        """
+        Instantiate a LocalQAdapter
+        :param nbr_of_cores: the total number of cores that the jobs can use
+        :param interval: how often (in seconds) localq checks on its jobs
+        :param priority_method: the order localq runs jobs in. Since localq has no notion of
+                                the priority of a job, the priority given when a job is started
+                                is ignored.
+        """
         self.nbr_of_cores = nbr_of_cores
         self.server = LocalQServer(nbr_of_cores, interval, priority_method)
         self.server.run()
 
-    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None):
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
         return self.server.add(cmd, nbr_of_cores, run_dir, stdout=stdout, stderr=stderr)
 
     def stop(self, job_id):
@@ -102,3 +139,825 @@ class LocalQAdapter(JobRunnerAdapter):
         for k, v in self.server.get_status_all().iteritems():
             jobs_and_status[k] = LocalQAdapter.localq2arteria_status(v)
         return jobs_and_status
+
+
+class SubprocessJob:
+    """
+    A job run by `SubprocessAdapter`
+    """
+
+    def __init__(self, job_id, cmd, nbr_of_cores, run_dir, stdout, stderr, priority=0, size=None, runtime=None):
+        self.job_id = job_id
+        self.cmd = cmd
+        self.nbr_of_cores = nbr_of_cores
+        self.run_dir = run_dir
+        self.stdout = stdout
+        self.stderr = stderr
+        self.priority = priority
+        self.size = size
+        self.runtime = runtime
+        self.state = arteria_state.PENDING
+        self.process = None
+        self.cancelled = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.returncode = None
+
+
+class SubprocessAdapter(JobRunnerAdapter):
+    """
+    An implementation of `JobRunnerAdapter` which runs jobs as subprocesses on the Tornado
+    IOLoop. Instead of polling the jobs at an interval, it is notified as soon as a job exits
+    (through Tornado's SIGCHLD handling), and will then immediately start the next job
+    waiting in the queue.
+
+    Jobs are started in the order given by the scheduling policy (see `queue_order`), as
+    soon as there are enough free cores for the next job. A job needing more cores than are
+    available in total will be run once no other jobs are running. This must be used from
+    the thread running the IOLoop.
+
+    To tell when waiting jobs are expected to start, the runtime predicted for a job is used
+    when given. Otherwise it is estimated from the size of the job, using the average time
+    per unit of size of the jobs which have finished.
+    """
+
+    # Weight of the latest finished job in the average time per unit of size.
+    RUNTIME_ESTIMATE_WEIGHT = 0.3
+
+    def __init__(self, nbr_of_cores, scheduling=FIFO, aging_interval=DEFAULT_AGING_INTERVAL):
+        """
+        Instantiate a SubprocessAdapter
+        :param nbr_of_cores: the total number of cores that the jobs can use
+        :param scheduling: the scheduling policy, one of `SCHEDULING_POLICIES`
+        :param aging_interval: in seconds, see `queue_order`
+        """
+        if scheduling not in SCHEDULING_POLICIES:
+            raise ValueError("Unknown scheduling policy: {}".format(scheduling))
+        self.nbr_of_cores = nbr_of_cores
+        self.scheduling = scheduling
+        self.aging_interval = aging_interval
+        self.jobs = OrderedDict()
+        self.queue = []
+        self.cores_in_use = 0
+        self.seconds_per_size_unit = None
+        self._job_ids = itertools.count(1)
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """
+        Add a function to be called each time a job changes state
+        :param listener: function taking the job id, the old and the new state.
+        """
+        self._listeners.append(listener)
+
+    def _set_state(self, job, new_state):
+        old_state = job.state
+        job.state = new_state
+        for listener in self._listeners:
+            try:
+                listener(job.job_id, old_state, new_state)
+            except Exception as e:
+                log.error("State listener failed for job {}: {}".format(job.job_id, e))
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def ordered_queue(self, now=None):
+        """
+        :return: the jobs waiting to run, in the order they will be run
+        """
+        return queue_order(self.queue, self.scheduling, self.aging_interval, now)
+
+    def _dispatch(self):
+        """
+        Start jobs from the queue for as long as there are cores available for them.
+        """
+        self.queue = self.ordered_queue()
+        while self.queue:
+            job = self.queue[0]
+            has_cores_for_job = self.cores_in_use + job.nbr_of_cores <= self.nbr_of_cores
+            if not has_cores_for_job and self.cores_in_use > 0:
+                break
+            self.queue.pop(0)
+            self._launch(job)
+
+    def _launch(self, job):
+        stdout = stderr = None
+        try:
+            stdout = open(job.stdout, "w") if job.stdout else None
+            if job.stderr and job.stderr == job.stdout:
+                stderr = stdout
+            else:
+                stderr = open(job.stderr, "w") if job.stderr else None
+            # Run the job in a process group of its own, so that it can be stopped
+            # together with any processes it starts.
+            job.process = Subprocess(job.cmd, shell=True, cwd=job.run_dir, stdout=stdout, stderr=stderr,
+                                     preexec_fn=os.setsid)
+        except (IOError, OSError, ValueError) as e:
+            log.error("Failed to start job {} ({}): {}".format(job.job_id, job.cmd, e))
+            job.finished = time.time()
+            self._set_state(job, arteria_state.ERROR)
+            return
+        finally:
+            # The job has its own copies of the file handles.
+            for f in set([stdout, stderr]):
+                if f:
+                    f.close()
+
+        job.started = time.time()
+        self.cores_in_use += job.nbr_of_cores
+        job.process.set_exit_callback(partial(self._on_exit, job))
+        log.debug("Started job {} with pid {}: {}".format(job.job_id, job.process.pid, job.cmd))
+        self._set_state(job, arteria_state.STARTED)
+
+    def _on_exit(self, job, returncode):
+        job.finished = time.time()
+        job.returncode = returncode
+        self.cores_in_use -= job.nbr_of_cores
+        log.debug("Job {} exited with return code {}".format(job.job_id, returncode))
+
+        if job.cancelled:
+            self._set_state(job, arteria_state.CANCELLED)
+        elif returncode == 0:
+            self._learn_runtime(job)
+            self._set_state(job, arteria_state.DONE)
+        else:
+            self._set_state(job, arteria_state.ERROR)
+
+        self._dispatch()
+
+    def _learn_runtime(self, job):
+        if not job.size:
+            return
+        seconds_per_size_unit = (job.finished - job.started) / float(job.size)
+        if self.seconds_per_size_unit is None:
+            self.seconds_per_size_unit = seconds_per_size_unit
+        else:
+            self.seconds_per_size_unit += \
+                SubprocessAdapter.RUNTIME_ESTIMATE_WEIGHT * (seconds_per_size_unit - self.seconds_per_size_unit)
+
+    def estimated_runtime(self, job):
+        """
+        :return: the estimated runtime of a job in seconds, or None if it can not be estimated
+        """
+        if job.runtime is not None:
+            return job.runtime
+        if job.size is None or self.seconds_per_size_unit is None:
+            return None
+        return job.size * self.seconds_per_size_unit
+
+    def queue_status(self, now=None):
+        """
+        Get the position of each waiting job in the queue, and when it is expected to start.
+        :return: a dict with the job id as key, and a dict with the `queue_position` (starting
+                 at 1) and the `expected_start` time (None if it can not be estimated) as value
+        """
+        now = now or time.time()
+        ordered_queue = self.ordered_queue(now)
+        running_jobs = []
+        for job in self.jobs.values():
+            if job.state == arteria_state.STARTED:
+                runtime = self.estimated_runtime(job)
+                running_jobs.append((job.nbr_of_cores, job.started + runtime if runtime is not None else None))
+        starts = expected_starts([(job.nbr_of_cores, self.estimated_runtime(job)) for job in ordered_queue],
+                                 running_jobs, self.nbr_of_cores, now)
+        return {job.job_id: {"queue_position": position, "expected_start": start}
+                for position, (job, start) in enumerate(zip(ordered_queue, starts), 1)}
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
+        job_id = next(self._job_ids)
+        job = SubprocessJob(job_id, cmd, nbr_of_cores, run_dir, stdout, stderr, priority, size, runtime)
+        self.jobs[job_id] = job
+        self.queue.append(job)
+        IOLoop.current().add_callback(self._dispatch)
+        return job_id
+
+    def stop(self, job_id):
+        job = self.jobs.get(int(job_id))
+        if not job:
+            return None
+
+        if job in self.queue:
+            self.queue.remove(job)
+            job.finished = time.time()
+            self._set_state(job, arteria_state.CANCELLED)
+        elif job.state == arteria_state.STARTED:
+            job.cancelled = True
+            try:
+                os.killpg(job.process.pid, signal.SIGTERM)
+            except OSError as e:
+                log.warning("Failed to stop job {}: {}".format(job.job_id, e))
+        return job.job_id
+
+    def stop_all(self):
+        for job_id in list(self.jobs):
+            self.stop(job_id)
+
+    def status(self, job_id):
+        job = self.jobs.get(int(job_id))
+        return job.state if job else arteria_state.NONE
+
+    def status_all(self):
+        return {job_id: job.state for job_id, job in self.jobs.items()}
+
+    def pid(self, job_id):
+        """
+        :return: the pid of the process started for the job, or None if the job is not running
+        """
+        job = self.jobs.get(int(job_id))
+        if not job or job.state != arteria_state.STARTED:
+            return None
+        return job.process.pid
+
+
+class BatchSchedulerAdapter(JobRunnerAdapter):
+    """
+    An implementation of `JobRunnerAdapter` which submits jobs to a batch scheduler (e.g. Slurm),
+    so that they can be spread over the nodes of a cluster. Each job is written to a script which
+    is submitted using `submit_command`. The state of all unfinished jobs is polled at an interval
+    by a background thread, using a single `status_command` for all of them.
+
+    The commands are templates, in which the following are replaced (shell quoted):
+     - submit_command: {script}, {nbr_of_cores}, {run_dir}, {stdout}, {stderr}, {job_name}
+     - status_command: {job_ids} (space separated) and {job_ids_comma} (comma separated)
+     - cancel_command: {job_ids} (space separated)
+
+    The output of the submit command is searched for the job id using `job_id_pattern`. Each line
+    of the output of the status command should start with a job id and its state, separated by
+    whitespace or `|`. Job ids which were not submitted by the adapter (e.g. job steps) are ignored,
+    as are jobs missing from the output, which keep their last known state.
+    """
+
+    DEFAULT_SUBMIT_COMMAND = "sbatch --parsable --job-name={job_name} --cpus-per-task={nbr_of_cores} " \
+                             "--chdir={run_dir} --output={stdout} --error={stderr} {script}"
+    DEFAULT_STATUS_COMMAND = "sacct --noheader --parsable2 --format=JobID,State --jobs={job_ids_comma}"
+    DEFAULT_CANCEL_COMMAND = "scancel {job_ids}"
+    DEFAULT_JOB_ID_PATTERN = r"^\s*(\d+)"
+
+    # Scheduler states (as reported by Slurm), and the corresponding arteria states.
+    STATE_MAPPING = {"PENDING": arteria_state.PENDING,
+                     "CONFIGURING": arteria_state.PENDING,
+                     "REQUEUED": arteria_state.PENDING,
+                     "SUSPENDED": arteria_state.PENDING,
+                     "RUNNING": arteria_state.STARTED,
+                     "COMPLETING": arteria_state.STARTED,
+                     "COMPLETED": arteria_state.DONE,
+                     "CANCELLED": arteria_state.CANCELLED,
+                     "PREEMPTED": arteria_state.CANCELLED,
+                     "FAILED": arteria_state.ERROR,
+                     "TIMEOUT": arteria_state.ERROR,
+                     "NODE_FAIL": arteria_state.ERROR,
+                     "OUT_OF_MEMORY": arteria_state.ERROR,
+                     "BOOT_FAIL": arteria_state.ERROR,
+                     "DEADLINE": arteria_state.ERROR}
+
+    FINISHED_STATES = (arteria_state.DONE, arteria_state.ERROR, arteria_state.CANCELLED)
+
+    def __init__(self, script_dir, submit_command=DEFAULT_SUBMIT_COMMAND, status_command=DEFAULT_STATUS_COMMAND,
+                 cancel_command=DEFAULT_CANCEL_COMMAND, job_id_pattern=DEFAULT_JOB_ID_PATTERN, state_mapping=None,
+                 interval=10):
+        """
+        Instantiate a BatchSchedulerAdapter
+        :param script_dir: directory to write the job scripts to, which must be readable by the nodes
+        :param submit_command: template of the command submitting a job script
+        :param status_command: template of the command getting the state of jobs
+        :param cancel_command: template of the command cancelling jobs
+        :param job_id_pattern: regular expression finding the job id in the output of the submit command
+        :param state_mapping: scheduler states to map to arteria states, in addition to `STATE_MAPPING`
+        :param interval: seconds between polling the state of the jobs (None to only poll when `poll`
+                         is called)
+        """
+        self.script_dir = script_dir
+        self.submit_command = submit_command
+        self.status_command = status_command
+        self.cancel_command = cancel_command
+        self.job_id_pattern = re.compile(job_id_pattern, re.MULTILINE)
+        self.state_mapping = dict(BatchSchedulerAdapter.STATE_MAPPING)
+        self.state_mapping.update(state_mapping or {})
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        # The submit and cancel commands are run off the IOLoop, one at a time, so that jobs
+        # are submitted in the order they were started, and cancelled after being submitted.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        if interval:
+            self._thread = threading.Thread(target=self._poll_forever, args=(interval,), name="batch-scheduler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    @staticmethod
+    def _run(command):
+        log.debug("Running: {}".format(command))
+        return subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT)
+
+    def _write_script(self, cmd, run_dir):
+        script = os.path.join(self.script_dir, "{}.{}.{}.sh".format(os.path.basename(os.path.normpath(run_dir)),
+                                                                    time.strftime("%Y%m%d-%H%M%S"),
+                                                                    uuid.uuid4().hex[:8]))
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\ncd {}\n{}\n".format(pipes.quote(run_dir), cmd))
+        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR | stat.S_IXGRP)
+        return script
+
+    def to_arteria_state(self, scheduler_state):
+        """
+        Convert a scheduler state (e.g. "CANCELLED by 1000") to an arteria state
+        :return: the arteria state, or None if the scheduler state is not known
+        """
+        words = scheduler_state.split()
+        if not words:
+            return None
+        return self.state_mapping.get(words[0].rstrip("+").upper())
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
+        """
+        See `JobRunnerAdapter.start`. The job is submitted in the background, since the submit
+        command may take a while to answer.
+        :return: a future of the job id (None on failure)
+        """
+        # The scheduler decides the order the jobs are run in, so the priority, size and runtime are not used.
+        return self._executor.submit(self._submit, cmd, nbr_of_cores, run_dir, stdout, stderr)
+
+    def _submit(self, cmd, nbr_of_cores, run_dir, stdout, stderr):
+        try:
+            script = self._write_script(cmd, run_dir)
+            submit_command = self.submit_command.format(script=pipes.quote(script),
+                                                        nbr_of_cores=int(nbr_of_cores),
+                                                        run_dir=pipes.quote(run_dir),
+                                                        stdout=pipes.quote(stdout or os.devnull),
+                                                        stderr=pipes.quote(stderr or os.devnull),
+                                                        job_name=pipes.quote(os.path.basename(
+                                                            os.path.normpath(run_dir))))
+            output = BatchSchedulerAdapter._run(submit_command)
+        except (IOError, OSError, subprocess.CalledProcessError) as e:
+            log.error("Failed to submit {}: {}".format(cmd, e))
+            return None
+
+        match = self.job_id_pattern.search(output)
+        if not match:
+            log.error("Could not find the job id of {} in: {}".format(cmd, output))
+            return None
+        job_id = match.group(1)
+        with self._lock:
+            self._states[job_id] = arteria_state.PENDING
+        log.info("Submitted {} as job {}".format(script, job_id))
+        return job_id
+
+    def poll(self):
+        """
+        Update the state of all unfinished jobs, using a single status command.
+        """
+        with self._lock:
+            job_ids = [job_id for job_id, state in self._states.items()
+                       if state not in BatchSchedulerAdapter.FINISHED_STATES]
+        if not job_ids:
+            return
+
+        try:
+            output = BatchSchedulerAdapter._run(self.status_command.format(
+                job_ids=" ".join(pipes.quote(job_id) for job_id in job_ids),
+                job_ids_comma=pipes.quote(",".join(job_ids))))
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.error("Failed to get the state of jobs {}: {}".format(", ".join(job_ids), e))
+            return
+
+        for line in output.splitlines():
+            fields = re.split(r"[|\s]+", line.strip(), maxsplit=1)
+            if len(fields) < 2:
+                continue
+            job_id, scheduler_state = fields
+            state = self.to_arteria_state(scheduler_state.replace("|", " "))
+            with self._lock:
+                if job_id not in self._states or self._states[job_id] in BatchSchedulerAdapter.FINISHED_STATES:
+                    continue
+                if state:
+                    self._states[job_id] = state
+                else:
+                    log.warning("Unknown state of job {}: {}".format(job_id, scheduler_state))
+
+    def _poll_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.poll()
+            except Exception as e:
+                log.error("Failed to poll the batch scheduler: {}".format(e))
+
+    def _cancel(self, job_ids):
+        try:
+            BatchSchedulerAdapter._run(self.cancel_command.format(
+                job_ids=" ".join(pipes.quote(job_id) for job_id in job_ids)))
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.error("Failed to cancel jobs {}: {}".format(", ".join(job_ids), e))
+            return False
+        with self._lock:
+            for job_id in job_ids:
+                self._states[job_id] = arteria_state.CANCELLED
+        return True
+
+    def stop(self, job_id):
+        """
+        See `JobRunnerAdapter.stop`. The job is cancelled in the background, once any jobs
+        submitted before have been submitted.
+        :return: a future of the job id of the stopped job (None if not found, or it could not be stopped)
+        """
+        return self._executor.submit(self._stop, str(job_id))
+
+    def _stop(self, job_id):
+        with self._lock:
+            state = self._states.get(job_id)
+        if state is None:
+            return None
+        if state in BatchSchedulerAdapter.FINISHED_STATES:
+            return job_id
+        return job_id if self._cancel([job_id]) else None
+
+    def stop_all(self):
+        """
+        See `JobRunnerAdapter.stop_all`.
+        :return: a future which is resolved once all jobs have been cancelled
+        """
+        return self._executor.submit(self._stop_all)
+
+    def _stop_all(self):
+        with self._lock:
+            job_ids = [job_id for job_id, state in self._states.items()
+                       if state not in BatchSchedulerAdapter.FINISHED_STATES]
+        if job_ids:
+            self._cancel(job_ids)
+
+    def attach(self, job_id, state=arteria_state.PENDING):
+        """
+        Follow a job which was submitted earlier, e.g. before the service was restarted.
+        :param job_id: of the job in the batch scheduler
+        :param state: the last known state of the job, kept until the job is polled
+        :return: the job id
+        """
+        job_id = str(job_id)
+        with self._lock:
+            self._states[job_id] = state
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            return self._states.get(str(job_id), arteria_state.NONE)
+
+    def status_all(self):
+        with self._lock:
+            return dict(self._states)
+
+
+class JobStoreAdapter(JobRunnerAdapter):
+    """
+    An implementation of `JobRunnerAdapter` which wraps another `JobRunnerAdapter`, and
+    records all jobs and their state transitions in a `JobStore`. Status queries are
+    answered from the store, which is kept up to date by calling `sync` regularly.
+
+    The job ids handed out are the ids in the store, so they stay valid across restarts
+    of the service. The ids the wrapped job runner knows the jobs by are recorded as well,
+    so that jobs which were unfinished when the service stopped can be followed again if the
+    job runner can re-attach to them (see `BatchSchedulerAdapter.attach`). Other unfinished
+    jobs died with the service, so they are marked as errors when the adapter is created.
+
+    Several jobs can be started as a group using `start_group`. The group gets a job of
+    its own in the store, whose state follows the jobs in it.
+    """
+
+    def __init__(self, job_runner, job_store):
+        """
+        Instantiate a JobStoreAdapter
+        :param job_runner: the `JobRunnerAdapter` which actually runs the jobs
+        :param job_store: the `JobStore` to record jobs in
+        """
+        self.job_runner = job_runner
+        self.job_store = job_store
+        # Maps job ids in the store to the ids used by the wrapped job runner (and back).
+        # This only contains the jobs started by this instance.
+        self._runner_job_ids = {}
+        self._store_job_ids = {}
+        # Futures of the runner job ids of jobs which are still being started, by their job id in the store.
+        self._submissions = {}
+        self._listeners = []
+        # Functions to call once all jobs in a group are done, by the job id of the group.
+        self._finalizers = {}
+        # Functions to call once a group has finished, whatever its state, by the job id of the group.
+        self._cleanups = {}
+
+        # Job runners which can tell when jobs change state are followed directly,
+        # instead of waiting for the next sync.
+        if hasattr(self.job_runner, "add_listener"):
+            self.job_runner.add_listener(self._on_runner_state_change)
+
+        self._resume_unfinished_jobs()
+
+    @staticmethod
+    def _interrupted_finalizer(group_job_id):
+        raise IOError("The group was started before the service was restarted, so it can not be finalized")
+
+    def _resume_unfinished_jobs(self):
+        """
+        Follow the jobs which were unfinished when the service stopped again, if the wrapped job
+        runner can re-attach to them (e.g. jobs in a batch scheduler, which keep running while the
+        service is down). Other jobs died with the service, so they are marked as errors. The
+        finalizers of groups are lost on a restart, so groups are marked as errors once their jobs
+        are done, rather than done.
+        """
+        can_attach = hasattr(self.job_runner, "attach")
+        group_job_ids = []
+        for job in self.job_store.unfinished_jobs():
+            if self.job_store.child_jobs(job["job_id"]):
+                group_job_ids.append(job["job_id"])
+                self._finalizers[job["job_id"]] = JobStoreAdapter._interrupted_finalizer
+            elif can_attach and job["runner_job_id"] is not None:
+                log.info("Following job {} for {} (job {} in the job runner) again after a restart of the "
+                         "service.".format(job["job_id"], job["runfolder"], job["runner_job_id"]))
+                self._track(job["job_id"], self.job_runner.attach(job["runner_job_id"], job["state"]))
+            else:
+                log.warning("Job {} for {} was interrupted by a restart of the service.".format(job["job_id"],
+                                                                                             job["runfolder"]))
+                self._set_state(job["job_id"], arteria_state.ERROR)
+        for group_job_id in group_job_ids:
+            self._update_group(group_job_id)
+
+    def add_listener(self, listener):
+        """
+        Add a function to be called each time a job changes state
+        :param listener: function taking the job (as a dict from the store), the old and the new state.
+        """
+        self._listeners.append(listener)
+
+    def _set_state(self, job_id, new_state):
+        old_state = self.job_store.state(job_id)
+        if old_state == new_state:
+            return
+        self.job_store.set_state(job_id, new_state)
+        job = self.job_store.get_job(job_id)
+        for listener in self._listeners:
+            try:
+                listener(job, old_state, new_state)
+            except Exception as e:
+                log.error("State listener failed for job {}: {}".format(job_id, e))
+        cleanup = self._cleanups.pop(job_id, None) if new_state in JobStore.FINISHED_STATES else None
+        if cleanup:
+            try:
+                cleanup(job_id)
+            except Exception as e:
+                log.error("Failed to clean up after job {}: {}".format(job_id, e))
+        if job["parent_job_id"] is not None:
+            self._update_group(job["parent_job_id"])
+
+    def _update_group(self, group_job_id):
+        """
+        Update the state of a group from the states of the jobs in it. A group is started once
+        any of its jobs have started, and finished once all of them have finished. If all jobs
+        were successful, the finalizer of the group is run before the group is done.
+        """
+        group_state = self.job_store.state(group_job_id)
+        if group_state in JobStore.FINISHED_STATES:
+            return
+
+        states = [job["state"] for job in self.job_store.child_jobs(group_job_id)]
+        if not all(state in JobStore.FINISHED_STATES for state in states):
+            if any(state != arteria_state.PENDING for state in states):
+                self._set_state(group_job_id, arteria_state.STARTED)
+            return
+
+        if arteria_state.ERROR in states:
+            self._finalizers.pop(group_job_id, None)
+            self._set_state(group_job_id, arteria_state.ERROR)
+        elif arteria_state.CANCELLED in states:
+            self._finalizers.pop(group_job_id, None)
+            self._set_state(group_job_id, arteria_state.CANCELLED)
+        elif group_job_id in self._finalizers:
+            self._finalize(group_job_id, self._finalizers.pop(group_job_id))
+        else:
+            self._set_state(group_job_id, arteria_state.DONE)
+
+    def _finalize(self, group_job_id, finalizer):
+        """
+        Run the finalizer of a group. If it returns a future, the group is done once the
+        future is resolved.
+        """
+        def _finished(future_or_result):
+            try:
+                if is_future(future_or_result):
+                    future_or_result.result()
+                self._set_state(group_job_id, arteria_state.DONE)
+            except Exception as e:
+                log.error("Failed to finalize job {}: {}".format(group_job_id, e))
+                self._set_state(group_job_id, arteria_state.ERROR)
+
+        try:
+            result = finalizer(group_job_id)
+        except Exception as e:
+            log.error("Failed to finalize job {}: {}".format(group_job_id, e))
+            self._set_state(group_job_id, arteria_state.ERROR)
+            return
+
+        if is_future(result):
+            IOLoop.current().add_future(result, _finished)
+        else:
+            _finished(result)
+
+    def _on_runner_state_change(self, runner_job_id, old_state, new_state):
+        job_id = self._store_job_ids.get(runner_job_id)
+        if job_id is not None:
+            self._set_state(job_id, new_state)
+
+    def sync(self):
+        """
+        Update the store with the current state of all unfinished jobs in the wrapped job runner.
+        """
+        runner_states = self.job_runner.status_all()
+        for job in self.job_store.unfinished_jobs():
+            runner_job_id = self._runner_job_ids.get(job["job_id"])
+            if runner_job_id is None or runner_job_id not in runner_states:
+                continue
+            self._set_state(job["job_id"], runner_states[runner_job_id])
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None,
+              features=None):
+        """
+        See `JobRunnerAdapter.start`.
+        :param features: of the job (see `run_features`), recorded so that the job becomes part of
+                         the history runtimes are predicted from once it is done (None to not record)
+        """
+        return self._start_job(cmd, nbr_of_cores, run_dir, stdout, stderr, priority=priority, size=size,
+                               runtime=runtime, features=features)
+
+    def start_group(self, jobs, run_dir, finalizer=None, priority=0, sizes=None, runtimes=None, features=None,
+                    cleanup=None):
+        """
+        Start several jobs as a group, which is done once all jobs in it are done.
+        :param jobs: a list of (cmd, nbr_of_cores, stdout, stderr) tuples, one for each job
+        :param run_dir: the directory to run the jobs in
+        :param finalizer: function called with the job id of the group once all jobs have finished
+                          successfully. The group is marked as an error if it raises, or returns
+                          a future which fails.
+        :param cleanup: function called with the job id of the group once it has finished, whether
+                        it was successful, failed or was cancelled (after the finalizer, if any)
+        :param priority: of the jobs in the group
+        :param sizes: the estimated size of each job (None if not known), in the order of `jobs`
+        :param runtimes: the predicted runtime of each job (None if not known), in the order of `jobs`
+        :param features: the features of each job (see `run_features`), in the order of `jobs`
+        :return: the job id of the group
+        """
+        group_job_id = self.job_store.add_job("\n".join(cmd for cmd, _, _, _ in jobs),
+                                              runfolder=os.path.basename(os.path.normpath(run_dir)),
+                                              run_dir=run_dir,
+                                              nbr_of_cores=sum(nbr_of_cores for _, nbr_of_cores, _, _ in jobs))
+        if finalizer:
+            self._finalizers[group_job_id] = finalizer
+        if cleanup:
+            self._cleanups[group_job_id] = cleanup
+        nothing = [None] * len(jobs)
+        for (cmd, nbr_of_cores, stdout, stderr), size, runtime, job_features in zip(
+                jobs, sizes or nothing, runtimes or nothing, features or nothing):
+            self._start_job(cmd, nbr_of_cores, run_dir, stdout, stderr, parent_job_id=group_job_id,
+                            priority=priority, size=size, runtime=runtime, features=job_features)
+        return group_job_id
+
+    def add_done_job(self, cmd, nbr_of_cores, run_dir):
+        """
+        Record a job which did not have to be run (e.g. since its output was already up to
+        date) as done. Listeners are not told about it, since it never changes state.
+        :return: the job id of the job
+        """
+        return self.job_store.add_job(cmd,
+                                      runfolder=os.path.basename(os.path.normpath(run_dir)),
+                                      run_dir=run_dir,
+                                      nbr_of_cores=nbr_of_cores,
+                                      state=arteria_state.DONE)
+
+    def _start_job(self, cmd, nbr_of_cores, run_dir, stdout, stderr, parent_job_id=None, priority=0, size=None,
+                   runtime=None, features=None):
+        job_id = self.job_store.add_job(cmd,
+                                        runfolder=os.path.basename(os.path.normpath(run_dir)),
+                                        run_dir=run_dir,
+                                        nbr_of_cores=nbr_of_cores,
+                                        stdout=stdout,
+                                        stderr=stderr,
+                                        parent_job_id=parent_job_id)
+        if features is not None:
+            self.job_store.add_job_features(job_id, features, runtime)
+        runner_job_id = self.job_runner.start(cmd, nbr_of_cores, run_dir, stdout=stdout, stderr=stderr,
+                                              priority=priority, size=size, runtime=runtime)
+        if is_future(runner_job_id):
+            # The job stays pending in the store until the job runner has started it.
+            self._submissions[job_id] = runner_job_id
+            IOLoop.current().add_future(runner_job_id, partial(self._on_submitted, job_id))
+            return job_id
+        if runner_job_id is None:
+            self._set_state(job_id, arteria_state.ERROR)
+            return None
+        self._track(job_id, runner_job_id)
+        return job_id
+
+    def _track(self, job_id, runner_job_id):
+        self._runner_job_ids[job_id] = runner_job_id
+        self._store_job_ids[runner_job_id] = job_id
+        self.job_store.set_runner_job_id(job_id, runner_job_id)
+
+    def _on_submitted(self, job_id, future):
+        """
+        Record the runner job id of a job once the job runner has started it, or mark the job
+        as an error if it could not be started. This does nothing if it has already been recorded.
+        """
+        if self._submissions.pop(job_id, None) is None:
+            return
+        try:
+            runner_job_id = future.result()
+        except Exception as e:
+            log.error("Failed to start job {}: {}".format(job_id, e))
+            runner_job_id = None
+        if runner_job_id is None:
+            self._set_state(job_id, arteria_state.ERROR)
+        else:
+            self._track(job_id, runner_job_id)
+
+    @gen.coroutine
+    def stop(self, job_id):
+        """
+        See `JobRunnerAdapter.stop`. Jobs which are still being started are stopped once they
+        have been started.
+        :return: a future of the job id of the stopped job (None if not found)
+        """
+        job_id = int(job_id)
+        child_jobs = self.job_store.child_jobs(job_id)
+        if child_jobs:
+            stopped = yield [self.stop(child_job["job_id"]) for child_job in child_jobs
+                             if child_job["state"] not in JobStore.FINISHED_STATES]
+            raise gen.Return(job_id if any(stopped) else None)
+
+        submission = self._submissions.get(job_id)
+        if submission is not None:
+            yield submission
+            self._on_submitted(job_id, submission)
+        runner_job_id = self._runner_job_ids.get(job_id)
+        if runner_job_id is None:
+            raise gen.Return(None)
+        stopped = self.job_runner.stop(runner_job_id)
+        if is_future(stopped):
+            stopped = yield stopped
+        if stopped is None:
+            raise gen.Return(None)
+        self._set_state(job_id, arteria_state.CANCELLED)
+        raise gen.Return(job_id)
+
+    @gen.coroutine
+    def stop_all(self):
+        """
+        See `JobRunnerAdapter.stop_all`.
+        :return: a future which is resolved once all jobs have been stopped
+        """
+        submissions = dict(self._submissions)
+        if submissions:
+            yield list(submissions.values())
+            for job_id, submission in submissions.items():
+                self._on_submitted(job_id, submission)
+        stopped = self.job_runner.stop_all()
+        if is_future(stopped):
+            yield stopped
+        for job in self.job_store.unfinished_jobs():
+            if job["job_id"] in self._runner_job_ids:
+                self._set_state(job["job_id"], arteria_state.CANCELLED)
+
+    def status(self, job_id):
+        return self.job_store.state(int(job_id)) or arteria_state.NONE
+
+    def queue_status(self):
+        """
+        Get the position in the queue of the jobs waiting to run, and when they are expected to
+        start, if the wrapped job runner can tell. A group is placed where the first of its jobs
+        is, and is expected to start when that job is.
+        :return: a dict with the job id as key, and a dict with the `queue_position` and the
+                 `expected_start` time (None if not known) as value
+        """
+        if not hasattr(self.job_runner, "queue_status"):
+            return {}
+        queue_status = {}
+        for runner_job_id, status in self.job_runner.queue_status().items():
+            job_id = self._store_job_ids.get(runner_job_id)
+            if job_id is None:
+                continue
+            queue_status[job_id] = status
+            parent_job_id = self.job_store.get_job(job_id)["parent_job_id"]
+            if parent_job_id is not None:
+                group_status = queue_status.get(parent_job_id)
+                if group_status is None or status["queue_position"] < group_status["queue_position"]:
+                    queue_status[parent_job_id] = status
+        return queue_status
+
+    def pid(self, job_id):
+        """
+        :return: the pid of the process running the job, or None if the job is not running, or
+                 the wrapped job runner can not tell (e.g. since it runs the jobs on other hosts)
+        """
+        runner_job_id = self._runner_job_ids.get(int(job_id))
+        if runner_job_id is None or not hasattr(self.job_runner, "pid"):
+            return None
+        return self.job_runner.pid(runner_job_id)
+
+    def status_all(self):
+        return self.job_store.states()
@@ -0,0 +1,279 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from arteria.web.state import State
+
+log = logging.getLogger(__name__)
+
+
+class JobStore:
+    """
+    Persists jobs, and the transitions between their states, in a SQLite database, so
+    that they survive restarts of the service. The database is run in WAL mode, so that
+    reads are not blocked by writes.
+    """
+
+    FINISHED_STATES = (State.DONE, State.ERROR, State.CANCELLED)
+    UNFINISHED_STATES = (State.NONE, State.PENDING, State.READY, State.STARTED)
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cmd TEXT NOT NULL,
+            runfolder TEXT,
+            run_dir TEXT,
+            nbr_of_cores INTEGER,
+            stdout TEXT,
+            stderr TEXT,
+            state TEXT NOT NULL,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+        CREATE INDEX IF NOT EXISTS jobs_runfolder ON jobs (runfolder);
+
+        CREATE TABLE IF NOT EXISTS job_state_transitions (
+            job_id INTEGER NOT NULL REFERENCES jobs (job_id),
+            state TEXT NOT NULL,
+            timestamp REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS job_state_transitions_job_id ON job_state_transitions (job_id);
+
+        CREATE TABLE IF NOT EXISTS job_resource_samples (
+            job_id INTEGER NOT NULL REFERENCES jobs (job_id),
+            timestamp REAL NOT NULL,
+            cpu_seconds REAL,
+            rss_bytes INTEGER,
+            read_bytes INTEGER,
+            write_bytes INTEGER,
+            output_bytes INTEGER,
+            nbr_of_processes INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS job_resource_samples_job_id ON job_resource_samples (job_id);
+
+        CREATE TABLE IF NOT EXISTS job_features (
+            job_id INTEGER PRIMARY KEY REFERENCES jobs (job_id),
+            machine_type TEXT,
+            nbr_of_lanes INTEGER,
+            nbr_of_tiles INTEGER,
+            nbr_of_cycles INTEGER,
+            nbr_of_samples INTEGER,
+            nbr_of_cores INTEGER,
+            predicted_runtime REAL
+        );
+    """
+
+    # The values of each resource sample of a job.
+    RESOURCE_SAMPLE_KEYS = ("cpu_seconds", "rss_bytes", "read_bytes", "write_bytes", "output_bytes", "nbr_of_processes")
+
+    # The features of a job its runtime is predicted from, see `runtime_model.FEATURES`.
+    JOB_FEATURE_KEYS = ("machine_type", "nbr_of_lanes", "nbr_of_tiles", "nbr_of_cycles", "nbr_of_samples",
+                        "nbr_of_cores")
+
+    # Columns added to the jobs table after it was first created, with their types. These
+    # are added to existing databases when they are opened.
+    ADDED_COLUMNS = [("parent_job_id", "INTEGER REFERENCES jobs (job_id)"),
+                     ("runner_job_id", "TEXT")]
+
+    def __init__(self, path=":memory:"):
+        """
+        Open (and create if needed) a job store
+        :param path: to the database file, or ":memory:" for a store which is not persisted
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(JobStore.SCHEMA)
+            self._add_missing_columns()
+            self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_parent_job_id ON jobs (parent_job_id)")
+
+    def _add_missing_columns(self):
+        existing_columns = [row[1] for row in self._connection.execute("PRAGMA table_info(jobs)").fetchall()]
+        for column, column_type in JobStore.ADDED_COLUMNS:
+            if column not in existing_columns:
+                log.info("Adding column {} to the jobs table in {}".format(column, self.path))
+                self._connection.execute("ALTER TABLE jobs ADD COLUMN {} {}".format(column, column_type))
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(sql, parameters).fetchall()]
+
+    def add_job(self, cmd, runfolder, run_dir, nbr_of_cores, stdout=None, stderr=None, state=State.PENDING,
+                parent_job_id=None):
+        """
+        Add a new job
+        :param state: of the new job. A job added in a finished state is finished when it is added.
+        :param parent_job_id: of the job this job is a part of, if any
+        :return: the job id of the new job
+        """
+        now = time.time()
+        finished = now if state in JobStore.FINISHED_STATES else None
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (cmd, runfolder, run_dir, nbr_of_cores, stdout, stderr, state, created, "
+                "finished, parent_job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cmd, runfolder, run_dir, nbr_of_cores, stdout, stderr, state, now, finished, parent_job_id))
+            job_id = cursor.lastrowid
+            self._connection.execute(
+                "INSERT INTO job_state_transitions (job_id, state, timestamp) VALUES (?, ?, ?)",
+                (job_id, state, now))
+        return job_id
+
+    def set_state(self, job_id, state, timestamp=None):
+        """
+        Record that a job has moved to a new state. This also sets the time the job
+        started or finished, when that is what the transition means.
+        :param job_id: of the job
+        :param state: the job moved to
+        :param timestamp: of the transition (defaults to now)
+        """
+        timestamp = timestamp or time.time()
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET state = ? WHERE job_id = ?", (state, job_id))
+            if state == State.STARTED:
+                self._connection.execute("UPDATE jobs SET started = ? WHERE job_id = ? AND started IS NULL",
+                                         (timestamp, job_id))
+            elif state in JobStore.FINISHED_STATES:
+                self._connection.execute("UPDATE jobs SET finished = ? WHERE job_id = ?", (timestamp, job_id))
+            self._connection.execute(
+                "INSERT INTO job_state_transitions (job_id, state, timestamp) VALUES (?, ?, ?)",
+                (job_id, state, timestamp))
+
+    def set_runner_job_id(self, job_id, runner_job_id):
+        """
+        Record the id the job runner knows a job by (e.g. the job id in a batch scheduler), so
+        that the job can be followed again after a restart
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET runner_job_id = ? WHERE job_id = ?",
+                                     (str(runner_job_id), job_id))
+
+    def get_job(self, job_id):
+        """
+        :return: a dict with all information about the job, or None if there is no such job
+        """
+        jobs = self._query("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def state(self, job_id):
+        """
+        :return: the state of the job, or None if there is no such job
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def states(self):
+        """
+        :return: a dict of job id as key and state as value, for all jobs
+        """
+        with self._lock:
+            return dict(self._connection.execute("SELECT job_id, state FROM jobs").fetchall())
+
+    def jobs_in_states(self, states):
+        """
+        :param states: the states to get jobs for
+        :return: all jobs in any of the states, as a list of dicts
+        """
+        placeholders = ", ".join("?" * len(states))
+        return self._query("SELECT * FROM jobs WHERE state IN ({}) ORDER BY job_id".format(placeholders),
+                           tuple(states))
+
+    def leaf_jobs_in_states(self, states):
+        """
+        :param states: the states to get jobs for
+        :return: all jobs in any of the states, which are not split into other jobs, as a list of dicts
+        """
+        placeholders = ", ".join("?" * len(states))
+        return self._query("SELECT * FROM jobs WHERE state IN ({}) AND NOT EXISTS "
+                           "(SELECT 1 FROM jobs AS child_jobs WHERE child_jobs.parent_job_id = jobs.job_id) "
+                           "ORDER BY job_id".format(placeholders),
+                           tuple(states))
+
+    def unfinished_jobs(self):
+        return self.jobs_in_states(JobStore.UNFINISHED_STATES)
+
+    def jobs_for_runfolder(self, runfolder):
+        """
+        :return: all jobs for the runfolder, as a list of dicts, the latest job first
+        """
+        return self._query("SELECT * FROM jobs WHERE runfolder = ? ORDER BY job_id DESC", (runfolder,))
+
+    def child_jobs(self, parent_job_id):
+        """
+        :return: the jobs which are part of the parent job, as a list of dicts
+        """
+        return self._query("SELECT * FROM jobs WHERE parent_job_id = ? ORDER BY job_id", (parent_job_id,))
+
+    def transitions(self, job_id):
+        """
+        :return: the state transitions of a job, as a list of (state, timestamp) tuples
+        """
+        with self._lock:
+            return [tuple(row) for row in self._connection.execute(
+                "SELECT state, timestamp FROM job_state_transitions WHERE job_id = ? ORDER BY rowid",
+                (job_id,)).fetchall()]
+
+    def add_resource_sample(self, job_id, sample, timestamp=None):
+        """
+        Record a sample of the resources used by a job
+        :param sample: a dict with the cpu_seconds, rss_bytes, read_bytes, write_bytes, output_bytes
+                       and nbr_of_processes of the job (missing values are stored as null)
+        :param timestamp: of the sample (defaults to now)
+        """
+        timestamp = timestamp or time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO job_resource_samples (job_id, timestamp, cpu_seconds, rss_bytes, read_bytes, "
+                "write_bytes, output_bytes, nbr_of_processes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, timestamp) + tuple(sample.get(key) for key in JobStore.RESOURCE_SAMPLE_KEYS))
+
+    def resource_samples(self, job_id):
+        """
+        :return: the resource samples of a job, as a list of dicts, the oldest first
+        """
+        return self._query("SELECT timestamp, {} FROM job_resource_samples WHERE job_id = ? ORDER BY rowid".format(
+            ", ".join(JobStore.RESOURCE_SAMPLE_KEYS)), (job_id,))
+
+    def add_job_features(self, job_id, features, predicted_runtime=None):
+        """
+        Record the features of a job its runtime is predicted from, and the runtime predicted
+        :param features: a dict with the `JOB_FEATURE_KEYS` (missing values are stored as null)
+        :param predicted_runtime: in seconds (None if not predicted)
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO job_features (job_id, {}, predicted_runtime) VALUES (?, {}, ?)".format(
+                    ", ".join(JobStore.JOB_FEATURE_KEYS), ", ".join("?" * len(JobStore.JOB_FEATURE_KEYS))),
+                (job_id,) + tuple(features.get(key) for key in JobStore.JOB_FEATURE_KEYS) + (predicted_runtime,))
+
+    def predicted_runtimes(self, job_ids):
+        """
+        :return: a dict with the job id as key and the predicted runtime as value, for the jobs
+                 (of `job_ids`) which have a predicted runtime
+        """
+        placeholders = ", ".join("?" * len(job_ids))
+        with self._lock:
+            return dict(self._connection.execute(
+                "SELECT job_id, predicted_runtime FROM job_features WHERE job_id IN ({}) "
+                "AND predicted_runtime IS NOT NULL".format(placeholders), tuple(job_ids)).fetchall())
+
+    def job_history(self, limit):
+        """
+        :param limit: the maximum number of jobs to return
+        :return: the features and wall time (in seconds) of the jobs which have finished successfully,
+                 as a list of dicts, the latest finished first
+        """
+        return self._query("SELECT job_features.job_id, {}, jobs.finished - jobs.started AS wall_time "
+                           "FROM job_features JOIN jobs ON jobs.job_id = job_features.job_id "
+                           "WHERE jobs.state = ? AND jobs.started IS NOT NULL AND jobs.finished IS NOT NULL "
+                           "ORDER BY jobs.finished DESC LIMIT ?".format(
+                               ", ".join("job_features." + key for key in JobStore.JOB_FEATURE_KEYS)),
+                           (State.DONE, limit))
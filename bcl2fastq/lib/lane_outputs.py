@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import shutil
+
+log = logging.getLogger(__name__)
+
+# Name of the directory in the output directory where the output of each lane is
+# placed, when running bcl2fastq split by lane.
+LANES_DIR_NAME = "Lanes"
+
+# The lists in Stats.json which have one entry per lane.
+STATS_PER_LANE_KEYS = ("ConversionResults", "ReadInfosForLanes", "UnknownBarcodes")
+
+
+def _lane_of(entry):
+    return entry.get("LaneNumber", entry.get("Lane", 0))
+
+
+def merge_stats(stats_list):
+    """
+    Merge the Stats.json content of several runs of bcl2fastq on the same flowcell, each
+    run on a different lane, into the Stats.json content of a single run.
+    :param stats_list: list of parsed Stats.json files
+    :return: the merged stats as a dict
+    """
+    if not stats_list:
+        return {}
+
+    merged = dict(stats_list[0])
+    for key in STATS_PER_LANE_KEYS:
+        entries = []
+        for stats in stats_list:
+            entries.extend(stats.get(key, []))
+        merged[key] = sorted(entries, key=_lane_of)
+    return merged
+
+
+def merge_lane_outputs(lane_outputs, output):
+    """
+    Merge the statistics and reports of bcl2fastq runs which were done one lane at the time.
+    The `Stats/Stats.json` files of the lanes are merged into `<output>/Stats/Stats.json`.
+    All other files in the `Stats` and `Reports` directories of each lane are copied into
+    `<output>/Stats/<lane>` and `<output>/Reports/<lane>`. The output of the lanes is left
+    as it is, so that the merge can be redone if a lane is rerun.
+    :param lane_outputs: the output directories of the lanes
+    :param output: the output directory to write the merged statistics and reports to
+    """
+    stats_dir = os.path.join(output, "Stats")
+    reports_dir = os.path.join(output, "Reports")
+    for merged_dir in [stats_dir, reports_dir]:
+        shutil.rmtree(merged_dir, ignore_errors=True)
+        os.makedirs(merged_dir)
+
+    stats_list = []
+    for lane_output in lane_outputs:
+        lane_name = os.path.basename(lane_output)
+        lane_stats_dir = os.path.join(lane_output, "Stats")
+        lane_reports_dir = os.path.join(lane_output, "Reports")
+
+        stats_file = os.path.join(lane_stats_dir, "Stats.json")
+        if os.path.exists(stats_file):
+            with open(stats_file) as f:
+                stats_list.append(json.load(f))
+        else:
+            log.warning("Found no Stats.json for {}".format(lane_output))
+
+        if os.path.isdir(lane_stats_dir):
+            shutil.copytree(lane_stats_dir, os.path.join(stats_dir, lane_name),
+                            ignore=shutil.ignore_patterns("Stats.json"))
+        if os.path.isdir(lane_reports_dir):
+            shutil.copytree(lane_reports_dir, os.path.join(reports_dir, lane_name))
+
+    # Write to a temporary file first, so that a half written Stats.json is never seen.
+    merged_stats_file = os.path.join(stats_dir, "Stats.json")
+    with open(merged_stats_file + ".tmp", "w") as f:
+        json.dump(merge_stats(stats_list), f, indent=2)
+    os.rename(merged_stats_file + ".tmp", merged_stats_file)
+    log.info("Merged the statistics of {} lanes into {}".format(len(lane_outputs), output))
@@ -0,0 +1,243 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from bcl2fastq.lib.bcl2fastq_logs import INDEX_SUFFIX, log_file_size, open_log_file
+
+log = logging.getLogger(__name__)
+
+ERROR = "error"
+WARNING = "warning"
+PHASE = "phase"
+
+# The kinds of indexed lines included when searching for each severity.
+SEVERITIES = {ERROR: (ERROR,), WARNING: (ERROR, WARNING)}
+
+ERROR_PATTERN = re.compile(r"\b(?:ERROR|FATAL|CRITICAL)\b|\b[Ee]rror:")
+WARNING_PATTERN = re.compile(r"\bWARN(?:ING)?\b|\b[Ww]arning:")
+
+# Lines marking the start of the phases of a bcl2fastq run. Only the first line of each phase is indexed.
+PHASE_PATTERNS = [("started", re.compile(r"\bbcl2fastq v\d")),
+                  ("conversion", re.compile(r"Conversion starting|Created \d+ .*threads")),
+                  ("demultiplexing", re.compile(r"\bDemultiplexing\b")),
+                  ("writing", re.compile(r"Writing FASTQ")),
+                  ("completed", re.compile(r"Processing completed"))]
+
+
+def classify_line(line):
+    """
+    :return: the kind (ERROR, WARNING or PHASE) of a log line, and the phase it starts (or None),
+             or (None, None) if the line is not one to index
+    """
+    if ERROR_PATTERN.search(line):
+        return ERROR, None
+    if WARNING_PATTERN.search(line):
+        return WARNING, None
+    for phase, pattern in PHASE_PATTERNS:
+        if pattern.search(line):
+            return PHASE, phase
+    return None, None
+
+
+class LogIndex:
+    """
+    An index of the errors, warnings and phase markers in a log, kept in a sidecar file
+    (`<log>.idx`) next to the log. Each entry holds the byte offset and length of the line,
+    so that the lines can be read with a seek each, instead of reading the whole log. The
+    index is updated incrementally, i.e. only the part of the log written since the last
+    update is read. If the log has been replaced (e.g. by a new run), it is indexed again.
+    """
+
+    VERSION = 1
+
+    # Number of bytes at the start of the log used to tell if the log has been replaced.
+    HEAD_SIZE = 4096
+
+    # Number of bytes read from the log at the time.
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.index_path = log_path + INDEX_SUFFIX
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.indexed_size = 0
+        self.nbr_of_lines = 0
+        self.head_size = 0
+        self.head_hash = None
+        # Entries are lists of [offset, length, line number, kind, phase].
+        self.entries = []
+        self.phases = set()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if content.get("version") != self.VERSION:
+            return
+        self.indexed_size = content["indexed_size"]
+        self.nbr_of_lines = content["nbr_of_lines"]
+        self.head_size = content["head_size"]
+        self.head_hash = content["head_hash"]
+        self.entries = content["entries"]
+        self.phases = set(entry[4] for entry in self.entries if entry[4])
+
+    def _save(self):
+        content = {"version": self.VERSION,
+                   "indexed_size": self.indexed_size,
+                   "nbr_of_lines": self.nbr_of_lines,
+                   "head_size": self.head_size,
+                   "head_hash": self.head_hash,
+                   "entries": self.entries}
+        try:
+            # Write to a temporary file first, so that a half written index is never seen.
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump(content, f)
+            os.rename(self.index_path + ".tmp", self.index_path)
+        except (IOError, OSError) as e:
+            log.warning("Could not write the index of {}: {}".format(self.log_path, e))
+
+    def _head_hash(self, size):
+        with open_log_file(self.log_path) as f:
+            return hashlib.sha1(f.read(size)).hexdigest()
+
+    def update(self):
+        """
+        Index whatever has been added to the log since the last update.
+        :raises: IOError/OSError if the log can not be read
+        """
+        size = log_file_size(self.log_path)
+        if size < self.indexed_size or (self.head_size and self._head_hash(self.head_size) != self.head_hash):
+            log.debug("{} has been replaced, so it is indexed again".format(self.log_path))
+            self._reset()
+        if size == self.indexed_size:
+            return
+
+        with open_log_file(self.log_path) as f:
+            f.seek(self.indexed_size)
+            position = self.indexed_size
+            partial_line = b""
+            while position < size:
+                chunk = f.read(min(self.CHUNK_SIZE, size - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                lines = (partial_line + chunk).split(b"\n")
+                # The last line is kept until it is complete.
+                partial_line = lines.pop()
+                for line in lines:
+                    self._index_line(line)
+
+        if self.head_size < self.HEAD_SIZE:
+            self.head_size = min(self.HEAD_SIZE, self.indexed_size)
+            self.head_hash = self._head_hash(self.head_size)
+        self._save()
+
+    def _index_line(self, line):
+        kind, phase = classify_line(line.decode("utf-8", "replace"))
+        if kind == PHASE and phase in self.phases:
+            kind = None
+        if kind:
+            self.entries.append([self.indexed_size, len(line), self.nbr_of_lines + 1, kind, phase])
+            if phase:
+                self.phases.add(phase)
+        self.indexed_size += len(line) + 1
+        self.nbr_of_lines += 1
+
+    def read_entries(self, entries):
+        """
+        Read the lines of index entries from the log, seeking to each of them.
+        :param entries: to read the lines of, in the order of the log
+        :return: a generator of (entry, line) tuples
+        """
+        with open_log_file(self.log_path) as f:
+            for entry in entries:
+                f.seek(entry[0])
+                yield entry, f.read(entry[1]).decode("utf-8", "replace")
+
+
+class LogSearcher:
+    """
+    Searches logs for errors, warnings and phase markers using their indexes, and for lines
+    matching a regular expression. A regular expression on its own has to be matched against
+    every line of the logs, but combined with a severity (or phases) only the indexed lines
+    are read and matched.
+    """
+
+    DEFAULT_LIMIT = 1000
+
+    def __init__(self):
+        # Indexes being updated, so that the same log is not indexed by several threads at once.
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock_for(self, log_path):
+        with self._locks_lock:
+            return self._locks.setdefault(log_path, threading.Lock())
+
+    @staticmethod
+    def _indexed_hits(log_path, kinds, phases, regex):
+        index = LogIndex(log_path)
+        index.update()
+        entries = [entry for entry in index.entries if entry[3] in kinds or (phases and entry[3] == PHASE)]
+        for entry, line in index.read_entries(entries):
+            if regex is None or regex.search(line):
+                yield {"line_number": entry[2], "offset": entry[0], "kind": entry[3], "phase": entry[4],
+                       "line": line}
+
+    @staticmethod
+    def _scanned_hits(log_path, regex):
+        offset = 0
+        with open_log_file(log_path) as f:
+            for line_number, line in enumerate(f, 1):
+                text = line.rstrip(b"\n").decode("utf-8", "replace")
+                if regex.search(text):
+                    kind, phase = classify_line(text)
+                    yield {"line_number": line_number, "offset": offset, "kind": kind, "phase": phase,
+                           "line": text}
+                offset += len(line)
+
+    def search(self, log_paths, regex=None, severity=None, phases=False, limit=DEFAULT_LIMIT):
+        """
+        Search logs
+        :param log_paths: the logs to search
+        :param regex: compiled regular expression the lines must match (None to match all lines)
+        :param severity: only lines of at least this severity (ERROR or WARNING, None for any line)
+        :param phases: include the lines marking the start of each phase
+        :param limit: the maximum number of lines to return
+        :return: a dict with the matching lines (`hits`), if the hits were cut off at the limit
+                 (`truncated`) and the number of logs searched
+        """
+        hits = []
+        truncated = False
+        logs_searched = 0
+        use_index = severity is not None or phases
+        for log_path in log_paths:
+            if truncated:
+                break
+            with self._lock_for(log_path):
+                try:
+                    if use_index:
+                        log_hits = LogSearcher._indexed_hits(log_path, SEVERITIES.get(severity, ()), phases, regex)
+                    else:
+                        log_hits = LogSearcher._scanned_hits(log_path, regex)
+                    for hit in log_hits:
+                        if len(hits) >= limit:
+                            truncated = True
+                            break
+                        hit["log"] = os.path.basename(log_path)
+                        hits.append(hit)
+                    logs_searched += 1
+                except (IOError, OSError) as e:
+                    # Logs may be archived or removed while they are searched.
+                    if len(log_paths) == 1 or e.errno != errno.ENOENT:
+                        raise
+        return {"hits": hits, "truncated": truncated, "logs_searched": logs_searched}
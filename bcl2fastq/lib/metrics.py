@@ -0,0 +1,298 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from arteria.web.state import State
+
+log = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(label_value):
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+class Metric(object):
+    """
+    Base class of metrics, which can have labels. The values of a metric are kept per
+    combination of label values.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, description, label_names=()):
+        """
+        Instantiate a Metric
+        :param name: of the metric, e.g. `bcl2fastq_jobs_finished_total`
+        :param description: of the metric, shown as its help text
+        :param label_names: the names of the labels of the metric
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError("{} takes the labels {}, not {}".format(self.name, self.label_names, sorted(labels)))
+        return tuple(labels[name] for name in self.label_names)
+
+    def _samples(self):
+        """
+        :return: the samples of the metric, as a list of (name suffix, label values, extra labels, value)
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def render(self):
+        """
+        :return: the metric in the Prometheus text format, as a list of lines
+        """
+        lines = ["# HELP {} {}".format(self.name, self.description),
+                 "# TYPE {} {}".format(self.name, self.TYPE)]
+        with self._lock:
+            samples = self._samples()
+        for suffix, label_values, extra_labels, value in samples:
+            lines.append("{}{}{} {}".format(self.name, suffix,
+                                            _format_labels(self.label_names, label_values, extra_labels),
+                                            _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """
+    A value which only goes up, e.g. the number of failed jobs.
+    """
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self):
+        return [("", label_values, (), value) for label_values, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value which can go up and down, e.g. the number of queued jobs.
+    """
+
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._label_values(labels))
+
+    def _samples(self):
+        return [("", label_values, (), value) for label_values, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values (e.g. latencies), as counts of observations in
+    cumulative buckets, and the sum and count of all observations.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                                                     1, 2.5, 5, 10)):
+        """
+        Instantiate a Histogram
+        :param buckets: the upper bounds of the buckets (a bucket for everything is added)
+        """
+        super(Histogram, self).__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        label_values = self._label_values(labels)
+        with self._lock:
+            counts, total = self._values.get(label_values, ([0] * len(self.buckets), 0.0))
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[i] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._label_values(labels), ([0] * len(self.buckets), 0.0))
+            return counts[-1]
+
+    def _samples(self):
+        samples = []
+        for label_values, (counts, total) in self._values.items():
+            for upper_bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", label_values, (("le", _format_value(upper_bound)),), count))
+            samples.append(("_sum", label_values, (), total))
+            samples.append(("_count", label_values, (), counts[-1]))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    Keeps a set of metrics, and renders them in the Prometheus text format. Collectors,
+    functions called before the metrics are rendered, can be added to update metrics
+    which are only measured when asked for (e.g. the number of queued jobs).
+    """
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._collectors = []
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError("There already is a metric named {}".format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, label_names=()):
+        return self._add(Counter(name, description, label_names))
+
+    def gauge(self, name, description, label_names=()):
+        return self._add(Gauge(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), **kwargs):
+        return self._add(Histogram(name, description, label_names, **kwargs))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                log.error("Failed collecting metrics: {}".format(e))
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class ServiceMetrics(object):
+    """
+    The metrics of the service: the latency of its handlers, the state of the job queue,
+    the time jobs wait and run (per bcl2fastq version and machine type), and counters of
+    failures.
+    """
+
+    UNKNOWN = "unknown"
+
+    # Jobs may wait and run for hours, so the buckets go from a second up to two days.
+    JOB_TIME_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 16 * 3600, 48 * 3600)
+
+    def __init__(self, runner_service=None):
+        """
+        Instantiate ServiceMetrics
+        :param runner_service: the `JobStoreAdapter` to follow the jobs of (None to not follow any jobs)
+        """
+        self.registry = MetricsRegistry()
+        self.handler_latency = self.registry.histogram(
+            "bcl2fastq_http_request_duration_seconds", "Time taken to handle requests, per route.",
+            ("route", "method", "code"))
+        self.usage_errors = self.registry.counter(
+            "bcl2fastq_usage_errors_total", "Requests which failed because of a usage error, per route.",
+            ("route",))
+        self.start_failures = self.registry.counter(
+            "bcl2fastq_start_failures_total", "Requests to start bcl2fastq which failed, per reason.",
+            ("reason",))
+        self.queue_depth = self.registry.gauge(
+            "bcl2fastq_queue_depth", "Number of jobs waiting to be run.")
+        self.cores_in_use = self.registry.gauge(
+            "bcl2fastq_cores_in_use", "Number of cores claimed by running jobs.")
+        self.jobs_finished = self.registry.counter(
+            "bcl2fastq_jobs_finished_total", "Number of jobs which have finished, per state.",
+            ("state", "bcl2fastq_version", "machine_type"))
+        self.job_wait_time = self.registry.histogram(
+            "bcl2fastq_job_wait_seconds", "Time jobs waited in the queue before they started.",
+            ("bcl2fastq_version", "machine_type"), buckets=self.JOB_TIME_BUCKETS)
+        self.job_run_time = self.registry.histogram(
+            "bcl2fastq_job_run_seconds", "Time jobs ran, from when they started until they finished.",
+            ("bcl2fastq_version", "machine_type", "state"), buckets=self.JOB_TIME_BUCKETS)
+
+        self._job_labels = {}
+        self._job_labels_lock = threading.Lock()
+        self.runner_service = runner_service
+        if runner_service:
+            runner_service.add_listener(self.on_job_state_change)
+            self.registry.add_collector(self.collect_queue)
+
+    def label_job(self, job_id, bcl2fastq_version=None, machine_type=None):
+        """
+        Set the bcl2fastq version and machine type to report the times of a job by
+        """
+        with self._job_labels_lock:
+            self._job_labels[job_id] = {"bcl2fastq_version": bcl2fastq_version or self.UNKNOWN,
+                                        "machine_type": machine_type or self.UNKNOWN}
+
+    def _labels_of(self, job_id, forget=False):
+        with self._job_labels_lock:
+            if forget:
+                labels = self._job_labels.pop(job_id, None)
+            else:
+                labels = self._job_labels.get(job_id)
+        return labels or {"bcl2fastq_version": self.UNKNOWN, "machine_type": self.UNKNOWN}
+
+    def on_job_state_change(self, job, old_state, new_state):
+        """
+        Record the wait and run time of jobs. Only jobs which are not part of another job
+        are recorded, so that the parts of a job split by lane are not counted twice. Jobs which
+        finish without ever being seen as started, e.g. because the scheduler ran them between two
+        polls, have waited in the queue until they finished.
+        """
+        if job["parent_job_id"] is not None:
+            return
+
+        finished = new_state in (State.DONE, State.ERROR, State.CANCELLED)
+        labels = self._labels_of(job["job_id"], forget=finished)
+        if new_state == State.STARTED and job["started"]:
+            self.job_wait_time.observe(max(0, job["started"] - job["created"]), **labels)
+        elif finished:
+            self.jobs_finished.inc(state=new_state, **labels)
+            if old_state == State.PENDING and new_state != State.CANCELLED and \
+                    not job["started"] and job["finished"]:
+                self.job_wait_time.observe(max(0, job["finished"] - job["created"]), **labels)
+            if job["started"] and job["finished"]:
+                self.job_run_time.observe(max(0, job["finished"] - job["started"]), state=new_state, **labels)
+
+    def collect_queue(self):
+        """
+        Measure the job queue, from the jobs in the job store.
+        """
+        job_store = self.runner_service.job_store
+        self.queue_depth.set(len(job_store.leaf_jobs_in_states([State.PENDING])))
+        self.cores_in_use.set(sum(job["nbr_of_cores"] or 0
+                                  for job in job_store.leaf_jobs_in_states([State.STARTED])))
+
+    def render(self):
+        return self.registry.render()
@@ -0,0 +1,272 @@
+import errno
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Limits how often an operation can be done, shared between threads.
+    """
+
+    def __init__(self, max_per_second=None):
+        """
+        Instantiate a RateLimiter
+        :param max_per_second: maximum number of operations per second (None for no limit)
+        """
+        self.interval = 1.0 / max_per_second if max_per_second else 0
+        self._next_slot = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Wait until it is time for the next operation.
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class OutputReaper:
+    """
+    Deletes old output directories in the background. Output directories are first
+    atomically renamed into a trash directory next to them (i.e. in the same allowed
+    output folder, and thus on the same file system), so that removing an output directory
+    returns immediately. The trashed directories are then deleted one at the time by a
+    background thread, which deletes the files of each directory in parallel. Directories
+    waiting to be deleted are sized in the background as they are scheduled, so that it is
+    known how much space is left to reclaim.
+    """
+
+    TRASH_DIR_NAME = ".bcl2fastq_trash"
+
+    # Number of files to delete in each batch handed to the worker threads.
+    BATCH_SIZE = 100
+
+    # Number of errors to keep around for the status.
+    MAX_ERRORS = 20
+
+    def __init__(self, nbr_of_threads=4, max_deletions_per_second=None):
+        """
+        Instantiate a OutputReaper, and start its background thread.
+        :param nbr_of_threads: number of threads used for deleting files
+        :param max_deletions_per_second: maximum number of files and directories to delete per second
+                                         (None for no limit), to avoid overloading the file system.
+        """
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=nbr_of_threads)
+        self._rate_limiter = RateLimiter(max_deletions_per_second)
+        self._lock = threading.Lock()
+
+        self._pending = []
+        self._current = None
+        self._current_bytes = 0
+        self._pending_bytes = {}
+        self._bytes_reclaimed = 0
+        self._files_deleted = 0
+        self._errors = []
+
+        self._thread = threading.Thread(target=self._run, name="output-reaper")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def trash_dir_for(path):
+        """
+        :param path: to get the trash directory for
+        :return: the trash directory next to path
+        """
+        return os.path.join(os.path.dirname(os.path.abspath(path)), OutputReaper.TRASH_DIR_NAME)
+
+    @staticmethod
+    def is_in_trash(path):
+        """
+        :return: True if path is a trash directory, or inside one
+        """
+        return OutputReaper.TRASH_DIR_NAME in os.path.abspath(path).split(os.sep)
+
+    @staticmethod
+    def move_to_trash(path, trash_root=None):
+        """
+        Atomically move a directory into a trash directory.
+        :param path: to move to the trash
+        :param trash_root: the folder whose trash directory to move path into, which must be on the
+                           same file system as path, and should be one of the folders `resume` is
+                           given (by default the directory of path)
+        :return: the path of the directory in the trash, or None if there was nothing to move
+        """
+        if not os.path.lexists(path):
+            return None
+
+        if trash_root:
+            trash_dir = os.path.join(os.path.abspath(trash_root), OutputReaper.TRASH_DIR_NAME)
+        else:
+            trash_dir = OutputReaper.trash_dir_for(path)
+        try:
+            os.mkdir(trash_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        trash_path = os.path.join(trash_dir, "{}.{}.{}".format(os.path.basename(os.path.abspath(path)),
+                                                                time.strftime("%Y%m%d-%H%M%S"),
+                                                                uuid.uuid4().hex[:8]))
+        try:
+            os.rename(path, trash_path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        log.info("Moved {} to {}, it will be deleted in the background.".format(path, trash_path))
+        return trash_path
+
+    def schedule(self, trash_path):
+        """
+        Schedule a directory in the trash to be deleted.
+        :param trash_path: the path of the directory in the trash
+        """
+        with self._lock:
+            self._pending.append(trash_path)
+        self._queue.put(trash_path)
+        self._executor.submit(self._size_pending, trash_path)
+
+    def resume(self, output_folders):
+        """
+        Schedule anything left in the trash directories of the output folders, e.g. from before
+        the service was restarted.
+        :param output_folders: folders to look for trash directories in (i.e. the folders output
+                               is trashed into, see `move_to_trash`)
+        """
+        for output_folder in output_folders:
+            trash_dir = os.path.join(output_folder, OutputReaper.TRASH_DIR_NAME)
+            if not os.path.isdir(trash_dir):
+                continue
+            for name in sorted(os.listdir(trash_dir)):
+                log.info("Found {} in trash, will delete it.".format(name))
+                self.schedule(os.path.join(trash_dir, name))
+
+    def status(self):
+        """
+        :return: a dict describing what the reaper is doing, and has done.
+        """
+        with self._lock:
+            pending = list(self._pending)
+            return {"current": self._current,
+                    "pending": pending,
+                    "reclaimable_bytes": self._current_bytes + sum(self._pending_bytes.values()),
+                    "bytes_reclaimed": self._bytes_reclaimed,
+                    "files_deleted": self._files_deleted,
+                    "errors": list(self._errors)}
+
+    def _record_error(self, path, error):
+        log.error("Failed to delete {}: {}".format(path, error))
+        with self._lock:
+            self._errors.append("{}: {}".format(path, error))
+            del self._errors[:-OutputReaper.MAX_ERRORS]
+
+    def _delete_files(self, paths_and_sizes):
+        for path, size in paths_and_sizes:
+            self._rate_limiter.wait()
+            try:
+                os.unlink(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    self._record_error(path, e)
+                continue
+            with self._lock:
+                self._current_bytes -= size
+                self._bytes_reclaimed += size
+                self._files_deleted += 1
+
+    @staticmethod
+    def _files_in(directory, names):
+        """
+        Find the entries of a directory which should be unlinked (i.e. everything but real
+        directories), together with their sizes.
+        """
+        files = []
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size))
+        return files
+
+    def _size_of(self, path):
+        total = 0
+        for directory, dir_names, file_names in os.walk(path):
+            symlinked_dirs = [name for name in dir_names if os.path.islink(os.path.join(directory, name))]
+            total += sum(size for _, size in OutputReaper._files_in(directory, file_names + symlinked_dirs))
+        return total
+
+    def _size_pending(self, path):
+        size = self._size_of(path)
+        with self._lock:
+            # The directory may already be (or have been) deleted, and is then counted in `_current_bytes`.
+            if path in self._pending and path != self._current:
+                self._pending_bytes[path] = size
+
+    def _reap(self, path):
+        with self._lock:
+            self._current_bytes = 0
+        size = self._size_of(path)
+        with self._lock:
+            self._current_bytes = size
+        log.info("Deleting {} ({} bytes).".format(path, size))
+
+        # Walk bottom up, so that each directory is empty once its files have been deleted.
+        for directory, dir_names, file_names in os.walk(path, topdown=False):
+            symlinked_dirs = [name for name in dir_names if os.path.islink(os.path.join(directory, name))]
+            files = OutputReaper._files_in(directory, file_names + symlinked_dirs)
+            batches = [files[i:i + OutputReaper.BATCH_SIZE] for i in range(0, len(files), OutputReaper.BATCH_SIZE)]
+            for future in [self._executor.submit(self._delete_files, batch) for batch in batches]:
+                future.result()
+            self._rate_limiter.wait()
+            try:
+                os.rmdir(directory)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    self._record_error(directory, e)
+
+        # Clean up anything that could not be removed above (e.g. if the path was not a directory).
+        if os.path.lexists(path):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.unlink(path)
+        log.info("Finished deleting {}.".format(path))
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            with self._lock:
+                self._current = path
+                self._pending_bytes.pop(path, None)
+            try:
+                self._reap(path)
+            except Exception as e:
+                self._record_error(path, e)
+            finally:
+                with self._lock:
+                    self._current = None
+                    self._current_bytes = 0
+                    self._pending.remove(path)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# The files of a runfolder which decide what bcl2fastq will be run with.
+PLAN_INPUT_FILES = ("SampleSheet.csv", "RunInfo.xml", "RunParameters.xml", "runParameters.xml")
+
+# Parameters which only decide how a job is started, not what is run, so that a start
+# with any of them still uses the plan made without them.
+START_ONLY_PARAMETERS = ("force", "priority")
+
+
+def plan_key(runfolder_input, request_data, environment=None):
+    """
+    Make a key for the plan of a runfolder, from the content of the samplesheet, RunInfo.xml and
+    RunParameters.xml of the runfolder, the parameters of the request (except `START_ONLY_PARAMETERS`)
+    and anything else the command of the plan is made from. The key changes as soon as any of
+    these change, but not if a file is only touched.
+    :param runfolder_input: path to the runfolder
+    :param request_data: the parameters of the request, as a dict
+    :param environment: anything else the plan depends on (e.g. the bcl2fastq binaries and the
+                        thread profiles), which must be serializable as json
+    :return: the key, as a hex string
+    """
+    plan_parameters = dict((key, value) for key, value in request_data.items() if key not in START_ONLY_PARAMETERS)
+    content_hash = hashlib.sha1()
+    content_hash.update(os.path.abspath(runfolder_input).encode("utf-8"))
+    content_hash.update(json.dumps(plan_parameters, sort_keys=True).encode("utf-8"))
+    content_hash.update(json.dumps(environment, sort_keys=True).encode("utf-8"))
+    for file_name in PLAN_INPUT_FILES:
+        path = os.path.join(runfolder_input, file_name)
+        content_hash.update(file_name.encode("utf-8"))
+        if not os.path.exists(path):
+            content_hash.update(b"\0")
+            continue
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+class PlanCache:
+    """
+    A least recently used cache of the plans made for runfolders, keyed by `plan_key`, so that
+    a start following a plan does not have to make the plan again.
+    """
+
+    # Maximum number of plans to keep.
+    CACHE_SIZE = 128
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the plan with the key, or None if there is no such plan
+        """
+        with self._lock:
+            plan = self._plans.pop(key, None)
+            if plan is not None:
+                self._plans[key] = plan
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans.pop(key, None)
+            self._plans[key] = plan
+            while len(self._plans) > self.size:
+                self._plans.popitem(last=False)
@@ -0,0 +1,202 @@
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class LogProgress:
+    """
+    Follows the progress of a bcl2fastq run by reading its log incrementally. Only the part
+    of the log written since the last update is read, and the tiles mentioned in it are
+    counted (each tile once).
+    """
+
+    # Number of bytes read from the log at the time.
+    CHUNK_SIZE = 64 * 1024
+
+    # Patterns of log lines mentioning a tile, with the lane and tile as named groups.
+    TILE_PATTERNS = [re.compile(r"lane\W+(?P<lane>\d+)\W+tile\W+(?P<tile>\d+)", re.IGNORECASE),
+                     re.compile(r"tile\W+(?P<tile>\d+)\W+(?:of\W+)?\(?lane\W+(?P<lane>\d+)", re.IGNORECASE)]
+
+    TIMESTAMP_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+
+    def __init__(self, log_path, total_tiles=None):
+        """
+        Instantiate a LogProgress
+        :param log_path: the log of the bcl2fastq run
+        :param total_tiles: the number of tiles the run will process (None if unknown)
+        """
+        self.log_path = log_path
+        self.total_tiles = total_tiles
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self._partial_line = b""
+        self.tiles = set()
+        self.first_timestamp = None
+        self.last_tile_timestamp = None
+
+    @staticmethod
+    def _parse_timestamp(line):
+        match = LogProgress.TIMESTAMP_PATTERN.match(line)
+        if not match:
+            return None
+        # The log timestamps are in local time.
+        return time.mktime(time.strptime(match.group(1), "%Y-%m-%d %H:%M:%S"))
+
+    def _parse_line(self, line):
+        timestamp = LogProgress._parse_timestamp(line)
+        if timestamp and self.first_timestamp is None:
+            self.first_timestamp = timestamp
+
+        for pattern in LogProgress.TILE_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                self.tiles.add((int(match.group("lane")), int(match.group("tile"))))
+                if timestamp:
+                    self.last_tile_timestamp = timestamp
+                return
+
+    def update(self):
+        """
+        Read whatever has been added to the log since the last update.
+        """
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            return
+
+        # The log has been replaced (e.g. by a new run), so start over.
+        if size < self.offset:
+            self._reset()
+
+        with open(self.log_path, "rb") as f:
+            f.seek(self.offset)
+            while self.offset < size:
+                chunk = f.read(min(LogProgress.CHUNK_SIZE, size - self.offset))
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                lines = (self._partial_line + chunk).split(b"\n")
+                # The last line is kept until it is complete.
+                self._partial_line = lines.pop()
+                for line in lines:
+                    self._parse_line(line.decode("utf-8", "replace"))
+
+    @property
+    def tiles_per_minute(self):
+        if not self.tiles or self.first_timestamp is None or self.last_tile_timestamp is None:
+            return None
+        elapsed = self.last_tile_timestamp - self.first_timestamp
+        if elapsed <= 0:
+            return None
+        return len(self.tiles) / elapsed * 60
+
+    def as_dict(self):
+        """
+        :return: a dict describing the progress of the run
+        """
+        tiles_processed = len(self.tiles)
+        progress = {"tiles_processed": tiles_processed,
+                    "tiles_total": self.total_tiles,
+                    "percent_complete": None,
+                    "tiles_per_minute": self.tiles_per_minute,
+                    "eta_seconds": None,
+                    "eta": None}
+
+        if self.total_tiles:
+            progress["percent_complete"] = round(min(100.0, 100.0 * tiles_processed / self.total_tiles), 1)
+            if progress["tiles_per_minute"]:
+                remaining_tiles = max(0, self.total_tiles - tiles_processed)
+                eta_seconds = remaining_tiles / progress["tiles_per_minute"] * 60
+                progress["eta_seconds"] = int(round(eta_seconds))
+                progress["eta"] = time.strftime("%Y-%m-%dT%H:%M:%S",
+                                                time.localtime(self.last_tile_timestamp + eta_seconds))
+        return progress
+
+
+def merge_progress(progresses):
+    """
+    Merge the progress of runs which are part of the same job (e.g. the lanes of a run
+    split by lane) into the progress of the job as a whole.
+    :param progresses: dicts as returned by `LogProgress.as_dict`
+    :return: a dict of the same form
+    """
+    tiles_processed = sum(progress["tiles_processed"] for progress in progresses)
+    known_totals = [progress["tiles_total"] for progress in progresses if progress["tiles_total"]]
+    tiles_total = sum(known_totals) if len(known_totals) == len(progresses) and progresses else None
+    rates = [progress["tiles_per_minute"] for progress in progresses if progress["tiles_per_minute"]]
+    etas = [progress["eta_seconds"] for progress in progresses if progress["eta_seconds"] is not None]
+    eta_strings = [progress["eta"] for progress in progresses if progress["eta"]]
+
+    merged = {"tiles_processed": tiles_processed,
+              "tiles_total": tiles_total,
+              "percent_complete": None,
+              "tiles_per_minute": sum(rates) if rates else None,
+              # The job is done once its slowest part is done.
+              "eta_seconds": max(etas) if etas else None,
+              "eta": max(eta_strings) if eta_strings else None}
+    if tiles_total:
+        merged["percent_complete"] = round(min(100.0, 100.0 * tiles_processed / tiles_total), 1)
+    return merged
+
+
+class ProgressTracker:
+    """
+    Keeps a `LogProgress` for each running job, so that the log of each job is only read
+    once, incrementally, however often the progress is asked for.
+    """
+
+    def __init__(self):
+        self._progresses = {}
+        self._lock = threading.Lock()
+
+    def progress(self, job_id, log_path, total_tiles=None):
+        """
+        Get the current progress of a job
+        :param job_id: of the job
+        :param log_path: the log of the job
+        :param total_tiles: the number of tiles the job will process (None if unknown)
+        :return: a dict describing the progress, see `LogProgress.as_dict`
+        """
+        with self._lock:
+            progress = self._progresses.get(job_id)
+            if progress is None or progress.log_path != log_path:
+                progress = LogProgress(log_path, total_tiles)
+                self._progresses[job_id] = progress
+            progress.update()
+            return progress.as_dict()
+
+    def forget(self, job_id):
+        """
+        Stop following the progress of a job (e.g. since it has finished)
+        """
+        with self._lock:
+            self._progresses.pop(job_id, None)
+
+
+def expected_tiles(runfolder_metadata, cmd):
+    """
+    Find how many tiles a bcl2fastq command will process
+    :param runfolder_metadata: `RunfolderMetadata` of the runfolder the command is run on
+    :param cmd: the bcl2fastq command
+    :return: the number of tiles, or None if it is not known (e.g. when only some tiles are
+             selected in a way that can not be resolved from the flowcell layout)
+    """
+    if not runfolder_metadata or not runfolder_metadata.nbr_of_tiles:
+        return None
+
+    tiles_match = re.search(r"--tiles[ =](\S+)", cmd)
+    if not tiles_match:
+        return runfolder_metadata.nbr_of_tiles
+
+    # Tiles selecting whole lanes, e.g. "s_1" or "s_1,s_2" (as when splitting by lane).
+    lanes = re.findall(r"^s_(\d+)$", tiles_match.group(1).replace(",", "\n"), re.MULTILINE)
+    if lanes and len(lanes) == len(tiles_match.group(1).split(",")):
+        layout = runfolder_metadata.flowcell_layout
+        return len(set(lanes)) * layout.surface_count * layout.swath_count * layout.tile_count
+    return None
@@ -0,0 +1,273 @@
+import logging
+import os
+import threading
+
+from arteria.web.state import State
+
+log = logging.getLogger(__name__)
+
+PROC_PATH = "/proc"
+
+
+def _clock_ticks_per_second():
+    try:
+        return os.sysconf("SC_CLK_TCK")
+    except (AttributeError, ValueError, OSError):
+        return 100
+
+
+def _page_size():
+    try:
+        return os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+
+CLOCK_TICKS_PER_SECOND = _clock_ticks_per_second()
+PAGE_SIZE = _page_size()
+
+
+def _read_stat(pid, proc_path=PROC_PATH):
+    """
+    :return: the fields of /proc/<pid>/stat after the command, which is left out since it may
+             contain spaces, i.e. the first field returned is the state (field 3 in proc(5))
+    """
+    with open(os.path.join(proc_path, str(pid), "stat")) as f:
+        content = f.read()
+    return content[content.rfind(")") + 2:].split()
+
+
+def process_tree(root_pid, proc_path=PROC_PATH):
+    """
+    Find the processes of a job: the process started for it, its descendants, and any other
+    process in its session (the jobs are run in sessions of their own).
+    :param root_pid: the pid of the process started for the job
+    :return: the pids of the processes, including `root_pid` if it is still running
+    """
+    children = {}
+    pids = set()
+    try:
+        entries = os.listdir(proc_path)
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            fields = _read_stat(entry, proc_path)
+        except (IOError, OSError):
+            # The process has exited since the directory was listed.
+            continue
+        pid, ppid, session = int(entry), int(fields[1]), int(fields[3])
+        children.setdefault(ppid, []).append(pid)
+        if pid == root_pid or session == root_pid:
+            pids.add(pid)
+
+    to_visit = list(pids)
+    while to_visit:
+        for child in children.get(to_visit.pop(), []):
+            if child not in pids:
+                pids.add(child)
+                to_visit.append(child)
+    return sorted(pids)
+
+
+def read_process(pid, proc_path=PROC_PATH):
+    """
+    Read the resource usage of a process from /proc.
+    :return: a dict with the start time (to tell reused pids apart), cpu_seconds, rss_bytes,
+             read_bytes and write_bytes of the process, or None if it has exited. The bytes
+             read and written are None if they can not be read (e.g. for lack of permissions).
+    """
+    try:
+        fields = _read_stat(pid, proc_path)
+    except (IOError, OSError):
+        return None
+    usage = {"start_time": int(fields[19]),
+             "cpu_seconds": float(int(fields[11]) + int(fields[12])) / CLOCK_TICKS_PER_SECOND,
+             "rss_bytes": int(fields[21]) * PAGE_SIZE,
+             "read_bytes": None,
+             "write_bytes": None}
+    try:
+        with open(os.path.join(proc_path, str(pid), "io")) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("read_bytes", "write_bytes"):
+                    usage[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return usage
+
+
+def directory_size(path):
+    """
+    :return: the total size in bytes of the files in a directory (0 if it does not exist)
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.lstat(os.path.join(root, file_name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def summarize_resources(samples):
+    """
+    Summarize the resource samples of a job.
+    :param samples: as returned by `JobStore.resource_samples`, oldest first
+    :return: a dict with the CPU time, peak RSS, bytes read and written and size of the output
+             at the last sample, the average number of cores used, and the average and current
+             growth rate of the output, or None if there are no samples
+    """
+    if not samples:
+        return None
+    first, last = samples[0], samples[-1]
+    elapsed = last["timestamp"] - first["timestamp"]
+    summary = {"samples": len(samples),
+               "last_sampled": last["timestamp"],
+               "cpu_seconds": last["cpu_seconds"],
+               "max_rss_bytes": max(sample["rss_bytes"] or 0 for sample in samples),
+               "read_bytes": last["read_bytes"],
+               "write_bytes": last["write_bytes"],
+               "output_bytes": last["output_bytes"],
+               "average_cores_used": None,
+               "output_bytes_per_second": None,
+               "current_output_bytes_per_second": None}
+    if elapsed > 0:
+        summary["average_cores_used"] = round((last["cpu_seconds"] - first["cpu_seconds"]) / elapsed, 2)
+        if last["output_bytes"] is not None and first["output_bytes"] is not None:
+            summary["output_bytes_per_second"] = round((last["output_bytes"] - first["output_bytes"]) / elapsed, 1)
+    if len(samples) > 1:
+        previous = samples[-2]
+        since_previous = last["timestamp"] - previous["timestamp"]
+        if since_previous > 0 and last["output_bytes"] is not None and previous["output_bytes"] is not None:
+            summary["current_output_bytes_per_second"] = round(
+                (last["output_bytes"] - previous["output_bytes"]) / since_previous, 1)
+    return summary
+
+
+class JobResources:
+    """
+    The resource usage of the processes of a job, accumulated over samples. The CPU time and
+    bytes read and written of processes which have exited are kept, so that the totals only
+    grow, also when the processes of a job come and go.
+    """
+
+    def __init__(self):
+        # The last usage of the processes seen in the previous sample, by (pid, start time).
+        self._processes = {}
+        self._exited = {"cpu_seconds": 0.0, "read_bytes": 0, "write_bytes": 0}
+
+    def sample(self, pids, proc_path=PROC_PATH):
+        """
+        Sample the processes of the job.
+        :param pids: of the processes of the job
+        :return: a dict with the total cpu_seconds, rss_bytes, read_bytes and write_bytes of the
+                 job, and the number of processes it has running
+        """
+        processes = {}
+        for pid in pids:
+            usage = read_process(pid, proc_path)
+            if usage:
+                processes[(pid, usage["start_time"])] = usage
+
+        for key, usage in self._processes.items():
+            if key not in processes:
+                for name in self._exited:
+                    self._exited[name] += usage[name] or 0
+        self._processes = processes
+
+        sample = {"nbr_of_processes": len(processes),
+                  "rss_bytes": sum(usage["rss_bytes"] for usage in processes.values())}
+        for name, exited in self._exited.items():
+            sample[name] = exited + sum(usage[name] or 0 for usage in processes.values())
+        return sample
+
+
+class ResourceMonitor:
+    """
+    Samples the resources used by running jobs at an interval: the CPU time, RSS and bytes read
+    and written of the process tree of each job (read from /proc, so only for jobs run as
+    subprocesses of the service), and the size of its output directory. The samples are stored
+    in the job store. A job split into several jobs (e.g. by lane) is sampled as a whole.
+    """
+
+    def __init__(self, runner_service, executor, proc_path=PROC_PATH):
+        """
+        Instantiate a ResourceMonitor
+        :param runner_service: the `JobStoreAdapter` running the jobs
+        :param executor: to sample with, since reading /proc and walking the output is blocking
+        :param proc_path: where procfs is mounted
+        """
+        self.runner_service = runner_service
+        self.executor = executor
+        self.proc_path = proc_path
+        # The output directory and accumulated usage of each job followed, by job id.
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._sampling = False
+        runner_service.add_listener(self.on_job_state_change)
+
+    def watch(self, job_id, output_dir=None):
+        """
+        Start sampling the resources of a job (once it has started)
+        :param output_dir: the output directory of the job, to follow the growth of (None to not follow any)
+        """
+        with self._lock:
+            self._watched[job_id] = (output_dir, JobResources())
+
+    def on_job_state_change(self, job, old_state, new_state):
+        if new_state in (State.DONE, State.ERROR, State.CANCELLED):
+            with self._lock:
+                self._watched.pop(job["job_id"], None)
+
+    def _targets(self):
+        """
+        :return: the jobs to sample, as a list of (job id, output directory, accumulated usage, pids)
+                 tuples, where the pids are those of the processes started for the jobs (or the
+                 parts of the job) which are running
+        """
+        job_store = self.runner_service.job_store
+        with self._lock:
+            watched = list(self._watched.items())
+        targets = []
+        for job_id, (output_dir, job_resources) in watched:
+            if job_store.state(job_id) != State.STARTED:
+                continue
+            parts = job_store.child_jobs(job_id) or [job_store.get_job(job_id)]
+            root_pids = [self.runner_service.pid(part["job_id"]) for part in parts
+                         if part["state"] == State.STARTED]
+            targets.append((job_id, output_dir, job_resources, [pid for pid in root_pids if pid]))
+        return targets
+
+    def _sample_targets(self, targets):
+        for job_id, output_dir, job_resources, root_pids in targets:
+            try:
+                pids = set()
+                for root_pid in root_pids:
+                    pids.update(process_tree(root_pid, self.proc_path))
+                sample = job_resources.sample(sorted(pids), self.proc_path)
+                sample["output_bytes"] = directory_size(output_dir) if output_dir else None
+                self.runner_service.job_store.add_resource_sample(job_id, sample)
+            except Exception as e:
+                log.error("Failed sampling the resources of job {}: {}".format(job_id, e))
+
+    def sample(self):
+        """
+        Sample all running jobs which are followed. This must be called from the thread running
+        the IOLoop. The sampling itself is done by the executor, and a new sampling is not begun
+        before the last one has finished.
+        """
+        if self._sampling:
+            return
+        targets = self._targets()
+        if not targets:
+            return
+        self._sampling = True
+
+        def _finished(future):
+            self._sampling = False
+
+        self.executor.submit(self._sample_targets, targets).add_done_callback(_finished)
@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+
+from arteria.web.state import State
+
+log = logging.getLogger(__name__)
+
+# The features of a job the runtime is predicted from.
+FEATURES = ("machine_type", "nbr_of_lanes", "nbr_of_tiles", "nbr_of_cycles", "nbr_of_samples", "nbr_of_cores")
+
+
+def run_features(runfolder_metadata, samplesheet, tiles, lane, nbr_of_cores):
+    """
+    Describe a bcl2fastq job by the features its runtime is predicted from.
+    :param runfolder_metadata: `RunfolderMetadata` of the runfolder (None if not known)
+    :param samplesheet: `Samplesheet` used by the job (None if not known)
+    :param tiles: the number of tiles the job processes (see `expected_tiles`, None if not known)
+    :param lane: the lane the job processes, or None if it processes all lanes
+    :param nbr_of_cores: the number of cores the job is run with
+    :return: the features, as a dict with the keys in `FEATURES` (with None for those not known)
+    """
+    features = dict.fromkeys(FEATURES)
+    features["nbr_of_cores"] = nbr_of_cores
+    features["nbr_of_tiles"] = tiles
+    if runfolder_metadata:
+        features["machine_type"] = runfolder_metadata.machine_type
+        features["nbr_of_cycles"] = sum(read.num_cycles for read in runfolder_metadata.reads)
+        layout = runfolder_metadata.flowcell_layout
+        if tiles and layout:
+            features["nbr_of_lanes"] = tiles // (layout.surface_count * layout.swath_count * layout.tile_count)
+    if samplesheet:
+        columns = samplesheet.columns
+        if lane is None:
+            features["nbr_of_samples"] = len(columns)
+        elif lane in columns.lanes():
+            features["nbr_of_samples"] = columns.nbr_of_samples(lane)
+        else:
+            features["nbr_of_samples"] = 0
+    return features
+
+
+def _feature_vector(features):
+    """
+    :return: the values the runtime is linear in, or None if any of the features needed are missing
+    """
+    tiles, cycles, cores = features.get("nbr_of_tiles"), features.get("nbr_of_cycles"), features.get("nbr_of_cores")
+    if not tiles or not cycles or not cores:
+        return None
+    size = float(tiles * cycles)
+    return [size / cores, size, float(features.get("nbr_of_samples") or 0)]
+
+
+def _solve(matrix, vector):
+    """
+    Solve a linear equation system with Gaussian elimination (with partial pivoting).
+    :return: the solution, or None if the system is singular
+    """
+    n = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for column in range(n):
+        pivot = max(range(column, n), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            return None
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, n):
+            factor = rows[row][column] / rows[column][column]
+            for i in range(column, n + 1):
+                rows[row][i] -= factor * rows[column][i]
+    solution = [0.0] * n
+    for row in reversed(range(n)):
+        solution[row] = (rows[row][n] - sum(rows[row][i] * solution[i] for i in range(row + 1, n))) / rows[row][row]
+    return solution
+
+
+class RuntimeModel:
+    """
+    A ridge regression of the wall time of jobs on the work per core (tiles x cycles / cores),
+    the total work (tiles x cycles) and the number of samples. The features are standardized
+    before fitting, so that the regularization affects them alike.
+    """
+
+    # Strength of the regularization, which keeps the fit stable with little history.
+    RIDGE = 0.1
+
+    def __init__(self, coefficients, intercept, means, scales, nbr_of_jobs):
+        self.coefficients = coefficients
+        self.intercept = intercept
+        self.means = means
+        self.scales = scales
+        self.nbr_of_jobs = nbr_of_jobs
+
+    @staticmethod
+    def fit(history):
+        """
+        Fit a model on the history of finished jobs.
+        :param history: a list of dicts with the `FEATURES` and the `wall_time` of each job
+        :return: the model, or None if there are no jobs with the features needed
+        """
+        rows = []
+        for job in history:
+            vector = _feature_vector(job)
+            if vector is not None and job.get("wall_time") is not None:
+                rows.append((vector, float(job["wall_time"])))
+        if not rows:
+            return None
+
+        nbr_of_features = len(rows[0][0])
+        means = [sum(vector[i] for vector, _ in rows) / len(rows) for i in range(nbr_of_features)]
+        scales = []
+        for i in range(nbr_of_features):
+            variance = sum((vector[i] - means[i]) ** 2 for vector, _ in rows) / len(rows)
+            scales.append(variance ** 0.5 or 1.0)
+        mean_wall_time = sum(wall_time for _, wall_time in rows) / len(rows)
+
+        standardized = [([(vector[i] - means[i]) / scales[i] for i in range(nbr_of_features)],
+                         wall_time - mean_wall_time)
+                        for vector, wall_time in rows]
+        matrix = [[sum(x[i] * x[j] for x, _ in standardized) + (RuntimeModel.RIDGE if i == j else 0.0)
+                   for j in range(nbr_of_features)]
+                  for i in range(nbr_of_features)]
+        vector = [sum(x[i] * y for x, y in standardized) for i in range(nbr_of_features)]
+        coefficients = _solve(matrix, vector)
+        if coefficients is None:
+            return None
+        return RuntimeModel(coefficients, mean_wall_time, means, scales, len(rows))
+
+    def predict(self, features):
+        """
+        :return: the predicted wall time of a job in seconds, or None if features needed are missing
+        """
+        vector = _feature_vector(features)
+        if vector is None:
+            return None
+        prediction = self.intercept + sum(coefficient * (value - mean) / scale for coefficient, value, mean, scale
+                                          in zip(self.coefficients, vector, self.means, self.scales))
+        return max(prediction, 0.0)
+
+
+class RuntimePredictor:
+    """
+    Predicts the runtime of jobs from the history of the jobs which have finished successfully,
+    as kept in the job store. A model is fitted for each machine type with enough history, and
+    one for all jobs, which is used for the other machine types. The models are fitted again
+    each time a job finishes successfully.
+    """
+
+    # The least number of finished jobs to fit a model on.
+    MIN_HISTORY = 5
+
+    # The most recent number of finished jobs to fit the models on.
+    MAX_HISTORY = 1000
+
+    def __init__(self, runner_service, executor=None):
+        """
+        Instantiate a RuntimePredictor
+        :param runner_service: the `JobStoreAdapter` whose job store holds the history
+        :param executor: to fit the models with, so that it is not done on the IOLoop (None to fit directly)
+        """
+        self.job_store = runner_service.job_store
+        self.executor = executor
+        self._models = {}
+        self._lock = threading.Lock()
+        runner_service.add_listener(self.on_job_state_change)
+        self.refit()
+
+    def refit(self):
+        """
+        Fit the models on the current history.
+        """
+        history = self.job_store.job_history(RuntimePredictor.MAX_HISTORY)
+        models = {}
+        by_machine_type = {None: history}
+        for job in history:
+            if job["machine_type"]:
+                by_machine_type.setdefault(job["machine_type"], []).append(job)
+        for machine_type, jobs in by_machine_type.items():
+            if len(jobs) >= RuntimePredictor.MIN_HISTORY:
+                model = RuntimeModel.fit(jobs)
+                if model:
+                    models[machine_type] = model
+        with self._lock:
+            self._models = models
+        log.debug("Fitted runtime models for {} on {} jobs".format(
+            ", ".join(str(machine_type) for machine_type in models) or "nothing", len(history)))
+
+    def on_job_state_change(self, job, old_state, new_state):
+        if new_state != State.DONE:
+            return
+        if self.executor:
+            self.executor.submit(self.refit)
+        else:
+            self.refit()
+
+    def model(self, machine_type):
+        """
+        :return: the model used for a machine type, or None if there is not enough history for any model
+        """
+        with self._lock:
+            return self._models.get(machine_type) or self._models.get(None)
+
+    def predict(self, features):
+        """
+        :param features: of the job, see `run_features`
+        :return: the predicted runtime of the job in seconds, or None if it can not be predicted
+        """
+        model = self.model(features.get("machine_type"))
+        return model.predict(features) if model else None
+
+
+def job_estimate(job_store, job_id, queue_status, now=None):
+    """
+    Estimate how long a job will run, and when it will end. The runtime of a job split into
+    several jobs (e.g. by lane) is from the start of the first to the end of the last of them.
+    :param job_store: holding the job
+    :param job_id: of the job
+    :param queue_status: as returned by `JobStoreAdapter.queue_status`
+    :param now: the current time (defaults to now)
+    :return: a dict with the `predicted_runtime` in seconds and the `expected_end` time, with
+             None for those not known, or None if no runtime was predicted for the job
+    """
+    now = now or time.time()
+    job = job_store.get_job(job_id)
+    if not job:
+        return None
+    jobs = job_store.child_jobs(job_id) or [job]
+    predictions = job_store.predicted_runtimes([job["job_id"] for job in jobs])
+
+    starts, ends = [], []
+    for job in jobs:
+        prediction = predictions.get(job["job_id"])
+        if job["state"] in (State.DONE, State.ERROR, State.CANCELLED):
+            start, end = job["started"], job["finished"]
+        elif job["started"] is not None:
+            start = job["started"]
+            end = max(start + prediction, now) if prediction is not None else None
+        else:
+            start = (queue_status.get(job["job_id"]) or {}).get("expected_start")
+            end = start + prediction if start is not None and prediction is not None else None
+        starts.append(start)
+        ends.append(end)
+
+    if not any(prediction is not None for prediction in predictions.values()):
+        return None
+    known_starts = [start for start in starts if start is not None]
+    first_start = min(known_starts) if known_starts else None
+    expected_end = max(ends) if None not in ends else None
+    if len(jobs) == 1:
+        predicted_runtime = predictions.get(jobs[0]["job_id"])
+    elif first_start is not None and expected_end is not None:
+        predicted_runtime = expected_end - first_start
+    elif None not in predictions.values() and len(predictions) == len(jobs):
+        # Not knowing when the jobs will start, they are assumed to be run side by side.
+        predicted_runtime = max(predictions.values())
+    else:
+        predicted_runtime = None
+    return {"predicted_runtime": predicted_runtime, "expected_end": expected_end}
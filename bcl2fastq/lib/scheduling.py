@@ -0,0 +1,101 @@
+import time
+
+from bcl2fastq.lib.progress import expected_tiles
+
+# Jobs of the same priority are run in the order they were submitted.
+FIFO = "fifo"
+
+# Jobs of the same priority are run smallest first, as estimated from RunInfo.xml, with aging
+# so that large jobs are not held back forever by smaller jobs submitted after them.
+SHORTEST_JOB_FIRST = "shortest_job_first"
+
+SCHEDULING_POLICIES = (FIFO, SHORTEST_JOB_FIRST)
+
+# How long (in seconds) a job has to wait for its size to count as half of what it is.
+DEFAULT_AGING_INTERVAL = 3600
+
+
+def estimated_run_size(runfolder_metadata, cmd):
+    """
+    Estimate the size of the work a bcl2fastq command will do, as the number of tiles it will
+    process (i.e. lanes x tiles per lane) times the number of cycles of the run.
+    :param runfolder_metadata: `RunfolderMetadata` of the runfolder the command is run on
+    :param cmd: the bcl2fastq command
+    :return: the size, or None if it is not known
+    """
+    tiles = expected_tiles(runfolder_metadata, cmd)
+    if not tiles:
+        return None
+    return tiles * sum(read.num_cycles for read in runfolder_metadata.reads)
+
+
+def queue_order(jobs, policy=FIFO, aging_interval=DEFAULT_AGING_INTERVAL, now=None):
+    """
+    Order the jobs waiting to run, those to run first first. Jobs of higher priority are always
+    run first. Among jobs of the same priority, `FIFO` runs them in the order they were submitted,
+    while `SHORTEST_JOB_FIRST` runs the smallest first. The size a job is ordered by is divided
+    by (1 + time waited / aging interval), so that any job will eventually be run before new
+    jobs, however small those are. Jobs of unknown size are ordered as the largest job waiting.
+    :param jobs: objects with the `priority`, `size` (None if unknown) and `submitted` time of the jobs
+    :param policy: `FIFO` or `SHORTEST_JOB_FIRST`
+    :param aging_interval: in seconds
+    :param now: the time to order the jobs at (defaults to now)
+    :return: the jobs, as an ordered list
+    """
+    if policy == FIFO:
+        return sorted(jobs, key=lambda job: (-job.priority, job.submitted))
+
+    now = now or time.time()
+    known_sizes = [job.size for job in jobs if job.size is not None]
+    unknown_size = max(known_sizes) if known_sizes else 0
+
+    def aged_size(job):
+        size = job.size if job.size is not None else unknown_size
+        return size / (1.0 + max(now - job.submitted, 0) / float(aging_interval))
+
+    return sorted(jobs, key=lambda job: (-job.priority, aged_size(job), job.submitted))
+
+
+def _end_time(entry):
+    end = entry[0]
+    return end is None, end
+
+
+def expected_starts(queued_jobs, running_jobs, nbr_of_cores, now=None):
+    """
+    Estimate when each waiting job will start, by playing out the queue: jobs are started in
+    order, once the jobs before them have started and enough cores are free (a job needing more
+    cores than there are in total waits for all cores).
+    :param queued_jobs: the jobs waiting to run, in the order they will be run, as a list of
+                        (nbr_of_cores, estimated runtime in seconds or None) tuples
+    :param running_jobs: the jobs running, as a list of (nbr_of_cores, estimated end time or None)
+                         tuples
+    :param nbr_of_cores: the total number of cores the jobs can use
+    :param now: the current time (defaults to now)
+    :return: the expected start time of each waiting job, in order, or None where it depends on a
+             job whose runtime is not known
+    """
+    now = now or time.time()
+    # Cores in use, and when they are expected to be freed (None if not known), the first freed first.
+    in_use = sorted(((end, cores) for cores, end in running_jobs), key=_end_time)
+    free_cores = nbr_of_cores - sum(cores for _, cores in in_use)
+    current = now
+    known = True
+
+    starts = []
+    for job_cores, runtime in queued_jobs:
+        needed = min(job_cores, nbr_of_cores)
+        while free_cores < needed and in_use:
+            end, cores = in_use.pop(0)
+            if end is None:
+                known = False
+            else:
+                current = max(current, end)
+            free_cores += cores
+        starts.append(current if known else None)
+
+        free_cores -= needed
+        end = current + runtime if known and runtime is not None else None
+        in_use.append((end, needed))
+        in_use.sort(key=_end_time)
+    return starts
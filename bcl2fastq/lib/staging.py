@@ -0,0 +1,126 @@
+import errno
+import hashlib
+import logging
+import os
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+
+from bcl2fastq.lib.output_reaper import OutputReaper
+
+log = logging.getLogger(__name__)
+
+# Size of the chunks files are copied and checksummed in.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Suffix of the directory the output is copied to, before it is moved into place.
+INCOMING_SUFFIX = ".incoming"
+
+
+def file_checksum(path):
+    """
+    :return: the md5 checksum of a file, as a hex string
+    """
+    checksum = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def copy_verified(source, destination):
+    """
+    Copy a file, and verify the copy by reading it back and comparing its checksum to
+    that of the source (computed as the source is copied).
+    :return: the size of the file in bytes
+    :raises: IOError if the checksum of the copy does not match that of the source
+    """
+    checksum = hashlib.md5()
+    size = 0
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        for chunk in iter(lambda: source_file.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+            destination_file.write(chunk)
+            size += len(chunk)
+    shutil.copystat(source, destination)
+    if file_checksum(destination) != checksum.hexdigest():
+        raise IOError("The copy of {} in {} does not match the original".format(source, destination))
+    return size
+
+
+def _copy_tree_structure(source_dir, destination_dir):
+    """
+    Create the directories and symlinks of a directory tree in another directory.
+    :return: the files in the tree, as a list of (source, destination) tuples
+    """
+    files = []
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        relative_dir = os.path.relpath(dir_path, source_dir)
+        target_dir = os.path.normpath(os.path.join(destination_dir, relative_dir))
+        os.makedirs(target_dir)
+        for name in dir_names + file_names:
+            source = os.path.join(dir_path, name)
+            destination = os.path.join(target_dir, name)
+            # Symlinks (also to directories, which os.walk does not follow) are recreated as they are.
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), destination)
+            elif name in file_names:
+                files.append((source, destination))
+    return files
+
+
+def move_output(source_dir, destination_dir, nbr_of_threads=4, output_reaper=None):
+    """
+    Move the output of a job from one file system (e.g. local scratch) to another. The files
+    are copied in parallel into a directory next to the destination, and each copy is verified
+    by its checksum. Only once all files have been copied is that directory renamed to the
+    destination (any existing destination is moved to the trash first, see `OutputReaper`),
+    and the source removed. If anything fails, the source is kept and the partial copy removed.
+    :param source_dir: the directory to move
+    :param destination_dir: where to move it (its parent must exist)
+    :param nbr_of_threads: the number of files to copy at the same time
+    :param output_reaper: if given, an existing destination moved to the trash is deleted in the
+                          background by this `OutputReaper` (otherwise it is left in the trash
+                          until the reaper is resumed)
+    :return: the number of bytes copied
+    :raises: IOError or OSError if the output could not be moved
+    """
+    incoming_dir = os.path.normpath(destination_dir) + INCOMING_SUFFIX
+    if os.path.lexists(incoming_dir):
+        shutil.rmtree(incoming_dir)
+
+    try:
+        files = _copy_tree_structure(source_dir, incoming_dir)
+        executor = ThreadPoolExecutor(max_workers=nbr_of_threads)
+        try:
+            futures = [executor.submit(copy_verified, source, destination) for source, destination in files]
+            size = sum(future.result() for future in futures)
+        finally:
+            executor.shutdown(wait=True)
+        trash_path = OutputReaper.move_to_trash(destination_dir)
+        os.rename(incoming_dir, destination_dir)
+    except (IOError, OSError) as e:
+        log.error("Failed moving {} to {}, it is kept where it is. Message: {}".format(source_dir, destination_dir, e))
+        shutil.rmtree(incoming_dir, ignore_errors=True)
+        raise
+
+    log.info("Moved {} files ({} bytes) from {} to {}".format(len(files), size, source_dir, destination_dir))
+    if trash_path and output_reaper:
+        output_reaper.schedule(trash_path)
+    shutil.rmtree(source_dir, ignore_errors=True)
+    return size
+
+
+def replace_symlink(target, link_path):
+    """
+    Atomically make a symlink point at a new target, replacing what is at the path of the
+    link, so that there is no moment when the link is missing.
+    """
+    temporary_link_path = "{}.{}".format(link_path, os.getpid())
+    try:
+        os.remove(temporary_link_path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    os.symlink(target, temporary_link_path)
+    os.rename(temporary_link_path, link_path)
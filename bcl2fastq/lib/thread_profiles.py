@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class ThreadProfile(namedtuple("ThreadProfile", ["loading_threads", "processing_threads", "writing_threads",
+                                                 "compression_level"])):
+    """
+    The number of threads bcl2fastq (2.x) should use for loading, processing and writing
+    data, and the compression level of the fastq files it writes. Any field can be None,
+    in which case bcl2fastq will use its own default for it.
+    """
+
+    __slots__ = ()
+
+    # The field, the argument to bcl2fastq, and its short form (if any).
+    ARGUMENTS = (("loading_threads", "--loading-threads", "-r"),
+                 ("processing_threads", "--processing-threads", "-p"),
+                 ("writing_threads", "--writing-threads", "-w"),
+                 ("compression_level", "--fastq-compression-level", None))
+
+    @staticmethod
+    def from_dict(profile_dict, nbr_of_cores):
+        """
+        Create a ThreadProfile from a dict, e.g. a `thread_profile` section of the config.
+        The number of processing threads defaults to the number of cores, and no more
+        threads than there are cores are used for loading or writing.
+        :param profile_dict: with the fields of the profile as keys
+        :param nbr_of_cores: the number of cores the job will be run with
+        :return: a ThreadProfile
+        """
+        def threads(key):
+            value = profile_dict.get(key)
+            return min(int(value), nbr_of_cores) if value else None
+
+        compression_level = profile_dict.get("compression_level")
+        return ThreadProfile(loading_threads=threads("loading_threads"),
+                             processing_threads=threads("processing_threads") or nbr_of_cores,
+                             writing_threads=threads("writing_threads"),
+                             compression_level=int(compression_level) if compression_level is not None else None)
+
+    def as_dict(self):
+        return OrderedDict((field, getattr(self, field)) for field in self._fields)
+
+    def as_arguments(self, given_arguments=()):
+        """
+        :param given_arguments: arguments which have already been given (e.g. as additional arguments),
+                                these are not overridden.
+        :return: the arguments to pass to bcl2fastq, as a list of strings
+        """
+        arguments = []
+        for field, argument, short_argument in ThreadProfile.ARGUMENTS:
+            value = getattr(self, field)
+            if value is None or argument in given_arguments or short_argument in given_arguments:
+                continue
+            arguments.append("{} {}".format(argument, value))
+        return arguments
+
+
+class ThreadProfileStore:
+    """
+    Keeps the thread profiles found to be the fastest by autotuning, per machine type and
+    number of cores, in a JSON file. If no file is given the profiles are only kept in memory.
+    `version` is increased each time a profile is stored.
+    """
+
+    def __init__(self, path=None):
+        """
+        Instantiate a ThreadProfileStore
+        :param path: of the JSON file to keep the profiles in
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self.version = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._profiles = json.load(f)
+
+    @staticmethod
+    def _key(machine_type, nbr_of_cores):
+        return "{}/{}".format(machine_type, nbr_of_cores)
+
+    def get(self, machine_type, nbr_of_cores):
+        """
+        :return: the fastest ThreadProfile found for the machine type and number of cores,
+                 or None if none has been found
+        """
+        with self._lock:
+            entry = self._profiles.get(ThreadProfileStore._key(machine_type, nbr_of_cores))
+        return ThreadProfile(**entry["profile"]) if entry else None
+
+    def put(self, machine_type, nbr_of_cores, profile, timings):
+        """
+        Store the fastest profile for a machine type and number of cores.
+        :param profile: the fastest ThreadProfile
+        :param timings: list of (ThreadProfile, seconds) tuples of all profiles which were tried
+        """
+        entry = {"machine_type": machine_type,
+                 "nbr_of_cores": nbr_of_cores,
+                 "profile": profile.as_dict(),
+                 "timings": [{"profile": tried_profile.as_dict(), "seconds": seconds}
+                             for tried_profile, seconds in timings],
+                 "tuned": time.time()}
+        with self._lock:
+            self._profiles[ThreadProfileStore._key(machine_type, nbr_of_cores)] = entry
+            self.version += 1
+            if self.path:
+                # Write to a temporary file first, so that the file is never half written.
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(self._profiles, f, indent=2)
+                os.rename(self.path + ".tmp", self.path)
+
+    def all(self):
+        """
+        :return: all stored entries, as a dict keyed by `<machine type>/<number of cores>`
+        """
+        with self._lock:
+            return dict(self._profiles)
+
+
+class ThreadProfiles:
+    """
+    Decides which thread profile to run bcl2fastq with. A profile found by autotuning for
+    the machine type and number of cores is preferred. Otherwise the `thread_profile` of the
+    machine type in the config is used, e.g.:
+
+        machine_type:
+          HiSeq X:
+            bcl2fastq_version: 2.20.0
+            thread_profile:
+              loading_threads: 4
+              writing_threads: 4
+              compression_level: 4
+
+    If neither exists, only the number of processing threads is set (to the number of cores).
+    """
+
+    def __init__(self, config, store):
+        """
+        Instantiate ThreadProfiles
+        :param config: the service configuration
+        :param store: the ThreadProfileStore with autotuned profiles
+        """
+        self.config = config
+        self.store = store
+
+    def configured_profile(self, machine_type, nbr_of_cores):
+        """
+        :return: the profile configured for the machine type, or the default profile if there is none
+        """
+        try:
+            profile_dict = self.config["machine_type"][machine_type].get("thread_profile") or {}
+        except KeyError:
+            profile_dict = {}
+        return ThreadProfile.from_dict(profile_dict, nbr_of_cores)
+
+    def profile_for(self, machine_type, nbr_of_cores):
+        """
+        :return: the ThreadProfile to use for the machine type and number of cores
+        """
+        tuned_profile = self.store.get(machine_type, nbr_of_cores)
+        if tuned_profile:
+            return tuned_profile
+        return self.configured_profile(machine_type, nbr_of_cores)
+
+    def autotune_candidates(self, machine_type, nbr_of_cores, loading_threads=(2, 4, 8), writing_threads=(2, 4, 8)):
+        """
+        The profiles to try when autotuning: all combinations of the given numbers of loading
+        and writing threads (as far as there are cores for them), with as many processing
+        threads as there are cores. The compression level is taken from the configured profile.
+        :return: a list of ThreadProfiles
+        """
+        compression_level = self.configured_profile(machine_type, nbr_of_cores).compression_level
+        candidates = OrderedDict()
+        for loading in loading_threads:
+            for writing in writing_threads:
+                candidate = ThreadProfile(loading_threads=min(loading, nbr_of_cores),
+                                          processing_threads=nbr_of_cores,
+                                          writing_threads=min(writing, nbr_of_cores),
+                                          compression_level=compression_level)
+                candidates[candidate] = True
+        return list(candidates)
+
+    @staticmethod
+    def fastest(timings):
+        """
+        :param timings: list of (ThreadProfile, seconds) tuples
+        :return: the fastest ThreadProfile
+        """
+        return min(timings, key=lambda profile_and_seconds: profile_and_seconds[1])[0]
@@ -0,0 +1,101 @@
+"""
+Benchmark of the time between one job finishing and the next job in the queue starting.
+
+A chain of short jobs is submitted to a runner with a single core, so that each job has
+to wait for the one before it. Each job records when it starts and ends, and the gap
+between the end of one job and the start of the next is the dispatch latency of the
+runner. This is done both for the subprocess runner and for the localq runner.
+
+Run it from the root of the repository with:
+
+    python -m benchmarks.bench_job_dispatch
+"""
+
+import os
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.process import Subprocess
+
+from bcl2fastq.lib.jobrunner import LocalQAdapter, SubprocessAdapter
+
+from benchmarks.bench_start_handler import percentile
+
+
+def job_command(timestamps_file, job_duration):
+    return "python -c 'import time; print(time.time())' >> {0}; sleep {1}; " \
+           "python -c 'import time; print(time.time())' >> {0}".format(timestamps_file, job_duration)
+
+
+def dispatch_gaps(timestamps_files):
+    """
+    :param timestamps_files: of the jobs, in the order they were submitted
+    :return: the gaps (in seconds) between each job ending and the next one starting
+    """
+    timestamps = []
+    for timestamps_file in timestamps_files:
+        with open(timestamps_file) as f:
+            timestamps.append([float(line) for line in f])
+    return [next_job[0] - job[1] for job, next_job in zip(timestamps, timestamps[1:])]
+
+
+@gen.coroutine
+def run_jobs(adapter, run_dir, nbr_of_jobs, job_duration):
+    timestamps_files = []
+    job_ids = []
+    for i in range(nbr_of_jobs):
+        timestamps_file = os.path.join(run_dir, "job_{}.timestamps".format(i))
+        timestamps_files.append(timestamps_file)
+        job_ids.append(adapter.start(job_command(timestamps_file, job_duration), 1, run_dir))
+
+    finished_states = ("done", "error", "cancelled")
+    while any(adapter.status(job_id) not in finished_states for job_id in job_ids):
+        yield gen.sleep(0.01)
+    raise gen.Return(timestamps_files)
+
+
+def run(name, adapter_factory, nbr_of_jobs, job_duration):
+    run_dir = tempfile.mkdtemp()
+    io_loop = IOLoop()
+    io_loop.make_current()
+    try:
+        adapter = adapter_factory()
+        timestamps_files = io_loop.run_sync(lambda: run_jobs(adapter, run_dir, nbr_of_jobs, job_duration))
+        gaps = dispatch_gaps(timestamps_files)
+        print("{:<12} dispatch latency ms: median {:8.2f}  p95 {:8.2f}  max {:8.2f}".format(
+            name,
+            percentile(gaps, 50) * 1000,
+            percentile(gaps, 95) * 1000,
+            max(gaps) * 1000))
+    finally:
+        Subprocess.uninitialize()
+        io_loop.close(all_fds=True)
+        shutil.rmtree(run_dir)
+
+
+def subprocess_adapter():
+    return SubprocessAdapter(nbr_of_cores=1)
+
+
+def localq_adapter(interval):
+    return lambda: LocalQAdapter(nbr_of_cores=1, interval=interval)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--jobs", dest="jobs", type="int", default=20)
+    parser.add_option("--duration", dest="duration", type="float", default=0.1,
+                      help="seconds each job sleeps")
+    parser.add_option("--localq-interval", dest="localq_interval", type="float", default=2,
+                      help="seconds between localq checking its jobs (as configured in the service)")
+    (options, args) = parser.parse_args()
+
+    run("subprocess", subprocess_adapter, options.jobs, options.duration)
+    run("localq", localq_adapter(options.localq_interval), options.jobs, options.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of samplesheet parsing, comparing `Samplesheet` against the pandas based
+implementation it replaced, on synthetic samplesheets of increasing size. The pandas
+implementation is only benchmarked if pandas is installed. With `--memory` the
+approximate memory used by the parsed samplesheet is reported as well, both for the
+columnar representation and for a list of `SampleRow` instances.
+
+Run it from the root of the repository with:
+
+    python -m benchmarks.bench_samplesheet
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from bcl2fastq.lib.illumina import Samplesheet, SampleRow
+from benchmarks.synthetic import write_samplesheet
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+
+
+def read_samples_with_pandas(samplesheet_file):
+    """
+    The implementation of `Samplesheet._read_samples` prior to the csv based parser.
+    """
+    from pandas import read_csv
+
+    with open(samplesheet_file) as samplesheet_file_handle:
+        enumurated_lines = enumerate(samplesheet_file_handle)
+        lines_with_data = filter(lambda x: "[Data]" in x[1], enumurated_lines)
+        lines_to_skip = lines_with_data[0][0] + 1
+        samplesheet_file_handle.seek(0)
+        samplesheet_df = read_csv(samplesheet_file_handle, skiprows=lines_to_skip)
+        samplesheet_df = samplesheet_df.fillna("")
+
+        def row_to_sample_row(index_and_row):
+            row = index_and_row[1]
+            return SampleRow(lane=row.get("Lane"), sample_id=row.get("Sample_ID"), sample_name=row.get("Sample_Name"),
+                             sample_plate=row.get("Sample_Plate"), sample_well=row.get("Sample_Well"),
+                             index1=row.get("index"), index2=row.get("index2"),
+                             sample_project=row.get("Sample_Project"), description=row.get("Description"))
+
+        return list(map(row_to_sample_row, samplesheet_df.iterrows()))
+
+
+def read_samples_with_csv(samplesheet_file):
+    return Samplesheet(samplesheet_file).samples
+
+
+def approximate_size(obj, seen=None):
+    """
+    Approximate the memory used by an object and everything it refers to.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approximate_size(key, seen) + approximate_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approximate_size(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += approximate_size(obj.__dict__, seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        size += approximate_size(getattr(obj, slot, None), seen)
+    return size
+
+
+def best_time(function, argument, repeats):
+    timings = []
+    for _ in range(repeats):
+        before = time.time()
+        function(argument)
+        timings.append(time.time() - before)
+    return min(timings)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sizes", dest="sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                      help="comma separated list of the number of samples in each samplesheet")
+    parser.add_option("--repeats", dest="repeats", type="int", default=3)
+    parser.add_option("--memory", dest="memory", action="store_true", default=False,
+                      help="also report the approximate memory used by the parsed samplesheet")
+    (options, args) = parser.parse_args()
+
+    try:
+        import pandas
+        implementations = [("csv", read_samples_with_csv), ("pandas", read_samples_with_pandas)]
+    except ImportError:
+        print("pandas is not installed, only benchmarking the csv based parser")
+        implementations = [("csv", read_samples_with_csv)]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for size in map(int, options.sizes.split(",")):
+            samplesheet_file = os.path.join(tmp_dir, "SampleSheet_{}.csv".format(size))
+            write_samplesheet(samplesheet_file, size)
+            results = ["{:>7} rows".format(size)]
+            for name, implementation in implementations:
+                results.append("{}: {:9.2f} ms".format(name, 1000 * best_time(implementation,
+                                                                             samplesheet_file,
+                                                                             options.repeats)))
+            if options.memory:
+                samplesheet = Samplesheet(samplesheet_file)
+                results.append("columns: {:8.1f} KiB".format(approximate_size(samplesheet.columns) / 1024.0))
+                results.append("rows: {:8.1f} KiB".format(approximate_size(samplesheet.samples) / 1024.0))
+                # What the rows used before `SampleRow` got `__slots__`, i.e. one dict per row.
+                rows_with_dict = [row._as_dict() for row in samplesheet.samples]
+                results.append("rows with __dict__: {:8.1f} KiB".format(approximate_size(rows_with_dict) / 1024.0))
+            print("  ".join(results))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
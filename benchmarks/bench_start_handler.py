@@ -0,0 +1,195 @@
+"""
+Benchmark of how status requests are affected by start requests that are in flight.
+
+A number of start requests are fired against the service, using a runner which
+simulates slow version probes and slow removal of old output, and the latency of
+status requests made while the starts are running is measured. This is done once
+with the blocking work run directly on the IOLoop (as it used to be), and once with
+it run on the executor used by `StartHandler`.
+
+Run it from the root of the repository with:
+
+    python -m benchmarks.bench_start_handler
+"""
+
+import json
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+from concurrent.futures import Future
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+
+from bcl2fastq.app import routes
+from bcl2fastq.handlers.bcl2fastq_handlers import Bcl2FastqServiceMixin
+from bcl2fastq.lib.bcl2fastq_utils import BCL2FastqRunner
+from bcl2fastq.lib.jobrunner import JobRunnerAdapter, JobStoreAdapter
+from bcl2fastq.lib.jobstore import JobStore
+
+
+class SlowRunner(BCL2FastqRunner):
+    """
+    A runner where probing the version and deleting the output takes `delay` seconds each.
+    """
+
+    def __init__(self, config, delay):
+        BCL2FastqRunner.__init__(self, config, "bcl2fastq")
+        self.delay = delay
+
+    def version(self):
+        time.sleep(self.delay)
+        return "2.20.0"
+
+    def construct_command(self):
+        return "true"
+
+    def delete_output(self, output_reaper=None):
+        time.sleep(self.delay)
+
+    def symlink_output_to_unaligned(self):
+        pass
+
+
+class SlowRunnerFactory:
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def create_bcl2fastq_runner(self, config):
+        return SlowRunner(config, self.delay)
+
+
+class NoOpRunnerAdapter(JobRunnerAdapter):
+    """
+    A job runner which only hands out job ids, so that only the service itself is measured.
+    It is wrapped in a `JobStoreAdapter` (with a store in memory), as the runner service is.
+    """
+
+    def __init__(self):
+        self.job_id = 0
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
+        self.job_id += 1
+        return self.job_id
+
+    def status(self, job_id):
+        return "pending"
+
+    def status_all(self):
+        return {}
+
+
+def reset_services():
+    """
+    Forget the services created by an earlier run, so that each run starts from scratch.
+    """
+    for name in dir(Bcl2FastqServiceMixin):
+        if name.startswith("_") and not name.startswith("__") and \
+                not callable(getattr(Bcl2FastqServiceMixin, name)):
+            setattr(Bcl2FastqServiceMixin, name, None)
+
+
+class InlineExecutor:
+    """
+    Runs submitted work directly, i.e. on the IOLoop, which is how starts used to be handled.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+@gen.coroutine
+def measure(port, nbr_of_starts, nbr_of_status_polls):
+    client = AsyncHTTPClient()
+    base_url = "http://127.0.0.1:{}/api/1.0".format(port)
+    body = json.dumps({"bcl2fastq_version": "2.20.0"})
+
+    starts = [client.fetch("{}/start/runfolder_{}".format(base_url, i), method="POST", body=body)
+              for i in range(nbr_of_starts)]
+
+    latencies = []
+    for _ in range(nbr_of_status_polls):
+        before = time.time()
+        yield client.fetch("{}/status/".format(base_url))
+        latencies.append(time.time() - before)
+        yield gen.sleep(0.01)
+
+    yield starts
+    raise gen.Return(latencies)
+
+
+def run(executor, delay, nbr_of_starts, nbr_of_status_polls):
+    runfolder_path = tempfile.mkdtemp()
+    output_path = tempfile.mkdtemp()
+    try:
+        for i in range(nbr_of_starts):
+            runfolder = "{}/runfolder_{}".format(runfolder_path, i)
+            shutil.os.mkdir(runfolder)
+        config = {"runfolder_path": runfolder_path,
+                  "default_output_path": output_path,
+                  "allowed_output_folders": [output_path],
+                  "bcl2fastq_logs_path": output_path,
+                  "bcl2fastq": {"versions": {}}}
+
+        reset_services()
+        Bcl2FastqServiceMixin._runner_service = JobStoreAdapter(NoOpRunnerAdapter(), JobStore())
+        Bcl2FastqServiceMixin._bcl2fastq_cmd_generation_service = SlowRunnerFactory(delay)
+        Bcl2FastqServiceMixin._executor = executor
+
+        io_loop = IOLoop()
+        io_loop.make_current()
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(Application(routes(config=config)), io_loop=io_loop)
+        server.add_sockets(sockets)
+        port = sockets[0].getsockname()[1]
+
+        latencies = io_loop.run_sync(lambda: measure(port, nbr_of_starts, nbr_of_status_polls))
+
+        server.stop()
+        io_loop.close(all_fds=True)
+        return latencies
+    finally:
+        shutil.rmtree(runfolder_path)
+        shutil.rmtree(output_path)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--starts", dest="starts", type="int", default=8)
+    parser.add_option("--polls", dest="polls", type="int", default=50)
+    parser.add_option("--delay", dest="delay", type="float", default=0.2,
+                      help="seconds each version probe and output removal takes")
+    (options, args) = parser.parse_args()
+
+    from concurrent.futures import ThreadPoolExecutor
+    setups = [("blocking (on IOLoop)", InlineExecutor()),
+              ("executor", ThreadPoolExecutor(max_workers=4))]
+
+    for name, executor in setups:
+        latencies = run(executor, options.delay, options.starts, options.polls)
+        print("{:<22} status latency ms: median {:8.2f}  p95 {:8.2f}  max {:8.2f}".format(
+            name,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            max(latencies) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Benchmark suite of the hot paths of the service, run on synthetic runfolders for each
+machine type in `machine_type_mappings`:
+
+ - parsing samplesheets of increasing size with `Samplesheet`
+ - `Bcl2FastqConfig.get_bases_mask_per_lane_from_samplesheet`
+ - `construct_command` of `BCL2Fastq2xRunner` (for each machine type) and of `BCL2Fastq1xRunner`
+ - the latency of `StartHandler` and `StatusHandler` requests, made over HTTP to the service
+   running in process (with a job runner which does not run anything)
+
+The results are written as JSON, and can be compared against the results of an earlier
+run, in which case cases which got slower than the threshold are reported (and the exit
+status is 1 if there are any).
+
+Run it from the root of the repository with:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --output new_results.json --compare results.json
+"""
+
+import json
+import os
+import platform
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+
+from bcl2fastq.app import routes
+from bcl2fastq.handlers.bcl2fastq_handlers import Bcl2FastqServiceMixin
+from bcl2fastq.lib.bcl2fastq_utils import Bcl2FastqConfig, BCL2Fastq1xRunner, BCL2Fastq2xRunner
+from bcl2fastq.lib.illumina import Samplesheet, machine_type_mappings
+from bcl2fastq.lib.jobrunner import JobStoreAdapter
+from bcl2fastq.lib.jobstore import JobStore
+from benchmarks.bench_start_handler import NoOpRunnerAdapter, percentile
+from benchmarks.synthetic import LANES_PER_MACHINE_TYPE, write_runfolder, write_samplesheet
+
+DEFAULT_SIZES = [10, 1000, 10000, 50000]
+
+# The number of samples in the runfolders used to benchmark commands and requests.
+DEFAULT_RUNFOLDER_SAMPLES = 1000
+
+# The version reported by the fake bcl2fastq binary used when benchmarking requests.
+BCL2FASTQ_VERSION = "2.20.0"
+
+
+def time_calls(function, repeats):
+    """
+    :return: the time each of `repeats` calls of the function took, in seconds
+    """
+    timings = []
+    for _ in range(repeats):
+        before = time.time()
+        function()
+        timings.append(time.time() - before)
+    return timings
+
+
+def result(name, params, timings):
+    return {"name": name,
+            "params": params,
+            "repeats": len(timings),
+            "best_ms": round(min(timings) * 1000, 3),
+            "median_ms": round(percentile(timings, 50) * 1000, 3),
+            "p95_ms": round(percentile(timings, 95) * 1000, 3)}
+
+
+def bench_samplesheets(tmp_dir, sizes, repeats):
+    results = []
+    for size in sizes:
+        samplesheet_file = os.path.join(tmp_dir, "SampleSheet_{}.csv".format(size))
+        write_samplesheet(samplesheet_file, size)
+
+        timings = time_calls(lambda: Samplesheet(samplesheet_file), repeats)
+        results.append(result("samplesheet_parse", {"rows": size}, timings))
+
+        samplesheet = Samplesheet(samplesheet_file)
+        timings = time_calls(lambda: Bcl2FastqConfig.get_bases_mask_per_lane_from_samplesheet(samplesheet,
+                                                                                            {2: 8, 3: 8},
+                                                                                            False),
+                             repeats)
+        results.append(result("bases_mask_per_lane", {"rows": size}, timings))
+    return results
+
+
+def general_config(runfolder_path, output_path, bcl2fastq_binary="bcl2fastq"):
+    return {"runfolder_path": runfolder_path,
+            "default_output_path": output_path,
+            "allowed_output_folders": [output_path],
+            "bcl2fastq_logs_path": output_path,
+            "bcl2fastq": {"versions": {BCL2FASTQ_VERSION: {"class_creation_function": "_get_bcl2fastq2x_runner",
+                                                           "binary": bcl2fastq_binary},
+                                       "1.8.4": {"class_creation_function": "_get_bcl2fastq1x_runner",
+                                                 "binary": "configureBclToFastq.pl"}}},
+            "machine_type": {machine_type: {"bcl2fastq_version": BCL2FASTQ_VERSION}
+                             for machine_type in machine_type_mappings.values()}}
+
+
+def bench_commands(tmp_dir, nbr_of_samples, repeats):
+    results = []
+    runfolder_path = os.path.join(tmp_dir, "commands")
+    config = general_config(runfolder_path, os.path.join(tmp_dir, "output"))
+
+    for machine_type in sorted(machine_type_mappings.values()):
+        runfolder = write_runfolder(runfolder_path, machine_type, nbr_of_samples)
+        runfolder_config = Bcl2FastqConfig(config, BCL2FASTQ_VERSION, runfolder, None, nbr_of_cores=8)
+        runner = BCL2Fastq2xRunner(runfolder_config, "bcl2fastq")
+        timings = time_calls(runner.construct_command, repeats)
+        results.append(result("construct_command", {"runner": "BCL2Fastq2xRunner",
+                                                    "machine_type": machine_type,
+                                                    "rows": nbr_of_samples}, timings))
+
+    # bcl2fastq 1.x is only used for lanes with different bases masks, so the first lane is single index.
+    machine_type = "HiSeq 2500"
+    runfolder = write_runfolder(os.path.join(tmp_dir, "commands_1x"), machine_type, nbr_of_samples,
+                                single_index_lanes=(1,))
+    runfolder_config = Bcl2FastqConfig(config, "1.8.4", runfolder, None, nbr_of_cores=8)
+    runner = BCL2Fastq1xRunner(runfolder_config, "configureBclToFastq.pl")
+    timings = time_calls(runner.construct_command, repeats)
+    results.append(result("construct_command", {"runner": "BCL2Fastq1xRunner",
+                                                "machine_type": machine_type,
+                                                "rows": nbr_of_samples}, timings))
+    return results
+
+
+def write_fake_bcl2fastq(path):
+    """
+    Write a script which reports its version the way bcl2fastq does.
+    """
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\necho BCL to FASTQ file converter\necho bcl2fastq v{}\n".format(BCL2FASTQ_VERSION))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+@gen.coroutine
+def measure_requests(port, runfolders, nbr_of_requests):
+    client = AsyncHTTPClient()
+    base_url = "http://127.0.0.1:{}/api/1.0".format(port)
+    timings = {"start": [], "status_one": [], "status_all": []}
+
+    job_ids = []
+    for i in range(nbr_of_requests):
+        before = time.time()
+        response = yield client.fetch("{}/start/{}".format(base_url, runfolders[i % len(runfolders)]),
+                                      method="POST", body="")
+        timings["start"].append(time.time() - before)
+        job_ids.append(json.loads(response.body)["job_id"])
+
+    for i in range(nbr_of_requests):
+        before = time.time()
+        yield client.fetch("{}/status/{}".format(base_url, job_ids[i]))
+        timings["status_one"].append(time.time() - before)
+
+        before = time.time()
+        yield client.fetch("{}/status/".format(base_url))
+        timings["status_all"].append(time.time() - before)
+
+    raise gen.Return(timings)
+
+
+def bench_requests(tmp_dir, nbr_of_samples, nbr_of_requests):
+    runfolder_path = os.path.join(tmp_dir, "requests")
+    output_path = os.path.join(tmp_dir, "requests_output")
+    os.makedirs(output_path)
+    bcl2fastq_binary = os.path.join(tmp_dir, "bcl2fastq")
+    write_fake_bcl2fastq(bcl2fastq_binary)
+    config = general_config(runfolder_path, output_path, bcl2fastq_binary)
+
+    runfolders = [os.path.basename(write_runfolder(runfolder_path, machine_type, nbr_of_samples))
+                  for machine_type in sorted(LANES_PER_MACHINE_TYPE)]
+
+    Bcl2FastqServiceMixin._runner_service = JobStoreAdapter(NoOpRunnerAdapter(), JobStore())
+
+    io_loop = IOLoop()
+    io_loop.make_current()
+    sockets = bind_sockets(0, "127.0.0.1")
+    server = HTTPServer(Application(routes(config=config)), io_loop=io_loop)
+    server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+    try:
+        timings = io_loop.run_sync(lambda: measure_requests(port, runfolders, nbr_of_requests), timeout=600)
+    finally:
+        server.stop()
+        io_loop.close(all_fds=True)
+
+    params = {"rows": nbr_of_samples, "requests": nbr_of_requests}
+    return [result("start_request", params, timings["start"]),
+            result("status_request", dict(params, jobs="one"), timings["status_one"]),
+            result("status_request", dict(params, jobs="all"), timings["status_all"])]
+
+
+def _key(case):
+    return case["name"], tuple(sorted(case["params"].items()))
+
+
+def compare(results, previous_results, threshold):
+    """
+    Compare the results against those of an earlier run.
+    :param threshold: how many times slower (by median) a case has to be to be counted as a regression
+    :return: the number of regressions
+    """
+    previous = {_key(case): case for case in previous_results["results"]}
+    regressions = 0
+    for case in results["results"]:
+        previous_case = previous.get(_key(case))
+        if not previous_case or not previous_case["median_ms"]:
+            continue
+        ratio = case["median_ms"] / previous_case["median_ms"]
+        regression = ratio > threshold
+        regressions += regression
+        print("{:<20} {:<70} {:10.3f} ms -> {:10.3f} ms  x{:5.2f}{}".format(
+            case["name"],
+            ", ".join("{}={}".format(key, value) for key, value in sorted(case["params"].items())),
+            previous_case["median_ms"],
+            case["median_ms"],
+            ratio,
+            "  REGRESSION" if regression else ""))
+    return regressions
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--output", dest="output", default="benchmark_results.json",
+                      help="file to write the results to, as JSON")
+    parser.add_option("--compare", dest="compare", help="results of an earlier run to compare against")
+    parser.add_option("--threshold", dest="threshold", type="float", default=1.2,
+                      help="how many times slower a case has to be to be reported as a regression")
+    parser.add_option("--sizes", dest="sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                      help="comma separated list of the number of samples in each samplesheet")
+    parser.add_option("--samples", dest="samples", type="int", default=DEFAULT_RUNFOLDER_SAMPLES,
+                      help="number of samples in the runfolders used for commands and requests")
+    parser.add_option("--repeats", dest="repeats", type="int", default=5)
+    parser.add_option("--requests", dest="requests", type="int", default=20)
+    (options, args) = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cases = []
+        cases.extend(bench_samplesheets(tmp_dir, map(int, options.sizes.split(",")), options.repeats))
+        cases.extend(bench_commands(tmp_dir, options.samples, options.repeats))
+        cases.extend(bench_requests(tmp_dir, options.samples, options.requests))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "results": cases}
+    with open(options.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    for case in cases:
+        print("{:<20} {:<70} median {:10.3f} ms  best {:10.3f} ms".format(
+            case["name"],
+            ", ".join("{}={}".format(key, value) for key, value in sorted(case["params"].items())),
+            case["median_ms"],
+            case["best_ms"]))
+    print("Results written to {}".format(options.output))
+
+    if options.compare:
+        with open(options.compare) as f:
+            previous_results = json.load(f)
+        print("\nCompared to {} ({}):".format(options.compare, previous_results.get("created")))
+        if compare(results, previous_results, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
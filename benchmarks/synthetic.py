@@ -0,0 +1,125 @@
+"""
+Generators for synthetic runfolder data used by the benchmarks.
+"""
+
+import os
+import random
+
+from bcl2fastq.lib.illumina import machine_type_mappings
+
+BASES = "ACGT"
+
+# The number of lanes on the flowcells of each machine type.
+LANES_PER_MACHINE_TYPE = {"MiSeq": 1,
+                          "HiSeq 2500": 8,
+                          "HiSeq 2000": 8,
+                          "HiSeq X": 8,
+                          "NovaSeq": 4,
+                          "NextSeq 500": 4,
+                          "HiSeq 4000": 8,
+                          "ISeq 100": 1,
+                          "NovaSeq X Plus": 8}
+
+# An instrument id for each machine type, which maps back to it through `machine_type_mappings`.
+INSTRUMENT_IDS = {machine_type: "{}00123".format(prefix) for prefix, machine_type in machine_type_mappings.items()}
+
+
+def random_index(length, rng):
+    return "".join(rng.choice(BASES) for _ in range(length))
+
+
+def samplesheet_string(nbr_of_samples, nbr_of_lanes=8, index1_length=8, index2_length=8, seed=1,
+                       single_index_lanes=()):
+    """
+    Create a samplesheet with `nbr_of_samples` samples spread evenly over `nbr_of_lanes` lanes.
+    :param nbr_of_samples: number of rows in the `[Data]` section
+    :param nbr_of_lanes: number of lanes to spread the samples over
+    :param index1_length: length of the first index
+    :param index2_length: length of the second index (0 for single index)
+    :param seed: seed for the random indexes, so that the same samplesheet can be recreated
+    :param single_index_lanes: lanes in which the samples only have the first index
+    :return: the samplesheet as a string
+    """
+    rng = random.Random(seed)
+    lines = ["[Header],,,,,,,,,,",
+             "IEMFileVersion,4,,,,,,,,,",
+             "Experiment Name,synthetic,,,,,,,,,",
+             "Date,1/1/2020,,,,,,,,,",
+             "Workflow,GenerateFASTQ,,,,,,,,,",
+             ",,,,,,,,,,",
+             "[Reads],,,,,,,,,,",
+             "151,,,,,,,,,,",
+             "151,,,,,,,,,,",
+             ",,,,,,,,,,",
+             "[Settings],,,,,,,,,,",
+             "Adapter,AGATCGGAAGAGCACACGTCTGAACTCCAGTCA,,,,,,,,,",
+             ",,,,,,,,,,",
+             "[Data],,,,,,,,,,",
+             "Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,I7_Index_ID,index,I5_Index_ID,index2,"
+             "Sample_Project,Description"]
+    for sample in range(nbr_of_samples):
+        lane = sample % nbr_of_lanes + 1
+        index2 = random_index(index2_length, rng) if index2_length and lane not in single_index_lanes else ""
+        lines.append("{lane},Sample_{nbr},Sample_{nbr},Plate_{plate},A{well},I7_{nbr},{index1},I5_{nbr},{index2},"
+                     "Project_{project},synthetic sample".format(lane=lane,
+                                                                 nbr=sample,
+                                                                 plate=sample // 96,
+                                                                 well=sample % 96,
+                                                                 index1=random_index(index1_length, rng),
+                                                                 index2=index2,
+                                                                 project=sample % 10))
+    return "\n".join(lines) + "\n"
+
+
+def write_samplesheet(path, nbr_of_samples, **kwargs):
+    with open(path, "w") as f:
+        f.write(samplesheet_string(nbr_of_samples, **kwargs))
+
+
+def run_info_xml(run_id, instrument, nbr_of_lanes, read_lengths=(151, 8, 8, 151), tiles_per_swath=24):
+    """
+    Create a RunInfo.xml.
+    :param run_id: the id (i.e. name) of the run
+    :param instrument: the instrument id, which decides the machine type
+    :param nbr_of_lanes: the number of lanes of the flowcell
+    :param read_lengths: the number of cycles of each read, reads of less than 10 cycles are index reads
+    :param tiles_per_swath: the number of tiles in each swath of the flowcell layout
+    :return: the RunInfo.xml as a string
+    """
+    reads = "\n".join('      <Read Number="{}" NumCycles="{}" IsIndexedRead="{}" />'.format(
+        number, length, "Y" if length < 10 else "N") for number, length in enumerate(read_lengths, 1))
+    return """<?xml version="1.0"?>
+<RunInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" Version="2">
+  <Run Id="{run_id}" Number="1">
+    <Flowcell>SYNTHETIC</Flowcell>
+    <Instrument>{instrument}</Instrument>
+    <Date>200101</Date>
+    <Reads>
+{reads}
+    </Reads>
+    <FlowcellLayout LaneCount="{lanes}" SurfaceCount="2" SwathCount="2" TileCount="{tiles}" />
+  </Run>
+</RunInfo>
+""".format(run_id=run_id, instrument=instrument, reads=reads, lanes=nbr_of_lanes, tiles=tiles_per_swath)
+
+
+def write_runfolder(parent_dir, machine_type, nbr_of_samples, nbr_of_lanes=None, **kwargs):
+    """
+    Create a runfolder with a RunInfo.xml and a SampleSheet.csv (but without any data).
+    :param parent_dir: the directory to create the runfolder in
+    :param machine_type: one of the machine types in `machine_type_mappings`
+    :param nbr_of_samples: number of rows in the samplesheet
+    :param nbr_of_lanes: number of lanes (defaults to the number of lanes of the machine type)
+    :param kwargs: passed on to `samplesheet_string`
+    :return: the path to the runfolder
+    """
+    nbr_of_lanes = nbr_of_lanes or LANES_PER_MACHINE_TYPE[machine_type]
+    instrument = INSTRUMENT_IDS[machine_type]
+    run_id = "200101_{}_0001_SYNTHETIC{}".format(instrument, nbr_of_samples)
+    runfolder = os.path.join(parent_dir, run_id)
+    os.makedirs(runfolder)
+    with open(os.path.join(runfolder, "RunInfo.xml"), "w") as f:
+        f.write(run_info_xml(run_id, instrument, nbr_of_lanes))
+    write_samplesheet(os.path.join(runfolder, "SampleSheet.csv"), nbr_of_samples,
+                      nbr_of_lanes=nbr_of_lanes, **kwargs)
+    return runfolder
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+A stand-in for a batch scheduler, used to test `BatchSchedulerAdapter`. Jobs are run
+in the background on the local machine, and their state is kept in a state directory.
+
+    fake_scheduler.py submit <state dir> <script> <stdout> <stderr>
+    fake_scheduler.py status <state dir> <job id>...
+    fake_scheduler.py cancel <state dir> <job id>...
+"""
+
+import os
+import signal
+import subprocess
+import sys
+
+
+def submit(state_dir, script, stdout, stderr):
+    job_ids = [int(name.split(".")[0]) for name in os.listdir(state_dir) if name.endswith(".pid")]
+    job_id = max(job_ids or [1000]) + 1
+    exit_file = os.path.join(state_dir, "{}.exit".format(job_id))
+    # The job must not hold on to the output of this script, since the caller waits for it to close.
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen("sh {} > {} 2> {}; echo $? > {}".format(script, stdout, stderr, exit_file),
+                                   shell=True, preexec_fn=os.setsid, stdout=devnull, stderr=devnull,
+                                   close_fds=True)
+    with open(os.path.join(state_dir, "{}.pid".format(job_id)), "w") as f:
+        f.write(str(process.pid))
+    print("{};cluster".format(job_id))
+
+
+def state_of(state_dir, job_id):
+    if not os.path.exists(os.path.join(state_dir, "{}.pid".format(job_id))):
+        return None
+    if os.path.exists(os.path.join(state_dir, "{}.cancelled".format(job_id))):
+        return "CANCELLED by 0"
+    exit_file = os.path.join(state_dir, "{}.exit".format(job_id))
+    if os.path.exists(exit_file):
+        with open(exit_file) as f:
+            exit_code = f.read().strip()
+        if exit_code == "":
+            return "RUNNING"
+        return "COMPLETED" if exit_code == "0" else "FAILED"
+    return "RUNNING"
+
+
+def status(state_dir, job_ids):
+    for job_id in job_ids:
+        state = state_of(state_dir, job_id)
+        if state:
+            print("{}|{}".format(job_id, state))
+            print("{}.batch|{}".format(job_id, state))
+
+
+def cancel(state_dir, job_ids):
+    for job_id in job_ids:
+        with open(os.path.join(state_dir, "{}.pid".format(job_id))) as f:
+            pid = int(f.read())
+        open(os.path.join(state_dir, "{}.cancelled".format(job_id)), "w").close()
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    action, state_dir, arguments = sys.argv[1], sys.argv[2], sys.argv[3:]
+    if action == "submit":
+        submit(state_dir, *arguments)
+    elif action == "status":
+        status(state_dir, arguments)
+    elif action == "cancel":
+        cancel(state_dir, arguments)
+    else:
+        sys.exit("Unknown action: {}".format(action))
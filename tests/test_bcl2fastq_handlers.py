@@ -3,11 +3,18 @@ from tornado.testing import *
 from tornado.escape import json_encode
 import mock
 from test_utils import TestUtils, DummyConfig, DummyRunnerConfig
+import gzip
 import shutil
+import tempfile
+import threading
 
 from bcl2fastq.handlers.bcl2fastq_handlers import *
 from bcl2fastq.lib.bcl2fastq_utils import BCL2Fastq2xRunner, BCL2FastqRunner
 from bcl2fastq.lib.bcl2fastq_logs import Bcl2FastqLogFileProvider
+from bcl2fastq.lib.fingerprint import write_fingerprint
+from bcl2fastq.lib.jobstore import JobStore
+from bcl2fastq.lib.output_reaper import OutputReaper
+from bcl2fastq.lib.thread_profiles import ThreadProfile, ThreadProfiles
 from bcl2fastq.app import routes
 from tornado.web import Application
 from test_utils import FakeRunner
@@ -42,6 +49,89 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
         response = self.fetch(self.API_BASE + "/versions")
         self.assertEqual(response.code, 200)
         self.assertEqual(sorted(json.loads(response.body)), sorted(["2.15.2", "1.8.4"]))
+        self.assertEqual(json.loads(response.body)["1.8.4"]["detected_version"], "1.8.4")
+
+    def test_autotune(self):
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"), \
+             mock.patch.object(RunfolderMetadata, 'for_runfolder') as for_runfolder, \
+             mock.patch.object(BCL2Fastq2xRunner, '_construct_command', return_value="bcl2fastq --tiles s_1_1101"):
+            for_runfolder.return_value.machine_type = "HiSeq X"
+
+            body = {"nbr_of_cores": 4}
+            response = self.fetch(
+                self.API_BASE + "/autotune/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode(body))
+
+            self.assertEqual(response.code, 202)
+            response_data = json.loads(response.body)
+            self.assertEqual(response_data["machine_type"], "HiSeq X")
+            self.assertEqual(len(response_data["candidates"]), 4)
+
+            # One job for the group, and one for each candidate.
+            self.assertEqual(response_data["job_id"], self.start_api_call_nbr())
+            for _ in response_data["candidates"]:
+                self.start_api_call_nbr()
+
+    def test_autotune_with_unknown_run(self):
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(RunfolderMetadata, 'for_runfolder', side_effect=IOError("No RunInfo.xml")):
+            response = self.fetch(self.API_BASE + "/autotune/150415_D00457_0091_AC6281ANXX", method="POST", body="")
+            self.assertEqual(response.code, 500)
+            self.assertIn("No RunInfo.xml", response.reason)
+
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(RunfolderMetadata, 'for_runfolder') as for_runfolder, \
+             mock.patch.object(JobStoreAdapter, 'start_group') as start_group:
+            for_runfolder.return_value.machine_type = None
+            response = self.fetch(self.API_BASE + "/autotune/150415_D00457_0091_AC6281ANXX", method="POST", body="")
+            self.assertEqual(response.code, 500)
+            self.assertFalse(start_group.called)
+
+    def test_autotune_with_batch_scheduler(self):
+        job_runner_config = {"type": "batch_scheduler", "batch_scheduler": {}}
+        with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"job_runner": job_runner_config}), \
+             mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(JobStoreAdapter, 'start_group') as start_group:
+            response = self.fetch(self.API_BASE + "/autotune/150415_D00457_0091_AC6281ANXX", method="POST", body="")
+            self.assertEqual(response.code, 500)
+            self.assertIn("local job runner", response.reason)
+            self.assertFalse(start_group.called)
+
+    def test_record_fastest_profile(self):
+        job_store = JobStore()
+        group_job_id = job_store.add_job("bcl2fastq\nbcl2fastq\nbcl2fastq", "runfolder", "/runfolder", 8)
+        candidates = [ThreadProfile(2, 4, 2, None), ThreadProfile(4, 4, 4, None), ThreadProfile(8, 4, 8, None)]
+        # The first candidate ran for 50 seconds, the second for 40 seconds after waiting for the first,
+        # and the last was never seen running, so only the time since it was created is known.
+        for started, finished in [(0, 50), (50, 90), (None, 20)]:
+            job_id = job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 8, parent_job_id=group_job_id)
+            created = job_store.get_job(job_id)["created"]
+            if started is not None:
+                job_store.set_state(job_id, State.STARTED, timestamp=created + started)
+            job_store.set_state(job_id, State.DONE, timestamp=created + finished)
+
+        thread_profiles = mock.MagicMock(fastest=ThreadProfiles.fastest)
+        AutotuneHandler.record_fastest_profile(job_store, thread_profiles, "HiSeq X", 8, "/output", candidates,
+                                               group_job_id)
+        thread_profiles.store.put.assert_called_once_with("HiSeq X", 8, candidates[1],
+                                                          [(candidates[0], 50), (candidates[1], 40)])
+
+        job_store = JobStore()
+        group_job_id = job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 8)
+        job_id = job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 8, parent_job_id=group_job_id)
+        job_store.set_state(job_id, State.DONE)
+        with self.assertRaises(ArteriaUsageException):
+            AutotuneHandler.record_fastest_profile(job_store, thread_profiles, "HiSeq X", 8, "/output",
+                                                   candidates[:1], group_job_id)
+
+    def test_autotune_missing_runfolder(self):
+        response = self.fetch(self.API_BASE + "/autotune/150415_D00457_0091_AC6281ANXX", method="POST", body="")
+        self.assertEqual(response.code, 500)
+
+    def test_autotune_profiles(self):
+        response = self.fetch(self.API_BASE + "/autotune/")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {})
 
     def test_start_missing_runfolder_in_body(self):
         response = self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body = "")
@@ -70,6 +160,40 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
             self.assertEqual(json.loads(response.body)["bcl2fastq_version"], "2.15.2")
             self.assertEqual(json.loads(response.body)["state"], "started")
 
+    def test_start_split_by_lane(self):
+        lane_commands = [(1, "bcl2fastq --tiles s_1", 2), (2, "bcl2fastq --tiles s_2", 2)]
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(shutil, 'rmtree', return_value=None), \
+             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"), \
+             mock.patch.object(BCL2FastqRunnerFactory, "create_bcl2fastq_runner",
+                               return_value=FakeRunner("2.15.2", self.DUMMY_RUNNER_CONF)), \
+             mock.patch.object(FakeRunner, "construct_lane_commands", return_value=lane_commands), \
+             mock.patch.object(BCL2FastqRunner, 'symlink_output_to_unaligned', return_value=None):
+
+            body = {"split_by_lane": True}
+            response = self.fetch(
+                self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode(body))
+
+            # One job for the group, and one for each lane.
+            group_job_id = self.start_api_call_nbr()
+            self.start_api_call_nbr()
+            self.start_api_call_nbr()
+
+            self.assertEqual(response.code, 202)
+            self.assertEqual(json.loads(response.body)["job_id"], group_job_id)
+            self.assertEqual(json.loads(response.body)["lanes"], [1, 2])
+            job_store = Bcl2FastqServiceMixin.runner_service(self.dummy_config).job_store
+            self.assertEqual([job["cmd"] for job in job_store.child_jobs(group_job_id)],
+                             ["bcl2fastq --tiles s_1", "bcl2fastq --tiles s_2"])
+
+    def test_start_with_invalid_lanes(self):
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"):
+            body = {"split_by_lane": True, "lanes": "1,x"}
+            response = self.fetch(
+                self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode(body))
+            self.assertEqual(response.code, 500)
+
     def test_start_with_empty_body(self):
         # Use mock to ensure that this will run without
         # creating the runfolder.
@@ -91,6 +215,229 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
             self.assertEqual(json.loads(response.body)["bcl2fastq_version"], "2.15.2")
             self.assertEqual(json.loads(response.body)["state"], "started")
 
+    def _plan_runfolder(self, runfolder_path):
+        runfolder = os.path.join(runfolder_path, "140213_D00251_0076_BH8FW8ADXX")
+        os.makedirs(runfolder)
+        shutil.copy("tests/sampledata/HiSeq-samples/2014-02_13_average_run/RunInfo.xml", runfolder)
+        # The index read of the runfolder is 7 cycles.
+        with open(os.path.join(runfolder, "SampleSheet.csv"), "w") as f:
+            f.write("[Data]\n"
+                    "Lane,Sample_ID,Sample_Name,index,Sample_Project\n"
+                    "1,1,1,ATTACTC,Test\n"
+                    "1,2,2,TCCGGAG,Test\n"
+                    "2,3,3,CGCTCA,Test\n")
+        return runfolder
+
+    @staticmethod
+    def _plan_config(runfolder_path):
+        machine_types = dict(DummyConfig.DUMMY_CONFIG["machine_type"])
+        machine_types["HiSeq 2500"] = {"bcl2fastq_version": "2.15.2"}
+        return {"runfolder_path": runfolder_path, "machine_type": machine_types}
+
+    def test_plan(self):
+        runfolder_path = tempfile.mkdtemp()
+        try:
+            runfolder = self._plan_runfolder(runfolder_path)
+            with mock.patch.dict(DummyConfig.DUMMY_CONFIG, self._plan_config(runfolder_path)), \
+                 mock.patch.object(BCL2Fastq2xRunner, 'version', return_value="2.15.2"):
+                response = self.fetch(self.API_BASE + "/plan/140213_D00251_0076_BH8FW8ADXX")
+                self.assertEqual(response.code, 200)
+                plan = json.loads(response.body)
+                self.assertFalse(plan["cached"])
+                self.assertEqual(plan["machine_type"], "HiSeq 2500")
+                self.assertEqual(len(plan["commands"]), 1)
+                self.assertIn("--use-bases-mask 1:y*,i7,y*", plan["commands"][0]["cmd"])
+                self.assertEqual(plan["bases_masks"]["2"], "y*,i6n*,y*")
+                self.assertEqual(plan["resources"]["nbr_of_samples"], 3)
+
+                self.assertIsNone(plan["commands"][0]["predicted_runtime_seconds"])
+                self.assertIsNone(plan["resources"]["predicted_runtime_seconds"])
+
+                # The runtimes are predicted when the plan is shown, also when it is cached.
+                with mock.patch.object(RuntimePredictor, 'predict', return_value=120.0):
+                    response = self.fetch(self.API_BASE + "/plan/140213_D00251_0076_BH8FW8ADXX", method="POST",
+                                          body="")
+                plan = json.loads(response.body)
+                self.assertTrue(plan["cached"])
+                self.assertEqual(plan["commands"][0]["predicted_runtime_seconds"], 120.0)
+                self.assertEqual(plan["resources"]["predicted_runtime_seconds"], 120.0)
+
+                # Making a plan has no side effects.
+                self.assertEqual(sorted(os.listdir(runfolder)), ["RunInfo.xml", "SampleSheet.csv"])
+        finally:
+            shutil.rmtree(runfolder_path)
+
+    def test_plan_split_by_lane_is_used_by_start(self):
+        runfolder_path = tempfile.mkdtemp()
+        try:
+            runfolder = self._plan_runfolder(runfolder_path)
+            body = json_encode({"split_by_lane": True, "lanes": [1, 2]})
+            with mock.patch.dict(DummyConfig.DUMMY_CONFIG, self._plan_config(runfolder_path)), \
+                 mock.patch.object(BCL2Fastq2xRunner, 'version', return_value="2.15.2"), \
+                 mock.patch.object(BCL2FastqRunner, 'delete_output', return_value=None), \
+                 mock.patch.object(BCL2FastqRunner, 'symlink_output_to_unaligned', return_value=None):
+                response = self.fetch(self.API_BASE + "/plan/140213_D00251_0076_BH8FW8ADXX", method="POST",
+                                      body=body)
+                self.assertEqual([command["lane"] for command in json.loads(response.body)["commands"]], [1, 2])
+                self.assertEqual(sorted(os.listdir(runfolder)), ["RunInfo.xml", "SampleSheet.csv"])
+
+                # How the job is started does not change the plan.
+                start_body = json_encode({"split_by_lane": True, "lanes": [1, 2], "force": True, "priority": 5})
+                with mock.patch.object(StartHandler, 'build_job') as build_job, \
+                     mock.patch.object(StartHandler, 'start_job', return_value={"job_id": 1}) as start_job:
+                    response = self.fetch(self.API_BASE + "/start/140213_D00251_0076_BH8FW8ADXX", method="POST",
+                                          body=start_body)
+                    self.assertFalse(build_job.called)
+                    self.assertEqual([lane for lane, _, _ in start_job.call_args[0][-1]], [1, 2])
+
+                self.assertEqual(response.code, 202)
+                self.assertTrue(os.path.exists(os.path.join(runfolder, "SampleSheet_L002.csv")))
+        finally:
+            shutil.rmtree(runfolder_path)
+
+    def test_start_with_up_to_date_output(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            self._plan_runfolder(tmp_dir)
+            output = os.path.join(tmp_dir, "output", "140213_D00251_0076_BH8FW8ADXX")
+            os.makedirs(output)
+            with open(os.path.join(output, "Sample_R1.fastq.gz"), "w") as f:
+                f.write("reads")
+            write_fingerprint(output, "abc")
+
+            config = dict(self._plan_config(tmp_dir), default_output_path=os.path.join(tmp_dir, "output"))
+            with mock.patch.dict(DummyConfig.DUMMY_CONFIG, config), \
+                 mock.patch.object(BCL2Fastq2xRunner, 'version', return_value="2.15.2"), \
+                 mock.patch.object(StartHandler, 'fingerprint', return_value="abc"), \
+                 mock.patch.object(StartHandler, 'clear_output') as clear_output, \
+                 mock.patch.object(StartHandler, 'start_job', return_value={"job_id": 1}) as start_job:
+                response = self.fetch(self.API_BASE + "/start/140213_D00251_0076_BH8FW8ADXX", method="POST",
+                                      body="")
+                job_id = self.start_api_call_nbr()
+
+                self.assertEqual(response.code, 202)
+                self.assertEqual(json.loads(response.body)["state"], State.DONE)
+                self.assertTrue(json.loads(response.body)["output_reused"])
+                self.assertEqual(json.loads(response.body)["job_id"], job_id)
+                self.assertEqual(Bcl2FastqServiceMixin.runner_service(self.dummy_config).status(job_id), State.DONE)
+                self.assertFalse(clear_output.called)
+                self.assertFalse(start_job.called)
+
+                # Unless it is forced, in which case the output is made again.
+                response = self.fetch(self.API_BASE + "/start/140213_D00251_0076_BH8FW8ADXX", method="POST",
+                                      body=json_encode({"force": True}))
+                self.assertEqual(response.code, 202)
+                self.assertTrue(clear_output.called)
+                kwargs = start_job.call_args[1]
+                self.assertEqual((kwargs["fingerprint"], kwargs["priority"]), ("abc", 0))
+                # The job is estimated off the IOLoop, when it is prepared.
+                self.assertEqual([features["machine_type"] for _, features in kwargs["estimates"]], ["HiSeq 2500"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_start_with_priority(self):
+        prepared_job = (None, None, "2.15.2", None, "bcl2fastq")
+        with mock.patch.object(StartHandler, 'prepare_job', return_value=(prepared_job, "abc", False, None)), \
+             mock.patch.object(StartHandler, 'start_job', return_value={"job_id": 1}) as start_job:
+            response = self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST",
+                                  body=json_encode({"priority": "10"}))
+            self.assertEqual(response.code, 202)
+            self.assertEqual(start_job.call_args[1]["priority"], 10)
+
+            for priority in ["high", 1.5, True]:
+                response = self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST",
+                                      body=json_encode({"priority": priority}))
+                self.assertEqual(response.code, 500)
+            self.assertEqual(start_job.call_count, 1)
+
+    def test_staging_has_its_own_executor(self):
+        with mock.patch.object(Bcl2FastqServiceMixin, "_staging_executor", None):
+            staging_executor = Bcl2FastqServiceMixin.staging_executor({"staging_copy_threads": 2})
+            self.assertIsNot(staging_executor, Bcl2FastqServiceMixin.executor(self.dummy_config))
+            self.assertEqual(staging_executor._max_workers, 2)
+            staging_executor.shutdown()
+
+    def test_finish_output(self):
+        job_runner = mock.MagicMock()
+        job_runner.config.split_by_lane = True
+        job_runner.config.scratch = None
+        StartHandler.finish_output(job_runner)
+        self.assertTrue(job_runner.merge_lane_outputs.called)
+        self.assertFalse(job_runner.move_staged_output.called)
+
+        job_runner = mock.MagicMock()
+        job_runner.config.split_by_lane = False
+        job_runner.config.scratch = "/scratch/runfolder"
+        output_reaper = mock.MagicMock()
+        StartHandler.finish_output(job_runner, output_reaper)
+        self.assertFalse(job_runner.merge_lane_outputs.called)
+        job_runner.move_staged_output.assert_called_once_with(output_reaper)
+
+    def test_plan_with_samplesheet(self):
+        with mock.patch.object(os.path, 'isdir', return_value=True):
+            body = {"samplesheet": TestUtils.DUMMY_SAMPLESHEET_STRING}
+            response = self.fetch(self.API_BASE + "/plan/150415_D00457_0091_AC6281ANXX", method="POST",
+                                  body=json_encode(body))
+            self.assertEqual(response.code, 500)
+
+    def test_start_batch(self):
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(shutil, 'rmtree', return_value=None), \
+             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"), \
+             mock.patch.object(BCL2FastqRunnerFactory, "create_bcl2fastq_runner",
+                               return_value=FakeRunner("2.15.2", self.DUMMY_RUNNER_CONF)), \
+             mock.patch.object(BCL2FastqRunner, 'symlink_output_to_unaligned', return_value=None) as symlink:
+
+            body = {"runfolders": ["150415_D00457_0091_AC6281ANXX",
+                                   {"runfolder": "150415_D00457_0092_AC6281ANXX", "tiles": "s_1"}],
+                    "defaults": {"barcode_mismatches": "0"}}
+            response = self.fetch(self.API_BASE + "/start_batch", method="POST", body=json_encode(body))
+
+            api_call_nbrs = [self.start_api_call_nbr(), self.start_api_call_nbr()]
+
+            self.assertEqual(response.code, 202)
+            jobs = json.loads(response.body)["jobs"]
+            self.assertEqual([job["runfolder"] for job in jobs],
+                             ["150415_D00457_0091_AC6281ANXX", "150415_D00457_0092_AC6281ANXX"])
+            self.assertEqual([job["job_id"] for job in jobs], api_call_nbrs)
+            self.assertEqual(jobs[1]["link"],
+                             "http://localhost:{0}/api/1.0/status/{1}".format(self.get_http_port(), api_call_nbrs[1]))
+            self.assertEqual(symlink.call_count, 2)
+
+    def test_start_batch_nothing_started_on_failure(self):
+        def isdir(path):
+            return not path.endswith("missing_runfolder")
+
+        with mock.patch.object(os.path, 'isdir', side_effect=isdir), \
+             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"), \
+             mock.patch.object(BCL2FastqRunnerFactory, "create_bcl2fastq_runner",
+                               return_value=FakeRunner("2.15.2", self.DUMMY_RUNNER_CONF)), \
+             mock.patch.object(BCL2FastqRunner, 'delete_output') as delete_output, \
+             mock.patch.object(Bcl2FastqConfig, 'write_pending_samplesheet') as write_samplesheet, \
+             mock.patch.object(Bcl2FastqConfig, 'discard_pending_samplesheet') as discard_samplesheet, \
+             mock.patch.object(JobStoreAdapter, 'start') as start:
+
+            body = {"runfolders": [{"runfolder": "150415_D00457_0091_AC6281ANXX",
+                                    "samplesheet": TestUtils.DUMMY_SAMPLESHEET_STRING},
+                                   "missing_runfolder"]}
+            response = self.fetch(self.API_BASE + "/start_batch", method="POST", body=json_encode(body))
+
+            self.assertEqual(response.code, 500)
+            self.assertEqual(list(json.loads(response.body)["errors"]), ["missing_runfolder"])
+            # The provided samplesheet is not written to the runfolder, since not all runfolders were valid.
+            self.assertFalse(write_samplesheet.called)
+            self.assertEqual(discard_samplesheet.call_count, 1)
+            self.assertFalse(delete_output.called)
+            self.assertFalse(start.called)
+
+    def test_start_batch_with_duplicates(self):
+        body = {"runfolders": ["150415_D00457_0091_AC6281ANXX", {"runfolder": "150415_D00457_0091_AC6281ANXX"}]}
+        response = self.fetch(self.API_BASE + "/start_batch", method="POST", body=json_encode(body))
+        self.assertEqual(response.code, 400)
+
+        response = self.fetch(self.API_BASE + "/start_batch", method="POST", body=json_encode({"runfolders": []}))
+        self.assertEqual(response.code, 400)
+
     def test_start_with_disallowed_output_specified(self):
 
         # TODO Please note that this test is not very good, since the
@@ -103,6 +450,7 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
                                                             general_config=self.dummy_config)
         with mock.patch.object(os.path, 'isdir', return_value=True), \
              mock.patch.object(shutil, 'rmtree', return_value=None) as rmmock, \
+             mock.patch.object(OutputReaper, 'move_to_trash', return_value=None) as trashmock, \
              mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"), \
              mock.patch.object(BCL2FastqRunnerFactory, "create_bcl2fastq_runner",
                                return_value=FakeRunner("2.15.2", runner_conf_with_invalid_output)), \
@@ -118,10 +466,13 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
                 self.assertEqual(response.reason, "Invalid output directory /not/foo/bar/runfolder was specified."
                                                   " Allowed dirs were: ['/foo/bar']")
                 rmmock.assert_not_called()
+                trashmock.assert_not_called()
 
     def test_start_with_allowed_output_specified(self):
         with mock.patch.object(os.path, 'isdir', return_value=True), \
-            mock.patch.object(shutil, 'rmtree', return_value=None) as rmmock, \
+            mock.patch.object(OutputReaper, 'move_to_trash',
+                              return_value='/foo/bar/.bcl2fastq_trash/runfolder') as trashmock, \
+            mock.patch.object(OutputReaper, 'schedule', return_value=None) as schedulemock, \
             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"), \
             mock.patch.object(BCL2FastqRunnerFactory, "create_bcl2fastq_runner",
                               return_value=FakeRunner("2.15.2", self.DUMMY_RUNNER_CONF)), \
@@ -134,7 +485,8 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
                 # Just increment it here so it doesn't break the other tests
                 self.start_api_call_nbr()
                 self.assertEqual(response.code, 202)
-                rmmock.assert_called_with('/foo/bar/runfolder')
+                trashmock.assert_called_with('/foo/bar/runfolder', '/foo/bar')
+                schedulemock.assert_called_with('/foo/bar/.bcl2fastq_trash/runfolder')
 
     def test_start_providing_samplesheet(self):
         # Use mock to ensure that this will run without
@@ -172,6 +524,112 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
         response = self.fetch(self.API_BASE + "/status/", method="GET")
         self.assertEqual(response.code, 200)
 
+    def test_status_with_progress(self):
+        progress = {"tiles_processed": 10, "tiles_total": 40, "percent_complete": 25.0,
+                    "tiles_per_minute": 5.0, "eta_seconds": 360, "eta": "2016-01-01T12:06:00"}
+        with mock.patch.object(JobStoreAdapter, 'status', return_value=State.STARTED), \
+             mock.patch.object(StatusHandler, 'job_progress', return_value=progress) as job_progress:
+            response = self.fetch(self.API_BASE + "/status/7", method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(json.loads(response.body), {"state": State.STARTED, "progress": progress})
+            job_progress.assert_called_once_with("7")
+
+    def test_status_with_queue_position(self):
+        expected_start = time.mktime((2016, 1, 1, 12, 0, 0, 0, 0, -1))
+        with mock.patch.object(JobStoreAdapter, 'status', return_value=State.PENDING), \
+             mock.patch.object(JobStoreAdapter, 'queue_status',
+                               return_value={7: {"queue_position": 2, "expected_start": expected_start}}):
+            response = self.fetch(self.API_BASE + "/status/7", method="GET")
+            self.assertEqual(json.loads(response.body), {"state": State.PENDING,
+                                                         "queue_position": 2,
+                                                         "expected_start": "2016-01-01T12:00:00"})
+
+    def test_status_with_predicted_runtime(self):
+        expected_end = time.mktime((2016, 1, 1, 13, 0, 0, 0, 0, -1))
+        with mock.patch.object(JobStoreAdapter, 'status', return_value=State.PENDING), \
+             mock.patch.object(JobStoreAdapter, 'queue_status', return_value={}), \
+             mock.patch('bcl2fastq.handlers.bcl2fastq_handlers.job_estimate',
+                        return_value={"predicted_runtime": 3600.0, "expected_end": expected_end}):
+            response = self.fetch(self.API_BASE + "/status/7", method="GET")
+            self.assertEqual(json.loads(response.body), {"state": State.PENDING,
+                                                         "predicted_runtime": 3600.0,
+                                                         "expected_end": "2016-01-01T13:00:00"})
+
+    def test_status_without_progress_when_not_started(self):
+        with mock.patch.object(JobStoreAdapter, 'status', return_value=State.DONE), \
+             mock.patch.object(StatusHandler, 'job_progress') as job_progress:
+            response = self.fetch(self.API_BASE + "/status/7", method="GET")
+            self.assertEqual(json.loads(response.body), {"state": State.DONE})
+            self.assertFalse(job_progress.called)
+
+    def test_resources(self):
+        job_store = Bcl2FastqServiceMixin.runner_service(self.dummy_config).job_store
+        job_id = job_store.add_job("bcl2fastq", "coolest_runfolder", "/runfolders/coolest_runfolder", 8,
+                                   state=State.DONE)
+        # Keep the count of jobs, which the job ids of the other tests follow.
+        self.start_api_call_nbr()
+        job_store.add_resource_sample(job_id, {"cpu_seconds": 10.0, "rss_bytes": 2000, "output_bytes": 0},
+                                      timestamp=100)
+        job_store.add_resource_sample(job_id, {"cpu_seconds": 50.0, "rss_bytes": 1000, "output_bytes": 500},
+                                      timestamp=110)
+
+        response = self.fetch(self.API_BASE + "/resources/{}".format(job_id), method="GET")
+        self.assertEqual(response.code, 200)
+        resources = json.loads(response.body)
+        self.assertEqual([sample["cpu_seconds"] for sample in resources["samples"]], [10.0, 50.0])
+        self.assertEqual(resources["summary"]["max_rss_bytes"], 2000)
+        self.assertEqual(resources["summary"]["average_cores_used"], 4.0)
+        self.assertEqual(resources["summary"]["output_bytes_per_second"], 50.0)
+
+        response = self.fetch(self.API_BASE + "/status/{}".format(job_id), method="GET")
+        self.assertEqual(json.loads(response.body)["resources"], resources["summary"])
+        # The resources of finished jobs are left out of the status of all jobs.
+        response = self.fetch(self.API_BASE + "/status/", method="GET")
+        self.assertNotIn("resources", json.loads(response.body)[str(job_id)])
+
+        response = self.fetch(self.API_BASE + "/resources/123456", method="GET")
+        self.assertEqual(response.code, 404)
+
+    def test_metrics(self):
+        self.fetch(self.API_BASE + "/versions")
+        response = self.fetch(self.API_BASE + "/metrics")
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn('bcl2fastq_http_request_duration_seconds_count{route="versions",method="GET",code="200"}',
+                      response.body)
+        self.assertIn("bcl2fastq_queue_depth", response.body)
+
+    def test_start_failure_metrics(self):
+        start_failures = Bcl2FastqServiceMixin.metrics(self.dummy_config).start_failures
+        failures_before = start_failures.value(reason="usage_error")
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(Bcl2FastqConfig, 'get_bcl2fastq_version_from_run_parameters', return_value="2.15.2"):
+            body = {"split_by_lane": True, "lanes": "1,x"}
+            self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode(body))
+        self.assertEqual(start_failures.value(reason="usage_error"), failures_before + 1)
+
+    def test_stats(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            stats_file = os.path.join(tmp_dir, "Stats.json")
+            with open(stats_file, "w") as f:
+                json.dump({"Flowcell": "H8FW8ADXX",
+                           "ConversionResults": [{"LaneNumber": 1, "DemuxResults": []},
+                                                 {"LaneNumber": 2, "DemuxResults": []}]}, f)
+            with mock.patch.object(StatsHandler, 'stats_files', return_value=(stats_file, None)):
+                response = self.fetch(self.API_BASE + "/stats/150415_D00457_0091_AC6281ANXX?lane=2")
+                self.assertEqual(response.code, 200)
+                self.assertEqual([lane["lane"] for lane in json.loads(response.body)["lanes"]], [2])
+
+                response = self.fetch(self.API_BASE + "/stats/150415_D00457_0091_AC6281ANXX?lane=x")
+                self.assertEqual(response.code, 400)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_stats_missing(self):
+        response = self.fetch(self.API_BASE + "/stats/no_such_runfolder")
+        self.assertEqual(response.code, 404)
+
     def test_all_stop_handler(self):
         response = self.fetch(self.API_BASE + "/stop/all", method="POST", body = "")
         self.assertEqual(response.code, 200)
@@ -184,11 +642,124 @@ class TestBcl2FastqHandlers(AsyncHTTPTestCase):
         response = self.fetch(self.API_BASE + "/stop/lll", method="POST", body = "")
         self.assertEqual(response.code, 500)
 
+    def _write_log(self, runfolder, content):
+        log_file = Bcl2FastqLogFileProvider(self.dummy_config).log_file_path(runfolder)
+        with open(log_file, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, log_file)
+
     def test_get_logs(self):
-        with mock.patch.object(Bcl2FastqLogFileProvider, "get_log_for_runfolder", return_value="This is a string"):
+        self._write_log("coolest_runfolder", "This is a string")
+        response = self.fetch(self.API_BASE + "/logs/coolest_runfolder", method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["log"], "This is a string")
+        self.assertEqual(json.loads(response.body)["next_offset"], len("This is a string"))
+
+    def test_get_logs_with_offset_and_limit(self):
+        self._write_log("coolest_runfolder", "This is a string")
+        response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?offset=5&limit=2", method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["log"], "is")
+        self.assertEqual(json.loads(response.body)["next_offset"], 7)
+
+    def test_get_logs_with_tail(self):
+        self._write_log("coolest_runfolder", "first\nsecond\nthird\n")
+        response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?tail=2", method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["log"], "second\nthird\n")
+
+    def test_get_logs_follow_returns_when_nothing_is_appended(self):
+        self._write_log("coolest_runfolder", "This is a string")
+        response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?offset=16&follow=true&timeout=0",
+                              method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["log"], "")
+        self.assertEqual(json.loads(response.body)["next_offset"], 16)
+
+    def test_get_archived_logs(self):
+        log_dir = tempfile.mkdtemp()
+        try:
+            for job_id, content in [(3, "first\nattempt\n"), (5, "second\nattempt\n")]:
+                with gzip.open(os.path.join(log_dir, "coolest_runfolder.{}.log.gz".format(job_id)), "wb") as f:
+                    f.write(content)
+
+            with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"bcl2fastq_logs_path": log_dir}):
+                response = self.fetch(self.API_BASE + "/logs/coolest_runfolder", method="GET")
+                self.assertEqual(response.code, 200)
+                self.assertEqual(json.loads(response.body)["log"], "second\nattempt\n")
+
+                response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?job_id=3&tail=1", method="GET")
+                self.assertEqual(response.code, 200)
+                self.assertEqual(json.loads(response.body)["log"], "attempt\n")
+                self.assertEqual(json.loads(response.body)["offset"], 6)
+
+                response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?job_id=4", method="GET")
+                self.assertEqual(response.code, 500)
+        finally:
+            shutil.rmtree(log_dir)
+
+    def test_get_logs_reads_the_log_off_the_ioloop(self):
+        self._write_log("coolest_runfolder", "first\nsecond\n")
+        ioloop_thread = threading.current_thread()
+        threads = []
+
+        def offset_for_tail(provider, runfolder, nbr_of_lines, job_id=None):
+            threads.append(threading.current_thread())
+            return 6
+
+        with mock.patch.object(Bcl2FastqLogFileProvider, "offset_for_tail", offset_for_tail):
+            response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?tail=1", method="GET")
+        self.assertEqual(json.loads(response.body)["log"], "second\n")
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], ioloop_thread)
+
+    def test_log_search(self):
+        log_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(log_dir, "coolest_runfolder.log"), "w") as f:
+                f.write("[1] WARNING: missing bcl\n[1] ERROR: corrupt filter file\n")
+            with gzip.open(os.path.join(log_dir, "coolest_runfolder.3.log.gz"), "wb") as f:
+                f.write("[1] ERROR: an earlier attempt\n")
+
+            with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"bcl2fastq_logs_path": log_dir}):
+                response = self.fetch(self.API_BASE + "/log_search/coolest_runfolder?severity=warning")
+                self.assertEqual(response.code, 200)
+                self.assertEqual([hit["line_number"] for hit in json.loads(response.body)["hits"]], [1, 2])
+
+                response = self.fetch(self.API_BASE + "/log_search/?severity=error&pattern=filter|earlier")
+                self.assertEqual(response.code, 200)
+                self.assertEqual([hit["log"] for hit in json.loads(response.body)["hits"]],
+                                 ["coolest_runfolder.3.log.gz", "coolest_runfolder.log"])
+
+                response = self.fetch(self.API_BASE + "/log_search/coolest_runfolder?job_id=3&pattern=attempt")
+                self.assertEqual(json.loads(response.body)["hits"][0]["line"], "[1] ERROR: an earlier attempt")
+        finally:
+            shutil.rmtree(log_dir)
+
+    def test_log_search_invalid_arguments(self):
+        for query in ["", "severity=fatal", "pattern=(", "severity=error&limit=0", "severity=error&job_id=1"]:
+            response = self.fetch(self.API_BASE + "/log_search/?" + query)
+            self.assertEqual(response.code, 400, query)
+
+    def test_get_logs_invalid_offset(self):
+        response = self.fetch(self.API_BASE + "/logs/coolest_runfolder?offset=-1", method="GET")
+        self.assertEqual(response.code, 400)
+
+    def test_get_logs_missing_log(self):
+        response = self.fetch(self.API_BASE + "/logs/runfolder_without_log", method="GET")
+        self.assertEqual(response.code, 500)
+
+    def test_get_logs_rotated_while_reading(self):
+        self._write_log("coolest_runfolder", "This is a string")
+        with mock.patch("bcl2fastq.lib.bcl2fastq_logs.open_log_file",
+                        side_effect=IOError(errno.ENOENT, "No such file or directory")):
             response = self.fetch(self.API_BASE + "/logs/coolest_runfolder", method="GET")
-            self.assertEqual(response.code, 200)
-            self.assertEqual(json.loads(response.body)["log"], "This is a string")
+        self.assertEqual(response.code, 404)
+
+    def test_reaper_status(self):
+        response = self.fetch(self.API_BASE + "/reaper", method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertIn("bytes_reclaimed", json.loads(response.body))
 
     def test_get_logs_trying_to_reach_other_files(self):
         response = self.fetch(self.API_BASE + "/logs/../../../etc/shadow", method="GET")
@@ -1,17 +1,18 @@
 
 import unittest
-from mock import MagicMock, patch, mock_open
+import gzip
+import os
+import tempfile
+import shutil
+import time
+from mock import MagicMock, patch
 
-from bcl2fastq.lib.bcl2fastq_logs import Bcl2FastqLogFileProvider
+from arteria.web.state import State
+
+from bcl2fastq.lib.bcl2fastq_logs import Bcl2FastqLogFileProvider, LogArchiver
 
 class TestBcl2FastqLogFileProvider(unittest.TestCase):
 
-    fake_file_content = """
-    This is a nice multi-line
-    string for
-    you
-    my friend
-    """
     fake_path = "/fake/path"
     mock_config = MagicMock()
     mock_config.__getitem__.return_value = fake_path
@@ -23,13 +24,146 @@ class TestBcl2FastqLogFileProvider(unittest.TestCase):
         log_file = self.log_filer_provider.log_file_path(self.runfolder)
         self.assertEqual(log_file, "{}/{}.log".format(self.fake_path, self.runfolder))
 
-    def test_get_log_for_runfolder(self):
-        with patch("__builtin__.open", mock_open(read_data=self.fake_file_content), create=True):
-            file_content = self.log_filer_provider.get_log_for_runfolder(self.runfolder)
-            self.assertEqual(file_content, self.fake_file_content)
 
-    def test_get_log_for_runfolder_does_not_exist(self):
+class TestBcl2FastqLogFileProviderStreaming(unittest.TestCase):
+
+    runfolder = "160218_ST-E00215_0070_BHKGLFCCXX"
+    log_content = "line 1\nline 2\nline 3\nline 4\n"
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file_provider = Bcl2FastqLogFileProvider({"bcl2fastq_logs_path": self.log_dir})
+        with open(self.log_file_provider.log_file_path(self.runfolder), "w") as f:
+            f.write(self.log_content)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_log_size(self):
+        self.assertEqual(self.log_file_provider.log_size(self.runfolder), len(self.log_content))
+
+    def test_offset_for_tail(self):
+        offset = self.log_file_provider.offset_for_tail(self.runfolder, 2)
+        self.assertEqual(self.log_content[offset:], "line 3\nline 4\n")
+
+    def test_offset_for_tail_more_lines_than_in_log(self):
+        self.assertEqual(self.log_file_provider.offset_for_tail(self.runfolder, 10), 0)
+
+    def test_offset_for_tail_spanning_chunks(self):
+        with patch.object(Bcl2FastqLogFileProvider, "CHUNK_SIZE", 4):
+            offset = self.log_file_provider.offset_for_tail(self.runfolder, 3)
+        self.assertEqual(self.log_content[offset:], "line 2\nline 3\nline 4\n")
+
+    def test_iter_log_chunks(self):
+        with patch.object(Bcl2FastqLogFileProvider, "CHUNK_SIZE", 5):
+            chunks = list(self.log_file_provider.iter_log_chunks(self.runfolder))
+        self.assertTrue(all(len(chunk) <= 5 for chunk in chunks))
+        self.assertEqual("".join(chunks), self.log_content)
+
+    def test_iter_log_chunks_with_offset_and_limit(self):
+        chunks = self.log_file_provider.iter_log_chunks(self.runfolder, offset=7, limit=6)
+        self.assertEqual("".join(chunks), "line 2")
+
+    def test_iter_log_chunks_opens_the_log_before_reading(self):
+        with patch("bcl2fastq.lib.bcl2fastq_logs.open_log_file", side_effect=IOError("rotated")):
+            with self.assertRaises(IOError):
+                self.log_file_provider.iter_log_chunks(self.runfolder)
+
+
+class ImmediateExecutor:
+
+    def submit(self, function, *args):
+        function(*args)
+
+
+class TestLogArchive(unittest.TestCase):
+
+    runfolder = "160218_ST-E00215_0070_BHKGLFCCXX"
+    log_content = "line 1\nline 2\nline 3\nline 4\n"
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file_provider = Bcl2FastqLogFileProvider({"bcl2fastq_logs_path": self.log_dir})
+        self.log_archiver = LogArchiver(self.log_dir, ImmediateExecutor())
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def write_log(self, content=None):
+        log_file = self.log_file_provider.log_file_path(self.runfolder)
+        with open(log_file, "w") as f:
+            f.write(content or self.log_content)
+        return log_file
+
+    def finish_job(self, job_id, log_file, state=State.DONE):
+        self.log_archiver.on_job_state_change({"job_id": job_id, "stdout": log_file}, State.STARTED, state)
+
+    def test_archive_finished_job(self):
+        log_file = self.write_log()
+        # The index of the live log no longer applies once it has been archived.
+        open(log_file + ".idx", "w").close()
+        self.finish_job(3, log_file, State.ERROR)
+
+        archived_log = os.path.join(self.log_dir, "{}.3.log.gz".format(self.runfolder))
+        self.assertEqual(os.listdir(self.log_dir), [os.path.basename(archived_log)])
+        with gzip.open(archived_log) as f:
+            self.assertEqual(f.read(), self.log_content)
+
+    def test_logs_of_unfinished_jobs_and_other_directories_are_left_alone(self):
+        log_file = self.write_log()
+        self.log_archiver.on_job_state_change({"job_id": 3, "stdout": log_file}, State.PENDING, State.STARTED)
+        self.finish_job(4, "/some/other/dir/{}.log".format(self.runfolder))
+        self.finish_job(5, None)
+        self.assertEqual(os.listdir(self.log_dir), [os.path.basename(log_file)])
+
+    def test_read_archived_logs(self):
+        self.finish_job(3, self.write_log("first attempt\n"))
+        self.finish_job(7, self.write_log())
+
+        self.assertEqual([job_id for job_id, _ in self.log_file_provider.archived_logs(self.runfolder)], [7, 3])
+        # Without a live log, the latest archived log is read.
+        self.assertEqual(self.log_file_provider.log_size(self.runfolder), len(self.log_content))
+        with patch.object(Bcl2FastqLogFileProvider, "CHUNK_SIZE", 5):
+            chunks = list(self.log_file_provider.iter_log_chunks(self.runfolder, offset=7, limit=13))
+        self.assertEqual("".join(chunks), "line 2\nline 3")
+        self.assertEqual("".join(self.log_file_provider.iter_log_chunks(self.runfolder, job_id=3)),
+                         "first attempt\n")
         with self.assertRaises(IOError):
-            self.log_filer_provider.get_log_for_runfolder(self.runfolder)
+            self.log_file_provider.log_size(self.runfolder, job_id=5)
+
+        # A live log is read before any archived log.
+        self.write_log("running\n")
+        self.assertEqual("".join(self.log_file_provider.iter_log_chunks(self.runfolder)), "running\n")
+
+    def test_offset_for_tail_of_archived_log(self):
+        self.finish_job(3, self.write_log())
+        for nbr_of_lines, expected in [(0, ""), (2, "line 3\nline 4\n"), (10, self.log_content)]:
+            with patch.object(Bcl2FastqLogFileProvider, "CHUNK_SIZE", 4):
+                offset = self.log_file_provider.offset_for_tail(self.runfolder, nbr_of_lines, job_id=3)
+            self.assertEqual(self.log_content[offset:], expected)
+
+    def test_retention(self):
+        for job_id in range(1, 5):
+            self.finish_job(job_id, self.write_log("x" * 10000))
+        sizes = {path: os.path.getsize(path) for _, path in self.log_file_provider.archived_logs(self.runfolder)}
+        paths = [path for _, path in self.log_file_provider.archived_logs(self.runfolder)]
+        now = time.time()
+        for i, path in enumerate(paths):
+            os.utime(path, (now - i * 24 * 3600, now - i * 24 * 3600))
+
+        # The oldest logs are removed first, to fit in the size limit.
+        self.log_archiver.max_total_bytes = sizes[paths[0]] + sizes[paths[1]] + sizes[paths[2]]
+        self.assertEqual(self.log_archiver.enforce_retention(), [paths[3]])
 
+        self.log_archiver.max_age_days = 1.5
+        self.assertEqual(self.log_archiver.enforce_retention(), [paths[2]])
+        self.assertEqual([path for _, path in self.log_file_provider.archived_logs(self.runfolder)], paths[:2])
 
+    def test_resume(self):
+        left_behind = os.path.join(self.log_dir, "{}.3.log".format(self.runfolder))
+        with open(left_behind, "w") as f:
+            f.write(self.log_content)
+        with open(left_behind + ".gz.tmp", "w") as f:
+            f.write("half written")
+        self.log_archiver.resume()
+        self.assertEqual(os.listdir(self.log_dir), [os.path.basename(left_behind) + ".gz"])
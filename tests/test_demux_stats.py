@@ -0,0 +1,130 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from bcl2fastq.lib import demux_stats
+from bcl2fastq.lib.demux_stats import SUMMARY_FILE_NAME, StatsSummaryCache, filter_summary, summarize_stats
+
+STATS = {"Flowcell": "H8FW8ADXX",
+         "RunNumber": 76,
+         "RunId": "140213_D00251_0076_BH8FW8ADXX",
+         "ConversionResults": [
+             {"LaneNumber": 2, "TotalClustersRaw": 2000, "TotalClustersPF": 1800, "Yield": 90000,
+              "DemuxResults": [{"SampleId": "S3", "SampleName": "sample3", "NumberReads": 1500, "Yield": 75000,
+                                "IndexMetrics": [{"IndexSequence": "ACGT", "MismatchCounts": {"0": 1400, "1": 100}}],
+                                "ReadMetrics": [{"ReadNumber": 1, "Yield": 75000, "YieldQ30": 60000,
+                                                 "QualityScoreSum": 2700000}]}],
+              "Undetermined": {"NumberReads": 300, "Yield": 15000,
+                               "ReadMetrics": [{"ReadNumber": 1, "Yield": 15000, "YieldQ30": 3000,
+                                                "QualityScoreSum": 300000}]}},
+             {"LaneNumber": 1, "TotalClustersRaw": 1000, "TotalClustersPF": 900, "Yield": 45000,
+              "DemuxResults": [{"SampleId": "S1", "SampleName": "sample1", "NumberReads": 400, "Yield": 20000,
+                                "IndexMetrics": [{"IndexSequence": "TTTT", "MismatchCounts": {"0": 400}}],
+                                "ReadMetrics": [{"ReadNumber": 1, "Yield": 20000, "YieldQ30": 20000,
+                                                 "QualityScoreSum": 800000}]},
+                               {"SampleId": "S2", "SampleName": "sample2", "NumberReads": 400, "Yield": 20000,
+                                "IndexMetrics": [],
+                                "ReadMetrics": [{"ReadNumber": 1, "Yield": 20000, "YieldQ30": 10000,
+                                                 "QualityScoreSum": 600000}]}],
+              "Undetermined": {"NumberReads": 100, "Yield": 5000, "ReadMetrics": []}}],
+         "UnknownBarcodes": [{"Lane": 1, "Barcodes": {"AAAA": 10, "CCCC": 30, "GGGG": 20}},
+                             {"Lane": 2, "Barcodes": {}}]}
+
+SAMPLESHEET = """[Header]
+IEMFileVersion,4
+
+[Data]
+Lane,Sample_ID,Sample_Name,index,Sample_Project
+1,S1,sample1,TTTT,ProjectA
+1,S2,sample2,AAAC,ProjectB
+2,S3,sample3,ACGT,ProjectA
+"""
+
+
+class TestDemuxStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stats_file = os.path.join(self.tmp_dir, "Stats.json")
+        self.samplesheet_file = os.path.join(self.tmp_dir, "SampleSheet.csv")
+        with open(self.stats_file, "w") as f:
+            json.dump(STATS, f)
+        with open(self.samplesheet_file, "w") as f:
+            f.write(SAMPLESHEET)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_summarize_stats(self):
+        summary = summarize_stats(self.stats_file, self.samplesheet_file)
+        self.assertEqual(summary["flowcell"], "H8FW8ADXX")
+        self.assertEqual([lane["lane"] for lane in summary["lanes"]], [1, 2])
+
+        lane = summary["lanes"][0]
+        self.assertEqual(lane["total_clusters_pf"], 900)
+        self.assertEqual(lane["undetermined"]["number_reads"], 100)
+        self.assertEqual(lane["top_unknown_barcodes"],
+                         [{"barcode": "CCCC", "count": 30}, {"barcode": "GGGG", "count": 20},
+                          {"barcode": "AAAA", "count": 10}])
+        self.assertEqual(lane["samples"][0], {"sample_id": "S1",
+                                              "sample_name": "sample1",
+                                              "project": "ProjectA",
+                                              "number_reads": 400,
+                                              "yield": 20000,
+                                              "percent_q30": 100.0,
+                                              "mean_quality_score": 40.0,
+                                              "perfect_index_reads": 400,
+                                              "one_mismatch_index_reads": 0})
+        self.assertEqual(summary["lanes"][1]["samples"][0]["one_mismatch_index_reads"], 100)
+
+    def test_stats_are_streamed(self):
+        self.assertEqual(sorted(demux_stats._iter_stats_streaming(self.stats_file)),
+                         sorted(demux_stats._iter_stats_in_memory(self.stats_file)))
+        with mock.patch.object(demux_stats.json, "load", side_effect=AssertionError("Stats.json was loaded")):
+            summary = summarize_stats(self.stats_file, self.samplesheet_file)
+        with mock.patch.object(demux_stats, "ijson", None):
+            self.assertEqual(summary, summarize_stats(self.stats_file, self.samplesheet_file))
+        self.assertEqual(summary["run_id"], "140213_D00251_0076_BH8FW8ADXX")
+
+    def test_summarize_stats_without_samplesheet(self):
+        summary = summarize_stats(self.stats_file)
+        self.assertEqual(summary["lanes"][0]["samples"][0]["project"], None)
+
+    def test_filter_summary(self):
+        summary = summarize_stats(self.stats_file, self.samplesheet_file)
+        self.assertEqual([lane["lane"] for lane in filter_summary(summary, lane=2)["lanes"]], [2])
+
+        by_project = filter_summary(summary, project="ProjectA")
+        self.assertEqual([[sample["sample_id"] for sample in lane["samples"]] for lane in by_project["lanes"]],
+                         [["S1"], ["S3"]])
+
+        by_sample = filter_summary(summary, sample="sample2")
+        self.assertEqual([lane["lane"] for lane in by_sample["lanes"]], [1])
+        self.assertEqual(filter_summary(summary, lane=2, sample="S1")["lanes"], [])
+
+    def test_cache(self):
+        cache = StatsSummaryCache()
+        summary = cache.summary(self.stats_file, self.samplesheet_file)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, SUMMARY_FILE_NAME)))
+
+        with mock.patch.object(demux_stats, "summarize_stats") as summarize:
+            self.assertEqual(StatsSummaryCache().summary(self.stats_file, self.samplesheet_file), summary)
+            self.assertFalse(summarize.called)
+
+    def test_cache_invalidated_by_mtime(self):
+        cache = StatsSummaryCache()
+        cache.summary(self.stats_file, self.samplesheet_file)
+        stats = dict(STATS, Flowcell="OTHER")
+        with open(self.stats_file, "w") as f:
+            json.dump(stats, f)
+        mtime = os.path.getmtime(self.stats_file) + 10
+        os.utime(self.stats_file, (mtime, mtime))
+        self.assertEqual(cache.summary(self.stats_file, self.samplesheet_file)["flowcell"], "OTHER")
+
+    def test_missing_stats(self):
+        with self.assertRaises(IOError):
+            StatsSummaryCache().summary(os.path.join(self.tmp_dir, "missing", "Stats.json"))
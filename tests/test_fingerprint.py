@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from arteria.web.state import State
+
+from bcl2fastq.lib.fingerprint import FINGERPRINT_FILE_NAME, FingerprintRecorder, input_fingerprint, \
+    output_matches, write_fingerprint
+
+
+class FakeRunnerService:
+
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def change_state(self, job_id, new_state, parent_job_id=None):
+        for listener in self.listeners:
+            listener({"job_id": job_id, "parent_job_id": parent_job_id}, State.STARTED, new_state)
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.samplesheet_file = os.path.join(self.tmp_dir, "SampleSheet.csv")
+        self.run_info_file = os.path.join(self.tmp_dir, "RunInfo.xml")
+        for path in [self.samplesheet_file, self.run_info_file]:
+            with open(path, "w") as f:
+                f.write(os.path.basename(path))
+
+        self.output_dir = os.path.join(self.tmp_dir, "output")
+        os.makedirs(os.path.join(self.output_dir, "Project"))
+        with open(os.path.join(self.output_dir, "Project", "Sample_R1.fastq.gz"), "w") as f:
+            f.write("reads")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def fingerprint(self, cmd="bcl2fastq", version="2.15.2"):
+        return input_fingerprint(self.samplesheet_file, self.run_info_file, cmd, version)
+
+    def test_input_fingerprint(self):
+        fingerprint = self.fingerprint()
+        self.assertEqual(self.fingerprint(), fingerprint)
+        self.assertNotEqual(self.fingerprint(cmd="bcl2fastq --tiles s_1"), fingerprint)
+        self.assertNotEqual(self.fingerprint(version="2.17.1"), fingerprint)
+        self.assertNotEqual(self.fingerprint(cmd=[(1, "bcl2fastq", 8)]), fingerprint)
+
+        with open(self.samplesheet_file, "a") as f:
+            f.write("changed")
+        self.assertNotEqual(self.fingerprint(), fingerprint)
+
+    def test_output_matches(self):
+        self.assertFalse(output_matches(self.output_dir, "abc"))
+
+        write_fingerprint(self.output_dir, "abc")
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, FINGERPRINT_FILE_NAME)))
+        self.assertTrue(output_matches(self.output_dir, "abc"))
+        self.assertFalse(output_matches(self.output_dir, "def"))
+
+        # The output is no longer intact if a file has changed size, or is missing.
+        fastq_file = os.path.join(self.output_dir, "Project", "Sample_R1.fastq.gz")
+        with open(fastq_file, "a") as f:
+            f.write("more reads")
+        self.assertFalse(output_matches(self.output_dir, "abc"))
+
+        write_fingerprint(self.output_dir, "abc")
+        os.remove(fastq_file)
+        self.assertFalse(output_matches(self.output_dir, "abc"))
+
+    def test_empty_output_does_not_match(self):
+        empty_dir = os.path.join(self.tmp_dir, "empty")
+        os.makedirs(empty_dir)
+        write_fingerprint(empty_dir, "abc")
+        self.assertFalse(output_matches(empty_dir, "abc"))
+
+    def test_recorder(self):
+        runner_service = FakeRunnerService()
+        recorder = FingerprintRecorder(runner_service)
+        failed_output_dir = os.path.join(self.tmp_dir, "failed")
+        os.makedirs(failed_output_dir)
+
+        recorder.expect(1, self.output_dir, "abc")
+        recorder.expect(2, failed_output_dir, "def")
+        runner_service.change_state(1, State.DONE, parent_job_id=3)
+        self.assertFalse(output_matches(self.output_dir, "abc"))
+
+        runner_service.change_state(1, State.DONE)
+        runner_service.change_state(2, State.ERROR)
+        self.assertTrue(output_matches(self.output_dir, "abc"))
+        self.assertFalse(os.path.exists(os.path.join(failed_output_dir, FINGERPRINT_FILE_NAME)))
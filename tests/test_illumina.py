@@ -1,6 +1,9 @@
 import unittest
 import os
+import shutil
+import tempfile
 from cStringIO import StringIO
+from mock import patch
 
 from bcl2fastq.lib.illumina import *
 
@@ -34,10 +37,55 @@ Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,I7_Index_ID,index,Sample_Pro
         result = Samplesheet(TestSamplesheet.samplesheet_file)
         self.assertEqual(len(result.samples), 8)
 
+    def test_samplesheet_sections(self):
+        result = Samplesheet(TestSamplesheet.samplesheet_file)
+        self.assertEqual(result.header["Experiment Name"], "Hiseq-2500-dual-index")
+        self.assertEqual(result.header["Description"], "")
+        self.assertEqual(result.reads, [151, 151])
+        self.assertEqual(result.settings["Adapter"], "AGATCGGAAGAGCACACGTCTGAACTCCAGTCA")
+        self.assertEqual(result.samples[0].index2, "TATAGCCT")
+        self.assertEqual(result.samples[1].index2, "")
+
+    def test__read_samples_without_data_section(self):
+        with self.assertRaises(AssertionError):
+            Samplesheet._read_samples(StringIO("[Header],,\nIEMFileVersion,4,\n"))
+
+    def test__read_samples_with_short_rows(self):
+        samples = Samplesheet._read_samples(StringIO("[Data]\nLane,Sample_ID,Sample_Name,index,Sample_Project\n"
+                                                     "2,1,1,CAGATC\n"))
+        self.assertEqual(samples, [SampleRow(lane="2", sample_id="1", sample_name="1",
+                                             index1="CAGATC", sample_project="")])
+
     def test__read_samples(self):
         result = Samplesheet._read_samples(StringIO(TestSamplesheet.tiny_dummy_samplesheet_string))
         self.assertItemsEqual(result, TestSamplesheet.expected_samples)
 
+    def test_write_for_lane(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            lane_samplesheet = os.path.join(tmp_dir, "SampleSheet_L002.csv")
+            Samplesheet.write_for_lane(TestSamplesheet.samplesheet_file, 2, lane_samplesheet)
+            result = Samplesheet(lane_samplesheet)
+            self.assertEqual([sample.sample_id for sample in result.samples], ["2"])
+            self.assertEqual(result.header["Experiment Name"], "Hiseq-2500-dual-index")
+            self.assertEqual(result.reads, [151, 151])
+            self.assertTrue(Samplesheet.has_lane_column(lane_samplesheet))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_write_for_lane_without_lane_column(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            samplesheet_file = os.path.join(tmp_dir, "SampleSheet.csv")
+            with open(samplesheet_file, "w") as f:
+                f.write("[Data]\nSample_ID,Sample_Name,index,Sample_Project\n1,1,CAGATC,A\n2,2,ACTTGA,A\n")
+            lane_samplesheet = os.path.join(tmp_dir, "SampleSheet_L003.csv")
+            Samplesheet.write_for_lane(samplesheet_file, 3, lane_samplesheet)
+            self.assertFalse(Samplesheet.has_lane_column(samplesheet_file))
+            self.assertEqual(len(Samplesheet(lane_samplesheet).samples), 2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_samplerow_defaults(self):
         samplerow = SampleRow(sample_id="1", sample_name="1",
                               index1="CAGATC", sample_project="Dummy-Project")
@@ -48,5 +96,102 @@ Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,I7_Index_ID,index,Sample_Pro
         self.assertEqual(samplerow.description, None)
 
 
+class TestSamplesheetColumns(unittest.TestCase):
+
+    interleaved_lanes_samplesheet_string = """[Data]
+Lane,Sample_ID,Sample_Name,index,index2,Sample_Project
+2,1,1,CAGATC,,Project-A
+1,2,2,ACTTGACG,GGTTAACC,Project-A
+2,3,3,GATCAG,,Project-B
+1,4,4,TGACCAGT,CCAATTGG,Project-A
+"""
+
+    def columns(self):
+        return Samplesheet._parse(StringIO(self.interleaved_lanes_samplesheet_string))[3]
+
+    def test_lanes(self):
+        columns = self.columns()
+        self.assertEqual(columns.lanes(), [1, 2])
+        self.assertEqual(columns.lane_range(1), (0, 2))
+        self.assertEqual(columns.lane_range(2), (2, 4))
+        self.assertEqual(columns.nbr_of_samples(2), 2)
+
+    def test_first_row(self):
+        self.assertEqual(self.columns().first_row(2).sample_id, "1")
+
+    def test_projects(self):
+        columns = self.columns()
+        self.assertEqual(columns.projects(1), ["Project-A"])
+        self.assertEqual(columns.projects(2), ["Project-A", "Project-B"])
+
+    def test_index_lengths(self):
+        columns = self.columns()
+        self.assertEqual(columns.index_lengths(1), (8, 8))
+        self.assertEqual(columns.index_lengths(2), (6, 0))
+
+    def test_to_sample_rows_keeps_samplesheet_order(self):
+        rows = self.columns().to_sample_rows()
+        self.assertEqual([row.sample_id for row in rows], ["1", "2", "3", "4"])
+        self.assertEqual([row.lane for row in rows], [2, 1, 2, 1])
+
+    def test_repeated_values_are_shared(self):
+        columns = self.columns()
+        projects = columns.columns["sample_project"]
+        self.assertIs(projects[0], projects[1])
+
+    def test_samplerow_has_no_dict(self):
+        row = self.columns().row(0)
+        self.assertFalse(hasattr(row, "__dict__"))
+
+
+class TestRunfolderMetadata(unittest.TestCase):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+    hiseq_runfolder = test_dir + "/sampledata/HiSeq-samples/2014-02_13_average_run"
+    miseq_single_read_runfolder = test_dir + "/sampledata/MiSeq-samples/2014-02_11_50kit_single_read"
+
+    def test_parse(self):
+        metadata = RunfolderMetadata.parse(self.hiseq_runfolder,
+                                           RunfolderMetadata._run_parameters_path(self.hiseq_runfolder))
+        self.assertEqual(metadata.run_id, "140213_D00251_0076_BH8FW8ADXX")
+        self.assertEqual(metadata.flowcell, "H8FW8ADXX")
+        self.assertEqual(metadata.instrument, "D00251")
+        self.assertEqual(metadata.machine_type, "HiSeq 2500")
+        self.assertEqual(metadata.reads, [Read(1, 151, False), Read(2, 7, True), Read(3, 151, False)])
+        self.assertEqual(metadata.index_lengths, {2: 7})
+        self.assertFalse(metadata.is_single_read)
+        self.assertEqual(metadata.flowcell_layout, FlowcellLayout(2, 2, 2, 16))
+        self.assertEqual(metadata.nbr_of_tiles, 128)
+        self.assertEqual(metadata.application_name, "HiSeq Control Software")
+
+    def test_single_read(self):
+        metadata = RunfolderMetadata.for_runfolder(self.miseq_single_read_runfolder)
+        self.assertTrue(metadata.is_single_read)
+        self.assertEqual(metadata.machine_type, "MiSeq")
+
+    def test_for_runfolder_is_cached(self):
+        RunfolderMetadata.for_runfolder(self.hiseq_runfolder)
+        with patch.object(RunfolderMetadata, "parse") as parse:
+            metadata = RunfolderMetadata.for_runfolder(self.hiseq_runfolder)
+            parse.assert_not_called()
+        self.assertEqual(metadata.instrument, "D00251")
+
+    def test_for_runfolder_reparses_when_changed(self):
+        runfolder = tempfile.mkdtemp()
+        try:
+            run_info = os.path.join(runfolder, "RunInfo.xml")
+            shutil.copy(os.path.join(self.hiseq_runfolder, "RunInfo.xml"), run_info)
+            self.assertEqual(RunfolderMetadata.for_runfolder(runfolder).instrument, "D00251")
 
+            with open(run_info) as f:
+                content = f.read().replace("D00251", "ST-E00215")
+            with open(run_info, "w") as f:
+                f.write(content)
+            stat = os.stat(run_info)
+            os.utime(run_info, (stat.st_atime, stat.st_mtime + 10))
 
+            metadata = RunfolderMetadata.for_runfolder(runfolder)
+            self.assertEqual(metadata.instrument, "ST-E00215")
+            self.assertEqual(metadata.machine_type, "HiSeq X")
+            self.assertIsNone(metadata.application_name)
+        finally:
+            shutil.rmtree(runfolder)
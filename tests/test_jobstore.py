@@ -0,0 +1,106 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from arteria.web.state import State
+
+from bcl2fastq.lib.jobstore import JobStore
+
+
+class TestJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.job_store = JobStore()
+
+    def add_job(self, runfolder="runfolder_1"):
+        return self.job_store.add_job("bcl2fastq", runfolder, "/runfolders/" + runfolder, 8,
+                                      stdout="/logs/{}.log".format(runfolder))
+
+    def test_add_job(self):
+        job_id = self.add_job()
+        job = self.job_store.get_job(job_id)
+        self.assertEqual(job["cmd"], "bcl2fastq")
+        self.assertEqual(job["runfolder"], "runfolder_1")
+        self.assertEqual(job["nbr_of_cores"], 8)
+        self.assertEqual(job["state"], State.PENDING)
+        self.assertIsNone(job["started"])
+
+    def test_job_ids_increase(self):
+        self.assertEqual(self.add_job(), 1)
+        self.assertEqual(self.add_job(), 2)
+
+    def test_set_state(self):
+        job_id = self.add_job()
+        self.job_store.set_state(job_id, State.STARTED, timestamp=10)
+        self.job_store.set_state(job_id, State.DONE, timestamp=20)
+        job = self.job_store.get_job(job_id)
+        self.assertEqual(job["state"], State.DONE)
+        self.assertEqual(job["started"], 10)
+        self.assertEqual(job["finished"], 20)
+        self.assertEqual([state for state, _ in self.job_store.transitions(job_id)],
+                         [State.PENDING, State.STARTED, State.DONE])
+
+    def test_states_and_queries(self):
+        first = self.add_job("runfolder_1")
+        second = self.add_job("runfolder_2")
+        third = self.add_job("runfolder_1")
+        self.job_store.set_state(second, State.DONE)
+
+        self.assertEqual(self.job_store.states(), {first: State.PENDING, second: State.DONE, third: State.PENDING})
+        self.assertEqual([job["job_id"] for job in self.job_store.unfinished_jobs()], [first, third])
+        self.assertEqual([job["job_id"] for job in self.job_store.jobs_for_runfolder("runfolder_1")],
+                         [third, first])
+        self.assertIsNone(self.job_store.get_job(123))
+        self.assertIsNone(self.job_store.state(123))
+
+    def test_resource_samples(self):
+        job_id = self.add_job()
+        self.assertEqual(self.job_store.resource_samples(job_id), [])
+        self.job_store.add_resource_sample(job_id, {"cpu_seconds": 1.5, "rss_bytes": 100, "nbr_of_processes": 2},
+                                           timestamp=10)
+        self.job_store.add_resource_sample(job_id, {"cpu_seconds": 3.0, "rss_bytes": 200, "output_bytes": 50},
+                                           timestamp=20)
+        samples = self.job_store.resource_samples(job_id)
+        self.assertEqual([sample["timestamp"] for sample in samples], [10, 20])
+        self.assertEqual(samples[0]["cpu_seconds"], 1.5)
+        self.assertEqual(samples[0]["nbr_of_processes"], 2)
+        self.assertIsNone(samples[0]["output_bytes"])
+        self.assertEqual(samples[1]["output_bytes"], 50)
+        self.assertEqual(self.job_store.resource_samples(self.add_job()), [])
+
+    def test_job_history(self):
+        features = {"machine_type": "HiSeq 2500", "nbr_of_lanes": 8, "nbr_of_tiles": 512, "nbr_of_cycles": 210,
+                    "nbr_of_samples": 96, "nbr_of_cores": 16}
+        job_ids = [self.add_job() for _ in range(4)]
+        for job_id, state, runtime in zip(job_ids, [State.DONE, State.DONE, State.ERROR, State.STARTED],
+                                          [100, 200, 300, None]):
+            self.job_store.add_job_features(job_id, features, predicted_runtime=150)
+            self.job_store.set_state(job_id, State.STARTED, timestamp=1000)
+            if runtime:
+                self.job_store.set_state(job_id, state, timestamp=1000 + runtime)
+        # Jobs without features are not part of the history.
+        self.job_store.set_state(self.add_job(), State.DONE)
+
+        history = self.job_store.job_history(10)
+        self.assertEqual([job["job_id"] for job in history], [job_ids[1], job_ids[0]])
+        self.assertEqual(history[0]["wall_time"], 200)
+        self.assertEqual(history[0]["machine_type"], "HiSeq 2500")
+        self.assertEqual(history[0]["nbr_of_samples"], 96)
+        self.assertEqual(len(self.job_store.job_history(1)), 1)
+        self.assertEqual(self.job_store.predicted_runtimes(job_ids[:2] + [123]), {job_ids[0]: 150, job_ids[1]: 150})
+
+    def test_runner_job_id(self):
+        job_id = self.job_store.add_job("bcl2fastq", "runfolder_1", "/runfolders/runfolder_1", 8)
+        self.assertIsNone(self.job_store.get_job(job_id)["runner_job_id"])
+        self.job_store.set_runner_job_id(job_id, 1234)
+        self.assertEqual(self.job_store.get_job(job_id)["runner_job_id"], "1234")
+
+    def test_persisted(self):
+        db_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(db_dir, "jobs.db")
+            job_id = JobStore(path).add_job("bcl2fastq", "runfolder_1", "/runfolders/runfolder_1", 8)
+            self.assertEqual(JobStore(path).get_job(job_id)["runfolder"], "runfolder_1")
+        finally:
+            shutil.rmtree(db_dir)
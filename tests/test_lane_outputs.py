@@ -0,0 +1,64 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+from bcl2fastq.lib.lane_outputs import LANES_DIR_NAME, merge_lane_outputs, merge_stats
+
+
+def lane_stats(lane):
+    return {"Flowcell": "H8FW8ADXX",
+            "RunNumber": 76,
+            "RunId": "140213_D00251_0076_BH8FW8ADXX",
+            "ConversionResults": [{"LaneNumber": lane, "TotalClustersRaw": 100 * lane}],
+            "ReadInfosForLanes": [{"LaneNumber": lane, "ReadInfos": []}],
+            "UnknownBarcodes": [{"Lane": lane, "Barcodes": {}}]}
+
+
+class TestLaneOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.lane_outputs = []
+        for lane in [2, 1]:
+            lane_output = os.path.join(self.output, LANES_DIR_NAME, "L{:03d}".format(lane))
+            os.makedirs(os.path.join(lane_output, "Stats"))
+            os.makedirs(os.path.join(lane_output, "Reports", "html"))
+            with open(os.path.join(lane_output, "Stats", "Stats.json"), "w") as f:
+                json.dump(lane_stats(lane), f)
+            with open(os.path.join(lane_output, "Stats", "ConversionStats.xml"), "w") as f:
+                f.write("<Stats/>")
+            with open(os.path.join(lane_output, "Reports", "html", "index.html"), "w") as f:
+                f.write("<html/>")
+            self.lane_outputs.append(lane_output)
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_merge_stats(self):
+        merged = merge_stats([lane_stats(2), lane_stats(1)])
+        self.assertEqual(merged["Flowcell"], "H8FW8ADXX")
+        self.assertEqual([result["LaneNumber"] for result in merged["ConversionResults"]], [1, 2])
+        self.assertEqual([info["LaneNumber"] for info in merged["ReadInfosForLanes"]], [1, 2])
+        self.assertEqual([barcodes["Lane"] for barcodes in merged["UnknownBarcodes"]], [1, 2])
+
+    def test_merge_stats_of_nothing(self):
+        self.assertEqual(merge_stats([]), {})
+
+    def test_merge_lane_outputs(self):
+        merge_lane_outputs(self.lane_outputs, self.output)
+        with open(os.path.join(self.output, "Stats", "Stats.json")) as f:
+            merged = json.load(f)
+        self.assertEqual(len(merged["ConversionResults"]), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.output, "Stats", "L001", "ConversionStats.xml")))
+        self.assertFalse(os.path.exists(os.path.join(self.output, "Stats", "L001", "Stats.json")))
+        self.assertTrue(os.path.exists(os.path.join(self.output, "Reports", "L002", "html", "index.html")))
+
+    def test_merge_lane_outputs_again(self):
+        merge_lane_outputs(self.lane_outputs, self.output)
+        merge_lane_outputs(self.lane_outputs[:1], self.output)
+        with open(os.path.join(self.output, "Stats", "Stats.json")) as f:
+            merged = json.load(f)
+        self.assertEqual([result["LaneNumber"] for result in merged["ConversionResults"]], [2])
+        self.assertFalse(os.path.exists(os.path.join(self.output, "Reports", "L001")))
@@ -0,0 +1,101 @@
+import unittest
+import gzip
+import os
+import re
+import shutil
+import tempfile
+
+from bcl2fastq.lib.log_index import ERROR, WARNING, PHASE, LogIndex, LogSearcher, classify_line
+
+
+class TestLogIndex(unittest.TestCase):
+
+    log_content = ("2016-01-01 12:00:00 [1] bcl2fastq v2.17.1.14\n"
+                   "2016-01-01 12:00:01 [1] INFO: Created 8 data processing threads\n"
+                   "2016-01-01 12:00:02 [1] WARNING: Missing bcl file for tile 1101 of lane 1\n"
+                   "2016-01-01 12:00:03 [1] Demultiplexing lane 1 tile 1101\n"
+                   "2016-01-01 12:00:04 [1] Demultiplexing lane 1 tile 1102\n"
+                   "2016-01-01 12:00:05 [1] ERROR: Corrupt filter file for tile 1102 of lane 1\n")
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, "runfolder.log")
+        self._write(self.log_content)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def _write(self, content, mode="w"):
+        with open(self.log_file, mode) as f:
+            f.write(content)
+
+    def test_classify_line(self):
+        self.assertEqual(classify_line("[1] ERROR: failed"), (ERROR, None))
+        self.assertEqual(classify_line("Error: missing file"), (ERROR, None))
+        self.assertEqual(classify_line("[1] WARNING: missing bcl"), (WARNING, None))
+        self.assertEqual(classify_line("Writing FASTQ files"), (PHASE, "writing"))
+        self.assertEqual(classify_line("Processing completed with 0 errors and 0 warnings."), (PHASE, "completed"))
+        self.assertEqual(classify_line("Processing lane 1 tile 1101"), (None, None))
+
+    def test_index(self):
+        index = LogIndex(self.log_file)
+        index.update()
+        self.assertEqual([(line_number, kind, phase) for _, _, line_number, kind, phase in index.entries],
+                         [(1, PHASE, "started"), (2, PHASE, "conversion"), (3, WARNING, None),
+                          (4, PHASE, "demultiplexing"), (6, ERROR, None)])
+        self.assertEqual([line for _, line in index.read_entries(index.entries[-1:])],
+                         ["2016-01-01 12:00:05 [1] ERROR: Corrupt filter file for tile 1102 of lane 1"])
+        self.assertTrue(os.path.exists(self.log_file + ".idx"))
+
+    def test_index_is_updated_incrementally(self):
+        LogIndex(self.log_file).update()
+        self._write("2016-01-01 12:00:06 [1] ERROR: another error\n2016-01-01 12:00:07 [1] ERR", mode="a")
+
+        index = LogIndex(self.log_file)
+        self.assertEqual(index.indexed_size, len(self.log_content))
+        index.update()
+        self.assertEqual([line_number for _, _, line_number, kind, _ in index.entries if kind == ERROR], [6, 7])
+        # The incomplete last line is left until it has been written.
+        self.assertEqual(index.indexed_size,
+                         len(self.log_content) + len("2016-01-01 12:00:06 [1] ERROR: another error\n"))
+
+    def test_replaced_log_is_indexed_again(self):
+        LogIndex(self.log_file).update()
+        self._write("2016-01-02 12:00:00 [1] WARNING: a new run" + " " * len(self.log_content) + "\n")
+        index = LogIndex(self.log_file)
+        index.update()
+        self.assertEqual([(line_number, kind) for _, _, line_number, kind, _ in index.entries], [(1, WARNING)])
+
+    def test_search(self):
+        searcher = LogSearcher()
+        result = searcher.search([self.log_file], severity=WARNING)
+        self.assertEqual([hit["line_number"] for hit in result["hits"]], [3, 6])
+        self.assertEqual(result["hits"][0]["log"], "runfolder.log")
+        self.assertEqual(self.log_content[result["hits"][1]["offset"]:].split("\n")[0], result["hits"][1]["line"])
+
+        result = searcher.search([self.log_file], regex=re.compile("tile 1102"), severity=ERROR)
+        self.assertEqual([hit["line_number"] for hit in result["hits"]], [6])
+
+        result = searcher.search([self.log_file], phases=True)
+        self.assertEqual([hit["phase"] for hit in result["hits"]], ["started", "conversion", "demultiplexing"])
+
+        # A pattern on its own is matched against all lines.
+        result = searcher.search([self.log_file], regex=re.compile("tile 1102"))
+        self.assertEqual([(hit["line_number"], hit["kind"]) for hit in result["hits"]], [(5, PHASE), (6, ERROR)])
+        self.assertEqual(self.log_content[result["hits"][0]["offset"]:].split("\n")[0], result["hits"][0]["line"])
+
+    def test_search_archived_logs(self):
+        archived_log = os.path.join(self.log_dir, "runfolder.3.log.gz")
+        with gzip.open(archived_log, "wb") as f:
+            f.write(self.log_content)
+        result = LogSearcher().search([archived_log, self.log_file], severity=ERROR)
+        self.assertEqual([(hit["log"], hit["line_number"]) for hit in result["hits"]],
+                         [("runfolder.3.log.gz", 6), ("runfolder.log", 6)])
+        self.assertEqual(result["hits"][0]["line"], result["hits"][1]["line"])
+        self.assertEqual(result["logs_searched"], 2)
+
+    def test_search_limit(self):
+        result = LogSearcher().search([self.log_file, os.path.join(self.log_dir, "missing.log")],
+                                      severity=WARNING, limit=1)
+        self.assertEqual(len(result["hits"]), 1)
+        self.assertTrue(result["truncated"])
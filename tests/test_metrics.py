@@ -0,0 +1,125 @@
+import unittest
+
+from arteria.web.state import State
+
+from bcl2fastq.lib.jobstore import JobStore
+from bcl2fastq.lib.metrics import MetricsRegistry, ServiceMetrics
+
+
+class FakeRunnerService:
+
+    def __init__(self):
+        self.job_store = JobStore()
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def set_state(self, job_id, state, timestamp):
+        old_state = self.job_store.state(job_id)
+        self.job_store.set_state(job_id, state, timestamp=timestamp)
+        for listener in self.listeners:
+            listener(self.job_store.get_job(job_id), old_state, state)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "A counter.", ("kind",))
+        gauge = registry.gauge("test_gauge", "A gauge.")
+        histogram = registry.histogram("test_seconds", "A histogram.", buckets=(1, 10))
+        counter.inc(kind='a "b"')
+        counter.inc(2, kind='a "b"')
+        gauge.set(3)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(registry.render().split("\n"),
+                         ["# HELP test_total A counter.",
+                          "# TYPE test_total counter",
+                          'test_total{kind="a \\"b\\""} 3.0',
+                          "# HELP test_gauge A gauge.",
+                          "# TYPE test_gauge gauge",
+                          "test_gauge 3.0",
+                          "# HELP test_seconds A histogram.",
+                          "# TYPE test_seconds histogram",
+                          'test_seconds_bucket{le="1.0"} 1.0',
+                          'test_seconds_bucket{le="10.0"} 2.0',
+                          'test_seconds_bucket{le="+Inf"} 2.0',
+                          "test_seconds_sum 5.5",
+                          "test_seconds_count 2.0",
+                          ""])
+
+    def test_wrong_labels(self):
+        counter = MetricsRegistry().counter("test_total", "A counter.", ("kind",))
+        with self.assertRaises(ValueError):
+            counter.inc(other="a")
+
+    def test_duplicate_metric(self):
+        registry = MetricsRegistry()
+        registry.gauge("test_gauge", "A gauge.")
+        with self.assertRaises(ValueError):
+            registry.counter("test_gauge", "A counter.")
+
+
+class TestServiceMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.runner_service = FakeRunnerService()
+        self.metrics = ServiceMetrics(self.runner_service)
+
+    def test_job_times(self):
+        job_id = self.runner_service.job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 8)
+        created = self.runner_service.job_store.get_job(job_id)["created"]
+        self.metrics.label_job(job_id, "2.20.0", "HiSeq X")
+
+        self.runner_service.set_state(job_id, State.STARTED, timestamp=created + 30)
+        self.runner_service.set_state(job_id, State.DONE, timestamp=created + 90)
+
+        labels = {"bcl2fastq_version": "2.20.0", "machine_type": "HiSeq X"}
+        self.assertEqual(self.metrics.job_wait_time.count(**labels), 1)
+        self.assertEqual(self.metrics.job_run_time.count(state=State.DONE, **labels), 1)
+        self.assertEqual(self.metrics.jobs_finished.value(state=State.DONE, **labels), 1)
+        self.assertIn('bcl2fastq_job_run_seconds_sum{bcl2fastq_version="2.20.0",machine_type="HiSeq X",'
+                      'state="done"} 60.0', self.metrics.render())
+
+    def test_wait_time_of_job_never_seen_as_started(self):
+        job_id = self.runner_service.job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 8)
+        created = self.runner_service.job_store.get_job(job_id)["created"]
+        self.metrics.label_job(job_id, "2.20.0", "HiSeq X")
+
+        self.runner_service.set_state(job_id, State.DONE, timestamp=created + 40)
+
+        labels = {"bcl2fastq_version": "2.20.0", "machine_type": "HiSeq X"}
+        self.assertEqual(self.metrics.job_wait_time.count(**labels), 1)
+        self.assertIn('bcl2fastq_job_wait_seconds_sum{bcl2fastq_version="2.20.0",machine_type="HiSeq X"} 40.0',
+                      self.metrics.render())
+        self.assertEqual(self.metrics.job_run_time.count(state=State.DONE, **labels), 0)
+
+    def test_failed_job_without_labels(self):
+        job_id = self.runner_service.job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 8)
+        self.runner_service.set_state(job_id, State.ERROR, timestamp=None)
+        self.assertEqual(self.metrics.jobs_finished.value(state=State.ERROR, bcl2fastq_version="unknown",
+                                                          machine_type="unknown"), 1)
+
+    def test_parts_of_jobs_are_not_recorded(self):
+        job_store = self.runner_service.job_store
+        group_job_id = job_store.add_job("bcl2fastq\nbcl2fastq", "runfolder", "/runfolder", 8)
+        job_id = job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 4, parent_job_id=group_job_id)
+        self.runner_service.set_state(job_id, State.DONE, timestamp=None)
+        self.assertEqual(self.metrics.jobs_finished.value(state=State.DONE, bcl2fastq_version="unknown",
+                                                          machine_type="unknown"), 0)
+
+    def test_queue(self):
+        job_store = self.runner_service.job_store
+        group_job_id = job_store.add_job("bcl2fastq\nbcl2fastq", "runfolder", "/runfolder", 8,
+                                         state=State.STARTED)
+        job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 4, state=State.STARTED,
+                          parent_job_id=group_job_id)
+        job_store.add_job("bcl2fastq", "runfolder", "/runfolder", 4, parent_job_id=group_job_id)
+        job_store.add_job("bcl2fastq", "other_runfolder", "/other_runfolder", 2)
+
+        self.metrics.render()
+        self.assertEqual(self.metrics.queue_depth.value(), 2)
+        self.assertEqual(self.metrics.cores_in_use.value(), 4)
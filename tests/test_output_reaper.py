@@ -0,0 +1,103 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+
+from bcl2fastq.lib.output_reaper import OutputReaper, RateLimiter
+
+
+class TestOutputReaper(unittest.TestCase):
+
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.output = os.path.join(self.output_folder, "runfolder")
+        os.makedirs(os.path.join(self.output, "Project_A", "Sample_1"))
+        for i in range(5):
+            with open(os.path.join(self.output, "Project_A", "Sample_1", "{}.fastq.gz".format(i)), "w") as f:
+                f.write("x" * 10)
+        os.symlink(os.path.join(self.output, "Project_A"), os.path.join(self.output, "link_to_project"))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def wait_for(self, reaper, timeout=5):
+        deadline = time.time() + timeout
+        while reaper.status()["pending"] and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_move_to_trash(self):
+        trash_path = OutputReaper.move_to_trash(self.output)
+        self.assertFalse(os.path.exists(self.output))
+        self.assertEqual(os.path.dirname(trash_path), os.path.join(self.output_folder, OutputReaper.TRASH_DIR_NAME))
+        self.assertTrue(os.path.isdir(trash_path))
+
+    def test_move_to_trash_of_other_folder(self):
+        trash_path = OutputReaper.move_to_trash(os.path.join(self.output, "Project_A"), trash_root=self.output_folder)
+        self.assertEqual(os.path.dirname(trash_path), os.path.join(self.output_folder, OutputReaper.TRASH_DIR_NAME))
+        self.assertFalse(os.path.exists(os.path.join(self.output, OutputReaper.TRASH_DIR_NAME)))
+        self.assertTrue(OutputReaper.is_in_trash(os.path.join(trash_path, "Sample_1")))
+        self.assertFalse(OutputReaper.is_in_trash(self.output))
+
+    def test_move_to_trash_non_existent(self):
+        self.assertIsNone(OutputReaper.move_to_trash(os.path.join(self.output_folder, "does_not_exist")))
+
+    def test_schedule(self):
+        reaper = OutputReaper(nbr_of_threads=2)
+        reaper.schedule(OutputReaper.move_to_trash(self.output))
+        self.wait_for(reaper)
+
+        status = reaper.status()
+        self.assertEqual(status["pending"], [])
+        # The files, and the symlink (which has the size of the path it points to).
+        self.assertEqual(status["bytes_reclaimed"], 50 + len(os.path.join(self.output, "Project_A")))
+        self.assertEqual(status["files_deleted"], 6)
+        self.assertEqual(status["errors"], [])
+        self.assertEqual(os.listdir(os.path.join(self.output_folder, OutputReaper.TRASH_DIR_NAME)), [])
+
+    def test_reclaimable_bytes_of_pending_directories(self):
+        reaper = OutputReaper(nbr_of_threads=2)
+        deleting = threading.Event()
+        with mock.patch.object(reaper, "_reap", side_effect=lambda path: deleting.wait(5)):
+            first = OutputReaper.move_to_trash(self.output)
+            shutil.copytree(first, self.output, symlinks=True)
+            second = OutputReaper.move_to_trash(self.output)
+            reaper.schedule(first)
+            reaper.schedule(second)
+
+            # The first directory is being deleted, and the second is sized while it waits.
+            deadline = time.time() + 5
+            while (reaper.status()["current"] != first or not reaper.status()["reclaimable_bytes"]) and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(reaper.status()["reclaimable_bytes"], 50 + len(os.path.join(self.output, "Project_A")))
+            deleting.set()
+            self.wait_for(reaper)
+        self.assertEqual(reaper.status()["reclaimable_bytes"], 0)
+
+    def test_resume(self):
+        trash_path = OutputReaper.move_to_trash(self.output)
+        reaper = OutputReaper()
+        reaper.resume([self.output_folder])
+        self.wait_for(reaper)
+        self.assertFalse(os.path.exists(trash_path))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_wait(self):
+        rate_limiter = RateLimiter(max_per_second=100)
+        before = time.time()
+        for _ in range(11):
+            rate_limiter.wait()
+        self.assertGreaterEqual(time.time() - before, 0.09)
+
+    def test_no_limit(self):
+        rate_limiter = RateLimiter()
+        before = time.time()
+        for _ in range(1000):
+            rate_limiter.wait()
+        self.assertLess(time.time() - before, 0.5)
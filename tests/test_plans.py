@@ -0,0 +1,52 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from bcl2fastq.lib.plans import PlanCache, plan_key
+
+
+class TestPlans(unittest.TestCase):
+
+    def setUp(self):
+        self.runfolder = tempfile.mkdtemp()
+        for file_name in ["SampleSheet.csv", "RunInfo.xml"]:
+            with open(os.path.join(self.runfolder, file_name), "w") as f:
+                f.write(file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.runfolder)
+
+    def test_plan_key_changes_with_content(self):
+        key = plan_key(self.runfolder, {"tiles": "s_1"})
+        self.assertEqual(plan_key(self.runfolder, {"tiles": "s_1"}), key)
+
+        # Touching the files does not change the key, changing them does.
+        os.utime(os.path.join(self.runfolder, "SampleSheet.csv"), None)
+        self.assertEqual(plan_key(self.runfolder, {"tiles": "s_1"}), key)
+        with open(os.path.join(self.runfolder, "SampleSheet.csv"), "a") as f:
+            f.write("changed")
+        self.assertNotEqual(plan_key(self.runfolder, {"tiles": "s_1"}), key)
+
+    def test_plan_key_changes_with_parameters(self):
+        self.assertNotEqual(plan_key(self.runfolder, {"tiles": "s_1"}), plan_key(self.runfolder, {"tiles": "s_2"}))
+        self.assertEqual(plan_key(self.runfolder, {"a": 1, "b": 2}), plan_key(self.runfolder, {"b": 2, "a": 1}))
+
+    def test_plan_key_ignores_start_only_parameters(self):
+        key = plan_key(self.runfolder, {"tiles": "s_1"})
+        self.assertEqual(plan_key(self.runfolder, {"tiles": "s_1", "force": True, "priority": 10}), key)
+
+    def test_plan_key_changes_with_environment(self):
+        self.assertNotEqual(plan_key(self.runfolder, {}, {"thread_profiles": 0}),
+                            plan_key(self.runfolder, {}, {"thread_profiles": 1}))
+
+    def test_plan_cache(self):
+        cache = PlanCache(size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        # "b" was the least recently used plan.
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
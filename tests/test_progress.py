@@ -0,0 +1,100 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from bcl2fastq.lib.illumina import FlowcellLayout, RunfolderMetadata
+from bcl2fastq.lib.progress import LogProgress, ProgressTracker, expected_tiles, merge_progress
+
+
+class TestLogProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmp_dir, "bcl2fastq.log")
+        open(self.log_file, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _append(self, content):
+        with open(self.log_file, "a") as f:
+            f.write(content)
+
+    def test_progress(self):
+        progress = LogProgress(self.log_file, total_tiles=4)
+        self._append("2016-01-01 12:00:00 [1] Processing lane 1 tile 1101\n"
+                     "2016-01-01 12:01:00 [1] Processing lane 1 tile 1102\n")
+        progress.update()
+        self.assertEqual(progress.as_dict(), {"tiles_processed": 2,
+                                              "tiles_total": 4,
+                                              "percent_complete": 50.0,
+                                              "tiles_per_minute": 2.0,
+                                              "eta_seconds": 60,
+                                              "eta": "2016-01-01T12:02:00"})
+
+    def test_tile_counted_once(self):
+        progress = LogProgress(self.log_file)
+        self._append("2016-01-01 12:00:00 [1] Demultiplexing lane 1 tile 1101\n"
+                     "2016-01-01 12:00:10 [1] Finished demultiplexing tile 1101 of lane 1\n"
+                     "2016-01-01 12:00:20 [1] Writing FASTQ files\n")
+        progress.update()
+        self.assertEqual(progress.tiles, {(1, 1101)})
+        self.assertEqual(progress.as_dict()["percent_complete"], None)
+
+    def test_only_new_lines_are_read(self):
+        progress = LogProgress(self.log_file)
+        self._append("2016-01-01 12:00:00 [1] Processing lane 1 tile 1101\n2016-01-01 12:00:01 [1] Processing lane")
+        progress.update()
+        self.assertEqual(progress.tiles, {(1, 1101)})
+        offset = progress.offset
+        self.assertEqual(offset, os.path.getsize(self.log_file))
+
+        self._append(" 2 tile 1101\n")
+        progress.update()
+        self.assertEqual(progress.tiles, {(1, 1101), (2, 1101)})
+        self.assertTrue(progress.offset > offset)
+
+    def test_replaced_log(self):
+        progress = LogProgress(self.log_file)
+        self._append("Processing lane 1 tile 1101\nProcessing lane 1 tile 1102\n")
+        progress.update()
+        with open(self.log_file, "w") as f:
+            f.write("Processing lane 2 tile 1101\n")
+        progress.update()
+        self.assertEqual(progress.tiles, {(2, 1101)})
+
+    def test_missing_log(self):
+        progress = LogProgress(os.path.join(self.tmp_dir, "missing.log"), total_tiles=4)
+        progress.update()
+        self.assertEqual(progress.as_dict()["percent_complete"], 0.0)
+
+    def test_tracker(self):
+        tracker = ProgressTracker()
+        self._append("Processing lane 1 tile 1101\n")
+        self.assertEqual(tracker.progress(1, self.log_file, 2)["percent_complete"], 50.0)
+        self._append("Processing lane 1 tile 1102\n")
+        self.assertEqual(tracker.progress(1, self.log_file, 2)["percent_complete"], 100.0)
+        tracker.forget(1)
+        self.assertEqual(tracker.progress(1, self.log_file, 4)["percent_complete"], 50.0)
+
+
+class TestProgressHelpers(unittest.TestCase):
+
+    def test_merge_progress(self):
+        merged = merge_progress([{"tiles_processed": 1, "tiles_total": 4, "percent_complete": 25.0,
+                                  "tiles_per_minute": 1.0, "eta_seconds": 180, "eta": "2016-01-01T12:03:00"},
+                                 {"tiles_processed": 3, "tiles_total": 4, "percent_complete": 75.0,
+                                  "tiles_per_minute": 2.0, "eta_seconds": 30, "eta": "2016-01-01T12:00:30"}])
+        self.assertEqual(merged, {"tiles_processed": 4, "tiles_total": 8, "percent_complete": 50.0,
+                                  "tiles_per_minute": 3.0, "eta_seconds": 180, "eta": "2016-01-01T12:03:00"})
+
+    def test_expected_tiles(self):
+        metadata = RunfolderMetadata("run", "flowcell", "E00123", [],
+                                     flowcell_layout=FlowcellLayout(lane_count=8, surface_count=2,
+                                                                    swath_count=2, tile_count=24))
+        self.assertEqual(expected_tiles(metadata, "bcl2fastq --input-dir foo"), 768)
+        self.assertEqual(expected_tiles(metadata, "bcl2fastq --tiles s_1 --input-dir foo"), 96)
+        self.assertEqual(expected_tiles(metadata, "bcl2fastq --tiles s_1,s_2"), 192)
+        self.assertEqual(expected_tiles(metadata, "bcl2fastq --tiles s_1_1101"), None)
+        self.assertEqual(expected_tiles(None, "bcl2fastq"), None)
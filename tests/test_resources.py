@@ -0,0 +1,193 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+
+from arteria.web.state import State
+
+from bcl2fastq.lib.jobstore import JobStore
+from bcl2fastq.lib.resources import CLOCK_TICKS_PER_SECOND, PAGE_SIZE, JobResources, ResourceMonitor, \
+    directory_size, process_tree, read_process, summarize_resources
+
+
+def write_process(proc_path, pid, ppid, session, utime=0, stime=0, rss=0, start_time=1, read_bytes=None,
+                  write_bytes=None):
+    """
+    Write the stat (and io) file of a fake process, in the format of /proc.
+    """
+    process_dir = os.path.join(proc_path, str(pid))
+    if not os.path.exists(process_dir):
+        os.makedirs(process_dir)
+    # Fields 3 (state) to 24 (rss), see proc(5).
+    fields = ["S", ppid, session, session, 0, -1, 0, 0, 0, 0, 0, utime, stime, 0, 0, 20, 0, 1, 0, start_time, 0, rss]
+    with open(os.path.join(process_dir, "stat"), "w") as f:
+        f.write("{} (bcl2fastq (a)) {}\n".format(pid, " ".join(map(str, fields))))
+    if read_bytes is not None:
+        with open(os.path.join(process_dir, "io"), "w") as f:
+            f.write("rchar: 1\nwchar: 2\nread_bytes: {}\nwrite_bytes: {}\n".format(read_bytes, write_bytes))
+
+
+def remove_process(proc_path, pid):
+    shutil.rmtree(os.path.join(proc_path, str(pid)))
+
+
+def sample(timestamp, cpu_seconds, rss_bytes, output_bytes):
+    return {"timestamp": timestamp, "cpu_seconds": cpu_seconds, "rss_bytes": rss_bytes, "read_bytes": 10,
+            "write_bytes": 20, "output_bytes": output_bytes, "nbr_of_processes": 1}
+
+
+class FakeRunnerService:
+
+    def __init__(self, job_store):
+        self.job_store = job_store
+        self.listeners = []
+        self.pids = {}
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def pid(self, job_id):
+        return self.pids.get(job_id)
+
+
+class ImmediateExecutor:
+
+    class Future:
+
+        def add_done_callback(self, callback):
+            callback(self)
+
+    def submit(self, function, *args):
+        function(*args)
+        return ImmediateExecutor.Future()
+
+
+class TestResources(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.proc_path = os.path.join(self.tmp_dir, "proc")
+        os.makedirs(self.proc_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_process_tree(self):
+        write_process(self.proc_path, 100, 1, 100)
+        write_process(self.proc_path, 101, 100, 100)
+        write_process(self.proc_path, 102, 101, 100)
+        # Started by the job, but in a session of its own.
+        write_process(self.proc_path, 103, 102, 103)
+        # Left in the session of the job by a process which has exited.
+        write_process(self.proc_path, 104, 1, 100)
+        write_process(self.proc_path, 200, 1, 200)
+        self.assertEqual(process_tree(100, self.proc_path), [100, 101, 102, 103, 104])
+        self.assertEqual(process_tree(300, self.proc_path), [])
+
+    def test_process_tree_of_real_process(self):
+        process = subprocess.Popen(["sleep", "10"], preexec_fn=os.setsid)
+        try:
+            self.assertEqual(process_tree(process.pid), [process.pid])
+            self.assertIsNotNone(read_process(process.pid))
+        finally:
+            process.kill()
+            process.wait()
+        self.assertIsNone(read_process(process.pid))
+        self.assertGreater(read_process(os.getpid())["rss_bytes"], 0)
+
+    def test_read_process(self):
+        write_process(self.proc_path, 100, 1, 100, utime=3 * CLOCK_TICKS_PER_SECOND, stime=CLOCK_TICKS_PER_SECOND,
+                      rss=10, start_time=5, read_bytes=1000, write_bytes=2000)
+        self.assertEqual(read_process(100, self.proc_path), {"start_time": 5,
+                                                             "cpu_seconds": 4.0,
+                                                             "rss_bytes": 10 * PAGE_SIZE,
+                                                             "read_bytes": 1000,
+                                                             "write_bytes": 2000})
+        write_process(self.proc_path, 101, 1, 100)
+        self.assertIsNone(read_process(101, self.proc_path)["read_bytes"])
+        self.assertIsNone(read_process(102, self.proc_path))
+
+    def test_usage_of_exited_processes_is_kept(self):
+        job_resources = JobResources()
+        write_process(self.proc_path, 100, 1, 100, utime=CLOCK_TICKS_PER_SECOND, rss=1, read_bytes=10, write_bytes=20)
+        write_process(self.proc_path, 101, 100, 100, utime=CLOCK_TICKS_PER_SECOND, rss=2, read_bytes=1, write_bytes=2)
+        first = job_resources.sample([100, 101], self.proc_path)
+        self.assertEqual(first, {"nbr_of_processes": 2, "cpu_seconds": 2.0, "rss_bytes": 3 * PAGE_SIZE,
+                                 "read_bytes": 11, "write_bytes": 22})
+
+        # The pid of the exited process is reused by a new process.
+        write_process(self.proc_path, 101, 100, 100, utime=CLOCK_TICKS_PER_SECOND, rss=2, start_time=2,
+                      read_bytes=1, write_bytes=2)
+        second = job_resources.sample([100, 101], self.proc_path)
+        self.assertEqual(second["cpu_seconds"], 3.0)
+        self.assertEqual(second["read_bytes"], 12)
+
+        remove_process(self.proc_path, 101)
+        third = job_resources.sample([100], self.proc_path)
+        self.assertEqual(third, {"nbr_of_processes": 1, "cpu_seconds": 3.0, "rss_bytes": PAGE_SIZE,
+                                 "read_bytes": 12, "write_bytes": 24})
+
+    def test_directory_size(self):
+        output_dir = os.path.join(self.tmp_dir, "output")
+        self.assertEqual(directory_size(output_dir), 0)
+        os.makedirs(os.path.join(output_dir, "Project"))
+        for path, content in [("Undetermined.fastq.gz", "abc"), ("Project/Sample.fastq.gz", "abcdef")]:
+            with open(os.path.join(output_dir, path), "w") as f:
+                f.write(content)
+        self.assertEqual(directory_size(output_dir), 9)
+
+    def test_summarize_resources(self):
+        self.assertIsNone(summarize_resources([]))
+        summary = summarize_resources([sample(100, 0, 500, 0), sample(110, 40, 800, 1000), sample(120, 80, 600, 1500)])
+        self.assertEqual(summary["samples"], 3)
+        self.assertEqual(summary["cpu_seconds"], 80)
+        self.assertEqual(summary["max_rss_bytes"], 800)
+        self.assertEqual(summary["output_bytes"], 1500)
+        self.assertEqual(summary["average_cores_used"], 4.0)
+        self.assertEqual(summary["output_bytes_per_second"], 75.0)
+        self.assertEqual(summary["current_output_bytes_per_second"], 50.0)
+
+        single = summarize_resources([sample(100, 10, 500, None)])
+        self.assertIsNone(single["average_cores_used"])
+        self.assertIsNone(single["current_output_bytes_per_second"])
+
+    def test_resource_monitor(self):
+        job_store = JobStore()
+        runner_service = FakeRunnerService(job_store)
+        monitor = ResourceMonitor(runner_service, ImmediateExecutor(), proc_path=self.proc_path)
+        output_dir = os.path.join(self.tmp_dir, "output")
+        os.makedirs(output_dir)
+        with open(os.path.join(output_dir, "Undetermined.fastq.gz"), "w") as f:
+            f.write("reads")
+
+        group_job_id = job_store.add_job("bcl2fastq", "runfolder", "/runfolders/runfolder", 8)
+        lane_job_ids = [job_store.add_job("bcl2fastq", "runfolder", "/runfolders/runfolder", 4,
+                                          parent_job_id=group_job_id) for _ in range(2)]
+        for job_id in [group_job_id] + lane_job_ids:
+            job_store.set_state(job_id, State.STARTED)
+        runner_service.pids = {lane_job_ids[0]: 100, lane_job_ids[1]: 200}
+        write_process(self.proc_path, 100, 1, 100, utime=CLOCK_TICKS_PER_SECOND, rss=1)
+        write_process(self.proc_path, 200, 1, 200, utime=CLOCK_TICKS_PER_SECOND, rss=1)
+        write_process(self.proc_path, 300, 1, 300, utime=CLOCK_TICKS_PER_SECOND, rss=1)
+
+        # Jobs are only sampled once they are watched.
+        monitor.sample()
+        self.assertEqual(job_store.resource_samples(group_job_id), [])
+
+        monitor.watch(group_job_id, output_dir)
+        monitor.sample()
+        samples = job_store.resource_samples(group_job_id)
+        self.assertEqual(len(samples), 1)
+        self.assertEqual(samples[0]["nbr_of_processes"], 2)
+        self.assertEqual(samples[0]["cpu_seconds"], 2.0)
+        self.assertEqual(samples[0]["output_bytes"], 5)
+
+        for listener in runner_service.listeners:
+            listener(job_store.get_job(group_job_id), State.STARTED, State.DONE)
+        monitor.sample()
+        self.assertEqual(len(job_store.resource_samples(group_job_id)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+
+from arteria.web.state import State
+
+from bcl2fastq.lib.illumina import FlowcellLayout, Read, RunfolderMetadata
+from bcl2fastq.lib.jobstore import JobStore
+from bcl2fastq.lib.runtime_model import RuntimeModel, RuntimePredictor, job_estimate, run_features
+
+
+def features(tiles, cycles=100, cores=8, samples=10, machine_type="HiSeq 2500"):
+    return {"machine_type": machine_type, "nbr_of_lanes": 1, "nbr_of_tiles": tiles, "nbr_of_cycles": cycles,
+            "nbr_of_samples": samples, "nbr_of_cores": cores}
+
+
+def wall_time(job_features):
+    # 60 seconds of setup, and 0.01 seconds per tile and cycle on one core.
+    return 60 + 0.01 * job_features["nbr_of_tiles"] * job_features["nbr_of_cycles"] / job_features["nbr_of_cores"]
+
+
+class FakeRunnerService:
+
+    def __init__(self, job_store):
+        self.job_store = job_store
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+class TestRuntimeModel(unittest.TestCase):
+
+    def setUp(self):
+        self.job_store = JobStore()
+        self.runner_service = FakeRunnerService(self.job_store)
+
+    def add_finished_job(self, job_features, runtime, state=State.DONE, predicted_runtime=None):
+        job_id = self.job_store.add_job("bcl2fastq", "runfolder", "/runfolders/runfolder",
+                                        job_features["nbr_of_cores"])
+        self.job_store.add_job_features(job_id, job_features, predicted_runtime)
+        self.job_store.set_state(job_id, State.STARTED, timestamp=1000)
+        self.job_store.set_state(job_id, state, timestamp=1000 + runtime)
+        return job_id
+
+    def test_run_features(self):
+        runfolder_metadata = RunfolderMetadata("run", "flowcell", "D00251",
+                                               [Read(1, 101, False), Read(2, 8, True), Read(3, 101, False)],
+                                               FlowcellLayout(lane_count=8, surface_count=2, swath_count=2,
+                                                              tile_count=16))
+        self.assertEqual(run_features(runfolder_metadata, None, 2 * 64, None, 8),
+                         {"machine_type": "HiSeq 2500", "nbr_of_lanes": 2, "nbr_of_tiles": 128, "nbr_of_cycles": 210,
+                          "nbr_of_samples": None, "nbr_of_cores": 8})
+        self.assertEqual(run_features(None, None, None, 1, 4)["nbr_of_cores"], 4)
+
+    def test_fit_recovers_linear_runtimes(self):
+        history = []
+        for tiles in [100, 200, 400, 800, 1600]:
+            for cores in [4, 8, 16]:
+                job_features = features(tiles, cores=cores, samples=tiles // 100)
+                history.append(dict(job_features, wall_time=wall_time(job_features)))
+        model = RuntimeModel.fit(history)
+        self.assertEqual(model.nbr_of_jobs, 15)
+        new_job = features(1200, cores=12, samples=12)
+        self.assertAlmostEqual(model.predict(new_job), wall_time(new_job), delta=0.05 * wall_time(new_job))
+        self.assertIsNone(model.predict(features(None)))
+        self.assertIsNone(RuntimeModel.fit([dict(features(None), wall_time=10)]))
+
+    def test_predictor_needs_enough_history(self):
+        predictor = RuntimePredictor(self.runner_service)
+        for tiles in [100, 200, 400, 800]:
+            self.add_finished_job(features(tiles), wall_time(features(tiles)))
+        # Failed jobs are not part of the history.
+        self.add_finished_job(features(1600), 10, state=State.ERROR)
+        predictor.refit()
+        self.assertIsNone(predictor.predict(features(300)))
+
+        job_id = self.add_finished_job(features(1600), wall_time(features(1600)))
+        for listener in self.runner_service.listeners:
+            listener(self.job_store.get_job(job_id), State.STARTED, State.DONE)
+        self.assertAlmostEqual(predictor.predict(features(300)), wall_time(features(300)), delta=10)
+
+    def test_predictor_falls_back_on_all_machine_types(self):
+        for tiles in [100, 200, 400, 800, 1600]:
+            self.add_finished_job(features(tiles, machine_type="NovaSeq"), 2 * wall_time(features(tiles)))
+        for tiles in [100, 200, 400]:
+            self.add_finished_job(features(tiles), wall_time(features(tiles)))
+        predictor = RuntimePredictor(self.runner_service)
+        self.assertIs(predictor.model("HiSeq 2500"), predictor.model(None))
+        self.assertIsNot(predictor.model("NovaSeq"), predictor.model(None))
+        self.assertAlmostEqual(predictor.predict(features(300, machine_type="NovaSeq")),
+                               2 * wall_time(features(300)), delta=10)
+
+    def test_job_estimate(self):
+        job_id = self.job_store.add_job("bcl2fastq", "runfolder", "/runfolders/runfolder", 8)
+        self.assertIsNone(job_estimate(self.job_store, job_id, {}, now=2000))
+        self.assertIsNone(job_estimate(self.job_store, job_id + 1, {}, now=2000))
+
+        self.job_store.add_job_features(job_id, features(100), 300)
+        self.assertEqual(job_estimate(self.job_store, job_id, {job_id: {"queue_position": 1, "expected_start": 2100}},
+                                      now=2000),
+                         {"predicted_runtime": 300, "expected_end": 2400})
+        self.job_store.set_state(job_id, State.STARTED, timestamp=1900)
+        self.assertEqual(job_estimate(self.job_store, job_id, {}, now=2000),
+                         {"predicted_runtime": 300, "expected_end": 2200})
+        # A job running longer than predicted is expected to end any moment.
+        self.assertEqual(job_estimate(self.job_store, job_id, {}, now=2500)["expected_end"], 2500)
+
+    def test_job_estimate_of_group(self):
+        group_job_id = self.job_store.add_job("bcl2fastq", "runfolder", "/runfolders/runfolder", 8)
+        lane_job_ids = [self.job_store.add_job("bcl2fastq", "runfolder", "/runfolders/runfolder", 4,
+                                               parent_job_id=group_job_id) for _ in range(2)]
+        self.job_store.add_job_features(lane_job_ids[0], features(100), 300)
+        self.job_store.add_job_features(lane_job_ids[1], features(100), 500)
+        self.assertEqual(job_estimate(self.job_store, group_job_id, {}, now=2000),
+                         {"predicted_runtime": 500, "expected_end": None})
+
+        self.job_store.set_state(lane_job_ids[0], State.STARTED, timestamp=2000)
+        queue_status = {lane_job_ids[1]: {"queue_position": 1, "expected_start": 2300}}
+        self.assertEqual(job_estimate(self.job_store, group_job_id, queue_status, now=2000),
+                         {"predicted_runtime": 800, "expected_end": 2800})
+
+
+if __name__ == '__main__':
+    unittest.main()
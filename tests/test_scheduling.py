@@ -0,0 +1,55 @@
+import unittest
+from collections import namedtuple
+
+from bcl2fastq.lib.illumina import FlowcellLayout, Read, RunfolderMetadata
+from bcl2fastq.lib.scheduling import FIFO, SHORTEST_JOB_FIRST, estimated_run_size, expected_starts, queue_order
+
+Job = namedtuple("Job", ["name", "priority", "size", "submitted"])
+
+
+class TestScheduling(unittest.TestCase):
+
+    def test_estimated_run_size(self):
+        runfolder_metadata = RunfolderMetadata("run", "flowcell", "D00251",
+                                               [Read(1, 101, False), Read(2, 8, True), Read(3, 101, False)],
+                                               FlowcellLayout(lane_count=8, surface_count=2, swath_count=2,
+                                                              tile_count=16))
+        self.assertEqual(estimated_run_size(runfolder_metadata, "bcl2fastq"), 8 * 64 * 210)
+        self.assertEqual(estimated_run_size(runfolder_metadata, "bcl2fastq --tiles s_1,s_2"), 2 * 64 * 210)
+        self.assertIsNone(estimated_run_size(runfolder_metadata, "bcl2fastq --tiles s_1_1101"))
+        self.assertIsNone(estimated_run_size(None, "bcl2fastq"))
+
+    def test_fifo(self):
+        jobs = [Job("first", 0, 10, 1), Job("second", 0, 1, 2), Job("urgent", 5, 100, 3)]
+        self.assertEqual([job.name for job in queue_order(jobs, FIFO)], ["urgent", "first", "second"])
+
+    def test_shortest_job_first(self):
+        jobs = [Job("large", 0, 1000, 100), Job("unknown", 0, None, 100), Job("small", 0, 10, 100),
+                Job("urgent", 1, 5000, 100)]
+        self.assertEqual([job.name for job in queue_order(jobs, SHORTEST_JOB_FIRST, now=100)],
+                         ["urgent", "small", "large", "unknown"])
+
+    def test_aging(self):
+        def order(now):
+            # A small job has just been submitted, while the large job has waited since 0.
+            jobs = [Job("large", 0, 1000, 0), Job("small", 0, 10, now)]
+            return [job.name for job in queue_order(jobs, SHORTEST_JOB_FIRST, aging_interval=3600, now=now)]
+
+        self.assertEqual(order(3600 * 50), ["small", "large"])
+        self.assertEqual(order(3600 * 100), ["large", "small"])
+
+    def test_expected_starts(self):
+        # 4 cores, of which 3 are used by a job ending at 100, and 1 by a job ending at 50.
+        running_jobs = [(3, 100), (1, 50)]
+        queued_jobs = [(1, 20), (2, 30), (4, 10), (1, None), (1, 10)]
+        self.assertEqual(expected_starts(queued_jobs, running_jobs, 4, now=10),
+                         [50, 100, 130, 140, 140])
+
+    def test_expected_starts_when_runtimes_are_not_known(self):
+        self.assertEqual(expected_starts([(1, 10), (2, 10)], [(1, None)], 2, now=10), [10, None])
+        self.assertEqual(expected_starts([(1, None), (1, 10), (2, 10)], [], 2, now=10), [10, 10, None])
+        self.assertEqual(expected_starts([], [(1, None)], 2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from bcl2fastq.lib import staging
+from bcl2fastq.lib.output_reaper import OutputReaper
+from bcl2fastq.lib.staging import copy_verified, file_checksum, move_output, replace_symlink
+
+
+class TestStaging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.scratch = os.path.join(self.tmp_dir, "scratch", "runfolder")
+        self.output = os.path.join(self.tmp_dir, "output", "runfolder")
+        os.makedirs(os.path.join(self.scratch, "Project", "Sample"))
+        os.makedirs(os.path.dirname(self.output))
+        self.files = {"Undetermined_S0_R1_001.fastq.gz": "undetermined",
+                      "Project/Sample/Sample_S1_R1_001.fastq.gz": "reads" * 1000,
+                      "Project/empty.txt": ""}
+        for path, content in self.files.items():
+            with open(os.path.join(self.scratch, path), "w") as f:
+                f.write(content)
+        os.symlink("Project/Sample", os.path.join(self.scratch, "Sample"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_copy_verified(self):
+        source = os.path.join(self.scratch, "Project/Sample/Sample_S1_R1_001.fastq.gz")
+        destination = os.path.join(self.tmp_dir, "copy")
+        with mock.patch.object(staging, "CHUNK_SIZE", 7):
+            self.assertEqual(copy_verified(source, destination), 5000)
+        self.assertEqual(file_checksum(destination), file_checksum(source))
+
+        with mock.patch.object(staging, "file_checksum", return_value="0"):
+            with self.assertRaises(IOError):
+                copy_verified(source, destination)
+
+    def test_move_output(self):
+        os.makedirs(self.output)
+        with open(os.path.join(self.output, "old.fastq.gz"), "w") as f:
+            f.write("old")
+
+        self.assertEqual(move_output(self.scratch, self.output, nbr_of_threads=2), 5012)
+        for path, content in self.files.items():
+            self.assertEqual(self.read(os.path.join(self.output, path)), content)
+        self.assertEqual(os.readlink(os.path.join(self.output, "Sample")), "Project/Sample")
+        self.assertFalse(os.path.exists(self.scratch))
+        self.assertFalse(os.path.exists(os.path.join(self.output, "old.fastq.gz")))
+        self.assertEqual(len(os.listdir(OutputReaper.trash_dir_for(self.output))), 1)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.output))),
+                         sorted([OutputReaper.TRASH_DIR_NAME, "runfolder"]))
+
+    def test_move_output_deletes_the_replaced_output(self):
+        os.makedirs(self.output)
+        with open(os.path.join(self.output, "old.fastq.gz"), "w") as f:
+            f.write("old")
+
+        output_reaper = OutputReaper(nbr_of_threads=1)
+        move_output(self.scratch, self.output, output_reaper=output_reaper)
+        deadline = time.time() + 5
+        while output_reaper.status()["pending"] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.read(os.path.join(self.output, "Undetermined_S0_R1_001.fastq.gz")), "undetermined")
+        self.assertEqual(os.listdir(OutputReaper.trash_dir_for(self.output)), [])
+        self.assertEqual(output_reaper.status()["bytes_reclaimed"], len("old"))
+
+    def test_failed_move_keeps_the_output_in_scratch(self):
+        with mock.patch.object(staging, "file_checksum", return_value="0"):
+            with self.assertRaises(IOError):
+                move_output(self.scratch, self.output)
+        self.assertFalse(os.path.exists(self.output))
+        self.assertFalse(os.path.exists(self.output + staging.INCOMING_SUFFIX))
+        for path, content in self.files.items():
+            self.assertEqual(self.read(os.path.join(self.scratch, path)), content)
+
+    def test_replace_symlink(self):
+        link_path = os.path.join(self.tmp_dir, "Unaligned")
+        replace_symlink(self.scratch, link_path)
+        self.assertEqual(os.readlink(link_path), self.scratch)
+        replace_symlink(self.output, link_path)
+        self.assertEqual(os.readlink(link_path), self.output)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["Unaligned", "output", "scratch"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from bcl2fastq.lib.thread_profiles import ThreadProfile, ThreadProfiles, ThreadProfileStore
+from test_utils import DummyConfig
+
+
+class TestThreadProfile(unittest.TestCase):
+
+    def test_from_dict(self):
+        profile = ThreadProfile.from_dict({"loading_threads": 4, "writing_threads": 16, "compression_level": 0}, 8)
+        self.assertEqual(profile, ThreadProfile(loading_threads=4, processing_threads=8, writing_threads=8,
+                                                compression_level=0))
+
+    def test_as_arguments(self):
+        profile = ThreadProfile(loading_threads=4, processing_threads=8, writing_threads=None, compression_level=2)
+        self.assertEqual(profile.as_arguments(),
+                         ["--loading-threads 4", "--processing-threads 8", "--fastq-compression-level 2"])
+
+    def test_as_arguments_does_not_override_given_arguments(self):
+        profile = ThreadProfile(loading_threads=4, processing_threads=8, writing_threads=4, compression_level=None)
+        self.assertEqual(profile.as_arguments(["-p", "--writing-threads"]), ["--loading-threads 4"])
+
+
+class TestThreadProfileStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "profiles.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_and_get(self):
+        store = ThreadProfileStore(self.path)
+        profile = ThreadProfile(2, 8, 4, None)
+        store.put("HiSeq X", 8, profile, [(profile, 10.0), (ThreadProfile(4, 8, 4, None), 12.5)])
+        self.assertEqual(store.version, 1)
+        self.assertEqual(store.get("HiSeq X", 8), profile)
+        self.assertIsNone(store.get("HiSeq X", 16))
+
+        reopened_store = ThreadProfileStore(self.path)
+        self.assertEqual(reopened_store.get("HiSeq X", 8), profile)
+        self.assertEqual(len(reopened_store.all()["HiSeq X/8"]["timings"]), 2)
+
+
+class TestThreadProfiles(unittest.TestCase):
+
+    config = {"machine_type": {"HiSeq X": {"bcl2fastq_version": "2.15.2",
+                                           "thread_profile": {"loading_threads": 4, "writing_threads": 4,
+                                                              "compression_level": 3}},
+                               "MiSeq": {"bcl2fastq_version": "2.15.2"}}}
+
+    def test_configured_profile(self):
+        thread_profiles = ThreadProfiles(self.config, ThreadProfileStore())
+        self.assertEqual(thread_profiles.profile_for("HiSeq X", 16), ThreadProfile(4, 16, 4, 3))
+        self.assertEqual(thread_profiles.profile_for("MiSeq", 16), ThreadProfile(None, 16, None, None))
+        self.assertEqual(thread_profiles.profile_for(None, 16), ThreadProfile(None, 16, None, None))
+
+    def test_tuned_profile_takes_precedence(self):
+        store = ThreadProfileStore()
+        store.put("HiSeq X", 16, ThreadProfile(8, 16, 2, 3), [])
+        thread_profiles = ThreadProfiles(self.config, store)
+        self.assertEqual(thread_profiles.profile_for("HiSeq X", 16), ThreadProfile(8, 16, 2, 3))
+        self.assertEqual(thread_profiles.profile_for("HiSeq X", 8), ThreadProfile(4, 8, 4, 3))
+
+    def test_autotune_candidates(self):
+        thread_profiles = ThreadProfiles(self.config, ThreadProfileStore())
+        candidates = thread_profiles.autotune_candidates("HiSeq X", 4, loading_threads=[2, 4, 8], writing_threads=[4])
+        self.assertEqual(candidates, [ThreadProfile(2, 4, 4, 3), ThreadProfile(4, 4, 4, 3)])
+
+    def test_fastest(self):
+        timings = [(ThreadProfile(2, 4, 4, None), 12.0), (ThreadProfile(4, 4, 4, None), 9.5)]
+        self.assertEqual(ThreadProfiles.fastest(timings), ThreadProfile(4, 4, 4, None))
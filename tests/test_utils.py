@@ -60,9 +60,12 @@ class DummyConfig:
         return self.DUMMY_CONFIG[key]
 
 class DummyRunnerConfig(Bcl2FastqConfig):
-    def __init__(self, output, general_config):
+    def __init__(self, output, general_config, split_by_lane=False, lanes=None):
         self.output = output
         self.general_config = general_config
+        self.split_by_lane = split_by_lane
+        self.lanes = lanes
+        self.scratch = None
 
 
 class FakeRunner(BCL2FastqRunner):
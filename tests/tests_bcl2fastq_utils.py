@@ -1,10 +1,12 @@
+import hashlib
 import unittest
-from mock import patch
+from mock import patch, MagicMock
 import tempfile
 import os
 
 from bcl2fastq.lib.bcl2fastq_utils import *
-from bcl2fastq.lib.illumina import Samplesheet
+from bcl2fastq.lib.illumina import Samplesheet, RunfolderMetadata
+from bcl2fastq.lib.thread_profiles import ThreadProfile
 from test_utils import TestUtils, DummyConfig
 
 
@@ -142,6 +144,23 @@ class TestBCL2FastqRunnerFactory(unittest.TestCase):
         runner = factory.create_bcl2fastq_runner(config)
         self.assertIsInstance(runner, BCL2Fastq2xRunner, msg="runner is: " + str(runner))
 
+    def test_created_runners_share_version_cache(self):
+        config = Bcl2FastqConfig(
+            general_config = DUMMY_CONFIG,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "test/output")
+
+        factory = BCL2FastqRunnerFactory(self.dummy_config)
+        runner = factory.create_bcl2fastq_runner(config)
+        self.assertIs(runner.version_cache, factory.version_cache)
+
+    def test_detected_versions(self):
+        factory = BCL2FastqRunnerFactory(self.dummy_config)
+        with patch.object(BinaryVersionCache, "get", return_value="bcl2fastq v2.15.2"):
+            detected_versions = factory.detected_versions()
+        self.assertEqual(detected_versions, {"2.15.2": "bcl2fastq v2.15.2", "1.8.4": "1.8.4"})
+
     def test_create_invalid_version_runner(self):
         config = Bcl2FastqConfig(
             general_config = DUMMY_CONFIG,
@@ -154,6 +173,48 @@ class TestBCL2FastqRunnerFactory(unittest.TestCase):
             factory.create_bcl2fastq_runner(config)
 
 
+class TestBinaryVersionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.binary = tempfile.mktemp()
+        with open(self.binary, "w") as f:
+            f.write("#!/bin/sh")
+        self.probed = []
+
+    def tearDown(self):
+        os.remove(self.binary)
+
+    def probe(self, binary):
+        self.probed.append(binary)
+        return "bcl2fastq v2.20.0.422"
+
+    def test_get_or_probe_only_probes_once(self):
+        cache = BinaryVersionCache()
+        self.assertEqual(cache.get_or_probe(self.binary, self.probe), "bcl2fastq v2.20.0.422")
+        self.assertEqual(cache.get_or_probe(self.binary, self.probe), "bcl2fastq v2.20.0.422")
+        self.assertEqual(self.probed, [self.binary])
+
+    def test_get_or_probe_probes_changed_binary(self):
+        cache = BinaryVersionCache()
+        cache.get_or_probe(self.binary, self.probe)
+        stat = os.stat(self.binary)
+        os.utime(self.binary, (stat.st_atime, stat.st_mtime + 10))
+        cache.get_or_probe(self.binary, self.probe)
+        self.assertEqual(len(self.probed), 2)
+
+    def test_get_does_not_probe(self):
+        cache = BinaryVersionCache()
+        self.assertIsNone(cache.get(self.binary))
+        cache.get_or_probe(self.binary, self.probe)
+        self.assertEqual(cache.get(self.binary), "bcl2fastq v2.20.0.422")
+
+    def test_get_or_probe_missing_binary(self):
+        cache = BinaryVersionCache()
+        cache.get_or_probe("/path/to/missing/binary", self.probe)
+        cache.get_or_probe("/path/to/missing/binary", self.probe)
+        self.assertEqual(len(self.probed), 2)
+
+
 class TestBCL2Fastq2xRunner(unittest.TestCase):
     def test_construct_command(self):
 
@@ -178,6 +239,127 @@ class TestBCL2Fastq2xRunner(unittest.TestCase):
                            "--my-best-arg 1 --my-best-arg 2"
         self.assertEqual(command, expected_command)
 
+    def test_construct_command_with_thread_profile(self):
+        config = Bcl2FastqConfig(
+            general_config = DUMMY_CONFIG,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "test/output",
+            use_base_mask="--use-bases-mask y*,i6,i6,y*",
+            additional_args="--writing-threads 2",
+            nbr_of_cores=16)
+
+        thread_profiles = MagicMock()
+        thread_profiles.profile_for.return_value = ThreadProfile(4, 16, 4, 3)
+        with patch.object(RunfolderMetadata, "for_runfolder") as for_runfolder:
+            for_runfolder.return_value.machine_type = "HiSeq X"
+            command = BCL2Fastq2xRunner(config, "/bcl/binary/path", thread_profiles=thread_profiles).construct_command()
+        thread_profiles.profile_for.assert_called_once_with("HiSeq X", 16)
+        expected_command = "/bcl/binary/path --input-dir test/runfolder/Data/Intensities/BaseCalls " \
+                           "--output-dir test/output " \
+                           "--sample-sheet test/runfolder/SampleSheet.csv " \
+                           "--loading-threads 4 " \
+                           "--processing-threads 16 " \
+                           "--fastq-compression-level 3 " \
+                           "--use-bases-mask y*,i6,i6,y* " \
+                           "--writing-threads 2"
+        self.assertEqual(command, expected_command)
+
+    def test_construct_autotune_commands(self):
+        config = Bcl2FastqConfig(
+            general_config = DUMMY_CONFIG,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "test/autotune",
+            tiles = "s_1_1101",
+            use_base_mask="--use-bases-mask y*,i6,i6,y*")
+        candidates = [ThreadProfile(2, 8, 2, None), ThreadProfile(4, 8, 4, None)]
+        commands = BCL2Fastq2xRunner(config, "/bcl/binary/path").construct_autotune_commands(candidates,
+                                                                                            "test/autotune")
+        self.assertEqual([(candidate, output) for candidate, output, _ in commands],
+                         [(candidates[0], "test/autotune/candidate_0"), (candidates[1], "test/autotune/candidate_1")])
+        self.assertIn("--tiles s_1_1101 --loading-threads 4 --processing-threads 8 --writing-threads 4",
+                      commands[1][2])
+
+    def test_construct_lane_commands(self):
+        runfolder = tempfile.mkdtemp()
+        try:
+            shutil.copy(TestBcl2FastqConfig.samplesheet_file, os.path.join(runfolder, "SampleSheet.csv"))
+            config = Bcl2FastqConfig(
+                general_config=DUMMY_CONFIG,
+                bcl2fastq_version="2.15.2",
+                runfolder_input=runfolder,
+                output="test/output",
+                use_base_mask="--use-bases-mask y*,i6,i6,y*",
+                nbr_of_cores=8,
+                split_by_lane=True,
+                lanes=["3", 1])
+
+            runner = BCL2Fastq2xRunner(config, "/bcl/binary/path")
+            lane_commands = runner.construct_lane_commands()
+            self.assertEqual([(lane, nbr_of_cores) for lane, _, nbr_of_cores in lane_commands], [(1, 4), (3, 4)])
+            expected_command = "/bcl/binary/path --input-dir {0}/Data/Intensities/BaseCalls " \
+                               "--output-dir test/output/Lanes/L003 " \
+                               "--sample-sheet {0}/SampleSheet_L003.csv " \
+                               "--tiles s_3 " \
+                               "--processing-threads 4 " \
+                               "--use-bases-mask y*,i6,i6,y*".format(runfolder)
+            self.assertEqual(lane_commands[1][1], expected_command)
+            lane_samplesheet = Samplesheet(os.path.join(runfolder, "SampleSheet_L003.csv"))
+            self.assertEqual([sample.lane for sample in lane_samplesheet.samples], [3])
+        finally:
+            shutil.rmtree(runfolder)
+
+    def test_construct_lane_commands_without_writing_samplesheets(self):
+        runfolder = tempfile.mkdtemp()
+        try:
+            shutil.copy(TestBcl2FastqConfig.samplesheet_file, os.path.join(runfolder, "SampleSheet.csv"))
+            config = Bcl2FastqConfig(
+                general_config=DUMMY_CONFIG,
+                bcl2fastq_version="2.15.2",
+                runfolder_input=runfolder,
+                output="test/output",
+                use_base_mask="--use-bases-mask y*,i6,i6,y*",
+                nbr_of_cores=8,
+                split_by_lane=True,
+                lanes=[3])
+
+            runner = BCL2Fastq2xRunner(config, "/bcl/binary/path")
+            lane_commands = runner.construct_lane_commands(write_samplesheets=False)
+            self.assertIn("--sample-sheet {0}/SampleSheet_L003.csv".format(runfolder), lane_commands[0][1])
+            self.assertEqual(os.listdir(runfolder), ["SampleSheet.csv"])
+
+            runner.write_lane_samplesheets([3])
+            self.assertTrue(os.path.exists(os.path.join(runfolder, "SampleSheet_L003.csv")))
+        finally:
+            shutil.rmtree(runfolder)
+
+    def test_construct_lane_commands_invalid_lane(self):
+        runfolder = tempfile.mkdtemp()
+        try:
+            shutil.copy(TestBcl2FastqConfig.samplesheet_file, os.path.join(runfolder, "SampleSheet.csv"))
+            config = Bcl2FastqConfig(
+                general_config=DUMMY_CONFIG,
+                bcl2fastq_version="2.15.2",
+                runfolder_input=runfolder,
+                output="test/output",
+                split_by_lane=True,
+                lanes=[9])
+            with self.assertRaises(ArteriaUsageException):
+                BCL2Fastq2xRunner(config, "/bcl/binary/path").construct_lane_commands()
+        finally:
+            shutil.rmtree(runfolder)
+
+    def test_lanes_require_split_by_lane(self):
+        with self.assertRaises(ArteriaUsageException):
+            Bcl2FastqConfig(
+                general_config=DUMMY_CONFIG,
+                bcl2fastq_version="2.15.2",
+                runfolder_input="test/runfolder",
+                output="test/output",
+                lanes=[1])
+
+
 class TestBCL2FastqRunner(unittest.TestCase):
 
     config = Bcl2FastqConfig(
@@ -225,6 +407,140 @@ class TestBCL2FastqRunner(unittest.TestCase):
                 m.assert_called_with(TestBCL2FastqRunner.config.output,
                                      TestBCL2FastqRunner.config.runfolder_input + "/Unaligned")
 
+    def test_delete_output_with_reaper(self):
+        config = Bcl2FastqConfig(
+            general_config = DUMMY_CONFIG,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "/foo/bar/runfolder")
+        reaper = MagicMock()
+        with patch.object(OutputReaper, "move_to_trash", return_value="/foo/bar/.bcl2fastq_trash/x") as trash, \
+             patch.object(shutil, "rmtree") as rmtree:
+            self.DummyBCL2FastqRunner(config, None, None).delete_output(reaper)
+            trash.assert_called_once_with("/foo/bar/runfolder", "/foo/bar")
+            reaper.schedule.assert_called_once_with("/foo/bar/.bcl2fastq_trash/x")
+            rmtree.assert_not_called()
+
+    def test_delete_output_of_selected_lanes(self):
+        config = Bcl2FastqConfig(
+            general_config = DUMMY_CONFIG,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "/foo/bar/runfolder",
+            split_by_lane=True,
+            lanes=[2])
+        with patch.object(shutil, "rmtree") as rmtree:
+            self.DummyBCL2FastqRunner(config, None, None).delete_output()
+            rmtree.assert_called_once_with("/foo/bar/runfolder/Lanes/L002")
+        # The output of the lanes is trashed into the allowed output folder, where the reaper looks for it.
+        with patch.object(OutputReaper, "move_to_trash", return_value=None) as trash:
+            self.DummyBCL2FastqRunner(config, None, None).delete_output(MagicMock())
+            trash.assert_called_once_with("/foo/bar/runfolder/Lanes/L002", "/foo/bar")
+
+    def test_output_staged_in_scratch(self):
+        general_config = dict(DummyConfig.DUMMY_CONFIG, scratch_path="/scratch")
+        config = Bcl2FastqConfig(
+            general_config = general_config,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "/foo/bar/runfolder",
+            split_by_lane=True)
+        scratch = "/scratch/runfolder." + hashlib.md5("/foo/bar/runfolder").hexdigest()[:12]
+        self.assertEqual(config.scratch, scratch)
+        self.assertEqual(config.work_output, scratch)
+        runner = self.DummyBCL2FastqRunner(config, None, None)
+        self.assertEqual(runner.lane_output(1), scratch + "/Lanes/L001")
+        with patch.object(shutil, "rmtree") as rmtree:
+            runner.delete_output()
+            self.assertEqual([call[0][0] for call in rmtree.call_args_list],
+                             ["/foo/bar/runfolder", scratch])
+
+        # Outputs with the same name in different output folders are staged in different directories.
+        self.assertNotEqual(Bcl2FastqConfig.scratch_dir_name("/foo/baz/runfolder"),
+                            Bcl2FastqConfig.scratch_dir_name("/foo/bar/runfolder"))
+        self.assertEqual(Bcl2FastqConfig.scratch_dir_name("/foo/bar/runfolder/"),
+                         Bcl2FastqConfig.scratch_dir_name("/foo/bar/runfolder"))
+
+        # Reruns of some of the lanes are merged with the output already in place, so they are not staged.
+        config = Bcl2FastqConfig(
+            general_config = general_config,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "/foo/bar/runfolder",
+            split_by_lane=True,
+            lanes=[2])
+        self.assertIsNone(config.scratch)
+        self.assertEqual(config.work_output, "/foo/bar/runfolder")
+
+    def test_move_staged_output(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            runfolder = os.path.join(tmp_dir, "runfolder")
+            os.makedirs(runfolder)
+            config = Bcl2FastqConfig(
+                general_config = dict(DummyConfig.DUMMY_CONFIG, scratch_path=os.path.join(tmp_dir, "scratch")),
+                bcl2fastq_version = "2.15.2",
+                runfolder_input = runfolder,
+                output = os.path.join(tmp_dir, "output", "runfolder"))
+            os.makedirs(config.scratch)
+            os.makedirs(os.path.dirname(config.output))
+            with open(os.path.join(config.scratch, "Sample_S1_R1_001.fastq.gz"), "w") as f:
+                f.write("reads")
+
+            runner = self.DummyBCL2FastqRunner(config, None, None)
+            runner.symlink_output_to_unaligned()
+            self.assertEqual(os.readlink(os.path.join(runfolder, "Unaligned")), config.scratch)
+            runner.move_staged_output()
+            self.assertEqual(os.readlink(os.path.join(runfolder, "Unaligned")), config.output)
+            self.assertTrue(os.path.exists(os.path.join(runfolder, "Unaligned", "Sample_S1_R1_001.fastq.gz")))
+            self.assertFalse(os.path.exists(config.scratch))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_samplesheet_kept_aside_in_dry_run(self):
+        runfolder = tempfile.mkdtemp()
+        try:
+            samplesheet_file = os.path.join(runfolder, "SampleSheet.csv")
+            with open(samplesheet_file, "w") as f:
+                f.write("old")
+            config = Bcl2FastqConfig(
+                general_config = DUMMY_CONFIG,
+                bcl2fastq_version = "2.15.2",
+                runfolder_input = runfolder,
+                output = "/foo/bar/runfolder",
+                samplesheet = "new",
+                dry_run = True)
+            self.assertEqual(config.samplesheet_file, samplesheet_file)
+            self.assertEqual(open(config.samplesheet_source).read(), "new")
+            self.assertEqual(os.listdir(runfolder), ["SampleSheet.csv"])
+
+            pending_samplesheet_file = config.samplesheet_source
+            config.write_pending_samplesheet()
+            self.assertEqual(config.samplesheet_source, samplesheet_file)
+            self.assertFalse(os.path.exists(pending_samplesheet_file))
+            self.assertEqual(open(samplesheet_file).read(), "new")
+            self.assertEqual(len(os.listdir(runfolder)), 2)
+        finally:
+            shutil.rmtree(runfolder)
+
+    def test_validate_output_rejects_trash(self):
+        config = Bcl2FastqConfig(
+            general_config = DUMMY_CONFIG,
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "/foo/bar/" + OutputReaper.TRASH_DIR_NAME)
+        with self.assertRaises(ArteriaUsageException):
+            self.DummyBCL2FastqRunner(config, None, None).validate_output()
+
+        config = Bcl2FastqConfig(
+            general_config = dict(DummyConfig.DUMMY_CONFIG,
+                                  allowed_output_folders=["/foo/bar/{}/x".format(OutputReaper.TRASH_DIR_NAME)]),
+            bcl2fastq_version = "2.15.2",
+            runfolder_input = "test/runfolder",
+            output = "/foo/bar/{}/x/runfolder".format(OutputReaper.TRASH_DIR_NAME))
+        with self.assertRaises(ArteriaUsageException):
+            self.DummyBCL2FastqRunner(config, None, None).validate_output()
+
 class TestBCL2Fastq1xRunner(unittest.TestCase):
 
     def test_construct_command(self):
@@ -1,7 +1,18 @@
 
+import os
+import shutil
+import sys
+import tempfile
 import unittest
-from bcl2fastq.lib.jobrunner import LocalQAdapter
+from mock import patch
+from bcl2fastq.lib.jobrunner import LocalQAdapter, SubprocessAdapter, BatchSchedulerAdapter, JobStoreAdapter, \
+    JobRunnerAdapter
+from bcl2fastq.lib.jobstore import JobStore
 from arteria.web.state import State
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.process import Subprocess
+from tornado.testing import AsyncTestCase, gen_test
 import time
 
 class TestLocalQAdapter(unittest.TestCase):
@@ -48,3 +59,510 @@ class TestLocalQAdapter(unittest.TestCase):
         self.assertEqual(result, {job_id_1: State.PENDING, job_id_2: State.PENDING})
 
 
+class TestSubprocessAdapter(AsyncTestCase):
+
+    def setUp(self):
+        super(TestSubprocessAdapter, self).setUp()
+        self.run_dir = tempfile.mkdtemp()
+        self.adapter = SubprocessAdapter(nbr_of_cores=2)
+        self.changes = []
+        self.adapter.add_listener(lambda job_id, old, new: self.changes.append((job_id, old, new)))
+
+    def tearDown(self):
+        self.adapter.stop_all()
+        # The SIGCHLD handler is tied to the IOLoop of each test.
+        Subprocess.uninitialize()
+        shutil.rmtree(self.run_dir)
+        super(TestSubprocessAdapter, self).tearDown()
+
+    @gen.coroutine
+    def wait_for_state(self, job_id, states, timeout=5):
+        deadline = time.time() + timeout
+        while self.adapter.status(job_id) not in states and time.time() < deadline:
+            yield gen.sleep(0.01)
+        raise gen.Return(self.adapter.status(job_id))
+
+    @gen_test
+    def test_start_and_finish(self):
+        stdout = os.path.join(self.run_dir, "out.log")
+        job_id = self.adapter.start("echo hello", 1, self.run_dir, stdout=stdout, stderr=stdout)
+        self.assertEqual(self.adapter.status(job_id), State.PENDING)
+        state = yield self.wait_for_state(job_id, [State.DONE, State.ERROR])
+        self.assertEqual(state, State.DONE)
+        self.assertEqual(self.changes, [(job_id, State.PENDING, State.STARTED),
+                                        (job_id, State.STARTED, State.DONE)])
+        with open(stdout) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+    @gen_test
+    def test_failing_job(self):
+        job_id = self.adapter.start("exit 3", 1, self.run_dir)
+        state = yield self.wait_for_state(job_id, [State.DONE, State.ERROR])
+        self.assertEqual(state, State.ERROR)
+
+    @gen_test
+    def test_missing_run_dir(self):
+        job_id = self.adapter.start("true", 1, os.path.join(self.run_dir, "missing"))
+        state = yield self.wait_for_state(job_id, [State.DONE, State.ERROR])
+        self.assertEqual(state, State.ERROR)
+
+    @gen_test
+    def test_jobs_wait_for_cores(self):
+        first = self.adapter.start("sleep 0.3", 2, self.run_dir)
+        second = self.adapter.start("true", 1, self.run_dir)
+        yield self.wait_for_state(first, [State.STARTED])
+        self.assertEqual(self.adapter.status(second), State.PENDING)
+        self.assertEqual(self.adapter.queue_depth(), 1)
+        state = yield self.wait_for_state(second, [State.DONE])
+        self.assertEqual(state, State.DONE)
+        self.assertEqual(self.adapter.status(first), State.DONE)
+
+    @gen_test
+    def test_job_larger_than_all_cores_runs_alone(self):
+        job_id = self.adapter.start("true", 4, self.run_dir)
+        state = yield self.wait_for_state(job_id, [State.DONE])
+        self.assertEqual(state, State.DONE)
+
+    @gen_test
+    def test_stop(self):
+        running = self.adapter.start("sleep 10", 2, self.run_dir)
+        pending = self.adapter.start("sleep 10", 1, self.run_dir)
+        yield self.wait_for_state(running, [State.STARTED])
+        self.assertEqual(self.adapter.stop(str(pending)), pending)
+        self.assertEqual(self.adapter.status(pending), State.CANCELLED)
+        self.assertEqual(self.adapter.stop(running), running)
+        state = yield self.wait_for_state(running, [State.CANCELLED])
+        self.assertEqual(state, State.CANCELLED)
+        self.assertIsNone(self.adapter.stop(123))
+
+    @gen_test
+    def test_status_all(self):
+        job_id_1 = self.adapter.start("true", 1, self.run_dir)
+        job_id_2 = self.adapter.start("true", 1, self.run_dir)
+        self.assertEqual(self.adapter.status_all(), {job_id_1: State.PENDING, job_id_2: State.PENDING})
+        self.assertEqual(self.adapter.status(123), State.NONE)
+        yield self.wait_for_state(job_id_2, [State.DONE])
+
+    def started_jobs(self):
+        return [job_id for job_id, _, new in self.changes if new == State.STARTED]
+
+    @gen_test
+    def test_higher_priority_runs_first(self):
+        blocker = self.adapter.start("sleep 0.3", 2, self.run_dir)
+        yield self.wait_for_state(blocker, [State.STARTED])
+        low = self.adapter.start("true", 2, self.run_dir)
+        high = self.adapter.start("true", 2, self.run_dir, priority=5)
+        self.assertEqual([job_id for job_id, _ in sorted(self.adapter.queue_status().items(),
+                                                         key=lambda item: item[1]["queue_position"])],
+                         [high, low])
+        yield self.wait_for_state(low, [State.DONE])
+        self.assertEqual(self.started_jobs(), [blocker, high, low])
+
+    @gen_test
+    def test_shortest_job_first(self):
+        adapter = SubprocessAdapter(nbr_of_cores=2, scheduling="shortest_job_first")
+        changes = []
+        adapter.add_listener(lambda job_id, old, new: changes.append(job_id) if new == State.STARTED else None)
+        blocker = adapter.start("sleep 0.3", 2, self.run_dir, size=100)
+        while adapter.status(blocker) != State.STARTED:
+            yield gen.sleep(0.01)
+        large = adapter.start("true", 2, self.run_dir, size=1000)
+        small = adapter.start("true", 2, self.run_dir, size=10)
+        queue_status = adapter.queue_status()
+        self.assertEqual(queue_status[small], {"queue_position": 1, "expected_start": None})
+        self.assertEqual(queue_status[large]["queue_position"], 2)
+
+        while adapter.status(large) != State.DONE:
+            yield gen.sleep(0.01)
+        self.assertEqual(changes, [blocker, small, large])
+        # The runtime of the jobs which have finished is used to tell when jobs will start.
+        self.assertIsNotNone(adapter.seconds_per_size_unit)
+        self.assertGreater(adapter.estimated_runtime(adapter.jobs[large]), 0)
+
+    @gen_test
+    def test_predicted_runtime_is_used_for_queue_status(self):
+        blocker = self.adapter.start("sleep 10", 2, self.run_dir, runtime=100)
+        yield self.wait_for_state(blocker, [State.STARTED])
+        waiting = self.adapter.start("true", 2, self.run_dir, size=10, runtime=5)
+        self.assertEqual(self.adapter.queue_status()[waiting]["expected_start"],
+                         self.adapter.jobs[blocker].started + 100)
+        self.assertEqual(self.adapter.estimated_runtime(self.adapter.jobs[waiting]), 5)
+        self.adapter.stop(blocker)
+        yield self.wait_for_state(waiting, [State.DONE])
+
+    def test_unknown_scheduling_policy(self):
+        with self.assertRaises(ValueError):
+            SubprocessAdapter(nbr_of_cores=2, scheduling="random")
+
+    @gen_test
+    def test_pid(self):
+        job_store_adapter = JobStoreAdapter(self.adapter, JobStore())
+        job_id = job_store_adapter.start("sleep 10", 1, self.run_dir)
+        self.assertIsNone(job_store_adapter.pid(job_id))
+        yield self.wait_for_state(job_id, [State.STARTED])
+        pid = job_store_adapter.pid(job_id)
+        self.assertEqual(pid, self.adapter.jobs[job_id].process.pid)
+        self.assertEqual(os.getpgid(pid), pid)
+        self.adapter.stop(job_id)
+        yield self.wait_for_state(job_id, [State.CANCELLED])
+        self.assertIsNone(job_store_adapter.pid(job_id))
+        self.assertIsNone(job_store_adapter.pid(123))
+
+    @gen_test
+    def test_job_store_follows_state_changes(self):
+        job_store_adapter = JobStoreAdapter(self.adapter, JobStore())
+        job_id = job_store_adapter.start("true", 1, self.run_dir)
+        deadline = time.time() + 5
+        while job_store_adapter.status(job_id) != State.DONE and time.time() < deadline:
+            yield gen.sleep(0.01)
+        self.assertEqual(job_store_adapter.status(job_id), State.DONE)
+
+
+class TestBatchSchedulerAdapter(unittest.TestCase):
+
+    fake_scheduler = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fake_scheduler.py")
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_dir = os.path.join(self.tmp_dir, "state")
+        self.script_dir = os.path.join(self.tmp_dir, "scripts")
+        os.makedirs(self.state_dir)
+        os.makedirs(self.script_dir)
+        scheduler = "{} {} {{}} {}".format(sys.executable, self.fake_scheduler, self.state_dir)
+        self.adapter = BatchSchedulerAdapter(script_dir=self.script_dir,
+                                             submit_command=scheduler.format("submit") + " {script} {stdout} {stderr}",
+                                             status_command=scheduler.format("status") + " {job_ids}",
+                                             cancel_command=scheduler.format("cancel") + " {job_ids}",
+                                             interval=None)
+
+    def tearDown(self):
+        self.adapter.stop_all().result()
+        shutil.rmtree(self.tmp_dir)
+
+    def wait_for_state(self, job_id, states, timeout=5):
+        deadline = time.time() + timeout
+        while self.adapter.status(job_id) not in states and time.time() < deadline:
+            time.sleep(0.05)
+            self.adapter.poll()
+        return self.adapter.status(job_id)
+
+    def test_start_and_finish(self):
+        stdout = os.path.join(self.tmp_dir, "out.log")
+        job_id = self.adapter.start("echo hello", 2, self.tmp_dir, stdout=stdout, stderr=stdout).result()
+        self.assertEqual(job_id, "1001")
+        self.assertEqual(self.adapter.status(job_id), State.PENDING)
+        self.assertEqual(self.wait_for_state(job_id, [State.DONE, State.ERROR]), State.DONE)
+        with open(stdout) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+    def test_failing_job(self):
+        job_id = self.adapter.start("exit 1", 1, self.tmp_dir).result()
+        self.assertEqual(self.wait_for_state(job_id, [State.DONE, State.ERROR]), State.ERROR)
+
+    def test_status_of_all_jobs_is_polled_at_once(self):
+        job_ids = [self.adapter.start("true", 1, self.tmp_dir).result() for _ in range(3)]
+        with patch.object(BatchSchedulerAdapter, "_run", wraps=BatchSchedulerAdapter._run) as run:
+            self.adapter.poll()
+            self.assertEqual(run.call_count, 1)
+            self.assertIn(" ".join(job_ids), run.call_args[0][0])
+        for job_id in job_ids:
+            self.assertEqual(self.wait_for_state(job_id, [State.DONE]), State.DONE)
+        self.assertEqual(self.adapter.status_all(), {job_id: State.DONE for job_id in job_ids})
+
+    def test_stop(self):
+        job_id = self.adapter.start("sleep 10", 1, self.tmp_dir).result()
+        self.assertEqual(self.wait_for_state(job_id, [State.STARTED]), State.STARTED)
+        self.assertEqual(self.adapter.stop(job_id).result(), job_id)
+        self.adapter.poll()
+        self.assertEqual(self.adapter.status(job_id), State.CANCELLED)
+        self.assertIsNone(self.adapter.stop("123").result())
+
+    def test_attach(self):
+        job_id = self.adapter.start("true", 1, self.tmp_dir).result()
+        self.assertEqual(self.wait_for_state(job_id, [State.DONE]), State.DONE)
+        restarted_adapter = BatchSchedulerAdapter(script_dir=self.script_dir,
+                                                  status_command=self.adapter.status_command,
+                                                  interval=None)
+        self.assertEqual(restarted_adapter.attach(int(job_id), State.STARTED), job_id)
+        self.assertEqual(restarted_adapter.status(job_id), State.STARTED)
+        restarted_adapter.poll()
+        self.assertEqual(restarted_adapter.status(job_id), State.DONE)
+
+    def test_failing_submit(self):
+        adapter = BatchSchedulerAdapter(script_dir=self.script_dir, submit_command="false", interval=None)
+        self.assertIsNone(adapter.start("true", 1, self.tmp_dir).result())
+
+    def test_to_arteria_state(self):
+        self.assertEqual(self.adapter.to_arteria_state("CANCELLED by 1000"), State.CANCELLED)
+        self.assertEqual(self.adapter.to_arteria_state("running"), State.STARTED)
+        self.assertIsNone(self.adapter.to_arteria_state("SOMETHING_ELSE"))
+
+
+class FakeJobRunner(JobRunnerAdapter):
+
+    def __init__(self):
+        self.jobs = {}
+        self.scheduling = {}
+        self.runtimes = {}
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
+        job_id = 100 + len(self.jobs)
+        self.jobs[job_id] = State.PENDING
+        self.scheduling[job_id] = (priority, size)
+        self.runtimes[job_id] = runtime
+        return job_id
+
+    def stop(self, job_id):
+        if job_id in self.jobs:
+            self.jobs[job_id] = State.CANCELLED
+            return job_id
+        return None
+
+    def stop_all(self):
+        for job_id in self.jobs:
+            self.jobs[job_id] = State.CANCELLED
+
+    def status_all(self):
+        return dict(self.jobs)
+
+
+class FakeAttachingJobRunner(FakeJobRunner):
+    """
+    A job runner whose jobs keep running when the service is restarted, like `BatchSchedulerAdapter`.
+    """
+
+    def attach(self, job_id, state=State.PENDING):
+        self.jobs[job_id] = state
+        return job_id
+
+
+class TestJobStoreAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.job_runner = FakeJobRunner()
+        self.job_store = JobStore()
+        self.adapter = JobStoreAdapter(self.job_runner, self.job_store)
+
+    def test_start(self):
+        job_id = self.adapter.start("ls -l", 1, "/path/to/runfolder_1", stdout="/tmp/log")
+        self.assertEqual(job_id, 1)
+        job = self.job_store.get_job(job_id)
+        self.assertEqual(job["runfolder"], "runfolder_1")
+        self.assertEqual(job["stdout"], "/tmp/log")
+        self.assertEqual(job["runner_job_id"], "100")
+        self.assertEqual(self.adapter.status(job_id), State.PENDING)
+
+    def test_sync(self):
+        changes = []
+        self.adapter.add_listener(lambda job, old, new: changes.append((job["job_id"], old, new)))
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        self.job_runner.jobs[100] = State.STARTED
+        self.adapter.sync()
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(job_id), State.STARTED)
+        self.assertEqual(self.adapter.status_all(), {job_id: State.STARTED})
+        self.assertEqual(changes, [(job_id, State.PENDING, State.STARTED)])
+
+    def test_add_done_job(self):
+        changes = []
+        self.adapter.add_listener(lambda job, old, new: changes.append((job["job_id"], old, new)))
+        job_id = self.adapter.add_done_job("ls -l", 1, "/path/to/runfolder_1")
+        job = self.job_store.get_job(job_id)
+        self.assertEqual(job["state"], State.DONE)
+        self.assertEqual(job["runfolder"], "runfolder_1")
+        self.assertIsNotNone(job["finished"])
+        self.assertEqual(self.job_runner.jobs, {})
+        self.assertEqual(changes, [])
+
+    def test_stop(self):
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        self.assertEqual(self.adapter.stop(str(job_id)).result(), job_id)
+        self.assertEqual(self.adapter.status(job_id), State.CANCELLED)
+        self.assertIsNone(self.adapter.stop(123).result())
+
+    def test_status_non_existent(self):
+        self.assertEqual(self.adapter.status(123), State.NONE)
+
+    def test_unfinished_jobs_are_marked_as_errors_on_restart(self):
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        restarted_adapter = JobStoreAdapter(FakeJobRunner(), self.job_store)
+        self.assertEqual(restarted_adapter.status(job_id), State.ERROR)
+
+    def test_unfinished_jobs_are_followed_after_restart(self):
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 1, None, None)], "/tmp",
+                                                finalizer=lambda group_job_id: None)
+        self.job_runner.jobs[100] = State.STARTED
+        self.adapter.sync()
+        job_runner = FakeAttachingJobRunner()
+        restarted_adapter = JobStoreAdapter(job_runner, self.job_store)
+        self.assertEqual(job_runner.jobs, {"100": State.STARTED, "101": State.PENDING, "102": State.PENDING})
+        self.assertEqual(restarted_adapter.status(job_id), State.STARTED)
+        self.assertEqual(restarted_adapter.status(group_job_id), State.PENDING)
+
+        job_runner.jobs.update({"100": State.DONE, "101": State.DONE, "102": State.DONE})
+        restarted_adapter.sync()
+        self.assertEqual(restarted_adapter.status(job_id), State.DONE)
+        # The finalizer of the group was lost in the restart, so its output can not be trusted.
+        self.assertEqual(restarted_adapter.status(group_job_id), State.ERROR)
+
+    def test_group(self):
+        changes = []
+        self.adapter.add_listener(lambda job, old, new: changes.append((job["job_id"], new)))
+        finalized = []
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 2, "/tmp/log", "/tmp/log")],
+                                                "/path/to/runfolder_1",
+                                                finalizer=lambda group_job_id: finalized.append(group_job_id))
+        group_job = self.job_store.get_job(group_job_id)
+        self.assertEqual(group_job["nbr_of_cores"], 3)
+        self.assertEqual(group_job["runfolder"], "runfolder_1")
+        child_job_ids = [job["job_id"] for job in self.job_store.child_jobs(group_job_id)]
+        self.assertEqual(len(child_job_ids), 2)
+
+        self.job_runner.jobs[100] = State.STARTED
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(group_job_id), State.STARTED)
+
+        self.job_runner.jobs[100] = State.DONE
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(group_job_id), State.STARTED)
+        self.assertEqual(finalized, [])
+
+        self.job_runner.jobs[101] = State.DONE
+        self.adapter.sync()
+        self.assertEqual(finalized, [group_job_id])
+        self.assertEqual(self.adapter.status(group_job_id), State.DONE)
+        self.assertEqual(changes[-1], (group_job_id, State.DONE))
+
+    def test_group_scheduling(self):
+        self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 1, None, None)], "/tmp", priority=3,
+                                 sizes=[10, None])
+        self.assertEqual(self.job_runner.scheduling, {100: (3, 10), 101: (3, None)})
+
+    def test_features_are_recorded(self):
+        features = {"machine_type": "HiSeq 2500", "nbr_of_tiles": 64, "nbr_of_cycles": 100, "nbr_of_cores": 1}
+        job_id = self.adapter.start("ls -l", 1, "/tmp", runtime=30, features=features)
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 1, None, None)], "/tmp",
+                                                runtimes=[10, None], features=[features, features])
+        child_job_ids = [job["job_id"] for job in self.job_store.child_jobs(group_job_id)]
+        self.assertEqual(self.job_runner.runtimes, {100: 30, 101: 10, 102: None})
+        self.assertEqual(self.job_store.predicted_runtimes([job_id, group_job_id] + child_job_ids),
+                         {job_id: 30, child_job_ids[0]: 10})
+        # Jobs started without features are not recorded.
+        self.assertEqual(self.job_store.predicted_runtimes([self.adapter.start("ls", 1, "/tmp", runtime=20)]), {})
+
+    def test_queue_status(self):
+        self.assertEqual(self.adapter.queue_status(), {})
+
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 1, None, None)], "/tmp")
+        child_job_ids = [job["job_id"] for job in self.job_store.child_jobs(group_job_id)]
+        self.job_runner.queue_status = lambda: {100: {"queue_position": 3, "expected_start": 30},
+                                                101: {"queue_position": 2, "expected_start": 20},
+                                                102: {"queue_position": 1, "expected_start": None}}
+        self.assertEqual(self.adapter.queue_status(),
+                         {job_id: {"queue_position": 3, "expected_start": 30},
+                          child_job_ids[0]: {"queue_position": 2, "expected_start": 20},
+                          child_job_ids[1]: {"queue_position": 1, "expected_start": None},
+                          group_job_id: {"queue_position": 1, "expected_start": None}})
+
+    def test_group_with_failed_job(self):
+        finalized = []
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 1, None, None)], "/tmp",
+                                                finalizer=lambda group_job_id: finalized.append(group_job_id))
+        self.job_runner.jobs[100] = State.ERROR
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(group_job_id), State.STARTED)
+        self.job_runner.jobs[101] = State.DONE
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(group_job_id), State.ERROR)
+        self.assertEqual(finalized, [])
+
+    def test_group_with_failing_finalizer(self):
+        def finalizer(group_job_id):
+            raise IOError("Could not merge")
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None)], "/tmp", finalizer=finalizer)
+        self.job_runner.jobs[100] = State.DONE
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(group_job_id), State.ERROR)
+
+    def test_group_cleanup(self):
+        cleaned_up = []
+        finalized = []
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None)], "/tmp",
+                                                finalizer=lambda group_job_id: finalized.append(group_job_id),
+                                                cleanup=lambda group_job_id: cleaned_up.append(group_job_id))
+        failing_group_job_id = self.adapter.start_group([("ls 2", 1, None, None)], "/tmp",
+                                                        cleanup=lambda group_job_id: cleaned_up.append(group_job_id))
+        self.job_runner.jobs[101] = State.ERROR
+        self.adapter.sync()
+        self.assertEqual(cleaned_up, [failing_group_job_id])
+        self.job_runner.jobs[100] = State.DONE
+        self.adapter.sync()
+        self.assertEqual(finalized, [group_job_id])
+        self.assertEqual(cleaned_up, [failing_group_job_id, group_job_id])
+        self.adapter.sync()
+        self.assertEqual(cleaned_up, [failing_group_job_id, group_job_id])
+
+    def test_stop_group(self):
+        group_job_id = self.adapter.start_group([("ls 1", 1, None, None), ("ls 2", 1, None, None)], "/tmp")
+        self.assertEqual(self.adapter.stop(group_job_id).result(), group_job_id)
+        self.assertEqual(self.adapter.status(group_job_id), State.CANCELLED)
+        self.assertEqual(self.job_runner.jobs, {100: State.CANCELLED, 101: State.CANCELLED})
+
+
+class FakeSubmittingJobRunner(FakeJobRunner):
+    """
+    A job runner which starts and stops jobs in the background, like `BatchSchedulerAdapter`.
+    """
+
+    def __init__(self):
+        FakeJobRunner.__init__(self)
+        self.submissions = []
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, priority=0, size=None, runtime=None):
+        future = Future()
+        self.submissions.append((future, cmd))
+        return future
+
+    def submit(self, fail=False):
+        future, cmd = self.submissions.pop(0)
+        job_id = None if fail else FakeJobRunner.start(self, cmd, 1, "/tmp")
+        future.set_result(job_id)
+
+    def stop(self, job_id):
+        future = Future()
+        future.set_result(FakeJobRunner.stop(self, job_id))
+        return future
+
+
+class TestJobStoreAdapterWithSubmissions(AsyncTestCase):
+
+    def setUp(self):
+        super(TestJobStoreAdapterWithSubmissions, self).setUp()
+        self.job_runner = FakeSubmittingJobRunner()
+        self.adapter = JobStoreAdapter(self.job_runner, JobStore())
+
+    @gen_test
+    def test_job_is_pending_until_submitted(self):
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        failing_job_id = self.adapter.start("ls -l", 1, "/tmp")
+        self.assertEqual(self.adapter.status(job_id), State.PENDING)
+        self.job_runner.submit()
+        self.job_runner.submit(fail=True)
+        yield gen.moment
+        self.assertEqual(self.adapter.status_all(), {job_id: State.PENDING, failing_job_id: State.ERROR})
+        self.job_runner.jobs[100] = State.STARTED
+        self.adapter.sync()
+        self.assertEqual(self.adapter.status(job_id), State.STARTED)
+
+    @gen_test
+    def test_stop_while_submitting(self):
+        job_id = self.adapter.start("ls -l", 1, "/tmp")
+        stopped = self.adapter.stop(job_id)
+        self.assertFalse(stopped.done())
+        self.job_runner.submit()
+        stopped_job_id = yield stopped
+        self.assertEqual(stopped_job_id, job_id)
+        self.assertEqual(self.adapter.status(job_id), State.CANCELLED)
+        self.assertEqual(self.job_runner.jobs, {100: State.CANCELLED})